@@ -1,12 +1,10 @@
-from flask import Flask, request, jsonify, render_template  # pyright: ignore[reportMissingImports]
+from flask import Flask, request, jsonify, render_template, make_response, Response  # pyright: ignore[reportMissingImports]
 from flask_cors import CORS  # pyright: ignore[reportMissingImports, reportMissingModuleSource]
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, inspect, text  # pyright: ignore[reportMissingImports]
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, inspect, text  # pyright: ignore[reportMissingImports]
 from sqlalchemy.ext.declarative import declarative_base  # pyright: ignore[reportMissingImports]
 from sqlalchemy.orm import sessionmaker  # pyright: ignore[reportMissingImports]
 from datetime import datetime, timedelta
 import os
-import time
-import requests
 from dotenv import load_dotenv
 
 # Importar el procesador de SMS
@@ -16,22 +14,6 @@ except ImportError:
     SMSGPSHandler = None
     print("Advertencia: sms_gps_handler no disponible")
 
-# Importar Twilio para enviar SMS
-try:
-    from twilio.rest import Client  # pyright: ignore[reportMissingImports]
-    TWILIO_AVAILABLE = True
-except ImportError:
-    TWILIO_AVAILABLE = False
-    print("Advertencia: Twilio no está disponible. Instala con: pip install twilio")
-
-# Importar Vonage para enviar SMS
-try:
-    import vonage  # pyright: ignore[reportMissingImports]
-    VONAGE_AVAILABLE = True
-except ImportError:
-    VONAGE_AVAILABLE = False
-    print("Advertencia: Vonage no está disponible. Instala con: pip install vonage")
-
 # Importar servicio de actualización automática
 try:
     from auto_update_service import AutoUpdateService
@@ -41,12 +23,39 @@ except ImportError:
 
 # Importar SMS gratis (módem GSM o Android)
 try:
-    from sms_sender_free import FreeSMSSender, create_sms_sender
+    from sms_sender_free import sender_registry
     FREE_SMS_AVAILABLE = True
 except ImportError:
     FREE_SMS_AVAILABLE = False
     print("Advertencia: SMS gratis no está disponible (instala pyserial para módem GSM)")
 
+# Importar analítica de alquileres (requiere NumPy)
+try:
+    from trip_analytics import TripAnalytics
+    TRIP_ANALYTICS_AVAILABLE = True
+except ImportError:
+    TRIP_ANALYTICS_AVAILABLE = False
+    print("Advertencia: Analítica de alquileres no disponible. Instala con: pip install numpy")
+
+from location_history import LocationHistory
+from sms_ingest_queue import SMSIngestQueue
+from device_index import SIMDeviceIndex
+from phone_utils import normalize_phone
+from rate_limit import get_all_stats as get_rate_limit_stats
+from http_pool import get_all_stats as get_http_pool_stats
+from live_updates import LiveUpdateBroker
+from provider_router import get_all_stats as get_provider_stats
+from sms_dispatcher import get_dispatcher, PRIORITY_MANUAL
+from webhook_dedup import WebhookDeduplicator, message_key, content_key
+from reply_tracker import reply_tracker
+from geofence import GeofenceEngine
+import trajectory_export
+from trajectory_compression import deadband, HistoryCompactor, NUMPY_AVAILABLE as COMPACTION_AVAILABLE
+import device_sync
+import spatial_index
+import db_engine
+from response_cache import devices_cache, install_invalidation_hook
+
 load_dotenv()
 
 app = Flask(__name__)
@@ -60,7 +69,8 @@ if 'RENDER' in os.environ and not os.getenv('DATABASE_URL'):
     # En Render, intentar usar /tmp que es persistente entre reinicios
     db_path = '/tmp/gps_devices.db'
     DATABASE_URL = f'sqlite:///{db_path}'
-engine = create_engine(DATABASE_URL, echo=False)
+# WAL, busy_timeout y pool en SQLite; pool_size/pre_ping en PostgreSQL (ver db_engine)
+engine = db_engine.create_db_engine(DATABASE_URL)
 Base = declarative_base()
 Session = sessionmaker(bind=engine)
 
@@ -74,6 +84,7 @@ class GPSDevice(Base):
     description = Column(String(255))
     # Campos simplificados para vehículos eléctricos de juguetes
     placa_gps = Column(String(50), default='')  # Número de placa GPS o SIM
+    sim_e164 = Column(String(20), index=True)  # placa_gps normalizado a E.164 (para identificar SMS recibidos)
     color = Column(String(50), default='')  # Color del vehículo
     # Campos antiguos (mantener para compatibilidad)
     tipo = Column(String(50), default=None)
@@ -90,6 +101,10 @@ class GPSDevice(Base):
     rental_start = Column(DateTime, default=None)
     rental_end = Column(DateTime, default=None)
     rental_duration_hours = Column(Integer, default=None)
+    # Revisión de la última modificación (para /api/devices/changes)
+    revision = Column(Integer, default=0, index=True)
+    # Tesela de la posición (índice espacial para /api/devices?bbox=)
+    quadkey = Column(String(spatial_index.QUADKEY_LEVEL), index=True)
     
     def to_dict(self):
         return {
@@ -109,11 +124,16 @@ class GPSDevice(Base):
             'is_rented': bool(self.is_rented),
             'rental_start': self.rental_start.isoformat() if self.rental_start else None,
             'rental_end': self.rental_end.isoformat() if self.rental_end else None,
-            'rental_duration_hours': self.rental_duration_hours
+            'rental_duration_hours': self.rental_duration_hours,
+            'revision': self.revision or 0
         }
 
 # Crear tablas
 Base.metadata.create_all(engine)
+device_sync.create_tables(engine)
+device_sync.install_revision_hook(Session, GPSDevice)
+spatial_index.install_quadkey_hook(Session, GPSDevice)
+install_invalidation_hook(Session, GPSDevice, devices_cache)
 
 # Migración de base de datos
 def migrate_database():
@@ -146,12 +166,123 @@ def migrate_database():
             if 'rental_duration_hours' not in columns:
                 conn.execute(text("ALTER TABLE gps_devices ADD COLUMN rental_duration_hours INTEGER"))
                 conn.commit()
+            
+            if 'sim_e164' not in columns:
+                conn.execute(text("ALTER TABLE gps_devices ADD COLUMN sim_e164 VARCHAR(20)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_gps_devices_sim_e164 ON gps_devices (sim_e164)"))
+                conn.commit()
+            
+            if 'revision' not in columns:
+                conn.execute(text("ALTER TABLE gps_devices ADD COLUMN revision INTEGER DEFAULT 0"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_gps_devices_revision ON gps_devices (revision)"))
+                conn.commit()
+            
+            if 'quadkey' not in columns:
+                conn.execute(text(f"ALTER TABLE gps_devices ADD COLUMN quadkey VARCHAR({spatial_index.QUADKEY_LEVEL})"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_gps_devices_quadkey ON gps_devices (quadkey)"))
+                conn.commit()
+            
+            # Calcular el quadkey de los vehículos que aún no lo tienen
+            rows = conn.execute(text(
+                "SELECT id, latitude, longitude FROM gps_devices WHERE quadkey IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL"
+            )).all()
+            if rows:
+                conn.execute(
+                    text("UPDATE gps_devices SET quadkey = :quadkey WHERE id = :id"),
+                    [{'quadkey': spatial_index.quadkey(row.latitude, row.longitude), 'id': row.id} for row in rows]
+                )
+                conn.commit()
+            
+            # Normalizar los números de SIM que aún no tienen sim_e164
+            rows = conn.execute(text(
+                "SELECT id, placa_gps FROM gps_devices WHERE sim_e164 IS NULL AND placa_gps IS NOT NULL AND placa_gps != ''"
+            )).all()
+            for row in rows:
+                conn.execute(
+                    text("UPDATE gps_devices SET sim_e164 = :sim WHERE id = :id"),
+                    {'sim': normalize_phone(row.placa_gps), 'id': row.id}
+                )
+            if rows:
+                conn.commit()
     except Exception as e:
         print(f"Error en migracion: {e}")
 
 # Ejecutar migración
 migrate_database()
 
+# Historial de ubicaciones (particionado por mes)
+location_history = LocationHistory(engine)
+
+# SMS de webhooks ya recibidos (los reintentos del proveedor se responden sin tocar la base)
+webhook_dedup = WebhookDeduplicator(
+    ttl_seconds=int(os.getenv('SMS_DEDUP_TTL_SECONDS', '86400')),
+    max_entries=int(os.getenv('SMS_DEDUP_MAX_ENTRIES', '100000')),
+    engine=engine if os.getenv('SMS_DEDUP_PERSISTENT', 'false').lower() == 'true' else None,
+    content_ttl_seconds=int(os.getenv('SMS_DEDUP_CONTENT_SECONDS', '20'))
+)
+
+# Índice en memoria SIM -> dispositivo (se invalida al agregar/editar/eliminar)
+sim_device_index = SIMDeviceIndex(Session, GPSDevice)
+
+# Canal SSE de actualizaciones en vivo para el dashboard (desactivado en Passenger, ver live_updates)
+live_broker = LiveUpdateBroker(
+    heartbeat_seconds=int(os.getenv('SSE_HEARTBEAT_SECONDS', '15')),
+    max_subscribers=int(os.getenv('SSE_MAX_SUBSCRIBERS', '20')),
+    enabled=os.getenv('SSE_ENABLED', 'true').lower() != 'false'
+)
+
+# Geocercas por sede evaluadas con cada fix (process_sms y la cola de ingesta)
+geofence_engine = GeofenceEngine(
+    engine, Session, GPSDevice,
+    refresh_seconds=int(os.getenv('GEOFENCE_REFRESH_SECONDS', '60'))
+)
+
+# Alquileres y su resumen de uso (distancia, velocidad, tiempo detenido y fuera de zona)
+trip_analytics = None
+if TRIP_ANALYTICS_AVAILABLE:
+    trip_analytics = TripAnalytics(engine, location_history, geofences=geofence_engine)
+    trip_analytics.sync_active(Session, GPSDevice)
+    if os.getenv('RENTAL_ANALYTICS_JOB', 'true').lower() != 'false':
+        trip_analytics.start(hour=int(os.getenv('RENTAL_ANALYTICS_HOUR', '3')))
+
+# Compactación diaria del historial cerrado (Douglas-Peucker con distancia sincronizada)
+history_compactor = None
+if COMPACTION_AVAILABLE:
+    history_compactor = HistoryCompactor(engine, location_history)
+    if os.getenv('HISTORY_COMPACT_JOB', 'true').lower() != 'false':
+        history_compactor.start(hour=int(os.getenv('HISTORY_COMPACT_HOUR', '4')))
+
+# Cola de ingesta de SMS: el webhook encola y un hilo escritor aplica por lotes
+sms_ingest_queue = None
+if os.getenv('SMS_INGEST_QUEUE', 'true').lower() != 'false':
+    sms_ingest_queue = SMSIngestQueue(
+        session_factory=Session,
+        gps_device_model=GPSDevice,
+        history=location_history,
+        device_index=sim_device_index,
+        geofences=geofence_engine,
+        deadband=deadband,
+        devices_cache=devices_cache,
+        dedup=webhook_dedup,
+        broker=live_broker,
+        max_batch_size=int(os.getenv('SMS_INGEST_BATCH_SIZE', '200')),
+        max_batch_wait=int(os.getenv('SMS_INGEST_BATCH_WAIT_MS', '50')) / 1000
+    )
+    sms_ingest_queue.start()
+
+# SMS recibidos directamente por el módem GSM (AT+CNMI): mismo camino que el webhook
+def ingest_modem_sms(sms_text, phone_number):
+    parsed = SMSGPSHandler.parse_sms(sms_text, phone_number)
+    if not parsed:
+        print(f"  ⚠ SMS del módem sin coordenadas ({phone_number}): {sms_text[:60]!r}")
+        return
+    if sms_ingest_queue and sms_ingest_queue.enqueue(parsed):
+        return
+    SMSGPSHandler.process_sms(sms_text, phone_number)
+
+if FREE_SMS_AVAILABLE and SMSGPSHandler and os.getenv('GSM_INBOUND_SMS', 'true').lower() != 'false':
+    sender_registry.set_inbound_handler(ingest_modem_sms)
+
 # Inicializar servicio de actualización automática
 auto_update_service = None
 if AutoUpdateService:
@@ -168,6 +299,10 @@ if AutoUpdateService:
     except Exception as e:
         print(f"Error inicializando auto_update_service: {e}")
 
+# Chequeo de salud periódico de los senders de SMS gratis (compartidos con auto_update_service)
+if FREE_SMS_AVAILABLE:
+    sender_registry.start()
+
 # Rutas
 @app.route('/')
 def index():
@@ -178,21 +313,251 @@ def manifest():
     return app.send_static_file('manifest.json')
 
 # API - Obtener todos los dispositivos
-@app.route('/api/devices', methods=['GET'])
-def get_devices():
+def build_devices_json():
+    """Lista completa de vehículos serializada (igual que jsonify)"""
     session = Session()
     try:
         devices = session.query(GPSDevice).filter(
             GPSDevice.status != 'deleted'
         ).all()
+        return (app.json.dumps([device.to_dict() for device in devices]) + '\n').encode()
+    finally:
+        session.close()
+
+@app.route('/api/devices', methods=['GET'])
+def get_devices():
+    # Solo los vehículos del área visible del mapa (con clusters en zooms bajos)
+    if request.args.get('bbox'):
+        try:
+            bbox = spatial_index.parse_bbox(request.args['bbox'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        session = Session()
+        try:
+            zoom = request.args.get('zoom', type=int)
+            result = spatial_index.query_bbox(
+                session, GPSDevice, bbox, zoom=zoom,
+                base_filter=GPSDevice.status != 'deleted'
+            )
+            result['bbox'] = list(bbox)
+            result['zoom'] = zoom
+            return jsonify(result)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        finally:
+            session.close()
+    
+    # Flota completa: desde la caché mientras ningún vehículo cambie
+    try:
+        body, etag = devices_cache.get(build_devices_json)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if request.if_none_match.contains(etag):
+        devices_cache.record_not_modified()
+        response = make_response('', 304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # El navegador puede guardarla pero debe revalidar (If-None-Match) en cada sondeo
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# API - Cambios incrementales desde una revisión (sincronización del dashboard)
+@app.route('/api/devices/changes', methods=['GET'])
+def get_device_changes():
+    session = Session()
+    try:
+        since = request.args.get('since', 0, type=int)
+        current = device_sync.current_revision(session)
+        
+        # Cursor más nuevo que la base de datos (BD recreada): sincronización completa
+        if since > current:
+            since = 0
+        
+        etag = f'devices-{since}-{current}'
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+            response.set_etag(etag, weak=True)
+            return response
         
-        devices_list = [device.to_dict() for device in devices]
-        return jsonify(devices_list)
+        query = session.query(GPSDevice)
+        if since:
+            changed = query.filter(GPSDevice.revision > since).all()
+        else:
+            changed = query.filter(GPSDevice.status != 'deleted').all()
+        
+        response = jsonify({
+            'revision': current,
+            'full': since == 0,
+            'devices': [d.to_dict() for d in changed if d.status != 'deleted'],
+            'deleted': [d.id for d in changed if d.status == 'deleted']
+        })
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
         session.close()
 
+# API - Canal de actualizaciones en vivo (Server-Sent Events)
+@app.route('/api/stream', methods=['GET'])
+def live_stream():
+    """
+    Emite eventos 'fix', 'device' y 'resync' a medida que ocurren
+
+    Parámetros opcionales:
+        devices: ids separados por coma (ej: 3,7)
+        bbox: región visible min_lon,min_lat,max_lon,max_lat (formato de Leaflet toBBoxString)
+    
+    Con el canal desactivado (SSE_ENABLED=false) responde 204: el navegador no
+    reconecta y el dashboard sigue sondeando /api/devices/changes.
+    """
+    if not live_broker.enabled:
+        return '', 204
+    
+    try:
+        devices = request.args.get('devices')
+        device_ids = [int(d) for d in devices.split(',') if d.strip()] if devices else None
+        
+        bbox = request.args.get('bbox')
+        if bbox:
+            bbox = tuple(float(v) for v in bbox.split(','))
+            if len(bbox) != 4:
+                raise ValueError('bbox debe tener 4 valores')
+    except ValueError as e:
+        return jsonify({'error': f'Parámetros inválidos: {e}'}), 400
+    
+    subscription = live_broker.subscribe(device_ids=device_ids, bbox=bbox or None)
+    if subscription is None:
+        return jsonify({'error': 'Demasiadas conexiones en vivo, usa el sondeo'}), 503
+    
+    response = Response(live_broker.stream(subscription), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Evitar que nginx/Passenger acumulen la respuesta en buffer
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# API - Latencia de respuesta del vehículo a las solicitudes URL#
+@app.route('/api/devices/<int:device_id>/replies', methods=['GET'])
+def get_device_replies(device_id):
+    return jsonify({'device_id': device_id, **reply_tracker.get_device_stats(device_id)})
+
+# API - Geocercas
+@app.route('/api/geofences', methods=['GET'])
+def get_geofences():
+    return jsonify(geofence_engine.list_fences(site=request.args.get('site')))
+
+@app.route('/api/geofences', methods=['POST'])
+def create_geofence():
+    try:
+        fence_id = geofence_engine.create(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    fence = next((f for f in geofence_engine.list_fences() if f['id'] == fence_id), None)
+    return jsonify(fence), 201
+
+@app.route('/api/geofences/<int:fence_id>', methods=['DELETE'])
+def delete_geofence(fence_id):
+    if not geofence_engine.delete(fence_id):
+        return jsonify({'error': 'Geocerca no encontrada'}), 404
+    return jsonify({'message': 'Geocerca eliminada'})
+
+@app.route('/api/geofences/events', methods=['GET'])
+def get_geofence_events():
+    return jsonify(geofence_engine.query_events(
+        device_id=request.args.get('device_id', type=int),
+        geofence_id=request.args.get('geofence_id', type=int),
+        limit=min(request.args.get('limit', 100, type=int), 1000)
+    ))
+
+@app.route('/api/devices/<int:device_id>/geofences', methods=['GET'])
+def get_device_geofences(device_id):
+    return jsonify({'device_id': device_id, 'inside': geofence_engine.inside_of(device_id)})
+
+# API - Historial de ubicaciones de un dispositivo
+@app.route('/api/devices/<int:device_id>/history', methods=['GET'])
+def get_device_history(device_id):
+    try:
+        start = request.args.get('from')
+        end = request.args.get('to')
+        limit = request.args.get('limit', type=int)
+        
+        points = location_history.query(
+            device_id=device_id,
+            start=datetime.fromisoformat(start) if start else None,
+            end=datetime.fromisoformat(end) if end else None,
+            limit=limit
+        )
+        return jsonify({'device_id': device_id, 'count': len(points), 'points': points})
+    except ValueError as e:
+        return jsonify({'error': f'Fecha inválida: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# API - Trayecto de un dispositivo como polilínea codificada
+@app.route('/api/devices/<int:device_id>/track', methods=['GET'])
+def get_device_track(device_id):
+    try:
+        start = request.args.get('from')
+        end = request.args.get('to')
+        precision = request.args.get('precision', 5, type=int)
+        if not 1 <= precision <= 7:
+            return jsonify({'error': 'precision debe estar entre 1 y 7'}), 400
+        
+        batches = location_history.iter_columns(
+            device_id=device_id,
+            start=datetime.fromisoformat(start) if start else None,
+            end=datetime.fromisoformat(end) if end else None
+        )
+        return jsonify({'device_id': device_id, **trajectory_export.encode_track(batches, precision)})
+    except ValueError as e:
+        return jsonify({'error': f'Fecha inválida: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# API - Exportación columnar del historial (un vehículo o toda la flota)
+@app.route('/api/history/export', methods=['GET'])
+def export_history():
+    try:
+        start = request.args.get('from')
+        end = request.args.get('to')
+        start = datetime.fromisoformat(start) if start else None
+        end = datetime.fromisoformat(end) if end else None
+    except ValueError as e:
+        return jsonify({'error': f'Fecha inválida: {e}'}), 400
+    
+    export_format = request.args.get('format', 'columns')
+    if export_format == 'arrow' and not trajectory_export.ARROW_AVAILABLE:
+        return jsonify({'error': 'El formato arrow requiere pyarrow instalado'}), 400
+    if export_format not in ('columns', 'arrow'):
+        return jsonify({'error': "format debe ser 'columns' o 'arrow'"}), 400
+    
+    batches = location_history.iter_columns(
+        device_id=request.args.get('device_id', type=int),
+        start=start,
+        end=end,
+        batch_size=min(request.args.get('batch_size', 50000, type=int), 200000)
+    )
+    if export_format == 'arrow':
+        return Response(trajectory_export.stream_arrow(batches), mimetype=trajectory_export.ARROW_MIMETYPE)
+    
+    response = Response(trajectory_export.stream_columns(batches), mimetype=trajectory_export.COLUMNS_MIMETYPE)
+    response.headers['X-Columns'] = trajectory_export.COLUMNS_HEADER
+    return response
+
+# Ejecuta ya la compactación del historial cerrado (lo mismo que el trabajo diario)
+@app.route('/api/history/compact', methods=['POST'])
+def compact_history():
+    if not history_compactor:
+        return jsonify({'error': 'Compactación del historial no disponible (instala numpy)'}), 503
+    try:
+        return jsonify(history_compactor.compact())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # API - Agregar dispositivo
 @app.route('/api/devices', methods=['POST'])
 def add_device():
@@ -210,6 +575,7 @@ def add_device():
             name=data.get('name'),
             description=data.get('description', ''),
             placa_gps=data.get('placa_gps', ''),
+            sim_e164=normalize_phone(data.get('placa_gps')),
             color=data.get('color', ''),
             tipo=data.get('tipo'),
             marca=data.get('marca'),
@@ -221,6 +587,8 @@ def add_device():
         
         session.add(device)
         session.commit()
+        sim_device_index.invalidate()
+        live_broker.publish_device(device.id, device.revision, 'created', device.latitude, device.longitude)
         
         return jsonify({
             'message': 'Dispositivo agregado exitosamente',
@@ -249,6 +617,7 @@ def update_device(device_id):
             device.description = data['description']
         if 'placa_gps' in data:
             device.placa_gps = data['placa_gps']
+            device.sim_e164 = normalize_phone(data['placa_gps'])
         if 'color' in data:
             device.color = data['color']
         if 'latitude' in data:
@@ -257,6 +626,8 @@ def update_device(device_id):
             device.longitude = data['longitude']
         
         session.commit()
+        sim_device_index.invalidate()
+        live_broker.publish_device(device.id, device.revision, 'updated', device.latitude, device.longitude)
         
         return jsonify({
             'message': 'Dispositivo actualizado exitosamente',
@@ -279,6 +650,11 @@ def delete_device(device_id):
         
         device.status = 'deleted'
         session.commit()
+        sim_device_index.invalidate()
+        live_broker.publish_device(device.id, device.revision, 'deleted', device.latitude, device.longitude)
+        reply_tracker.forget(device.id)
+        geofence_engine.forget(device.id)
+        deadband.forget(device.id)
         
         return jsonify({'message': 'Dispositivo eliminado exitosamente'})
     except Exception as e:
@@ -303,8 +679,11 @@ def start_rental(device_id):
         device.rental_start = datetime.utcnow()
         device.rental_end = datetime.utcnow() + timedelta(hours=duration_hours)
         device.rental_duration_hours = duration_hours
+        if trip_analytics:
+            trip_analytics.start_rental(session, device.id, device.rental_start, device.rental_end, duration_hours)
         
         session.commit()
+        live_broker.publish_device(device.id, device.revision, 'rental_started', device.latitude, device.longitude)
         
         return jsonify({
             'message': 'Alquiler iniciado exitosamente',
@@ -329,8 +708,11 @@ def end_rental(device_id):
         device.rental_start = None
         device.rental_end = None
         device.rental_duration_hours = None
+        if trip_analytics:
+            trip_analytics.end_rental(session, device.id, datetime.utcnow())
         
         session.commit()
+        live_broker.publish_device(device.id, device.revision, 'rental_ended', device.latitude, device.longitude)
         
         return jsonify({
             'message': 'Alquiler finalizado exitosamente',
@@ -342,32 +724,75 @@ def end_rental(device_id):
     finally:
         session.close()
 
+# API - Alquileres y su resumen de uso
+@app.route('/api/rentals', methods=['GET'])
+def get_rentals():
+    if not trip_analytics:
+        return jsonify({'error': 'Analítica de alquileres no disponible (instala numpy)'}), 503
+    return jsonify(trip_analytics.list_rentals(
+        device_id=request.args.get('device_id', type=int),
+        limit=min(request.args.get('limit', 50, type=int), 500)
+    ))
+
+@app.route('/api/rentals/<int:rental_id>/summary', methods=['GET'])
+def get_rental_summary(rental_id):
+    if not trip_analytics:
+        return jsonify({'error': 'Analítica de alquileres no disponible (instala numpy)'}), 503
+    try:
+        summary = trip_analytics.summary(rental_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if summary is None:
+        return jsonify({'error': 'Alquiler no encontrado'}), 404
+    return jsonify(summary)
+
+# Ejecuta ya el resumen de los alquileres terminados (lo mismo que el trabajo nocturno)
+@app.route('/api/rentals/analyze', methods=['POST'])
+def analyze_rentals():
+    if not trip_analytics:
+        return jsonify({'error': 'Analítica de alquileres no disponible (instala numpy)'}), 503
+    try:
+        return jsonify(trip_analytics.analyze_pending())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # API - Recibir SMS de Twilio, Vonage o formato directo
 @app.route('/api/sms/receive', methods=['POST'])
 def receive_sms():
+    dedup_key = None
     try:
         phone_number = None
         sms_text = None
+        # ID del mensaje asignado por el proveedor (para descartar reintentos del webhook)
+        provider = 'direct'
+        message_id = None
         
         # Formato Twilio (form-urlencoded)
         if 'From' in request.form:
             phone_number = request.form.get('From', '').replace('whatsapp:', '')
             sms_text = request.form.get('Body', '')
+            provider = 'twilio'
+            message_id = request.form.get('MessageSid') or request.form.get('SmsSid')
         # Formato Vonage (JSON o form-urlencoded)
         elif 'msisdn' in request.form:
             phone_number = request.form.get('msisdn', '')
             sms_text = request.form.get('text', '')
+            provider = 'vonage'
+            message_id = request.form.get('messageId')
         # Formato JSON (directo, Vonage, o Sinch)
         elif request.is_json:
             data = request.get_json()
             # Intentar formato Sinch primero
             if 'inbound' in data or 'type' in data or ('from' in data and 'to' in data and 'message' in data):
                 # Formato Sinch webhook - múltiples variantes
+                provider = 'sinch'
+                message_id = data.get('id')
                 if 'inbound' in data:
                     # Formato: {"inbound": {"from": "...", "body": "..."}}
                     inbound = data.get('inbound', {})
                     phone_number = inbound.get('from', '')
                     sms_text = inbound.get('body', '') or inbound.get('message', '')
+                    message_id = inbound.get('id') or message_id
                 elif 'from' in data and isinstance(data.get('from'), dict):
                     # Formato: {"from": {"endpoint": "..."}, "message": "..."}
                     phone_number = data.get('from', {}).get('endpoint', '')
@@ -380,10 +805,13 @@ def receive_sms():
             elif 'msisdn' in data:
                 phone_number = data.get('msisdn', '')
                 sms_text = data.get('text', '')
+                provider = 'vonage'
+                message_id = data.get('messageId')
             # Formato directo o Twilio JSON
             else:
                 phone_number = data.get('phone_number', '') or data.get('From', '')
                 sms_text = data.get('sms_text', '') or data.get('Body', '') or data.get('text', '')
+                message_id = data.get('message_id') or data.get('MessageSid')
         else:
             return jsonify({'error': 'Formato de solicitud no válido'}), 400
         
@@ -393,11 +821,51 @@ def receive_sms():
         if not SMSGPSHandler:
             return jsonify({'error': 'SMSGPSHandler no disponible'}), 500
         
+        # Reintento de un SMS ya recibido: confirmar sin parsear ni tocar la base.
+        # Sin ID solo se descartan copias de los últimos segundos: una placa
+        # estacionada responde cada URL# con el mismo texto
+        if message_id:
+            key = message_key(provider, message_id)
+        else:
+            key = content_key(phone_number, sms_text)
+        if not webhook_dedup.claim(key):
+            return jsonify({'status': 'duplicate', 'message': 'SMS ya recibido'}), 200
+        dedup_key = key
+        
+        # Parsear y encolar: el hilo escritor aplica la actualización por lotes
+        if sms_ingest_queue and sms_ingest_queue.is_running:
+            parsed = SMSGPSHandler.parse_sms(sms_text, phone_number)
+            if not parsed:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'No se pudo parsear el SMS. Formato no reconocido.',
+                    'received_sms': sms_text
+                }), 200
+            
+            # Si el lote falla, la cola libera la clave para que el reintento sí se procese
+            parsed['dedup_key'] = dedup_key
+            if sms_ingest_queue.enqueue(parsed):
+                return jsonify({
+                    'status': 'queued',
+                    'message': 'Ubicación recibida, se aplicará en el siguiente lote',
+                    'parsed_data': {
+                        'latitude': parsed['latitude'],
+                        'longitude': parsed['longitude'],
+                        'phone_number': parsed['phone_number']
+                    }
+                }), 202
+            # Cola llena: procesar de forma síncrona
+        
         # Procesar SMS
         result = SMSGPSHandler.process_sms(sms_text, phone_number)
+        if result['status'] == 'error':
+            webhook_dedup.forget(dedup_key)
         
         return jsonify(result), 200
     except Exception as e:
+        # Que el reintento del proveedor sí se procese
+        if dedup_key:
+            webhook_dedup.forget(dedup_key)
         app.logger.error(f"Error recibiendo SMS: {e}")
         import traceback
         app.logger.debug(traceback.format_exc())
@@ -416,224 +884,52 @@ def request_location(device_id):
             return jsonify({'error': 'El dispositivo no tiene número de SIM configurado'}), 400
         
         # Formatear número de teléfono
-        to_number = device.placa_gps.strip()
-        if not to_number.startswith('+'):
-            to_number = to_number.replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-            if to_number.startswith('0'):
-                to_number = to_number[1:]
-            if not to_number.startswith('57'):
-                to_number = f'+57{to_number}'
-            else:
-                to_number = f'+{to_number}'
+        to_number = normalize_phone(device.placa_gps)
+        if not to_number:
+            return jsonify({'error': f'Número de SIM inválido: {device.placa_gps}'}), 400
         
         # Obtener mensaje
-        data = request.get_json()
+        data = request.get_json(silent=True)
         message = data.get('message', 'URL#') if data else 'URL#'
         
-        # Intentar usar SMS gratis primero (módem GSM o Android)
-        sms_sent = False
-        sms_method = None
-        
-        if FREE_SMS_AVAILABLE:
-            try:
-                sms_method_env = os.getenv('SMS_METHOD', 'auto')
-                # Verificar variables de entorno para diagnóstico
-                smsmobileapi_key = os.getenv('SMSMOBILEAPI_KEY', '')
-                messagebird_api_key = os.getenv('MESSAGEBIRD_API_KEY', '')
-                sinch_service_plan_id = os.getenv('SINCH_SERVICE_PLAN_ID', '')
-                app.logger.info(f"Intentando enviar SMS con método: {sms_method_env}")
-                app.logger.info(f"SMSMobileAPI_KEY configurado: {'Sí' if smsmobileapi_key else 'No'}")
-                app.logger.info(f"MessageBird configurado: {'Sí' if messagebird_api_key else 'No'}")
-                app.logger.info(f"Sinch configurado: {'Sí' if sinch_service_plan_id else 'No'}")
-                
-                free_sender = create_sms_sender(method=sms_method_env)
-                if free_sender:
-                    app.logger.info(f"Método gratis disponible: {free_sender.is_available()}, método detectado: {free_sender.method}")
-                    if free_sender.is_available():
-                        app.logger.info(f"Enviando SMS a {to_number} con mensaje: {message}")
-                        # Verificar si MessageBird está disponible antes de enviar
-                        messagebird_key = os.getenv('MESSAGEBIRD_API_KEY', '')
-                        app.logger.info(f"MessageBird API Key disponible: {'Sí' if messagebird_key else 'No'} (longitud: {len(messagebird_key)})")
-                        
-                        result = free_sender.send_sms(to_number, message)
-                        app.logger.info(f"Resultado del envío: {result}")
-                        app.logger.info(f"Método usado: {result.get('method', 'desconocido')}, Éxito: {result.get('success', False)}")
-                        if result.get('success'):
-                            sms_sent = True
-                            sms_method = result.get('method', 'free')
-                            app.logger.info(f"SMS enviado usando método gratis ({sms_method}) a {device.name} ({to_number})")
-                            return jsonify({
-                                'message': f'SMS enviado exitosamente a {device.name} (método: {sms_method})',
-                                'message_sid': f"free_{sms_method}_{int(time.time())}",
-                                'to': to_number,
-                                'method': sms_method,
-                                'status': 'success'
-                            }), 200
-                        else:
-                            error_msg = result.get('error', 'Error desconocido')
-                            app.logger.warning(f"Error al enviar SMS gratis: {error_msg}")
-                            app.logger.info(f"Intentando métodos de pago (Vonage/Sinch/Twilio)...")
-                    else:
-                        app.logger.warning(f"Método gratis no disponible. Método detectado: {free_sender.method if free_sender else 'None'}")
-                else:
-                    app.logger.warning("No se pudo crear el sender gratis")
-            except Exception as e:
-                app.logger.warning(f"Error con método gratis: {e}, intentando Vonage/Twilio...")
-                import traceback
-                app.logger.error(traceback.format_exc())
-        
-        # Intentar usar Vonage si está disponible y configurado
-        if VONAGE_AVAILABLE and not sms_sent:
-            vonage_api_key = os.getenv('VONAGE_API_KEY')
-            vonage_api_secret = os.getenv('VONAGE_API_SECRET')
-            vonage_phone = os.getenv('VONAGE_PHONE_NUMBER', 'API de Vonage')  # Usar texto por defecto si no hay número
-            
-            if vonage_api_key and vonage_api_secret:
-                try:
-                    vonage_client = vonage.Client(key=vonage_api_key, secret=vonage_api_secret)
-                    vonage_sms = vonage.Sms(vonage_client)
-                    
-                    app.logger.info(f"Intentando enviar SMS vía Vonage desde {vonage_phone} a {to_number}")
-                    response_data = vonage_sms.send_message({
-                        'from': vonage_phone,
-                        'to': to_number,
-                        'text': message
-                    })
-                    
-                    if response_data["messages"][0]["status"] == "0":
-                        app.logger.info(f"SMS enviado exitosamente vía Vonage. Message ID: {response_data['messages'][0]['message-id']}")
-                        return jsonify({
-                            'message': f'SMS enviado exitosamente a {device.name} (método: Vonage)',
-                            'message_sid': response_data['messages'][0]['message-id'],
-                            'to': to_number,
-                            'method': 'vonage',
-                            'status': 'success'
-                        }), 200
-                    else:
-                        error_msg = response_data["messages"][0]["error-text"]
-                        app.logger.warning(f"Error con Vonage: {error_msg}, intentando Twilio...")
-                except Exception as e:
-                    app.logger.warning(f"Error con Vonage: {e}, intentando Sinch/Twilio...")
-                    import traceback
-                    app.logger.debug(traceback.format_exc())
-        
-        # Intentar usar Sinch si está disponible y configurado
-        if not sms_sent:
-            sinch_service_plan_id = os.getenv('SINCH_SERVICE_PLAN_ID')
-            sinch_api_token = os.getenv('SINCH_API_TOKEN')
-            sinch_api_url = os.getenv('SINCH_API_URL', 'https://us.sms.api.sinch.com/xms/v1')
-            sinch_from_number = os.getenv('SINCH_FROM_NUMBER')
-            
-            if sinch_service_plan_id and sinch_api_token and sinch_api_url and sinch_from_number:
-                app.logger.info(f"Intentando enviar SMS con método Sinch (from: {sinch_from_number})")
-                try:
-                    headers = {
-                        'Content-Type': 'application/json',
-                        'Authorization': f'Bearer {sinch_api_token}'
-                    }
-                    body = {
-                        'from': sinch_from_number,
-                        'to': [to_number],
-                        'body': message
-                    }
-                    
-                    # La URL de Sinch ya incluye el service plan ID
-                    full_sinch_url = f"{sinch_api_url.rstrip('/')}/{sinch_service_plan_id}/batches"
-                    
-                    app.logger.info(f"Enviando SMS a Sinch: URL={full_sinch_url}, to={to_number}, from={sinch_from_number}")
-                    response = requests.post(full_sinch_url, json=body, headers=headers, timeout=15)
-                    
-                    app.logger.info(f"Respuesta de Sinch: Status={response.status_code}, Body={response.text}")
-                    
-                    if response.status_code == 201:  # 201 Created for successful batch
-                        response_data = response.json()
-                        batch_id = response_data.get('id') or response_data.get('batch_id')
-                        app.logger.info(f"SMS aceptado por Sinch. Batch ID: {batch_id}")
-                        app.logger.info(f"NOTA: En modo trial, Sinch solo envía a números verificados. Verifica {to_number} en el dashboard de Sinch.")
-                        return jsonify({
-                            'message': f'SMS aceptado por Sinch a {device.name} (método: Sinch). En modo trial, verifica el número en Sinch.',
-                            'message_sid': batch_id,
-                            'to': to_number,
-                            'method': 'sinch',
-                            'status': 'accepted',
-                            'warning': 'En modo trial, Sinch solo envía a números verificados. Verifica el número en el dashboard de Sinch.'
-                        }), 200
-                    else:
-                        error_msg = response.text
-                        app.logger.error(f"Error con Sinch (HTTP {response.status_code}): {error_msg}")
-                        app.logger.warning(f"Error con Sinch: {error_msg}, intentando Twilio...")
-                except Exception as e:
-                    app.logger.warning(f"Error con Sinch: {e}, intentando Twilio...")
-                    import traceback
-                    app.logger.debug(traceback.format_exc())
-        
-        # Usar Twilio como respaldo
-        if not TWILIO_AVAILABLE:
-            return jsonify({
-                'error': 'No hay método de envío de SMS disponible. Configura un módem GSM, Android, Vonage, Sinch o Twilio.',
-                'status': 'error'
-            }), 500
+        # Despachador compartido con el barrido automático: el pedido manual se
+        # adelanta en la cola y, si ya hay un SMS igual pendiente a esta SIM, se une a él
+        result = get_dispatcher().send(
+            to_number, message, priority=PRIORITY_MANUAL, device_name=device.name, device_id=device.id
+        )
+        app.logger.info(f"Envío a {device.name} ({to_number}): {result['attempts']}")
         
-        # Configurar Twilio
-        account_sid = os.getenv('TWILIO_ACCOUNT_SID')
-        auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-        twilio_phone = os.getenv('TWILIO_PHONE_NUMBER')
+        if result['success']:
+            sms_method = result['method']
+            response = {
+                'message': f'SMS enviado exitosamente a {device.name} (método: {sms_method})',
+                'message_sid': result.get('message_sid'),
+                'to': to_number,
+                'method': sms_method,
+                'status': result.get('status', 'success'),
+                'attempts': result['attempts'],
+                'queued_ms': result['queued_ms']
+            }
+            if result.get('warning'):
+                response['warning'] = result['warning']
+            return jsonify(response), 200
         
-        if not account_sid or not auth_token:
+        if not result['attempts']:
             return jsonify({
-                'error': 'Twilio no está configurado. Configura TWILIO_ACCOUNT_SID y TWILIO_AUTH_TOKEN, o usa un módem GSM/Android/Vonage/Sinch.',
+                'error': 'No hay método de envío de SMS disponible. Configura un módem GSM, Android, Vonage, Sinch o Twilio '
+                         '(o espera a que se recupere un proveedor con cupo: ver /api/metrics -> sms_providers).',
                 'status': 'error'
             }), 500
         
-        try:
-            client = Client(account_sid, auth_token)
-        except Exception as e:
-            return jsonify({'error': f'Error al inicializar cliente de Twilio: {str(e)}'}), 500
-        
-        try:
-            app.logger.info(f"Intentando enviar SMS vía Twilio desde {twilio_phone} a {to_number}")
-            message_obj = client.messages.create(
-                body=message,
-                from_=twilio_phone,
-                to=to_number
-            )
-            
-            app.logger.info(f"SMS enviado exitosamente vía Twilio. SID: {message_obj.sid}")
-            
-            return jsonify({
-                'message': f'SMS enviado exitosamente a {device.name} (método: Twilio)',
-                'message_sid': message_obj.sid,
+        return jsonify({
+            'error': f"Error al enviar SMS: {result['error']}",
+            'status': 'error',
+            'attempts': result['attempts'],
+            'details': {
                 'to': to_number,
-                'method': 'twilio',
-                'status': 'success'
-            }), 200
-        except Exception as e:
-            error_msg = str(e)
-            import traceback
-            error_trace = traceback.format_exc()
-            app.logger.error(f"Error al enviar SMS vía Twilio: {error_msg}")
-            app.logger.error(f"Traceback: {error_trace}")
-            
-            # Detectar errores comunes de Twilio
-            if "not a valid phone number" in error_msg.lower():
-                error_msg = f"Número de teléfono inválido: {to_number}. Verifica el formato."
-            elif "unverified" in error_msg.lower() or "verified" in error_msg.lower():
-                error_msg = f"El número {to_number} no está verificado en Twilio. Verifícalo en la consola de Twilio."
-            elif "insufficient" in error_msg.lower() or "balance" in error_msg.lower():
-                error_msg = "Crédito insuficiente en tu cuenta de Twilio. Recarga tu cuenta."
-            elif "429" in error_msg or "daily messages limit" in error_msg.lower() or "exceeded" in error_msg.lower():
-                error_msg = "Límite diario de SMS alcanzado (50 SMS/día en plan de prueba). El límite se reinicia en 24 horas. Detén el servicio automático o aumenta el intervalo."
-            
-            return jsonify({
-                'error': f'Error al enviar SMS: {error_msg}',
-                'status': 'error',
-                'details': {
-                    'from': twilio_phone,
-                    'to': to_number,
-                    'message': message,
-                    'traceback': error_trace if app.debug else None
-                }
-            }), 500
+                'message': message
+            }
+        }), 500
             
     except Exception as e:
         error_msg = str(e)
@@ -702,6 +998,31 @@ def set_auto_update_interval():
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+# API - Métricas internas
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Obtiene métricas de los subsistemas internos"""
+    return jsonify({
+        'database': db_engine.get_stats(engine),
+        'devices_cache': devices_cache.get_stats(),
+        'sms_ingest': sms_ingest_queue.get_metrics() if sms_ingest_queue else None,
+        'sim_device_index': sim_device_index.get_stats(),
+        'rate_limits': get_rate_limit_stats(),
+        'live_updates': live_broker.get_stats(),
+        'http_pools': get_http_pool_stats(),
+        'sms_providers': get_provider_stats(),
+        'sms_dispatcher': get_dispatcher().get_stats(),
+        'webhook_dedup': webhook_dedup.get_stats(),
+        'replies': reply_tracker.get_stats(),
+        'geofences': geofence_engine.get_stats(),
+        'trip_analytics': trip_analytics.get_stats() if trip_analytics else None,
+        'trajectory_compression': {
+            'deadband': deadband.get_stats(),
+            'compaction': history_compactor.get_stats() if history_compactor else None
+        },
+        'sms_senders': sender_registry.get_status() if FREE_SMS_AVAILABLE else None
+    }), 200
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -1,125 +1,99 @@
 """
 Servicio de actualización automática de ubicaciones GPS
-Envía SMS cada X segundos a todos los vehículos para solicitar su ubicación
-Soporta múltiples métodos: GSM Modem, Android Phone, Twilio
+Envía SMS a los vehículos para solicitar su ubicación; cada vehículo tiene su
+propio plazo según alquiler, movimiento y frescura de su última ubicación
+Soporta múltiples métodos: GSM Modem, Android Phone, Vonage, Sinch, Twilio
+(los envíos pasan por el despachador compartido de sms_dispatcher.py)
 """
 import threading
 import time
-from datetime import datetime
+import heapq
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
 import os
 from dotenv import load_dotenv
+from phone_utils import normalize_phone
+from rate_limit import get_all_stats as get_rate_limit_stats
+from provider_router import get_all_stats as get_provider_stats
+from sms_dispatcher import (
+    get_dispatcher, configured_methods, vonage_configured, twilio_configured,
+    PRIORITY_SWEEP, FREE_SMS_AVAILABLE
+)
+from geo_utils import haversine_m
+from reply_tracker import reply_tracker
 
-# Importar Twilio
-try:
-    from twilio.rest import Client
-    TWILIO_AVAILABLE = True
-except ImportError:
-    TWILIO_AVAILABLE = False
-    print("Advertencia: Twilio no está disponible")
-
-# Importar Vonage
-try:
-    import vonage
-    VONAGE_AVAILABLE = True
-except ImportError:
-    VONAGE_AVAILABLE = False
-    print("Advertencia: Vonage no está disponible")
-
-# Importar SMS gratis (módem GSM o Android)
-try:
-    from sms_sender_free import FreeSMSSender, create_sms_sender
-    FREE_SMS_AVAILABLE = True
-except ImportError:
-    FREE_SMS_AVAILABLE = False
+if FREE_SMS_AVAILABLE:
+    from sms_sender_free import get_sms_sender
+else:
     print("Advertencia: SMS gratis no está disponible (instala pyserial para módem GSM)")
 
 load_dotenv()
 
+# Velocidad (m/s) a partir de la cual se considera que el vehículo se mueve
+MOVING_SPEED_MPS = 0.5
+# Si al alquiler le queda menos que esto (o ya venció) se sondea al mínimo
+RENTAL_ENDING_WINDOW = timedelta(minutes=10)
+
 class AutoUpdateService:
     """
-    Servicio que envía SMS automáticamente cada X segundos
-    para solicitar ubicación a todos los vehículos GPS
+    Servicio que envía SMS automáticamente para solicitar ubicación
+    a los vehículos GPS, con un plazo propio por vehículo
     """
     
-    def __init__(self, session_factory, gps_device_model, interval_seconds=10):
+    def __init__(self, session_factory, gps_device_model, interval_seconds=10, max_workers=None):
         """
         Args:
             session_factory: Función que retorna una sesión de base de datos
             gps_device_model: Modelo GPSDevice
-            interval_seconds: Intervalo en segundos entre envíos (default: 10)
+            interval_seconds: Intervalo máximo en segundos entre envíos a un mismo vehículo (default: 10)
+            max_workers: Hilos del despachador compartido si aún no existe
+                (default: SMS_DISPATCH_WORKERS, AUTO_UPDATE_WORKERS o 16).
+                El ritmo real lo fija el limitador de cada proveedor (rate_limit.py)
         """
         self.session_factory = session_factory
         self.gps_device_model = gps_device_model
         self.interval_seconds = interval_seconds
+        # Cola única de SMS salientes, compartida con la solicitud manual de app.py
+        self.dispatcher = get_dispatcher(max_workers)
+        self.max_workers = self.dispatcher.workers
+        # Intervalo mínimo (vehículos alquilados en movimiento o por devolver)
+        self.min_interval_seconds = int(os.getenv('AUTO_UPDATE_MIN_INTERVAL', '60'))
+        # Cada cuánto se recargan los vehículos desde la base de datos
+        self.refresh_seconds = 30
+        # Planificador: heap de (plazo, device_id) + estado por vehículo
+        self._schedule = []
+        self._schedule_lock = threading.Lock()
+        self._next_poll = {}
+        self._devices = {}
+        self._speeds = {}
+        self._last_polled = {}
+        self._next_refresh = 0
         self.is_running = False
         self.thread = None
         self.last_update = None
+        self._stats_lock = threading.Lock()
         self.stats = {
             'total_sent': 0,
             'total_errors': 0,
-            'last_sent_time': None
+            'last_sent_time': None,
+            'last_sweep_seconds': None
         }
         
-        # Intentar usar SMS gratis primero (módem GSM o Android)
-        self.free_sms_sender = None
+        # Intentar usar SMS gratis primero (módem GSM o Android).
+        # El sender es compartido con app.py a través del registro del proceso.
+        self.sms_method_env = os.getenv('SMS_METHOD', 'auto')
         self.sms_method = None
         
         if FREE_SMS_AVAILABLE:
-            sms_method_env = os.getenv('SMS_METHOD', 'auto')
-            self.free_sms_sender = create_sms_sender(method=sms_method_env)
-            if self.free_sms_sender and self.free_sms_sender.is_available():
-                self.sms_method = self.free_sms_sender.method
+            free_sms_sender = get_sms_sender(self.sms_method_env)
+            if free_sms_sender:
+                self.sms_method = free_sms_sender.method
                 print(f"✓ Usando método de SMS gratis: {self.sms_method}")
             else:
                 print("⚠ Método de SMS gratis no disponible, usando Vonage/Twilio como respaldo")
         
-        # Configurar Vonage (prioridad sobre Twilio)
-        self.vonage_configured = False
-        if VONAGE_AVAILABLE:
-            vonage_api_key = os.getenv('VONAGE_API_KEY')
-            vonage_api_secret = os.getenv('VONAGE_API_SECRET')
-            vonage_phone = os.getenv('VONAGE_PHONE_NUMBER', 'API de Vonage')  # Usar texto por defecto si no hay número
-            
-            if vonage_api_key and vonage_api_secret:
-                try:
-                    self.vonage_client = vonage.Client(key=vonage_api_key, secret=vonage_api_secret)
-                    self.vonage_sms = vonage.Sms(self.vonage_client)
-                    self.vonage_phone = vonage_phone
-                    self.vonage_configured = True
-                    if not self.sms_method:
-                        print(f"✓ Vonage configurado como método principal (from: {vonage_phone})")
-                except Exception as e:
-                    print(f"Error configurando Vonage: {e}")
-                    self.vonage_configured = False
-            else:
-                self.vonage_configured = False
-        else:
-            self.vonage_configured = False
-        
-        # Configurar Twilio como respaldo
-        self.twilio_configured = False
-        if TWILIO_AVAILABLE:
-            account_sid = os.getenv('TWILIO_ACCOUNT_SID')
-            auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-            twilio_phone = os.getenv('TWILIO_PHONE_NUMBER')
-            
-            if account_sid and auth_token:
-                try:
-                    self.twilio_client = Client(account_sid, auth_token)
-                    self.twilio_phone = twilio_phone
-                    self.twilio_configured = True
-                    if not self.sms_method and not self.vonage_configured:
-                        print("✓ Twilio configurado como método principal")
-                except Exception as e:
-                    print(f"Error configurando Twilio: {e}")
-                    self.twilio_configured = False
-            else:
-                self.twilio_configured = False
-        else:
-            self.twilio_configured = False
-        
         # Verificar que al menos un método esté disponible
-        if not self.sms_method and not self.vonage_configured and not self.twilio_configured:
+        if not configured_methods():
             print("⚠ ADVERTENCIA: No hay método de envío de SMS configurado")
             print("  Opciones:")
             print("  1. Conecta un módem GSM USB y configura SMS_METHOD=gsm_modem")
@@ -129,173 +103,247 @@ class AutoUpdateService:
     
     def _format_phone_number(self, phone):
         """
-        Formatea el número de teléfono para envío internacional
+        Formatea el número de teléfono para envío internacional (E.164)
+        """
+        return normalize_phone(phone)
+    
+    def _submit_location_request(self, device):
+        """
+        Encola el SMS que solicita la ubicación de un vehículo
+
+        El despachador elige el proveedor sano más barato; si ya hay un pedido
+        manual pendiente para la misma SIM, el barrido espera ese mismo envío.
+        """
+        to_number = self._format_phone_number(device.placa_gps)
+        message = 'URL#'  # Comando para solicitar ubicación
+        return self.dispatcher.submit(
+            to_number, message, priority=PRIORITY_SWEEP, device_name=device.name, device_id=device.id
+        )
+    
+    def _send_sweep(self, devices):
+        """
+        Encola la solicitud de ubicación de todos los dispositivos y espera los resultados
+        
+        Los hilos del despachador envían en paralelo; cada proveedor aplica su
+        propio token bucket y tope de concurrencia, así que el barrido escala con
+        el throughput de los proveedores y no con el tamaño de la flota.
+        
+        Returns:
+            bool: True si el servicio se detuvo por límite diario
         """
-        phone = str(phone).strip()
+        started = time.monotonic()
+        auto_stopped = False
+        # No reenviar a los vehículos cuya solicitud anterior sigue esperando respuesta
+        pending = [device for device in devices if device.placa_gps and not reply_tracker.awaiting_reply(device.id)]
+        if len(pending) < len(devices):
+            print(f"  {len(devices) - len(pending)} vehículos aún no responden la solicitud anterior")
+        jobs = [self._submit_location_request(device) for device in pending]
         
-        # Si no tiene código de país, asumir Colombia (+57)
-        if not phone.startswith('+'):
-            # Remover espacios y caracteres especiales
-            phone = phone.replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+        for index, job in enumerate(jobs):
+            result = job.wait()
+            if result.get('cancelled'):
+                continue
             
-            # Si empieza con 0, removerlo
-            if phone.startswith('0'):
-                phone = phone[1:]
+            with self._stats_lock:
+                if result['success']:
+                    self.stats['total_sent'] += 1
+                else:
+                    self.stats['total_errors'] += 1
             
-            # Agregar código de país de Colombia
-            if not phone.startswith('57'):
-                phone = f'+57{phone}'
+            if result['success']:
+                print(f"  ✓ SMS enviado a {result['device_name']} ({result['to']}) vía {result['method']}")
             else:
-                phone = f'+{phone}'
+                print(f"  ✗ Error enviando a {result['device_name']}: {result['error']}")
+            
+            # Todos los proveedores agotaron su cupo diario: detener el servicio
+            if result['quota_exhausted'] and not auto_stopped:
+                print(f"  ⚠ Límite diario alcanzado en todos los proveedores. Deteniendo servicio automático...")
+                self.is_running = False
+                auto_stopped = True
+            
+            # Servicio detenido (por cupo o por stop()): cancelar lo que falte del barrido
+            if not self.is_running:
+                for remaining_job in jobs[index + 1:]:
+                    self.dispatcher.cancel(remaining_job)
         
-        return phone
+        self.stats['last_sweep_seconds'] = round(time.monotonic() - started, 3)
+        return auto_stopped
     
-    def _send_location_request(self, device):
+    def _device_snapshot(self, device):
         """
-        Envía un SMS a un dispositivo para solicitar su ubicación
-        Intenta usar método gratis primero, luego Twilio como respaldo
+        Copia los campos que usa el planificador para no compartir objetos ORM entre hilos
         """
-        if not device.placa_gps:
-            return {
-                'success': False,
-                'error': 'Dispositivo no tiene número de SIM configurado'
-            }
+        return SimpleNamespace(
+            id=device.id,
+            name=device.name,
+            placa_gps=device.placa_gps,
+            latitude=device.latitude,
+            longitude=device.longitude,
+            last_update=device.last_update,
+            is_rented=bool(device.is_rented),
+            rental_end=device.rental_end
+        )
+    
+    def _refresh_devices(self):
+        """
+        Recarga los vehículos con SIM, estima su velocidad y recalcula sus plazos
+        """
+        session = self.session_factory()
+        try:
+            devices = session.query(self.gps_device_model).filter(
+                self.gps_device_model.status != 'deleted'
+            ).all()
+            snapshots = {d.id: self._device_snapshot(d) for d in devices if d.placa_gps}
+        finally:
+            session.close()
         
-        to_number = self._format_phone_number(device.placa_gps)
-        message = 'URL#'  # Comando para solicitar ubicación
+        # Velocidad aproximada entre los dos últimos fixes conocidos
+        for device_id, device in snapshots.items():
+            previous = self._devices.get(device_id)
+            if (previous and device.last_update and previous.last_update
+                    and device.last_update > previous.last_update
+                    and device.latitude is not None and previous.latitude is not None):
+                elapsed = (device.last_update - previous.last_update).total_seconds()
+                distance = haversine_m(previous.latitude, previous.longitude, device.latitude, device.longitude)
+                self._speeds[device_id] = distance / elapsed
         
-        # Intentar usar SMS gratis primero (módem GSM o Android)
-        if self.free_sms_sender and self.free_sms_sender.is_available():
-            try:
-                result = self.free_sms_sender.send_sms(to_number, message)
-                if result.get('success'):
-                    return {
-                        'success': True,
-                        'message_sid': f"free_{self.sms_method}_{int(time.time())}",
-                        'to': to_number,
-                        'device_name': device.name,
-                        'method': self.sms_method
-                    }
-                else:
-                    # Si falla el método gratis, intentar Vonage/Twilio como respaldo
-                    print(f"  ⚠ Método gratis falló: {result.get('error')}, intentando Vonage/Twilio...")
-            except Exception as e:
-                print(f"  ⚠ Error con método gratis: {e}, intentando Vonage/Twilio...")
+        with self._schedule_lock:
+            self._devices = snapshots
+            for device_id in list(self._next_poll):
+                if device_id not in snapshots:
+                    del self._next_poll[device_id]
+                    self._speeds.pop(device_id, None)
+                    self._last_polled.pop(device_id, None)
+            for device_id in snapshots:
+                self._schedule_device(device_id)
+            
+            # Compactar el heap si acumuló demasiadas entradas obsoletas
+            if len(self._schedule) > 4 * max(len(snapshots), 1):
+                self._schedule = [(deadline, device_id) for device_id, (deadline, _, _) in self._next_poll.items()]
+                heapq.heapify(self._schedule)
         
-        # Intentar usar Vonage si está configurado
-        if self.vonage_configured:
-            try:
-                response_data = self.vonage_sms.send_message({
-                    'from': self.vonage_phone,
-                    'to': to_number,
-                    'text': message
-                })
-                
-                if response_data["messages"][0]["status"] == "0":
-                    return {
-                        'success': True,
-                        'message_sid': response_data['messages'][0]['message-id'],
-                        'to': to_number,
-                        'device_name': device.name,
-                        'method': 'vonage'
-                    }
-                else:
-                    error_msg = response_data["messages"][0]["error-text"]
-                    print(f"  ⚠ Error con Vonage: {error_msg}, intentando Twilio...")
-            except Exception as e:
-                print(f"  ⚠ Error con Vonage: {e}, intentando Twilio...")
+        self._next_refresh = time.time() + min(self.refresh_seconds, self.interval_seconds)
+    
+    def _compute_interval(self, device):
+        """
+        Intervalo de sondeo de un vehículo según alquiler, movimiento y frescura
         
-        # Usar Twilio como respaldo
-        if not self.twilio_configured:
-            return {
-                'success': False,
-                'error': 'No hay método de envío de SMS disponible'
-            }
+        Returns:
+            tuple: (segundos, motivo)
+        """
+        ceiling = self.interval_seconds
+        floor = min(self.min_interval_seconds, ceiling)
+        moving = self._speeds.get(device.id, 0.0) >= MOVING_SPEED_MPS
         
-        try:
-            message_obj = self.twilio_client.messages.create(
-                body=message,
-                from_=self.twilio_phone,
-                to=to_number
-            )
-            
-            return {
-                'success': True,
-                'message_sid': message_obj.sid,
-                'to': to_number,
-                'device_name': device.name,
-                'method': 'twilio'
-            }
-        except Exception as e:
-            error_msg = str(e)
-            # Si se alcanzó el límite diario (429), detener el servicio automáticamente
-            if "429" in error_msg or "daily messages limit" in error_msg.lower() or "exceeded" in error_msg.lower():
-                print(f"  ⚠ Límite diario alcanzado. Deteniendo servicio automático...")
-                self.stop()
-                return {
-                    'success': False,
-                    'error': 'Límite diario de SMS alcanzado. Servicio detenido automáticamente.',
-                    'device_name': device.name,
-                    'method': 'twilio',
-                    'auto_stopped': True
-                }
-            return {
-                'success': False,
-                'error': error_msg,
-                'device_name': device.name,
-                'method': 'twilio'
-            }
+        if device.is_rented:
+            if device.rental_end and device.rental_end - datetime.utcnow() <= RENTAL_ENDING_WINDOW:
+                interval, reason = floor, 'alquiler por terminar o vencido'
+            elif moving:
+                interval, reason = floor, 'alquilado en movimiento'
+            else:
+                interval, reason = min(ceiling, floor * 3), 'alquilado detenido'
+        elif moving:
+            # Un vehículo sin alquilar que se mueve merece seguimiento
+            interval, reason = max(floor, ceiling / 2), 'en movimiento sin alquiler'
+        else:
+            interval, reason = ceiling, 'estacionado'
+        
+        # Un vehículo que dejó de responder se sondea cada vez menos (no gastar SMS)
+        factor = reply_tracker.backoff_factor(device.id)
+        if factor > 1:
+            return interval * factor, f'{reason}, sin respuesta (x{factor})'
+        return interval, reason
+    
+    def _schedule_device(self, device_id):
+        """
+        Calcula el próximo plazo de un vehículo y lo agrega al heap
+        (llamar con _schedule_lock tomado)
+        """
+        device = self._devices[device_id]
+        interval, reason = self._compute_interval(device)
+        
+        # Contar desde el último sondeo o desde el último fix recibido (lo más reciente)
+        base = self._last_polled.get(device_id, 0)
+        if device.last_update:
+            base = max(base, device.last_update.replace(tzinfo=timezone.utc).timestamp())
+        deadline = max(time.time(), base + interval)
+        
+        self._next_poll[device_id] = (deadline, interval, reason)
+        heapq.heappush(self._schedule, (deadline, device_id))
+    
+    def _pop_due(self, now):
+        """
+        Saca del heap los vehículos cuyo plazo ya venció
+        """
+        due = []
+        with self._schedule_lock:
+            while self._schedule and self._schedule[0][0] <= now:
+                deadline, device_id = heapq.heappop(self._schedule)
+                # Ignorar entradas obsoletas (el vehículo se reprogramó o se eliminó)
+                current = self._next_poll.get(device_id)
+                if current and current[0] == deadline:
+                    due.append(self._devices[device_id])
+        return due
     
     def _update_loop(self):
         """
-        Loop principal que envía SMS cada X segundos
+        Loop principal: cada vehículo tiene su propio plazo en un heap y se
+        sondea cuando vence; interval_seconds es el tope para toda la flota
         """
+        self._next_refresh = 0
         while self.is_running:
             try:
-                session = self.session_factory()
+                if time.time() >= self._next_refresh:
+                    self._refresh_devices()
+                    if not self._devices:
+                        print(f"[{datetime.now().strftime('%H:%M:%S')}] No hay vehículos con SIM configurado")
                 
-                try:
-                    # Obtener todos los vehículos activos (no eliminados)
-                    devices = session.query(self.gps_device_model).filter(
-                        self.gps_device_model.status != 'deleted'
-                    ).all()
+                due = self._pop_due(time.time())
+                if due:
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] Enviando SMS a {len(due)} vehículos...")
                     
-                    # Filtrar solo los que tienen número de SIM configurado
-                    devices_with_sim = [d for d in devices if d.placa_gps]
-                    
-                    if devices_with_sim:
-                        print(f"[{datetime.now().strftime('%H:%M:%S')}] Enviando SMS a {len(devices_with_sim)} vehículos...")
-                        
-                        for device in devices_with_sim:
-                            result = self._send_location_request(device)
-                            
-                            if result['success']:
-                                self.stats['total_sent'] += 1
-                                print(f"  ✓ SMS enviado a {result['device_name']} ({result['to']})")
-                            else:
-                                self.stats['total_errors'] += 1
-                                error_msg = result.get('error', 'Error desconocido')
-                                print(f"  ✗ Error enviando a {result.get('device_name', 'desconocido')}: {error_msg}")
-                                
-                                # Si se alcanzó el límite diario, detener el servicio
-                                if result.get('auto_stopped'):
-                                    print(f"  ⚠ Servicio detenido automáticamente debido al límite diario")
-                                    return  # Salir del loop
-                        
-                        self.stats['last_sent_time'] = datetime.now()
-                    else:
-                        print(f"[{datetime.now().strftime('%H:%M:%S')}] No hay vehículos con SIM configurado")
+                    if self._send_sweep(due):
+                        print(f"  ⚠ Servicio detenido automáticamente debido al límite diario")
+                        return  # Salir del loop
                     
-                finally:
-                    session.close()
+                    polled_at = time.time()
+                    with self._schedule_lock:
+                        for device in due:
+                            self._last_polled[device.id] = polled_at
+                            if device.id in self._devices:
+                                self._schedule_device(device.id)
+                    self.stats['last_sent_time'] = datetime.now()
                 
-                # Esperar el intervalo antes de la siguiente iteración
-                time.sleep(self.interval_seconds)
+                # Dormir hasta el próximo plazo (máximo 1 s para reaccionar a stop/set_interval)
+                with self._schedule_lock:
+                    next_deadline = self._schedule[0][0] if self._schedule else self._next_refresh
+                wait = min(next_deadline, self._next_refresh) - time.time()
+                time.sleep(max(0.05, min(wait, 1.0)))
                 
             except Exception as e:
                 print(f"Error en loop de actualización: {e}")
                 self.stats['total_errors'] += 1
-                time.sleep(self.interval_seconds)
+                time.sleep(min(self.interval_seconds, 5))
+    
+    def get_schedule(self):
+        """
+        Próximos sondeos programados, ordenados por plazo
+        """
+        now = time.time()
+        with self._schedule_lock:
+            entries = [
+                {
+                    'device_id': device_id,
+                    'name': self._devices[device_id].name,
+                    'next_poll_in_seconds': round(max(0, deadline - now), 1),
+                    'interval_seconds': round(interval, 1),
+                    'reason': reason,
+                    'speed_mps': round(self._speeds.get(device_id, 0.0), 2)
+                }
+                for device_id, (deadline, interval, reason) in self._next_poll.items()
+                if device_id in self._devices
+            ]
+        return sorted(entries, key=lambda e: e['next_poll_in_seconds'])
     
     def start(self):
         """
@@ -305,7 +353,7 @@ class AutoUpdateService:
             return {'status': 'already_running', 'message': 'El servicio ya está corriendo'}
         
         # Verificar que al menos un método esté disponible
-        if not self.sms_method and not self.vonage_configured and not self.twilio_configured:
+        if not configured_methods():
             return {
                 'status': 'error',
                 'message': 'No hay método de envío de SMS configurado. Configura un módem GSM, Android, Vonage o Twilio.'
@@ -317,7 +365,7 @@ class AutoUpdateService:
         
         return {
             'status': 'started',
-            'message': f'Servicio iniciado. Enviando SMS cada {self.interval_seconds} segundos.',
+            'message': f'Servicio iniciado. Enviando SMS a cada vehículo como máximo cada {self.interval_seconds} segundos.',
             'interval': self.interval_seconds
         }
     
@@ -344,22 +392,24 @@ class AutoUpdateService:
         """
         Obtiene el estado actual del servicio
         """
-        # Determinar método principal
-        main_method = None
-        if self.sms_method:
-            main_method = self.sms_method
-        elif self.vonage_configured:
-            main_method = 'vonage'
-        elif self.twilio_configured:
-            main_method = 'twilio'
+        # Determinar método principal (el más barato configurado)
+        methods = configured_methods()
+        main_method = methods[0] if methods else None
         
         return {
             'is_running': self.is_running,
             'interval_seconds': self.interval_seconds,
             'sms_method': main_method,
-            'free_sms_available': self.free_sms_sender is not None and self.free_sms_sender.is_available() if self.free_sms_sender else False,
-            'vonage_configured': self.vonage_configured,
-            'twilio_configured': self.twilio_configured,
+            'free_sms_available': FREE_SMS_AVAILABLE and get_sms_sender(self.sms_method_env) is not None,
+            'vonage_configured': vonage_configured(),
+            'twilio_configured': twilio_configured(),
+            'configured_methods': methods,
+            'max_workers': self.max_workers,
+            'min_interval_seconds': min(self.min_interval_seconds, self.interval_seconds),
+            'rate_limits': get_rate_limit_stats(),
+            'providers': get_provider_stats(),
+            'dispatcher': self.dispatcher.get_stats(),
+            'schedule': self.get_schedule(),
             'stats': self.get_stats()
         }
     
@@ -370,18 +420,21 @@ class AutoUpdateService:
         return {
             'total_sent': self.stats['total_sent'],
             'total_errors': self.stats['total_errors'],
-            'last_sent_time': self.stats['last_sent_time'].isoformat() if self.stats['last_sent_time'] else None
+            'last_sent_time': self.stats['last_sent_time'].isoformat() if self.stats['last_sent_time'] else None,
+            'last_sweep_seconds': self.stats['last_sweep_seconds']
         }
     
     def set_interval(self, seconds):
         """
-        Cambia el intervalo de actualización
+        Cambia el intervalo de actualización (tope para todos los vehículos)
         """
         if seconds < 5:
             return {'status': 'error', 'message': 'El intervalo mínimo es 5 segundos'}
         
         old_interval = self.interval_seconds
         self.interval_seconds = seconds
+        # Recalcular los plazos de todos los vehículos con el nuevo tope
+        self._next_refresh = 0
         
         return {
             'status': 'updated',
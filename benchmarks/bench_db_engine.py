@@ -0,0 +1,163 @@
+"""
+Benchmark de concurrencia de la base de datos: lectores y escritores a la vez
+Reproduce la carga del servidor: hilos lectores que leen toda la tabla de
+vehículos (como /api/devices) e hilos escritores que actualizan la posición
+de un vehículo y agregan un punto al historial en una transacción (como
+process_sms). Compara create_engine con sus valores por defecto contra
+db_engine.create_db_engine, siempre sobre SQLite (archivos temporales
+nuevos) y además sobre PostgreSQL si se indica una URL.
+
+Uso:
+    python benchmarks/bench_db_engine.py [lectores] [escritores] [segundos] [url_postgres]
+    (la URL de PostgreSQL también se toma de BENCH_POSTGRES_URL)
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import (  # noqa: E402  # pyright: ignore[reportMissingImports]
+    Table, Column, Integer, Float, DateTime, MetaData, create_engine, select, update
+)
+from db_engine import create_db_engine  # noqa: E402
+
+VEHICLES = 500
+
+metadata = MetaData()
+devices = Table(
+    'bench_devices', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('latitude', Float),
+    Column('longitude', Float),
+    Column('last_update', DateTime),
+    Column('revision', Integer)
+)
+history = Table(
+    'bench_history', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('device_id', Integer),
+    Column('latitude', Float),
+    Column('longitude', Float),
+    Column('timestamp', DateTime)
+)
+
+
+def prepare(engine):
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(devices.insert(), [
+            {'id': i, 'latitude': 7.1254, 'longitude': -73.1198, 'last_update': datetime.utcnow(), 'revision': 0}
+            for i in range(1, VEHICLES + 1)
+        ])
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(engine, readers, writers, seconds):
+    """
+    Ejecuta la carga y retorna operaciones, latencias (ms) y errores por tipo
+    """
+    prepare(engine)
+    stop = threading.Event()
+    lock = threading.Lock()
+    results = {'read': [], 'write': [], 'errors': {}}
+
+    def record(kind, elapsed_ms=None, error=None):
+        with lock:
+            if error is not None:
+                name = type(error).__name__
+                results['errors'][name] = results['errors'].get(name, 0) + 1
+            else:
+                results[kind].append(elapsed_ms)
+
+    def reader():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    rows = conn.execute(select(devices)).all()
+                assert len(rows) == VEHICLES
+                record('read', (time.perf_counter() - started) * 1000)
+            except Exception as e:
+                record('read', error=e)
+
+    def writer(seed):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            device_id = rng.randint(1, VEHICLES)
+            lat, lon = 7.1254 + rng.uniform(-0.05, 0.05), -73.1198 + rng.uniform(-0.05, 0.05)
+            now = datetime.utcnow()
+            started = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(update(devices).where(devices.c.id == device_id).values(
+                        latitude=lat, longitude=lon, last_update=now, revision=devices.c.revision + 1
+                    ))
+                    conn.execute(history.insert().values(device_id=device_id, latitude=lat, longitude=lon, timestamp=now))
+                record('write', (time.perf_counter() - started) * 1000)
+            except Exception as e:
+                record('write', error=e)
+
+    threads = [threading.Thread(target=reader, daemon=True) for _ in range(readers)]
+    threads += [threading.Thread(target=writer, args=(k,), daemon=True) for k in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    return results
+
+
+def report(label, results, seconds):
+    print(f'  {label}')
+    for kind, name in (('read', 'lecturas'), ('write', 'escrituras')):
+        latencies = results[kind]
+        print(f'    {name:10} {len(latencies) / seconds:9.0f} ops/s   p50 {percentile(latencies, 0.5):7.2f} ms'
+              f'   p99 {percentile(latencies, 0.99):8.2f} ms')
+    errors = ', '.join(f'{name}: {count}' for name, count in results['errors'].items()) or 'ninguno'
+    print(f'    errores    {errors}')
+
+
+def main():
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    postgres_url = sys.argv[4] if len(sys.argv) > 4 else os.getenv('BENCH_POSTGRES_URL')
+
+    print(f'{readers} lectores + {writers} escritores durante {seconds:g} s ({VEHICLES} vehículos)')
+    with tempfile.TemporaryDirectory() as tmp:
+        print('SQLite:')
+        url = f'sqlite:///{os.path.join(tmp, "default.db")}'
+        report('create_engine por defecto (rollback journal, synchronous=FULL)',
+               run(create_engine(url), readers, writers, seconds), seconds)
+        url = f'sqlite:///{os.path.join(tmp, "tuned.db")}'
+        report('create_db_engine (WAL, synchronous=NORMAL, busy_timeout, mmap)',
+               run(create_db_engine(url), readers, writers, seconds), seconds)
+
+    if postgres_url:
+        print('PostgreSQL:')
+        report('create_engine por defecto', run(create_engine(postgres_url), readers, writers, seconds), seconds)
+        report('create_db_engine (pool_size, max_overflow, pre_ping)',
+               run(create_db_engine(postgres_url), readers, writers, seconds), seconds)
+        engine = create_engine(postgres_url)
+        metadata.drop_all(engine)
+        engine.dispose()
+    else:
+        print('PostgreSQL: omitido (indica la URL como 4.º argumento o en BENCH_POSTGRES_URL)')
+
+
+if __name__ == '__main__':
+    main()
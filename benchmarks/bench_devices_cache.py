@@ -0,0 +1,80 @@
+"""
+Benchmark de GET /api/devices con y sin la caché de respuesta
+Crea una flota en una base SQLite temporal y mide la latencia de la ruta
+(con el cliente de pruebas de Flask) reconstruyendo la respuesta en cada
+petición, desde la caché y con revalidación 304 (If-None-Match). Luego
+simula dashboards que sondean mientras llegan fixes y reporta la tasa de
+aciertos.
+
+Uso:
+    python benchmarks/bench_devices_cache.py [vehículos] [peticiones] [sondeos_por_fix]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+TMP = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(TMP, "devices.db")}'
+os.environ.setdefault('SMS_METHOD', 'none')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as server  # noqa: E402
+from sms_gps_handler import SMSGPSHandler  # noqa: E402
+
+
+def timed(client, requests, headers=None, invalidate=False):
+    started = time.perf_counter()
+    for _ in range(requests):
+        if invalidate:
+            server.devices_cache.invalidate()
+        response = client.get('/api/devices', headers=headers or {})
+        assert response.status_code in (200, 304)
+    return (time.perf_counter() - started) / requests * 1000
+
+
+def main():
+    vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    polls_per_fix = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    with server.engine.begin() as conn:
+        conn.execute(server.GPSDevice.__table__.insert(), [
+            {
+                'device_id': f'BENCH{i}', 'name': f'Carro {i}', 'placa_gps': f'300{i:07d}',
+                'latitude': 7.1254 + i * 1e-4, 'longitude': -73.1198, 'status': 'active', 'revision': 0
+            }
+            for i in range(vehicles)
+        ])
+    server.sim_device_index.invalidate()
+    client = server.app.test_client()
+
+    rebuild_ms = timed(client, requests, invalidate=True)
+    cached_ms = timed(client, requests)
+    etag = client.get('/api/devices').headers['ETag']
+    revalidate_ms = timed(client, requests, headers={'If-None-Match': etag})
+    size = len(client.get('/api/devices').data)
+
+    print(f'GET /api/devices con {vehicles} vehículos ({size / 1e3:.0f} KB):')
+    print(f'  Reconstruyendo cada vez:  {rebuild_ms:7.2f} ms/petición')
+    print(f'  Desde la caché:           {cached_ms:7.2f} ms/petición  ({rebuild_ms / cached_ms:.0f}x)')
+    print(f'  Revalidación (304):       {revalidate_ms:7.2f} ms/petición, 0 bytes')
+
+    # Dashboards sondeando mientras llegan fixes de la flota
+    before = server.devices_cache.get_stats()
+    for k in range(requests):
+        if k % polls_per_fix == 0:
+            SMSGPSHandler.process_sms(f'LAT:{7.2 + k * 1e-3:.5f},LON:-73.1200', f'300{k % vehicles:07d}')
+        client.get('/api/devices')
+    after = server.devices_cache.get_stats()
+    hits = after['hits'] - before['hits']
+    misses = after['misses'] - before['misses']
+    print(f'Sondeos con un fix cada {polls_per_fix}: {hits} aciertos, {misses} fallos '
+          f'(tasa de aciertos {hits / (hits + misses):.0%})')
+    server.engine.dispose()
+    shutil.rmtree(TMP, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
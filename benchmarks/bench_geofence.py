@@ -0,0 +1,110 @@
+"""
+Benchmark de la evaluación de geocercas por fix
+Genera cientos de geocercas (polígonos irregulares y círculos) alrededor de
+Bucaramanga y prueba fixes aleatorios contra ellas: recorriendo todas las
+geocercas con la prueba exacta (como sería sin índice) y con GeofenceIndex
+(grilla + bbox + prueba exacta). Ambos deben dar el mismo resultado.
+
+Uso:
+    python benchmarks/bench_geofence.py [geocercas] [fixes]
+"""
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geofence import Fence, GeofenceIndex  # noqa: E402
+
+Row = namedtuple('Row', 'id site name kind coordinates center_lat center_lon radius_m')
+
+CENTER_LAT = 7.1254
+CENTER_LON = -73.1198
+# Área de la flota: ~0.3° (unos 33 km) alrededor del centro
+SPREAD = 0.15
+
+
+def make_fences(count, rng):
+    fences = []
+    for fence_id in range(1, count + 1):
+        lat = CENTER_LAT + rng.uniform(-SPREAD, SPREAD)
+        lon = CENTER_LON + rng.uniform(-SPREAD, SPREAD)
+        if fence_id % 3 == 0:
+            row = Row(fence_id, 'default', f'circulo {fence_id}', 'circle', None, lat, lon, rng.uniform(100, 1500))
+        else:
+            # Polígono irregular de 8 a 40 vértices y radio de 200 m a 2 km
+            vertices = rng.randint(8, 40)
+            radius = rng.uniform(0.002, 0.02)
+            ring = []
+            for k in range(vertices):
+                angle = 2 * math.pi * k / vertices
+                r = radius * rng.uniform(0.6, 1.0)
+                ring.append((lon + r * math.cos(angle), lat + r * math.sin(angle)))
+            row = Row(fence_id, 'default', f'poligono {fence_id}', 'polygon', json.dumps(ring), None, None, None)
+        fences.append(Fence(row))
+    return fences
+
+
+def main():
+    fence_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    fix_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    rng = random.Random(42)
+
+    fences = make_fences(fence_count, rng)
+    fixes = [
+        (CENTER_LAT + rng.uniform(-SPREAD, SPREAD), CENTER_LON + rng.uniform(-SPREAD, SPREAD))
+        for _ in range(fix_count)
+    ]
+
+    started = time.perf_counter()
+    index = GeofenceIndex(fences)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    # Sin índice: prueba exacta contra cada geocerca (sin prefiltro por bbox)
+    def linear(lat, lon):
+        inside = []
+        for fence in fences:
+            if fence.ring is None:
+                hit = Fence.contains(fence, lat, lon)
+            else:
+                hit = False
+                ring = fence.ring
+                lon_j, lat_j = ring[-1]
+                for lon_i, lat_i in ring:
+                    if (lat_i > lat) != (lat_j > lat):
+                        if lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+                            hit = not hit
+                    lon_j, lat_j = lon_i, lat_i
+            if hit:
+                inside.append(fence.id)
+        return frozenset(inside)
+
+    sample = fixes[:min(len(fixes), 10000)]
+    for lat, lon in sample[:2000]:
+        assert linear(lat, lon) == index.containing(lat, lon), (lat, lon)
+
+    started = time.perf_counter()
+    for lat, lon in sample:
+        linear(lat, lon)
+    linear_us = (time.perf_counter() - started) / len(sample) * 1e6
+
+    started = time.perf_counter()
+    hits = 0
+    for lat, lon in fixes:
+        hits += bool(index.containing(lat, lon))
+    indexed_us = (time.perf_counter() - started) / len(fixes) * 1e6
+
+    per_cell = [len(cell) for cell in index.cells.values()]
+    print(f'Geocercas: {fence_count}  fixes: {fix_count:,}  (dentro de alguna: {hits / len(fixes):.0%})')
+    print(f'  Índice: {len(index.cells):,} celdas, {sum(per_cell) / len(per_cell):.1f} geocercas/celda, '
+          f'{len(index.large)} grandes, construido en {build_ms:.1f} ms')
+    print(f'  Recorriendo todas:  {linear_us:10.1f} µs/fix')
+    print(f'  Con índice:         {indexed_us:10.1f} µs/fix  ({linear_us / indexed_us:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
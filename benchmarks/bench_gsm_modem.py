@@ -0,0 +1,251 @@
+"""
+Benchmark del driver AT contra un módem simulado en un pty
+El módem falso responde a los comandos de inicialización, al prompt de
+AT+CMGS y emite URC (+CMTI) cada cierto número de envíos. Compara el envío
+anterior (sleep fijo de 0.5 s + 2 s y lectura a ciegas) con el driver basado
+en eventos, mide comandos en pipeline y la recepción por lotes
+(AT+CNMI / AT+CMGL / AT+CMGD por índice) de una ráfaga de SMS entrantes. Al final
+reparte envíos concurrentes entre 1..N módems simulados con ModemPool, con
+el limitador real de cada módem (SMS_RATE_GSM_MODEM / SMS_BURST_GSM_MODEM).
+
+Solo funciona en Linux/macOS (usa os.openpty).
+
+Uso:
+    python benchmarks/bench_gsm_modem.py [mensajes] [latencia_red_ms] [módems]
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serial  # noqa: E402  # pyright: ignore[reportMissingImports]
+from gsm_modem import ATModem  # noqa: E402
+from modem_inbox import ModemInbox  # noqa: E402
+from modem_pool import ModemPool  # noqa: E402
+from rate_limit import get_limiter  # noqa: E402
+
+
+class FakeModem:
+    """
+    Módem GSM simulado sobre el lado maestro de un pty
+    """
+
+    def __init__(self, network_delay=0.1, urc_every=10):
+        self.master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        self.network_delay = network_delay
+        self.urc_every = urc_every
+        self.echo = True
+        self.sent = 0
+        # Memoria de la SIM: índice -> [estado, remitente, texto]
+        self.storage = {}
+        self.next_index = 1
+        self.list_commands = 0
+        self.delete_commands = 0
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _write(self, text):
+        with self._lock:
+            os.write(self.master, text.encode())
+
+    def deliver(self, phone_number, text):
+        """
+        Simula la llegada de un SMS: se guarda en la SIM y se avisa con +CMTI
+        """
+        with self._lock:
+            index = self.next_index
+            self.next_index += 1
+            self.storage[index] = ['REC UNREAD', phone_number, text]
+        self._write(f'\r\n+CMTI: "SM",{index}\r\n')
+
+    def _list_messages(self, status):
+        timestamp = datetime.now().strftime('%y/%m/%d,%H:%M:%S-20')
+        with self._lock:
+            self.list_commands += 1
+            entries = [(index, list(entry)) for index, entry in sorted(self.storage.items())
+                       if status == 'ALL' or entry[0] == status]
+            for index, _ in entries:
+                self.storage[index][0] = 'REC READ'
+        response = ''.join(
+            f'\r\n+CMGL: {index},"{state}","{phone}",,"{timestamp}"\r\n{text}'
+            for index, (state, phone, text) in entries
+        )
+        self._write(response + '\r\n\r\nOK\r\n')
+
+    def _delete(self, index):
+        with self._lock:
+            self.delete_commands += 1
+            found = self.storage.pop(index, None) is not None
+        self._write('\r\nOK\r\n' if found else '\r\n+CMS ERROR: 321\r\n')
+
+    def _loop(self):
+        buffer = b''
+        sms_text = None
+        while True:
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return
+            buffer += data
+
+            while True:
+                if sms_text is not None:
+                    # Modo texto de AT+CMGS: todo hasta Ctrl+Z es el mensaje
+                    index = buffer.find(b'\x1a')
+                    if index < 0:
+                        break
+                    buffer = buffer[index + 1:]
+                    sms_text = None
+                    time.sleep(self.network_delay)
+                    self.sent += 1
+                    self._write(f'\r\n+CMGS: {self.sent % 256}\r\n\r\nOK\r\n')
+                    if self.urc_every and self.sent % self.urc_every == 0:
+                        self._write('\r\n+CMTI: "SM",1\r\n')
+                    continue
+
+                index = buffer.find(b'\r')
+                if index < 0:
+                    break
+                command = buffer[:index].decode(errors='ignore').strip()
+                buffer = buffer[index + 1:].lstrip(b'\n')
+                if not command:
+                    continue
+                if self.echo:
+                    self._write(command + '\r\n')
+
+                upper = command.upper()
+                if upper.startswith('AT+CMGS='):
+                    sms_text = b''
+                    self._write('\r\n> ')
+                elif upper == 'ATE0':
+                    self.echo = False
+                    self._write('\r\nOK\r\n')
+                elif upper == 'AT+CSQ':
+                    self._write('\r\n+CSQ: 21,0\r\n\r\nOK\r\n')
+                elif upper.startswith('AT+CMGL'):
+                    self._list_messages(command.split('=', 1)[1].strip('"') if '=' in command else 'REC UNREAD')
+                elif upper.startswith('AT+CMGD='):
+                    self._delete(int(command.split('=', 1)[1].split(',')[0]))
+                elif upper.startswith('AT'):
+                    self._write('\r\nOK\r\n')
+                else:
+                    self._write('\r\nERROR\r\n')
+
+
+def legacy_send(port, phone, message):
+    """
+    Envío anterior de FreeSMSSender, copiado tal cual (sin la apertura del puerto)
+    """
+    port.write(f'AT+CMGS="{phone}"\r\n'.encode())
+    time.sleep(0.5)
+    port.write(message.encode())
+    port.write(b'\x1A')
+    time.sleep(2)
+    response = port.read(500).decode('utf-8', errors='ignore')
+    return 'OK' in response or '+CMGS' in response
+
+
+def bench_pool(modems, messages, network_delay):
+    """
+    Envía `messages` SMS desde varios hilos por un pool de `modems` módems simulados
+
+    Returns:
+        tuple: (SMS/s, envíos por puerto)
+    """
+    fakes = [FakeModem(network_delay=network_delay, urc_every=0) for _ in range(modems)]
+    pool = ModemPool([fake.port for fake in fakes])
+    assert pool.open() == modems
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=modems * 4) as executor:
+        list(executor.map(lambda _: pool.send_sms('573001234567', 'URL#'), range(messages)))
+    throughput = messages / (time.perf_counter() - started)
+    per_port = [member['sent'] for member in pool.get_stats()['members']]
+    pool.close()
+    return throughput, per_port
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    network_delay = (int(sys.argv[2]) if len(sys.argv) > 2 else 100) / 1000
+    pool_size = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    # Envío anterior: pocas muestras bastan (el tiempo lo fijan los sleep)
+    fake = FakeModem(network_delay=network_delay, urc_every=0)
+    port = serial.Serial(fake.port, 9600, timeout=0.2)
+    legacy_samples = 3
+    started = time.perf_counter()
+    for _ in range(legacy_samples):
+        assert legacy_send(port, '573001234567', 'URL#')
+    legacy_per_sms = (time.perf_counter() - started) / legacy_samples
+    port.close()
+
+    fake = FakeModem(network_delay=network_delay, urc_every=10)
+    urcs = []
+    started = time.perf_counter()
+    modem = ATModem(fake.port).open()
+    open_seconds = time.perf_counter() - started
+    modem.add_urc_handler(lambda line, body: urcs.append(line))
+
+    started = time.perf_counter()
+    for _ in range(messages):
+        modem.send_sms('573001234567', 'URL#')
+    engine_per_sms = (time.perf_counter() - started) / messages
+
+    # Pipeline: se encolan todos y el driver los escribe uno tras otro sin esperas
+    started = time.perf_counter()
+    requests = [modem.submit('AT+CSQ') for _ in range(200)]
+    for request in requests:
+        assert request.wait(5) == ['+CSQ: 21,0']
+    pipelined = 200 / (time.perf_counter() - started)
+    stats = modem.get_stats()
+    urc_count = len(urcs)
+
+    # Recepción: ráfaga de SMS entrantes, leídos y borrados por lotes
+    inbound = 500
+    received = []
+    done = threading.Event()
+
+    def on_sms(text, phone):
+        received.append((phone, text))
+        if len(received) == inbound:
+            done.set()
+
+    inbox = ModemInbox(modem, on_sms, batch_delay=0.05)
+    inbox.start()
+    started = time.perf_counter()
+    for i in range(inbound):
+        fake.deliver(f'+5730012{i:05d}', f'LAT:7.{i:04d},LON:-73.1198')
+    done.wait(30)
+    inbound_seconds = time.perf_counter() - started
+    inbox.stop()
+    modem.close()
+
+    print(f'Módem simulado en {fake.port}, latencia de red {network_delay * 1000:.0f} ms')
+    print(f'  Apertura + inicialización (driver):   {open_seconds * 1000:8.1f} ms (antes: 2000+ ms de sleep)')
+    print(f'  Envío anterior (sleep fijo):          {legacy_per_sms * 1000:8.1f} ms/SMS  ({1 / legacy_per_sms:6.2f} SMS/s)')
+    print(f'  Driver AT por eventos:                {engine_per_sms * 1000:8.1f} ms/SMS  ({1 / engine_per_sms:6.2f} SMS/s, {legacy_per_sms / engine_per_sms:.1f}x)')
+    print(f'  Comandos en pipeline (AT+CSQ):        {pipelined:8.0f} cmd/s')
+    print(f'  URC recibidas: {urc_count} (esperadas {messages // 10}), errores: {stats["errors"]}, timeouts: {stats["timeouts"]}')
+    print(f'  Recepción: {len(received)}/{inbound} SMS en {inbound_seconds * 1000:.0f} ms con '
+          f'{fake.list_commands} AT+CMGL y {fake.delete_commands} AT+CMGD '
+          f'(uno a uno serían además {inbound} AT+CMGR); quedan {len(fake.storage)} en la SIM')
+
+    limiter = get_limiter('gsm_modem').get_stats()
+    print(f'  Limitador por módem: {limiter["rate_per_second"]} SMS/s, ráfaga {limiter["burst"]}, '
+          f'{limiter["concurrency"]} envío(s) a la vez')
+    single = None
+    for modems in range(1, pool_size + 1):
+        throughput, per_port = bench_pool(modems, messages, network_delay)
+        single = single or throughput
+        print(f'  Pool de {modems} módem(s):                {throughput:8.2f} SMS/s ({throughput / single:.1f}x)  por puerto: {per_port}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark de la exportación del historial de un día de toda la flota
+Llena una base SQLite temporal con un fix cada `intervalo` segundos por
+vehículo durante 24 horas y compara:
+
+- la consulta anterior (LocationHistory.query: un dict por punto + JSON);
+- la exportación columnar (iter_columns + stream_columns), verificando que
+  los bytes se decodifican a los mismos puntos;
+- el trayecto de un vehículo: JSON de puntos vs polilínea codificada.
+
+Uso:
+    python benchmarks/bench_history_export.py [vehículos] [intervalo_s]
+"""
+import json
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine  # noqa: E402  # pyright: ignore[reportMissingImports]
+from location_history import LocationHistory, COLUMN_TYPES  # noqa: E402
+from trajectory_export import stream_columns, encode_track  # noqa: E402
+
+
+def seed(history, vehicles, interval, day_start):
+    rng = random.Random(7)
+    fixes_per_vehicle = 24 * 3600 // interval
+    with history.engine.begin() as conn:
+        for device_id in range(1, vehicles + 1):
+            lat, lon = 7.1254 + rng.uniform(-0.05, 0.05), -73.1198 + rng.uniform(-0.05, 0.05)
+            rows = []
+            for k in range(fixes_per_vehicle):
+                lat += rng.uniform(-0.0005, 0.0005)
+                lon += rng.uniform(-0.0005, 0.0005)
+                rows.append({
+                    'device_id': device_id,
+                    'latitude': lat,
+                    'longitude': lon,
+                    'timestamp': day_start + timedelta(seconds=k * interval + rng.randint(0, interval - 1))
+                })
+            history.append_many(conn, rows)
+    return vehicles * fixes_per_vehicle
+
+
+def decode_columns(payload):
+    """
+    Decodifica el formato 'columns' (como lo haría un cliente) a arrays
+    """
+    columns = {name: array(typecode) for name, typecode in COLUMN_TYPES}
+    offset = 0
+    while offset < len(payload):
+        (count,) = struct.unpack_from('<I', payload, offset)
+        offset += 4
+        for name, typecode in COLUMN_TYPES:
+            size = count * 8
+            columns[name].frombytes(payload[offset:offset + size])
+            offset += size
+    return columns
+
+
+def main():
+    vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    interval = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f'sqlite:///{os.path.join(tmp, "history.db")}')
+        history = LocationHistory(engine)
+        day_start = datetime(2026, 3, 10)
+        day_end = day_start + timedelta(days=1)
+        history.ensure_partition(day_start)
+        total = seed(history, vehicles, interval, day_start)
+
+        started = time.perf_counter()
+        points = history.query(start=day_start, end=day_end)
+        json_payload = json.dumps({'count': len(points), 'points': points}).encode()
+        json_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        columns_payload = b''.join(stream_columns(history.iter_columns(start=day_start, end=day_end)))
+        columns_s = time.perf_counter() - started
+
+        decoded = decode_columns(columns_payload)
+        assert len(decoded['device_id']) == len(points) == total
+        expected = sorted((p['device_id'], p['timestamp'], p['latitude'], p['longitude']) for p in points)
+        actual = sorted(
+            (d, (datetime(1970, 1, 1) + timedelta(milliseconds=t)).isoformat(), lat, lon)
+            for d, t, lat, lon in zip(decoded['device_id'], decoded['timestamp_ms'], decoded['latitude'], decoded['longitude'])
+        )
+        assert expected == actual
+
+        one = history.query(device_id=1, start=day_start, end=day_end)
+        one_json = json.dumps({'count': len(one), 'points': one}).encode()
+        started = time.perf_counter()
+        track = json.dumps(encode_track(history.iter_columns(device_id=1, start=day_start, end=day_end))).encode()
+        track_ms = (time.perf_counter() - started) * 1000
+
+        print(f'Flota: {vehicles} vehículos x {24 * 3600 // interval} fixes = {total:,} puntos en un día')
+        print(f'  query() + JSON:          {json_s * 1000:8.0f} ms  {len(json_payload) / 1e6:7.2f} MB')
+        print(f'  iter_columns + columns:  {columns_s * 1000:8.0f} ms  {len(columns_payload) / 1e6:7.2f} MB'
+              f'  ({json_s / columns_s:.1f}x más rápido, {len(json_payload) / len(columns_payload):.1f}x menos bytes)')
+        print(f'Trayecto de un vehículo ({len(one)} puntos):')
+        print(f'  JSON de puntos:          {len(one_json) / 1e3:8.1f} KB')
+        print(f'  Polilínea codificada:    {len(track) / 1e3:8.1f} KB  ({track_ms:.1f} ms)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Micro-benchmark del parser de SMS GPS
+Compara el parser anterior (lista de regex reconstruida en cada llamada, hasta
+seis re.search) con el parser actual (patrones precompilados y formato
+aprendido por remitente) sobre un corpus con las formas reales que
+envían las placas. También mide la alternativa de un solo patrón combinado
+(un lookahead por formato, despachando por match.lastgroup) para justificar
+por qué el parser no la usa.
+
+Uso:
+    python benchmarks/bench_sms_parser.py [repeticiones]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sms_gps_handler import SMS_FORMATS, SMSGPSHandler, _COMPILED_FORMATS, _sender_formats, _sender_formats_lock  # noqa: E402
+
+# Formas de mensaje que envían las placas (una por remitente)
+CORPUS = [
+    ('+573001000001', 'http://maps.google.com/maps?q=N7.097760,W73.122780'),
+    ('+573001000002', 'Lat:N7.11 Lon:W73.12 Speed:0.0km/h 2024-05-01 10:22 http://maps.google.com/maps?q=N7.110000,W73.120000'),
+    ('+573001000003', 'https://www.google.com/maps?q=N7.125400,W73.119800 bat:85%'),
+    ('+573001000004', 'LAT:7.1254,LON:-73.1198'),
+    ('+573001000005', 'lat: 7.1301 lon: -73.1255 spd: 12'),
+    ('+573001000006', '7.1254,-73.1198'),
+    ('+573001000007', '7.1254 -73.1198'),
+    ('+573001000008', 'lat=7.1254&lon=-73.1198'),
+    ('+573001000009', 'GPS:7.1254,-73.1198'),
+    ('+573001000010', 'GPS: 7.0931 -73.1079 ACC ON'),
+    ('+573001000011', 'Mensaje sin coordenadas'),
+]
+
+
+def legacy_parse_sms(sms_text, phone_number):
+    """
+    Parser anterior, copiado tal cual para comparar
+    """
+    patterns = [
+        r'maps\.google\.com/maps\?q=([NS])(\d+\.?\d*),([EW])(\d+\.?\d*)',
+        r'q=([NS])(\d+\.?\d*),([EW])(\d+\.?\d*)',
+        r'LAT[:\s]*([+-]?\d+\.?\d*)[,\s]+LON[:\s]*([+-]?\d+\.?\d*)',
+        r'([+-]?\d+\.?\d*)[,\s]+([+-]?\d+\.?\d*)',
+        r'lat[=:]\s*([+-]?\d+\.?\d*)[,\s&]+lon[=:]\s*([+-]?\d+\.?\d*)',
+        r'GPS[:\s]*([+-]?\d+\.?\d*)[,\s]+([+-]?\d+\.?\d*)',
+    ]
+
+    for i, pattern in enumerate(patterns):
+        match = re.search(pattern, sms_text, re.IGNORECASE)
+        if match:
+            try:
+                if i < 2:
+                    direction_lat = match.group(1).upper()
+                    lat_value = float(match.group(2))
+                    direction_lon = match.group(3).upper()
+                    lon_value = float(match.group(4))
+                    lat = lat_value if direction_lat == 'N' else -lat_value
+                    lon = lon_value if direction_lon == 'E' else -lon_value
+                else:
+                    lat = float(match.group(1))
+                    lon = float(match.group(2))
+
+                if -90 <= lat <= 90 and -180 <= lon <= 180:
+                    return {
+                        'latitude': lat,
+                        'longitude': lon,
+                        'phone_number': phone_number,
+                        'raw_sms': sms_text
+                    }
+            except (ValueError, IndexError):
+                continue
+
+    return None
+
+
+# Un solo patrón con prioridad: cada alternativa busca su formato en todo el texto
+COMBINED = re.compile(
+    r'\A(?:' + '|'.join(rf'(?=[\s\S]*?(?P<{name}>{pattern}))' for name, pattern in SMS_FORMATS) + ')',
+    re.IGNORECASE
+)
+
+
+def ordered_format(sms_text):
+    """
+    Formato de mayor prioridad presente en el texto, con los search en orden (lo que hace el parser)
+    """
+    for format_index, pattern in enumerate(_COMPILED_FORMATS):
+        if pattern.search(sms_text):
+            return SMS_FORMATS[format_index][0]
+    return None
+
+
+def combined_format(sms_text):
+    """
+    Formato de mayor prioridad presente en el texto, con un solo match del patrón combinado
+    """
+    match = COMBINED.match(sms_text)
+    return match.lastgroup if match else None
+
+
+def coordinates(result):
+    return (result['latitude'], result['longitude']) if result else None
+
+
+def run(parse, repetitions):
+    """
+    Retorna mensajes por segundo al parsear el corpus `repetitions` veces
+    """
+    started = time.perf_counter()
+    for _ in range(repetitions):
+        for phone, text in CORPUS:
+            parse(text, phone)
+    elapsed = time.perf_counter() - started
+    return repetitions * len(CORPUS) / elapsed
+
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    # Ambos parsers deben dar las mismas coordenadas en todo el corpus
+    for phone, text in CORPUS:
+        expected = coordinates(legacy_parse_sms(text, phone))
+        actual = coordinates(SMSGPSHandler.parse_sms(text, phone))
+        assert expected == actual, f'{text!r}: {expected} != {actual}'
+
+    legacy = run(legacy_parse_sms, repetitions)
+
+    # Selección del formato: search en orden contra el patrón combinado
+    for _, text in CORPUS:
+        assert ordered_format(text) == combined_format(text), text
+    selection = {}
+    for name, select in (('ordered', ordered_format), ('combined', combined_format)):
+        started = time.perf_counter()
+        for _ in range(repetitions):
+            for _, text in CORPUS:
+                select(text)
+        selection[name] = repetitions * len(CORPUS) / (time.perf_counter() - started)
+
+    # Sin aprendizaje: se olvida el formato del remitente antes de cada mensaje
+    started = time.perf_counter()
+    for _ in range(repetitions):
+        for phone, text in CORPUS:
+            with _sender_formats_lock:
+                _sender_formats.pop(phone, None)
+            SMSGPSHandler.parse_sms(text, phone)
+    cold = repetitions * len(CORPUS) / (time.perf_counter() - started)
+
+    _sender_formats.clear()
+    warm = run(SMSGPSHandler.parse_sms, repetitions)
+
+    print(f'Corpus: {len(CORPUS)} mensajes x {repetitions} repeticiones')
+    print(f'  Parser anterior:                    {legacy:12,.0f} msg/s')
+    print(f'  Parser actual (sin aprendizaje):    {cold:12,.0f} msg/s  ({cold / legacy:.2f}x)')
+    print(f'  Parser actual (formato aprendido):  {warm:12,.0f} msg/s  ({warm / legacy:.2f}x)')
+    print('Selección del formato (sin convertir coordenadas):')
+    print(f'  search en orden (parser actual):    {selection["ordered"]:12,.0f} msg/s')
+    print(f'  patrón combinado con lookahead:     {selection["combined"]:12,.0f} msg/s  '
+          f'({selection["combined"] / selection["ordered"]:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
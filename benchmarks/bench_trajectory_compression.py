@@ -0,0 +1,133 @@
+"""
+Benchmark de la reducción del historial en una flota mayormente estacionada
+Simula un día por vehículo con un fix cada `intervalo` segundos: estacionado
+la mayor parte del tiempo (posición repetida con ruido del GPS de unos
+metros) y algunos recorridos cortos. Mide:
+
+- cuántos fixes escribe process_sms sin filtro y con la banda muerta;
+- cuántos puntos quedan tras la compactación (Douglas-Peucker con distancia
+  sincronizada) y cuánto tarda, verificando que ningún punto descartado
+  quede a más de la tolerancia de la trayectoria conservada.
+
+Uso:
+    python benchmarks/bench_trajectory_compression.py [vehículos] [intervalo_s] [banda_m] [tolerancia_m]
+"""
+import math
+import os
+import sys
+import time
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from trajectory_compression import DeadBandFilter, compress_batch, _METERS_PER_DEGREE  # noqa: E402
+
+CENTER_LAT = 7.1254
+CENTER_LON = -73.1198
+
+
+def make_vehicle(rng, fixes, interval):
+    """
+    Un día de un vehículo: paradas de 2-6 h y recorridos de 10-30 min a 3-12 km/h
+    """
+    lats = np.empty(fixes)
+    lons = np.empty(fixes)
+    lat = CENTER_LAT + rng.uniform(-0.03, 0.03)
+    lon = CENTER_LON + rng.uniform(-0.03, 0.03)
+    k = 0
+    while k < fixes:
+        parked = int(rng.uniform(120, 360) * 60 / interval)
+        for _ in range(min(parked, fixes - k)):
+            # Ruido del GPS alrededor de la posición estacionada (σ ≈ 3 m)
+            lats[k] = lat + rng.normal(0, 3) / _METERS_PER_DEGREE
+            lons[k] = lon + rng.normal(0, 3) / _METERS_PER_DEGREE
+            k += 1
+        heading = rng.uniform(0, 2 * math.pi)
+        for _ in range(min(int(rng.uniform(10, 30) * 60 / interval), fixes - k)):
+            heading += rng.normal(0, 0.15)
+            step = rng.uniform(3, 12) / 3.6 * interval / _METERS_PER_DEGREE
+            lat += step * math.sin(heading)
+            lon += step * math.cos(heading)
+            lats[k] = lat
+            lons[k] = lon
+            k += 1
+    return lats, lons
+
+
+def max_sed_error(timestamps, lats, lons, keep):
+    """
+    Máxima distancia (m) de un punto descartado a la trayectoria interpolada
+    """
+    kept = np.flatnonzero(keep)
+    interp_lat = np.interp(timestamps, timestamps[kept], lats[kept])
+    interp_lon = np.interp(timestamps, timestamps[kept], lons[kept])
+    scale = _METERS_PER_DEGREE * math.cos(math.radians(float(lats.mean())))
+    dx = (lons - interp_lon) * scale
+    dy = (lats - interp_lat) * _METERS_PER_DEGREE
+    return float(np.sqrt(dx * dx + dy * dy).max())
+
+
+def main():
+    vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    interval = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    deadband_m = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+    tolerance_m = float(sys.argv[4]) if len(sys.argv) > 4 else 10
+    rng = np.random.default_rng(5)
+    fixes = 24 * 3600 // interval
+
+    deadband = DeadBandFilter(meters=deadband_m)
+    batch = {name: array(typecode) for name, typecode in (
+        ('device_id', 'q'), ('timestamp_ms', 'q'), ('latitude', 'd'), ('longitude', 'd')
+    )}
+    received = 0
+    filter_s = 0.0
+    for device_id in range(1, vehicles + 1):
+        lats, lons = make_vehicle(rng, fixes, interval)
+        received += fixes
+        # Mismo recorrido que process_sms: la posición guardada solo cambia al guardar
+        started = time.perf_counter()
+        last_lat = last_lon = last_ms = None
+        for k in range(fixes):
+            lat, lon, ts = float(lats[k]), float(lons[k]), k * interval * 1000
+            store, close_stop = deadband.check(device_id, last_lat, last_lon, lat, lon)
+            if close_stop:
+                batch['device_id'].append(device_id)
+                batch['timestamp_ms'].append(last_ms)
+                batch['latitude'].append(last_lat)
+                batch['longitude'].append(last_lon)
+            if store:
+                last_lat, last_lon = lat, lon
+                batch['device_id'].append(device_id)
+                batch['timestamp_ms'].append(ts)
+                batch['latitude'].append(lat)
+                batch['longitude'].append(lon)
+            last_ms = ts
+        filter_s += time.perf_counter() - started
+
+    written = len(batch['device_id'])
+    started = time.perf_counter()
+    keep = compress_batch(batch, tolerance_m)
+    compact_ms = (time.perf_counter() - started) * 1000
+    kept = int(keep.sum())
+
+    device_ids = np.frombuffer(batch['device_id'], dtype=np.int64)
+    timestamps = np.frombuffer(batch['timestamp_ms'], dtype=np.int64).astype(np.float64)
+    lats = np.frombuffer(batch['latitude'], dtype=np.float64)
+    lons = np.frombuffer(batch['longitude'], dtype=np.float64)
+    worst = 0.0
+    for device_id in range(1, vehicles + 1):
+        rows = device_ids == device_id
+        worst = max(worst, max_sed_error(timestamps[rows], lats[rows], lons[rows], keep[rows]))
+    assert worst <= tolerance_m + 1e-6, worst
+
+    print(f'Flota: {vehicles} vehículos x {fixes} fixes = {received:,} fixes recibidos en un día')
+    print(f'  Sin filtro (un INSERT por fix):    {received:10,} puntos')
+    print(f'  Banda muerta de {deadband_m:g} m:             {written:10,} puntos  ({received / written:.1f}x menos escrituras, '
+          f'{filter_s / received * 1e6:.1f} µs/fix)')
+    print(f'  + compactación a {tolerance_m:g} m:           {kept:10,} puntos  ({received / kept:.1f}x en total, '
+          f'{compact_ms:.0f} ms, error máximo {worst:.1f} m)')
+
+
+if __name__ == '__main__':
+    main()
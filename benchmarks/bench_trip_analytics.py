@@ -0,0 +1,200 @@
+"""
+Benchmark de la analítica de alquileres sobre un día completo de la flota
+Simula cada vehículo moviéndose y deteniéndose durante 24 horas (un fix cada
+`intervalo` segundos), con varios alquileres por vehículo y geocercas que
+delimitan la zona permitida. Mide:
+
+- summarize_rentals (NumPy) contra un recorrido punto por punto en Python
+  con los mismos criterios (y verifica que den lo mismo);
+- el trabajo nocturno completo (TripAnalytics.analyze_pending) leyendo el
+  historial desde una base SQLite temporal.
+
+Uso:
+    python benchmarks/bench_trip_analytics.py [vehículos] [intervalo_s] [geocercas]
+"""
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402  # pyright: ignore[reportMissingImports]
+from geo_utils import haversine_m  # noqa: E402
+from geofence import Fence, GeofenceIndex  # noqa: E402
+from location_history import LocationHistory, EPOCH  # noqa: E402
+import trip_analytics  # noqa: E402
+from trip_analytics import TripAnalytics, rentals, summarize_rentals, SUMMARY_FIELDS  # noqa: E402
+
+Row = namedtuple('Row', 'id site name kind coordinates center_lat center_lon radius_m')
+
+CENTER_LAT = 7.1254
+CENTER_LON = -73.1198
+DAY = datetime(2026, 3, 10)
+
+
+class StaticFences:
+    def __init__(self, fences):
+        self._fences = fences
+
+    def fences(self):
+        return self._fences
+
+
+def make_fences(count, rng):
+    fences = []
+    for fence_id in range(1, count + 1):
+        lat = CENTER_LAT + rng.uniform(-0.05, 0.05)
+        lon = CENTER_LON + rng.uniform(-0.05, 0.05)
+        if fence_id % 2:
+            fences.append(Fence(Row(fence_id, 'default', 'c', 'circle', None, lat, lon, rng.uniform(300, 2000))))
+        else:
+            ring = [
+                (lon + 0.015 * math.cos(a) * rng.uniform(0.6, 1), lat + 0.015 * math.sin(a) * rng.uniform(0.6, 1))
+                for a in np.linspace(0, 2 * math.pi, rng.randint(8, 30), endpoint=False)
+            ]
+            fences.append(Fence(Row(fence_id, 'default', 'p', 'polygon', json.dumps(ring), None, None, None)))
+    return fences
+
+
+def make_day(vehicles, interval, rng):
+    """
+    Fixes de la flota ordenados por (vehículo, tiempo) y 3 alquileres por vehículo
+    """
+    np_rng = np.random.default_rng(1)
+    per_vehicle = 24 * 3600 // interval
+    device_ids = np.repeat(np.arange(1, vehicles + 1, dtype=np.int64), per_vehicle)
+    base_ms = (DAY - EPOCH) // timedelta(milliseconds=1)
+    timestamps = base_ms + np.tile(np.arange(per_vehicle, dtype=np.int64) * interval * 1000, vehicles)
+    # Caminata: detenido el 40 % de los tramos, el resto a 2-15 km/h; algún salto del GPS
+    moving = np_rng.random(device_ids.size) > 0.4
+    step = np.where(moving, np_rng.uniform(2, 15, device_ids.size) / 3.6 * interval / 111320, 0.0)
+    angle = np_rng.uniform(0, 2 * math.pi, device_ids.size)
+    dlat = step * np.sin(angle)
+    dlon = step * np.cos(angle)
+    jumps = np_rng.random(device_ids.size) < 0.002
+    dlat[jumps] += 0.05
+    lats = CENTER_LAT + np.cumsum(dlat.reshape(vehicles, per_vehicle), axis=1).ravel() + np.repeat(np_rng.uniform(-0.03, 0.03, vehicles), per_vehicle)
+    lons = CENTER_LON + np.cumsum(dlon.reshape(vehicles, per_vehicle), axis=1).ravel() + np.repeat(np_rng.uniform(-0.03, 0.03, vehicles), per_vehicle)
+
+    rental_rows = []
+    for device_id in range(1, vehicles + 1):
+        hour = rng.uniform(6, 9)
+        for _ in range(3):
+            start = DAY + timedelta(hours=hour)
+            end = start + timedelta(hours=rng.uniform(0.5, 3))
+            rental_rows.append((device_id, start, end))
+            hour += (end - start).total_seconds() / 3600 + rng.uniform(0.2, 2)
+    return device_ids, timestamps, lats, lons, rental_rows
+
+
+def python_summary(points, index):
+    """
+    Mismo resumen recorriendo punto por punto (como se haría sin NumPy)
+    """
+    result = dict.fromkeys(SUMMARY_FIELDS, 0)
+    result['fixes'] = len(points)
+    idle_run = 0.0
+    for (t1, lat1, lon1), (t2, lat2, lon2) in zip(points, points[1:]):
+        dt = (t2 - t1) / 1000.0
+        distance = haversine_m(lat1, lon1, lat2, lon2)
+        speed = distance / dt * 3.6 if dt > 0 else 0.0
+        if dt <= 0 or speed > trip_analytics.MAX_PLAUSIBLE_SPEED_KMH:
+            if idle_run >= trip_analytics.IDLE_MIN_SECONDS:
+                result['idle_segments'] += 1
+            idle_run = 0.0
+            continue
+        result['distance_m'] += distance
+        result['max_speed_kmh'] = max(result['max_speed_kmh'], speed)
+        if speed < trip_analytics.IDLE_SPEED_KMH:
+            result['idle_seconds'] += dt
+            idle_run += dt
+        else:
+            result['moving_seconds'] += dt
+            if idle_run >= trip_analytics.IDLE_MIN_SECONDS:
+                result['idle_segments'] += 1
+            idle_run = 0.0
+        if not index.containing(lat1, lon1):
+            result['out_of_bounds_seconds'] += dt
+    if idle_run >= trip_analytics.IDLE_MIN_SECONDS:
+        result['idle_segments'] += 1
+    if result['moving_seconds']:
+        result['avg_speed_kmh'] = result['distance_m'] / result['moving_seconds'] * 3.6
+    return result
+
+
+def main():
+    vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    interval = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    fence_count = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    rng = random.Random(3)
+
+    fences = make_fences(fence_count, rng)
+    device_ids, timestamps, lats, lons, rental_rows = make_day(vehicles, interval, rng)
+    rows_ms = [(d, (s - EPOCH) // timedelta(milliseconds=1), (e - EPOCH) // timedelta(milliseconds=1)) for d, s, e in rental_rows]
+    print(f'Día de flota: {vehicles} vehículos x {24 * 3600 // interval} fixes = {device_ids.size:,} puntos, '
+          f'{len(rental_rows)} alquileres, {fence_count} geocercas')
+
+    started = time.perf_counter()
+    vectorized = summarize_rentals(rows_ms, device_ids, timestamps, lats, lons, fences)
+    numpy_s = time.perf_counter() - started
+
+    # Referencia en Python puro sobre los mismos puntos
+    index = GeofenceIndex(fences)
+    started = time.perf_counter()
+    reference = []
+    for device_id, start_ms, end_ms in rows_ms:
+        lo = (device_id - 1) * (24 * 3600 // interval)
+        hi = lo + 24 * 3600 // interval
+        points = [
+            (int(timestamps[i]), float(lats[i]), float(lons[i]))
+            for i in range(lo, hi) if start_ms <= timestamps[i] <= end_ms
+        ]
+        reference.append(python_summary(points, index))
+    python_s = time.perf_counter() - started
+
+    for got, expected in zip(vectorized, reference):
+        for field in SUMMARY_FIELDS:
+            assert abs(got[field] - expected[field]) <= 0.1 + 1e-6 * abs(expected[field]), (field, got, expected)
+
+    print(f'  Python punto por punto:   {python_s * 1000:9.0f} ms')
+    print(f'  NumPy (summarize_rentals): {numpy_s * 1000:8.0f} ms  ({python_s / numpy_s:.0f}x)')
+
+    # Trabajo nocturno completo: historial en SQLite -> resúmenes guardados
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f'sqlite:///{os.path.join(tmp, "fleet.db")}')
+        history = LocationHistory(engine)
+        history.ensure_partition(DAY)
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            history.append_many(conn, [
+                {
+                    'device_id': int(d),
+                    'timestamp': EPOCH + timedelta(milliseconds=int(t)),
+                    'latitude': float(lat),
+                    'longitude': float(lon)
+                }
+                for d, t, lat, lon in zip(device_ids, timestamps, lats, lons)
+            ])
+        seed_s = time.perf_counter() - started
+
+        analytics = TripAnalytics(engine, history, geofences=StaticFences(fences))
+        with engine.begin() as conn:
+            conn.execute(rentals.insert(), [
+                {'device_id': d, 'started_at': s, 'ends_at': e, 'ended_at': e, 'duration_hours': 1}
+                for d, s, e in rental_rows
+            ])
+        result = analytics.analyze_pending(now=DAY + timedelta(days=1))
+        assert result['rentals'] == len(rental_rows)
+        print(f'  Trabajo nocturno desde SQLite ({seed_s:.0f} s para cargar la base): '
+              f'{result["elapsed_ms"]:.0f} ms para {result["fixes"]:,} fixes')
+
+
+if __name__ == '__main__':
+    main()
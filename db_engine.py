@@ -0,0 +1,155 @@
+"""
+Creación del engine de base de datos con la configuración de producción
+Con los valores por defecto de create_engine, SQLite usaba rollback journal
+(cada escritura bloquea también a los lectores), synchronous=FULL y ningún
+reintento ante "database is locked", mientras los hilos de Flask, la cola de
+ingesta, AutoUpdateService y los trabajos nocturnos comparten el archivo.
+
+- SQLite (archivo): WAL (lectores y un escritor a la vez), busy_timeout,
+  synchronous=NORMAL (seguro con WAL; solo se arriesga la última transacción
+  ante un corte de energía), mmap y caché de páginas más grandes. Los PRAGMAs
+  se aplican en cada conexión nueva del pool (QueuePool).
+- PostgreSQL (y otros): pool_size / max_overflow, pool_pre_ping para
+  descartar conexiones cortadas por el servidor y pool_recycle. Las URLs
+  postgres:// (Render, Heroku) se aceptan como postgresql://.
+
+Variables de entorno:
+    SQLITE_JOURNAL_MODE=WAL|DELETE|...  (por defecto WAL; DELETE en discos de red)
+    SQLITE_SYNCHRONOUS=NORMAL|FULL|OFF  (por defecto NORMAL)
+    SQLITE_BUSY_TIMEOUT_MS=<ms>         (por defecto 5000)
+    SQLITE_CACHE_SIZE_KB=<KiB>          (por defecto 65536)
+    SQLITE_MMAP_SIZE=<bytes>            (por defecto 268435456)
+    DB_POOL_SIZE=<conexiones>           (por defecto 10)
+    DB_MAX_OVERFLOW=<conexiones>        (por defecto 20)
+    DB_POOL_TIMEOUT=<segundos>          (por defecto 30)
+    DB_POOL_RECYCLE=<segundos>          (por defecto 1800)
+"""
+import os
+from sqlalchemy import create_engine, event  # pyright: ignore[reportMissingImports]
+from sqlalchemy.engine import make_url  # pyright: ignore[reportMissingImports]
+from sqlalchemy.pool import QueuePool  # pyright: ignore[reportMissingImports]
+
+SQLITE_PRAGMAS = ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size')
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+def sqlite_settings():
+    """
+    PRAGMAs que se aplican a cada conexión SQLite (según el entorno)
+
+    Returns:
+        dict: PRAGMA -> valor
+    """
+    return {
+        'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL').upper(),
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper(),
+        'busy_timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000),
+        # Negativo: tamaño en KiB en vez de páginas
+        'cache_size': -_env_int('SQLITE_CACHE_SIZE_KB', 65536),
+        'mmap_size': _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+    }
+
+
+def pool_settings():
+    """
+    Parámetros del pool de conexiones (según el entorno)
+    """
+    return {
+        'pool_size': _env_int('DB_POOL_SIZE', 10),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 20),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30)
+    }
+
+
+def normalize_url(url):
+    """
+    Acepta el esquema postgres:// que entregan algunos proveedores
+    """
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def _is_file_sqlite(url):
+    if url.get_backend_name() != 'sqlite':
+        return False
+    database = url.database or ''
+    return database not in ('', ':memory:') and 'mode=memory' not in database
+
+
+def install_sqlite_pragmas(engine, pragmas):
+    """
+    Aplica los PRAGMAs a cada conexión nueva del engine
+    """
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def create_db_engine(database_url, echo=False, **overrides):
+    """
+    Crea el engine de SQLAlchemy con la configuración adecuada al motor
+
+    Args:
+        database_url: URL de la base de datos (sqlite:///..., postgresql://...)
+        echo: Mostrar el SQL ejecutado
+        **overrides: Argumentos de create_engine que reemplazan a los calculados
+
+    Returns:
+        Engine: Engine de SQLAlchemy
+    """
+    url = make_url(normalize_url(database_url))
+    options = {'echo': echo}
+
+    if url.get_backend_name() == 'sqlite':
+        if _is_file_sqlite(url):
+            pragmas = sqlite_settings()
+            options.update(pool_settings())
+            # El pool comparte conexiones entre hilos; busy_timeout también como timeout del driver
+            options['connect_args'] = {
+                'check_same_thread': False,
+                'timeout': pragmas['busy_timeout'] / 1000
+            }
+            options.update(overrides)
+            engine = create_engine(url, **options)
+            install_sqlite_pragmas(engine, pragmas)
+            return engine
+        # Base en memoria: una sola conexión por hilo (por defecto de SQLAlchemy), sin WAL
+        options.update(overrides)
+        return create_engine(url, **options)
+
+    options.update(pool_settings())
+    options['pool_pre_ping'] = True
+    options['pool_recycle'] = _env_int('DB_POOL_RECYCLE', 1800)
+    options.update(overrides)
+    return create_engine(url, **options)
+
+
+def get_stats(engine):
+    """
+    Estado del pool y configuración efectiva de la base de datos
+    """
+    pool = engine.pool
+    stats = {
+        'backend': engine.url.get_backend_name(),
+        'pool': pool.__class__.__name__,
+        'pool_status': pool.status()
+    }
+    if isinstance(pool, QueuePool):
+        stats['pool_size'] = pool.size()
+        stats['checked_out'] = pool.checkedout()
+        stats['overflow'] = pool.overflow()
+    if stats['backend'] == 'sqlite':
+        with engine.connect() as conn:
+            stats['pragmas'] = {
+                name: conn.exec_driver_sql(f'PRAGMA {name}').scalar() for name in SQLITE_PRAGMAS
+            }
+    return stats
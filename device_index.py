@@ -0,0 +1,105 @@
+"""
+Índice en memoria número de SIM -> dispositivo GPS
+Permite resolver el remitente de un SMS en O(1) sin consultar la base de datos.
+El índice se reconstruye de forma diferida cuando se invalida (add_device,
+update_device, delete_device) y, si un número no aparece, se reconstruye como
+máximo una vez cada `refresh_seconds` por si otro proceso registró el vehículo.
+"""
+import threading
+import time
+from sqlalchemy import select  # pyright: ignore[reportMissingImports]
+from phone_utils import normalize_phone
+
+
+class SIMDeviceIndex:
+    """
+    Caché local del proceso: SIM normalizada (E.164) o device_id -> (id, name)
+    """
+
+    def __init__(self, session_factory, gps_device_model, refresh_seconds=30):
+        """
+        Args:
+            session_factory: Función que retorna una sesión de base de datos
+            gps_device_model: Modelo GPSDevice
+            refresh_seconds: Antigüedad mínima del índice para reconstruirlo ante un número desconocido
+        """
+        self.session_factory = session_factory
+        self.gps_device_model = gps_device_model
+        self.refresh_seconds = refresh_seconds
+        self._by_sim = None
+        self._by_device_id = None
+        self._built_at = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'rebuilds': 0}
+
+    def invalidate(self):
+        """
+        Marca el índice como obsoleto; se reconstruye en la siguiente consulta
+        """
+        with self._lock:
+            self._by_sim = None
+            self._by_device_id = None
+
+    def _build(self):
+        """
+        Carga todos los dispositivos no eliminados en memoria
+        """
+        model = self.gps_device_model
+        session = self.session_factory()
+        try:
+            rows = session.execute(
+                select(model.id, model.name, model.device_id, model.sim_e164, model.placa_gps).where(
+                    model.status != 'deleted'
+                )
+            ).all()
+        finally:
+            session.close()
+
+        by_sim = {}
+        by_device_id = {}
+        for row in rows:
+            entry = (row.id, row.name)
+            sim = row.sim_e164 or normalize_phone(row.placa_gps)
+            if sim:
+                by_sim[sim] = entry
+            by_device_id[row.device_id] = entry
+
+        self._by_sim = by_sim
+        self._by_device_id = by_device_id
+        self._built_at = time.monotonic()
+        self.stats['rebuilds'] += 1
+
+    def resolve(self, phone_number):
+        """
+        Resuelve el número que envió el SMS a un dispositivo
+
+        Args:
+            phone_number: Número del remitente en cualquier formato (o un device_id)
+
+        Returns:
+            tuple: (id, name) del dispositivo o None si no está registrado
+        """
+        sim = normalize_phone(phone_number)
+        with self._lock:
+            if self._by_sim is None:
+                self._build()
+
+            entry = self._by_sim.get(sim) or self._by_device_id.get(phone_number)
+            if entry is None and time.monotonic() - self._built_at > self.refresh_seconds:
+                self._build()
+                entry = self._by_sim.get(sim) or self._by_device_id.get(phone_number)
+
+            self.stats['hits' if entry else 'misses'] += 1
+            return entry
+
+    def get_stats(self):
+        """
+        Obtiene estadísticas del índice
+        """
+        with self._lock:
+            return {
+                'hits': self.stats['hits'],
+                'misses': self.stats['misses'],
+                'rebuilds': self.stats['rebuilds'],
+                'size': len(self._by_sim) if self._by_sim is not None else None
+            }
@@ -0,0 +1,70 @@
+"""
+Revisiones monótonas de la tabla gps_devices para sincronización incremental
+Cada escritura sobre un GPSDevice recibe el siguiente número de revisión de un
+contador global (tabla sync_state). El dashboard pide solo los cambios con
+revision > cursor en /api/devices/changes en vez de la flota completa.
+
+El contador se incrementa con un UPDATE, que en SQLite toma el lock de
+escritura: las revisiones quedan en el mismo orden en que se confirman las
+transacciones.
+"""
+from sqlalchemy import Table, Column, String, Integer, MetaData, event, select, update  # pyright: ignore[reportMissingImports]
+
+COUNTER_NAME = 'gps_devices'
+
+metadata = MetaData()
+sync_state = Table(
+    'sync_state', metadata,
+    Column('name', String(50), primary_key=True),
+    Column('value', Integer, nullable=False, default=0)
+)
+
+
+def create_tables(engine):
+    """
+    Crea la tabla del contador y su fila inicial si no existen
+    """
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        exists = conn.execute(select(sync_state.c.value).where(sync_state.c.name == COUNTER_NAME)).first()
+        if exists is None:
+            conn.execute(sync_state.insert().values(name=COUNTER_NAME, value=0))
+
+
+def next_revision(session):
+    """
+    Reserva el siguiente número de revisión dentro de la transacción actual
+    """
+    session.execute(
+        update(sync_state).where(sync_state.c.name == COUNTER_NAME).values(value=sync_state.c.value + 1)
+    )
+    return session.execute(select(sync_state.c.value).where(sync_state.c.name == COUNTER_NAME)).scalar_one()
+
+
+def current_revision(session):
+    """
+    Última revisión confirmada
+    """
+    return session.execute(select(sync_state.c.value).where(sync_state.c.name == COUNTER_NAME)).scalar_one_or_none() or 0
+
+
+def install_revision_hook(session_factory, gps_device_model):
+    """
+    Asigna una revisión nueva a cada GPSDevice creado o modificado en un flush
+
+    Cubre todas las rutas que usan el ORM (add_device, update_device,
+    delete_device, alquileres, process_sms). Los UPDATE masivos deben llamar a
+    next_revision por su cuenta.
+    """
+    @event.listens_for(session_factory, 'before_flush')
+    def _assign_revision(session, flush_context, instances):
+        changed = [
+            obj for obj in list(session.new) + list(session.dirty)
+            if isinstance(obj, gps_device_model) and (obj in session.new or session.is_modified(obj))
+        ]
+        if changed:
+            revision = next_revision(session)
+            for obj in changed:
+                obj.revision = revision
+
+    return _assign_revision
@@ -0,0 +1,59 @@
+"""
+Utilidades geográficas comunes (distancias sobre la esfera terrestre y
+polilíneas codificadas)
+"""
+import math
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """
+    Distancia en metros entre dos puntos (grados decimales) usando haversine
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def _encode_signed(value, out):
+    # Zigzag + bloques de 5 bits en ASCII (algoritmo de polilíneas de Google)
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode_deltas(values):
+    """
+    Codifica una secuencia de enteros como diferencias sucesivas en texto compacto
+    """
+    out = []
+    previous = 0
+    for value in values:
+        _encode_signed(value - previous, out)
+        previous = value
+    return ''.join(out)
+
+
+def encode_polyline(latitudes, longitudes, precision=5):
+    """
+    Polilínea codificada (formato de Google Maps / Leaflet.encoded)
+
+    Cada punto se guarda como diferencia con el anterior, redondeado a
+    `precision` decimales: un fix ocupa unos pocos bytes en vez de ~40 en JSON.
+    """
+    factor = 10 ** precision
+    out = []
+    previous_lat = previous_lon = 0
+    for lat, lon in zip(latitudes, longitudes):
+        lat_i = int(round(lat * factor))
+        lon_i = int(round(lon * factor))
+        _encode_signed(lat_i - previous_lat, out)
+        _encode_signed(lon_i - previous_lon, out)
+        previous_lat, previous_lon = lat_i, lon_i
+    return ''.join(out)
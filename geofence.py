@@ -0,0 +1,459 @@
+"""
+Geocercas por sede (polígonos y círculos) evaluadas con cada fix GPS
+Cada fix que confirma process_sms o la cola de ingesta se prueba contra las
+geocercas activas y, si el vehículo entró o salió de alguna, se registra un
+evento en geofence_events (en la misma transacción que el fix) y se publica
+por el canal en vivo.
+
+Para que la evaluación quepa en el camino de ingesta (bastante menos de 1 ms
+por fix con cientos de geocercas) se precalcula un índice en memoria:
+
+- Cada geocerca tiene su rectángulo envolvente (bbox); un círculo lo calcula
+  a partir del radio.
+- Una grilla de celdas de CELL_DEGREES grados guarda qué geocercas tocan cada
+  celda; un fix solo mira las de su celda (las geocercas enormes van a una
+  lista aparte que se revisa siempre).
+- Las candidatas se filtran por bbox y solo las que pasan se prueban exacto:
+  punto en polígono (ray casting) o distancia haversine al centro.
+
+El estado "dentro de qué geocercas está cada vehículo" vive en memoria y se
+inicializa con la última posición de gps_devices, así el primer fix tras
+reiniciar no genera eventos falsos. Las geocercas creadas o borradas en otro
+proceso se detectan cada GEOFENCE_REFRESH_SECONDS.
+
+Variables de entorno:
+    GEOFENCE_REFRESH_SECONDS=<segundos>   (por defecto 60)
+"""
+import json
+import math
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import (  # pyright: ignore[reportMissingImports]
+    Table, Column, Integer, Float, String, Text, Boolean, DateTime, MetaData, Index, func, select
+)
+from geo_utils import haversine_m
+
+CELL_DEGREES = 0.01
+# Una geocerca que cubre más celdas que esto se revisa con cada fix
+MAX_CELLS_PER_FENCE = 2500
+METERS_PER_DEGREE_LAT = 111320.0
+
+metadata = MetaData()
+geofences = Table(
+    'geofences', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('site', String(100), nullable=False, default='default', index=True),
+    Column('name', String(100), nullable=False),
+    Column('kind', String(10), nullable=False),  # polygon, circle
+    Column('coordinates', Text),  # polígono: JSON [[lon, lat], ...]
+    Column('center_lat', Float),
+    Column('center_lon', Float),
+    Column('radius_m', Float),
+    Column('active', Boolean, default=True),
+    Column('created_at', DateTime, default=datetime.utcnow)
+)
+geofence_events = Table(
+    'geofence_events', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('geofence_id', Integer, nullable=False),
+    Column('device_id', Integer, nullable=False),
+    Column('event', String(10), nullable=False),  # enter, exit
+    Column('latitude', Float, nullable=False),
+    Column('longitude', Float, nullable=False),
+    Column('timestamp', DateTime, nullable=False),
+    Index('ix_geofence_events_device_ts', 'device_id', 'timestamp')
+)
+
+
+def validate_geofence(data):
+    """
+    Valida y normaliza los datos de una geocerca recibidos por la API
+
+    Returns:
+        dict: Valores listos para insertar en geofences
+
+    Raises:
+        ValueError: si faltan datos o no son válidos
+    """
+    name = (data.get('name') or '').strip()
+    if not name:
+        raise ValueError('name es requerido')
+    kind = data.get('kind', 'polygon')
+    values = {'name': name[:100], 'site': (data.get('site') or 'default')[:100], 'kind': kind, 'active': True}
+
+    if kind == 'polygon':
+        try:
+            ring = [(float(lon), float(lat)) for lon, lat in data.get('coordinates') or []]
+        except (TypeError, ValueError):
+            raise ValueError('coordinates debe ser una lista de [lon, lat]')
+        # Un anillo cerrado repite el primer punto al final
+        if len(ring) > 1 and ring[0] == ring[-1]:
+            ring = ring[:-1]
+        if len(ring) < 3:
+            raise ValueError('El polígono necesita al menos 3 puntos')
+        if any(not (-180 <= lon <= 180 and -90 <= lat <= 90) for lon, lat in ring):
+            raise ValueError('Coordenadas fuera de rango')
+        values['coordinates'] = json.dumps(ring)
+    elif kind == 'circle':
+        try:
+            lat = float(data['latitude'])
+            lon = float(data['longitude'])
+            radius = float(data['radius_m'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('El círculo necesita latitude, longitude y radius_m')
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180) or radius <= 0:
+            raise ValueError('Centro fuera de rango o radio no positivo')
+        values.update({'center_lat': lat, 'center_lon': lon, 'radius_m': radius})
+    else:
+        raise ValueError("kind debe ser 'polygon' o 'circle'")
+    return values
+
+
+class Fence:
+    """
+    Geocerca preparada para evaluar: bbox + anillo o círculo
+    """
+    __slots__ = ('id', 'site', 'name', 'kind', 'min_lat', 'min_lon', 'max_lat', 'max_lon',
+                 'ring', 'center_lat', 'center_lon', 'radius_m')
+
+    def __init__(self, row):
+        self.id = row.id
+        self.site = row.site
+        self.name = row.name
+        self.kind = row.kind
+        self.ring = None
+        self.center_lat = row.center_lat
+        self.center_lon = row.center_lon
+        self.radius_m = row.radius_m
+        if self.kind == 'polygon':
+            self.ring = [tuple(point) for point in json.loads(row.coordinates)]
+            lons = [lon for lon, _ in self.ring]
+            lats = [lat for _, lat in self.ring]
+            self.min_lon, self.max_lon = min(lons), max(lons)
+            self.min_lat, self.max_lat = min(lats), max(lats)
+        else:
+            dlat = self.radius_m / METERS_PER_DEGREE_LAT
+            dlon = dlat / max(math.cos(math.radians(self.center_lat)), 1e-6)
+            self.min_lat, self.max_lat = self.center_lat - dlat, self.center_lat + dlat
+            self.min_lon, self.max_lon = self.center_lon - dlon, self.center_lon + dlon
+
+    def contains(self, lat, lon):
+        if not (self.min_lat <= lat <= self.max_lat and self.min_lon <= lon <= self.max_lon):
+            return False
+        if self.ring is None:
+            return haversine_m(lat, lon, self.center_lat, self.center_lon) <= self.radius_m
+
+        # Ray casting: cantidad de lados que cruza un rayo hacia el este
+        inside = False
+        ring = self.ring
+        lon_j, lat_j = ring[-1]
+        for lon_i, lat_i in ring:
+            if (lat_i > lat) != (lat_j > lat):
+                if lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+                    inside = not inside
+            lon_j, lat_j = lon_i, lat_i
+        return inside
+
+    def to_dict(self):
+        data = {
+            'id': self.id,
+            'site': self.site,
+            'name': self.name,
+            'kind': self.kind,
+            'bbox': [self.min_lon, self.min_lat, self.max_lon, self.max_lat]
+        }
+        if self.ring is not None:
+            data['coordinates'] = [list(point) for point in self.ring]
+        else:
+            data.update({'latitude': self.center_lat, 'longitude': self.center_lon, 'radius_m': self.radius_m})
+        return data
+
+
+class GeofenceIndex:
+    """
+    Grilla inmutable celda -> geocercas que la tocan
+    """
+
+    def __init__(self, fences, cell_degrees=CELL_DEGREES):
+        self.fences = fences
+        self.by_id = {fence.id: fence for fence in fences}
+        self.cell_degrees = cell_degrees
+        self.cells = {}
+        self.large = []
+        for fence in fences:
+            x0, y0 = self._cell(fence.min_lat, fence.min_lon)
+            x1, y1 = self._cell(fence.max_lat, fence.max_lon)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > MAX_CELLS_PER_FENCE:
+                self.large.append(fence)
+                continue
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    self.cells.setdefault((x, y), []).append(fence)
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lon / self.cell_degrees)), int(math.floor(lat / self.cell_degrees))
+
+    def containing(self, lat, lon):
+        """
+        IDs de las geocercas que contienen el punto
+        """
+        candidates = self.cells.get(self._cell(lat, lon), ())
+        inside = [fence.id for fence in candidates if fence.contains(lat, lon)]
+        inside.extend(fence.id for fence in self.large if fence.contains(lat, lon))
+        return frozenset(inside)
+
+
+class GeofenceEngine:
+    """
+    Geocercas activas + estado por vehículo; emite eventos de entrada y salida
+    """
+
+    def __init__(self, engine, session_factory, gps_device_model, refresh_seconds=60):
+        """
+        Args:
+            engine: Engine de SQLAlchemy donde viven geofences y geofence_events
+            session_factory: Función que retorna una sesión de base de datos
+            gps_device_model: Modelo GPSDevice (última posición de cada vehículo)
+            refresh_seconds: Cada cuánto se comprueba si otro proceso cambió las geocercas
+        """
+        self.engine = engine
+        self.session_factory = session_factory
+        self.gps_device_model = gps_device_model
+        self.refresh_seconds = refresh_seconds
+        self._index = None
+        self._signature = None
+        self._checked_at = 0.0
+        self._inside = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'evaluations': 0,
+            'enter': 0,
+            'exit': 0,
+            'reloads': 0,
+            'total_us': 0.0,
+            'max_us': 0.0
+        }
+        metadata.create_all(engine)
+
+    def _load_signature(self, conn):
+        # Alta o baja de una geocerca cambia la cantidad o el id máximo
+        return tuple(conn.execute(
+            select(func.count(), func.max(geofences.c.id)).where(geofences.c.active == True)  # noqa: E712
+        ).one())
+
+    def _reload_locked(self):
+        """
+        Reconstruye el índice y recalcula el estado de cada vehículo con su última posición
+        """
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(geofences).where(geofences.c.active == True)).all()  # noqa: E712
+            self._signature = self._load_signature(conn)
+        index = GeofenceIndex([Fence(row) for row in rows])
+
+        model = self.gps_device_model
+        session = self.session_factory()
+        try:
+            positions = session.execute(
+                select(model.id, model.latitude, model.longitude).where(model.status != 'deleted')
+            ).all()
+        finally:
+            session.close()
+
+        self._inside = {
+            row.id: index.containing(row.latitude, row.longitude)
+            for row in positions if row.latitude is not None and row.longitude is not None
+        }
+        self._index = index
+        self._checked_at = time.monotonic()
+        self.stats['reloads'] += 1
+
+    def _ensure_index_locked(self):
+        if self._index is None:
+            self._reload_locked()
+            return
+        if time.monotonic() - self._checked_at < self.refresh_seconds:
+            return
+        self._checked_at = time.monotonic()
+        with self.engine.connect() as conn:
+            signature = self._load_signature(conn)
+        if signature != self._signature:
+            self._reload_locked()
+
+    def invalidate(self):
+        """
+        Fuerza la reconstrucción del índice (se creó o borró una geocerca)
+        """
+        with self._lock:
+            self._index = None
+
+    def evaluate(self, device_id, latitude, longitude, timestamp=None, pending=None):
+        """
+        Prueba un fix contra las geocercas y actualiza el estado del vehículo
+
+        Args:
+            pending: Dict opcional donde queda el estado nuevo en vez de
+                     aplicarlo; se aplica con commit_state(pending) después del
+                     commit de la BD (un rollback no desalinea el estado)
+
+        Returns:
+            list: Eventos (dicts) de entrada/salida; vacía si no cruzó ningún borde
+        """
+        started = time.perf_counter()
+        with self._lock:
+            self._ensure_index_locked()
+            index = self._index
+            inside = index.containing(latitude, longitude)
+            if pending is not None and device_id in pending:
+                previous = pending[device_id]
+            else:
+                previous = self._inside.get(device_id)
+            if pending is None:
+                self._inside[device_id] = inside
+        if pending is not None:
+            pending[device_id] = inside
+
+        events = []
+        # Un vehículo sin estado (recién creado) solo inicializa el suyo
+        if previous is not None and previous != inside:
+            timestamp = timestamp or datetime.utcnow()
+            for event, fence_ids in (('exit', previous - inside), ('enter', inside - previous)):
+                for fence_id in sorted(fence_ids):
+                    fence = index.by_id.get(fence_id)
+                    if fence is None:
+                        continue
+                    events.append({
+                        'geofence_id': fence_id,
+                        'geofence': fence.name,
+                        'site': fence.site,
+                        'device_id': device_id,
+                        'event': event,
+                        'latitude': latitude,
+                        'longitude': longitude,
+                        'timestamp': timestamp
+                    })
+
+        elapsed_us = (time.perf_counter() - started) * 1e6
+        with self._lock:
+            self.stats['evaluations'] += 1
+            self.stats['total_us'] += elapsed_us
+            self.stats['max_us'] = max(self.stats['max_us'], elapsed_us)
+            for event in events:
+                self.stats[event['event']] += 1
+        return events
+
+    def append_events(self, session, events):
+        """
+        Registra eventos dentro de la transacción de la sesión dada (el commit lo hace quien llama)
+        """
+        if events:
+            session.execute(geofence_events.insert(), [
+                {key: event[key] for key in ('geofence_id', 'device_id', 'event', 'latitude', 'longitude', 'timestamp')}
+                for event in events
+            ])
+            for event in events:
+                marker = '⚠' if event['event'] == 'exit' else '✓'
+                action = 'salió de' if event['event'] == 'exit' else 'entró a'
+                print(f"  {marker} Vehículo {event['device_id']} {action} la geocerca {event['geofence']} ({event['site']})")
+        return len(events)
+
+    def commit_state(self, pending):
+        """
+        Aplica el estado que evaluate dejó en `pending` (tras el commit de la BD)
+        """
+        if pending:
+            with self._lock:
+                self._inside.update(pending)
+
+    def forget(self, device_id):
+        """
+        Descarta el estado de un vehículo eliminado
+        """
+        with self._lock:
+            self._inside.pop(device_id, None)
+
+    def fences(self):
+        """
+        Geocercas activas ya preparadas (Fence) para evaluarlas en otros módulos
+        """
+        with self._lock:
+            self._ensure_index_locked()
+            return list(self._index.fences)
+
+    def list_fences(self, site=None):
+        with self._lock:
+            self._ensure_index_locked()
+            fences = self._index.fences
+        return [fence.to_dict() for fence in fences if site is None or fence.site == site]
+
+    def inside_of(self, device_id):
+        """
+        IDs de las geocercas en las que está un vehículo (según su último fix)
+        """
+        with self._lock:
+            return sorted(self._inside.get(device_id, ()))
+
+    def create(self, data):
+        """
+        Crea una geocerca
+
+        Raises:
+            ValueError: si los datos no son válidos
+        """
+        values = validate_geofence(data)
+        values['created_at'] = datetime.utcnow()
+        with self.engine.begin() as conn:
+            fence_id = conn.execute(geofences.insert().values(**values)).inserted_primary_key[0]
+        self.invalidate()
+        return fence_id
+
+    def delete(self, fence_id):
+        """
+        Borra una geocerca (sus eventos se conservan)
+
+        Returns:
+            bool: False si no existía
+        """
+        with self.engine.begin() as conn:
+            deleted = conn.execute(geofences.delete().where(geofences.c.id == fence_id)).rowcount
+        self.invalidate()
+        return bool(deleted)
+
+    def query_events(self, device_id=None, geofence_id=None, limit=100):
+        """
+        Eventos más recientes primero
+        """
+        query = select(geofence_events).order_by(geofence_events.c.timestamp.desc(), geofence_events.c.id.desc())
+        if device_id is not None:
+            query = query.where(geofence_events.c.device_id == device_id)
+        if geofence_id is not None:
+            query = query.where(geofence_events.c.geofence_id == geofence_id)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query.limit(limit)).all()
+        return [
+            {
+                'id': row.id,
+                'geofence_id': row.geofence_id,
+                'device_id': row.device_id,
+                'event': row.event,
+                'latitude': row.latitude,
+                'longitude': row.longitude,
+                'timestamp': row.timestamp.isoformat()
+            }
+            for row in rows
+        ]
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            index = self._index
+            stats['tracked_devices'] = len(self._inside)
+        evaluations = stats.pop('evaluations')
+        total_us = stats.pop('total_us')
+        stats['evaluations'] = evaluations
+        stats['avg_us'] = round(total_us / evaluations, 1) if evaluations else None
+        stats['max_us'] = round(stats['max_us'], 1)
+        stats['fences'] = len(index.fences) if index else None
+        stats['grid_cells'] = len(index.cells) if index else None
+        stats['large_fences'] = len(index.large) if index else None
+        return stats
@@ -0,0 +1,476 @@
+"""
+Driver de comandos AT para el módem GSM
+Un hilo lector consume el puerto serie, arma las líneas de respuesta y las
+asigna al comando en curso hasta su código final (OK, ERROR, +CMS ERROR...).
+En vez de dormir tiempos fijos y leer a ciegas, cada comando espera su propio
+resultado: el prompt '>' de AT+CMGS dispara el envío del texto y el +CMGS/OK
+final completa el envío.
+
+Los comandos se encolan (pipeline): el siguiente se escribe apenas llega el
+código final del anterior, sin esperas intermedias. Las líneas no solicitadas
+(URC: +CMTI, +CMT, RING, +CREG...) se entregan a los manejadores registrados
+con add_urc_handler.
+
+Si un comando no responde a tiempo, el módem puede seguir respondiéndolo
+después (un +CMGS/OK tardío). Antes del siguiente comando se resincroniza el
+puerto: ESC para salir de un prompt pendiente y AT+CMGF?, que solo se da por
+bueno cuando llega su propia línea +CMGF: seguida de OK; lo que llegue antes
+es la respuesta tardía y se descarta.
+
+En la respuesta de AT+CMGL/AT+CMGR, la línea que sigue a cada encabezado es
+el texto del SMS y se toma como dato aunque diga 'OK' o empiece con 'ERROR'.
+
+Acepta cualquier puerto que pyserial pueda abrir, incluido el extremo esclavo
+de un pty (os.openpty) para probarlo contra un módem simulado; ver
+tests/test_gsm_modem.py y benchmarks/bench_gsm_modem.py.
+"""
+import collections
+import threading
+import time
+import serial  # pyright: ignore[reportMissingImports]
+
+# Códigos que terminan un comando
+FINAL_OK = ('OK',)
+FINAL_ERRORS = ('ERROR', '+CME ERROR', '+CMS ERROR', 'NO CARRIER', 'BUSY', 'NO ANSWER', 'NO DIALTONE')
+
+# Líneas no solicitadas que puede emitir el módem en cualquier momento
+URC_PREFIXES = ('+CMTI:', '+CMT:', '+CDS:', '+CDSI:', '+CBM:', '+CLIP:', '+CRING:', 'RING',
+                '+CREG:', '+CGREG:', '+CUSD:', '+CPIN:', '^RSSI:', '^BOOT:', '^MODE:')
+# URC cuyo contenido viene en la línea siguiente (SMS entregado directamente)
+URC_WITH_BODY = ('+CMT:', '+CDS:', '+CBM:')
+
+# Encabezados de SMS listados/leídos: la línea siguiente es el texto
+SMS_HEADERS = ('+CMGL:', '+CMGR:')
+
+CTRL_Z = b'\x1a'
+ESC = b'\x1b'
+# Comando de resincronización tras un timeout y cuánto se espera su respuesta
+RESYNC_COMMAND = 'AT+CMGF?'
+RESYNC_TIMEOUT = 2.0
+RESYNC_ATTEMPTS = 3
+
+
+class ATError(Exception):
+    """
+    El módem respondió con un código de error
+    """
+
+    def __init__(self, command, result, lines=None):
+        self.command = command
+        self.result = result
+        self.lines = lines or []
+        super().__init__(f'{command}: {result}')
+
+
+class ATTimeout(ATError):
+    """
+    El comando no recibió su código final a tiempo
+    """
+
+
+class ATRequest:
+    """
+    Comando AT encolado o en curso
+    """
+
+    def __init__(self, command, payload=None):
+        """
+        Args:
+            command: Comando sin terminador (ej: 'AT+CMGF=1')
+            payload: Bytes a enviar tras el prompt '>' (texto del SMS), o None
+        """
+        self.command = command
+        self.payload = payload
+        self.lines = []
+        self.result = None
+        self.error = None
+        self.prompt_sent = False
+        self.done = threading.Event()
+        self.sent_at = None
+        self.elapsed_ms = None
+        # La próxima línea es el texto de un SMS (tras +CMGL:/+CMGR:)
+        self.expect_body = False
+        # Resincronización: solo termina con OK después de su propia respuesta
+        self.resync = False
+        self.got_response = False
+        self.deadline = None
+        self.attempts = 0
+        # Prefijo de las líneas de respuesta propias (AT+CREG? -> +CREG:) para
+        # no confundirlas con URC del mismo nombre
+        name = command[2:].split('=')[0].rstrip('?') if command.upper().startswith('AT+') else None
+        self.response_prefix = f'{name.upper()}:' if name else None
+
+    def wait(self, timeout):
+        """
+        Espera el código final
+
+        Returns:
+            list: Líneas de respuesta (sin eco ni código final)
+        """
+        if not self.done.wait(timeout):
+            raise ATTimeout(self.command, 'timeout', self.lines)
+        if self.error:
+            raise ATError(self.command, self.error, self.lines)
+        return self.lines
+
+
+class ATModem:
+    """
+    Módem GSM controlado con comandos AT desde un hilo lector
+    """
+
+    def __init__(self, port, baudrate=9600):
+        """
+        Args:
+            port: Puerto serie (ej: /dev/ttyUSB0, COM3 o el esclavo de un pty)
+            baudrate: Velocidad del puerto
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.serial = None
+        self.is_running = False
+        self.thread = None
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._inflight = None
+        self._urc_handlers = []
+        self._urc_body_for = None
+        self.stats = {
+            'commands': 0,
+            'errors': 0,
+            'timeouts': 0,
+            'resyncs': 0,
+            'resync_failures': 0,
+            'late_lines': 0,
+            'urcs': 0,
+            'sms_sent': 0,
+            'last_command_ms': None,
+            'avg_command_ms': None
+        }
+
+    def open(self, init_commands=('ATE0', 'AT+CMEE=1', 'AT+CMGF=1'), timeout=5):
+        """
+        Abre el puerto, inicia el hilo lector y configura el módem
+
+        Raises:
+            ATError: si el módem no responde a la inicialización
+        """
+        self.serial = serial.Serial(
+            port=self.port,
+            baudrate=self.baudrate,
+            timeout=0.1,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE
+        )
+        self.is_running = True
+        self.thread = threading.Thread(target=self._reader_loop, daemon=True)
+        self.thread.start()
+
+        try:
+            # Un AT suelto sincroniza el módem aunque tenga basura en el buffer
+            self.command('AT', timeout=timeout)
+            for command in init_commands:
+                self.command(command, timeout=timeout)
+        except ATError:
+            self.close()
+            raise
+        return self
+
+    def close(self):
+        """
+        Detiene el hilo lector y cierra el puerto; los comandos pendientes fallan
+        """
+        self.is_running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1)
+        with self._lock:
+            requests = list(self._pending)
+            if self._inflight:
+                requests.append(self._inflight)
+            self._pending.clear()
+            self._inflight = None
+        for request in requests:
+            request.error = 'puerto cerrado'
+            request.done.set()
+        if self.serial:
+            try:
+                self.serial.close()
+            except Exception:
+                pass
+            self.serial = None
+
+    def add_urc_handler(self, handler):
+        """
+        Registra un manejador de líneas no solicitadas
+
+        Args:
+            handler: Función handler(line, body); body es la línea siguiente
+                     para +CMT/+CDS/+CBM y None para el resto
+        """
+        self._urc_handlers.append(handler)
+
+    def submit(self, command, payload=None):
+        """
+        Encola un comando sin esperar su resultado
+
+        Returns:
+            ATRequest: usar request.wait(timeout) para obtener la respuesta
+        """
+        if not self.is_running:
+            raise ATError(command, 'puerto cerrado')
+        request = ATRequest(command, payload)
+        with self._lock:
+            self._pending.append(request)
+            if self._inflight is None:
+                self._write_next_locked()
+        return request
+
+    def command(self, command, timeout=5):
+        """
+        Ejecuta un comando y espera su código final
+
+        Returns:
+            list: Líneas de respuesta
+        """
+        request = self.submit(command)
+        try:
+            return request.wait(timeout)
+        except ATTimeout:
+            self._abandon(request)
+            raise
+
+    def send_sms(self, phone_number, text, timeout=60):
+        """
+        Envía un SMS en modo texto (AT+CMGF=1)
+
+        Returns:
+            int: Referencia del mensaje (+CMGS: <mr>), o None si el módem no la informa
+        """
+        payload = text.replace('\x1a', '').encode('utf-8', errors='ignore') + CTRL_Z
+        request = self.submit(f'AT+CMGS="{phone_number}"', payload=payload)
+        try:
+            lines = request.wait(timeout)
+        except ATTimeout:
+            self._abandon(request)
+            raise
+        with self._lock:
+            self.stats['sms_sent'] += 1
+        for line in lines:
+            if line.startswith('+CMGS:'):
+                try:
+                    return int(line.split(':', 1)[1].strip())
+                except ValueError:
+                    return None
+        return None
+
+    def _write_locked(self, data):
+        try:
+            self.serial.write(data)
+        except Exception as e:
+            # El puerto se cayó: el comando en curso falla
+            if self._inflight:
+                self._finish_locked(self._inflight, error=f'error de escritura: {e}')
+
+    def _write_next_locked(self):
+        """
+        Escribe el siguiente comando de la cola (llamar con el lock tomado)
+        """
+        if self._inflight is not None or not self._pending:
+            return
+        request = self._pending.popleft()
+        self._inflight = request
+        request.sent_at = time.perf_counter()
+        if request.resync:
+            # ESC cierra un prompt '>' que haya quedado abierto; el \r descarta la línea
+            request.attempts += 1
+            request.deadline = time.monotonic() + RESYNC_TIMEOUT
+            self._write_locked(ESC + b'\r')
+        self._write_locked(f'{request.command}\r'.encode())
+
+    def _finish_locked(self, request, result=None, error=None):
+        """
+        Completa el comando en curso y escribe el siguiente
+        """
+        request.result = result
+        request.error = error
+        request.elapsed_ms = (time.perf_counter() - request.sent_at) * 1000 if request.sent_at else None
+        self.stats['commands'] += 1
+        if error:
+            self.stats['errors'] += 1
+        if request.elapsed_ms is not None:
+            self.stats['last_command_ms'] = round(request.elapsed_ms, 3)
+            avg = self.stats['avg_command_ms']
+            self.stats['avg_command_ms'] = round(request.elapsed_ms if avg is None else 0.9 * avg + 0.1 * request.elapsed_ms, 3)
+        if self._inflight is request:
+            self._inflight = None
+        request.done.set()
+        self._write_next_locked()
+
+    def _abandon(self, request):
+        """
+        Descarta un comando que no respondió a tiempo y resincroniza el puerto
+
+        El módem puede responderlo más tarde: el siguiente comando de la cola
+        no se escribe hasta que la resincronización termine.
+        """
+        with self._lock:
+            self.stats['timeouts'] += 1
+            if request in self._pending:
+                self._pending.remove(request)
+                return
+            if self._inflight is request:
+                self._inflight = None
+                resync = ATRequest(RESYNC_COMMAND)
+                resync.resync = True
+                self.stats['resyncs'] += 1
+                self._pending.appendleft(resync)
+                self._write_next_locked()
+
+    def _check_resync(self):
+        """
+        Reintenta (o abandona) una resincronización que no recibió respuesta
+        """
+        with self._lock:
+            request = self._inflight
+            if request is None or not request.resync or time.monotonic() < request.deadline:
+                return
+            self._inflight = None
+            if request.attempts < RESYNC_ATTEMPTS:
+                request.got_response = False
+                self._pending.appendleft(request)
+                self._write_next_locked()
+                return
+            self.stats['resync_failures'] += 1
+            print(f"⚠ El módem {self.port} no respondió a la resincronización; se sigue con la cola")
+            request.done.set()
+            self._write_next_locked()
+
+    def _reader_loop(self):
+        """
+        Loop del hilo lector: arma líneas y detecta el prompt '>'
+        """
+        buffer = b''
+        while self.is_running:
+            try:
+                data = self.serial.read(self.serial.in_waiting or 1)
+            except Exception as e:
+                print(f"⚠ Error leyendo el módem GSM: {e}")
+                self.close()
+                return
+            if not data:
+                self._check_resync()
+                continue
+
+            buffer += data
+            while True:
+                index = min((i for i in (buffer.find(b'\r'), buffer.find(b'\n')) if i >= 0), default=-1)
+                if index < 0:
+                    break
+                line = buffer[:index].decode('utf-8', errors='ignore').strip()
+                buffer = buffer[index + 1:]
+                if line:
+                    self._handle_line(line)
+
+            # El prompt de AT+CMGS llega sin fin de línea
+            if buffer.strip() == b'>':
+                buffer = b''
+                self._handle_prompt()
+
+    def _handle_prompt(self):
+        with self._lock:
+            request = self._inflight
+            if request is not None and request.payload is not None and not request.prompt_sent:
+                request.prompt_sent = True
+                self._write_locked(request.payload)
+            elif request is None or request.resync:
+                # Prompt tardío de un AT+CMGS abandonado: salir del modo texto
+                self._write_locked(ESC)
+
+    def _handle_line(self, line):
+        """
+        Clasifica una línea: cuerpo de URC, URC, eco, respuesta o código final
+        """
+        if line == '>':
+            self._handle_prompt()
+            return
+
+        if self._urc_body_for is not None:
+            header, self._urc_body_for = self._urc_body_for, None
+            self._dispatch_urc(header, line)
+            return
+
+        with self._lock:
+            request = self._inflight
+            if request is not None and request.expect_body:
+                # Texto del SMS: dato aunque parezca un código final o una URC
+                request.expect_body = False
+                request.lines.append(line)
+                return
+
+            is_response = request is not None and request.response_prefix and line.upper().startswith(request.response_prefix)
+
+            if not is_response and line.startswith(URC_PREFIXES):
+                if line.startswith(URC_WITH_BODY):
+                    self._urc_body_for = line
+                    return
+                urc = line
+            elif request is not None and request.resync:
+                self._handle_resync_line_locked(request, line)
+                return
+            else:
+                urc = None
+                if request is None:
+                    # Línea suelta sin comando en curso (respuesta tardía de un comando abandonado)
+                    self.stats['late_lines'] += 1
+                    return
+                if line == request.command:
+                    # Eco (antes de que ATE0 lo desactive)
+                    return
+                if line in FINAL_OK:
+                    self._finish_locked(request, result=line)
+                elif line.startswith(FINAL_ERRORS):
+                    self._finish_locked(request, result=line, error=line)
+                else:
+                    request.lines.append(line)
+                    if line.startswith(SMS_HEADERS):
+                        request.expect_body = True
+
+        if urc:
+            self._dispatch_urc(urc, None)
+
+    def _handle_resync_line_locked(self, request, line):
+        """
+        Línea recibida durante la resincronización
+
+        Hasta ver la respuesta propia (+CMGF:) todo es del comando abandonado
+        (o de ESC) y se descarta; el OK que le sigue cierra la resincronización.
+        """
+        if line.upper().startswith(request.response_prefix):
+            request.got_response = True
+        elif line in FINAL_OK and request.got_response:
+            self._finish_locked(request, result=line)
+        elif line.startswith(FINAL_ERRORS) and request.got_response:
+            self._finish_locked(request, result=line, error=line)
+        else:
+            self.stats['late_lines'] += 1
+
+    def _dispatch_urc(self, line, body):
+        with self._lock:
+            self.stats['urcs'] += 1
+        for handler in list(self._urc_handlers):
+            try:
+                handler(line, body)
+            except Exception as e:
+                print(f"⚠ Error en manejador de URC {line!r}: {e}")
+
+    def get_stats(self):
+        """
+        Obtiene estadísticas del driver
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['queued'] = len(self._pending) + (1 if self._inflight else 0)
+        stats['port'] = self.port
+        stats['is_open'] = self.is_running
+        return stats
@@ -0,0 +1,182 @@
+"""
+Sesiones HTTP persistentes por proveedor de SMS
+Cada proveedor (SMSMobileAPI, MessageBird, Sinch, gateway Android, Vonage,
+Twilio) usa un requests.Session compartido con keep-alive, un pool de
+conexiones del tamaño de su concurrencia en rate_limit, timeouts separados de
+conexión y lectura, y reintentos con backoff.
+
+Los reintentos solo cubren errores al conectar (la petición nunca salió): un
+envío de SMS no es idempotente y repetirlo tras un timeout de lectura o un 5xx
+podría mandar el mensaje dos veces.
+
+Variables de entorno:
+    HTTP_CONNECT_TIMEOUT=<segundos>   (por defecto 3.05; 2 para el gateway local)
+    HTTP_READ_TIMEOUT=<segundos>      (por defecto 15)
+    HTTP_MAX_RETRIES=<reintentos>     (por defecto 2)
+"""
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from rate_limit import get_limiter
+
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05'))
+DEFAULT_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '15'))
+MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '2'))
+
+# proveedor -> timeout de conexión (el gateway Android está en la red local)
+CONNECT_TIMEOUTS = {
+    'android_gateway': 2.0,
+}
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter que cuenta peticiones y conexiones nuevas para medir la reutilización
+    """
+
+    def __init__(self, provider, **kwargs):
+        self.provider = provider
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'new_connections': 0,
+            'errors': 0
+        }
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                adapter._count('new_connections')
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                adapter._count('new_connections')
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool
+        }
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def send(self, request, **kwargs):
+        self._count('requests')
+        try:
+            return super().send(request, **kwargs)
+        except requests.exceptions.RequestException:
+            self._count('errors')
+            raise
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['pool_maxsize'] = self._pool_maxsize
+        # Peticiones que usaron una conexión ya abierta
+        reused = max(stats['requests'] - stats['new_connections'], 0)
+        stats['reused_connections'] = reused
+        stats['reuse_rate'] = round(reused / stats['requests'], 3) if stats['requests'] else None
+        return stats
+
+
+_sessions = {}
+_adapters = {}
+_clients = {}
+_registry_lock = threading.Lock()
+
+
+def get_timeout(provider):
+    """
+    Timeout (conexión, lectura) para las peticiones de un proveedor
+    """
+    return (CONNECT_TIMEOUTS.get(provider, DEFAULT_CONNECT_TIMEOUT), DEFAULT_READ_TIMEOUT)
+
+
+def get_session(provider):
+    """
+    Obtiene (o crea) el requests.Session compartido de un proveedor
+    """
+    session = _sessions.get(provider)
+    if session is None:
+        with _registry_lock:
+            session = _sessions.get(provider)
+            if session is None:
+                # Una conexión por envío simultáneo permitido
+                pool_size = max(get_limiter(provider).concurrency, 1)
+                adapter = PooledHTTPAdapter(
+                    provider,
+                    pool_connections=4,
+                    pool_maxsize=pool_size,
+                    max_retries=Retry(
+                        total=MAX_RETRIES,
+                        connect=MAX_RETRIES,
+                        read=0,
+                        status=0,
+                        backoff_factor=0.5
+                    )
+                )
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _adapters[provider] = adapter
+                _sessions[provider] = session
+    return session
+
+
+def get_vonage_client(api_key, api_secret):
+    """
+    Cliente de Vonage compartido (uno por credenciales) sobre la sesión con pool
+    """
+    import vonage  # pyright: ignore[reportMissingImports]
+
+    key = ('vonage', api_key, api_secret)
+    client = _clients.get(key)
+    if client is None:
+        client = vonage.Client(key=api_key, secret=api_secret)
+        client.session = get_session('vonage')
+        client.timeout = get_timeout('vonage')
+        with _registry_lock:
+            client = _clients.setdefault(key, client)
+    return client
+
+
+def get_twilio_client(account_sid, auth_token):
+    """
+    Cliente de Twilio compartido (uno por credenciales) sobre la sesión con pool
+    """
+    from twilio.rest import Client  # pyright: ignore[reportMissingImports]
+    from twilio.http.http_client import TwilioHttpClient  # pyright: ignore[reportMissingImports]
+
+    key = ('twilio', account_sid, auth_token)
+    client = _clients.get(key)
+    if client is None:
+        http_client = TwilioHttpClient()
+        http_client.session = get_session('twilio')
+        http_client.timeout = get_timeout('twilio')
+        client = Client(account_sid, auth_token, http_client=http_client)
+        with _registry_lock:
+            client = _clients.setdefault(key, client)
+    return client
+
+
+def get_all_stats():
+    """
+    Estadísticas de reutilización de conexiones de todas las sesiones creadas
+    """
+    with _registry_lock:
+        adapters = dict(_adapters)
+    stats = {}
+    for provider, adapter in adapters.items():
+        stats[provider] = adapter.get_stats()
+        stats[provider]['timeout'] = list(get_timeout(provider))
+    return stats
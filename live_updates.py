@@ -0,0 +1,276 @@
+"""
+Canal de actualizaciones en vivo (Server-Sent Events) para el dashboard
+Cada pestaña abierta mantiene una conexión a /api/stream y recibe un evento
+compacto cuando se confirma un fix GPS (process_sms o la cola de ingesta),
+cuando un vehículo entra o sale de una geocerca o cuando cambia un dispositivo
+(alquiler, alta, edición, baja), en vez de consultar la flota completa con
+temporizadores.
+
+Cada suscripción puede filtrarse por dispositivos y/o por la región visible del
+mapa. Un fix también llega si la posición anterior del vehículo estaba en la
+región, para que el cliente vea salir el marcador en vez de dejarlo congelado
+en el borde. Si un cliente no consume a tiempo su cola se descarta y recibe un evento
+'resync' para que vuelva a sincronizar con /api/devices/changes.
+
+El broker vive en memoria del proceso: con varios workers cada uno solo
+entrega lo que él mismo confirma, por eso el dashboard mantiene un sondeo
+lento de respaldo.
+
+Cada conexión abierta ocupa un hilo (o, con Passenger, un proceso completo)
+mientras dure, así que el máximo por proceso es pequeño y passenger_wsgi.py
+lo desactiva por defecto. Sin canal, /api/stream responde 204 (el navegador
+no reconecta) y el dashboard sigue con el sondeo de /api/devices/changes.
+
+Variables de entorno:
+    SSE_ENABLED=true|false  (por defecto true; false en passenger_wsgi.py)
+    SSE_MAX_SUBSCRIBERS=<conexiones por proceso>  (por defecto 20)
+    SSE_HEARTBEAT_SECONDS=<segundos>  (por defecto 15)
+"""
+import itertools
+import json
+import queue
+import threading
+
+
+class Subscription:
+    """
+    Conexión SSE de un cliente y sus filtros
+    """
+
+    def __init__(self, subscription_id, device_ids=None, bbox=None, max_pending=100):
+        """
+        Args:
+            subscription_id: Identificador interno de la suscripción
+            device_ids: Conjunto de ids de dispositivos a seguir (None = todos)
+            bbox: (min_lon, min_lat, max_lon, max_lat) de la región visible (None = sin filtro)
+            max_pending: Eventos que se pueden acumular antes de pedir resync
+        """
+        self.id = subscription_id
+        self.device_ids = set(device_ids) if device_ids else None
+        self.bbox = bbox
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.needs_resync = False
+
+    def _in_bbox(self, latitude, longitude):
+        if latitude is None or longitude is None:
+            return False
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        return min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon
+
+    def matches(self, device_id, latitude=None, longitude=None, previous=None):
+        """
+        Indica si un evento del dispositivo le interesa a esta suscripción
+
+        Con ambos filtros basta con cumplir uno (seguir un vehículo aunque salga
+        de la región visible).
+
+        Args:
+            previous: (latitude, longitude) antes del evento; si estaba en la
+                      región, el evento llega aunque la nueva posición esté fuera
+        """
+        if self.device_ids is None and self.bbox is None:
+            return True
+        if self.device_ids is not None and device_id in self.device_ids:
+            return True
+        if self.bbox is not None:
+            return self._in_bbox(latitude, longitude) or (previous is not None and self._in_bbox(*previous))
+        return False
+
+
+class LiveUpdateBroker:
+    """
+    Reparte eventos a las suscripciones SSE abiertas
+    """
+
+    def __init__(self, heartbeat_seconds=15, max_pending=100, max_subscribers=20, enabled=True):
+        """
+        Args:
+            heartbeat_seconds: Segundos sin eventos tras los que se envía un heartbeat
+            max_pending: Tamaño de la cola de cada suscripción
+            max_subscribers: Máximo de conexiones simultáneas
+            enabled: False para no aceptar suscripciones (los clientes sondean)
+        """
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_pending = max_pending
+        self.max_subscribers = max_subscribers
+        self.enabled = enabled
+        self._subscriptions = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.stats = {
+            'connections': 0,
+            'published': 0,
+            'delivered': 0,
+            'resyncs': 0,
+            'heartbeats': 0,
+            'rejected': 0
+        }
+
+    def subscribe(self, device_ids=None, bbox=None):
+        """
+        Registra una suscripción nueva
+
+        Returns:
+            Subscription: None si el canal está desactivado o se alcanzó el máximo de conexiones
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscribers:
+                self.stats['rejected'] += 1
+                return None
+            subscription = Subscription(next(self._ids), device_ids, bbox, self.max_pending)
+            self._subscriptions[subscription.id] = subscription
+            self.stats['connections'] += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Elimina una suscripción (el cliente cerró la conexión)
+        """
+        with self._lock:
+            self._subscriptions.pop(subscription.id, None)
+
+    @staticmethod
+    def _frame(event, data):
+        """
+        Serializa un evento en formato SSE
+        """
+        return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+    def _deliver(self, subscription, frame):
+        """
+        Encola un evento; si la cola está llena, la suscripción pasa a resync
+        """
+        try:
+            subscription.queue.put_nowait(frame)
+            return True
+        except queue.Full:
+            if not subscription.needs_resync:
+                subscription.needs_resync = True
+                with self._lock:
+                    self.stats['resyncs'] += 1
+            return False
+
+    def publish_fixes(self, fixes, previous=None):
+        """
+        Publica fixes GPS ya confirmados en la base de datos
+
+        Args:
+            fixes: Lista de dicts con id, latitude, longitude, last_update y revision
+            previous: dict id -> (latitude, longitude) antes del fix, para avisar
+                      a quien veía el vehículo que salió de su región
+        """
+        previous = previous or {}
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+        if not subscriptions:
+            return
+
+        delivered = 0
+        for fix in fixes:
+            last_update = fix.get('last_update')
+            frame = self._frame('fix', {
+                'id': fix['id'],
+                'lat': fix['latitude'],
+                'lon': fix['longitude'],
+                't': last_update.isoformat() if last_update else None,
+                'rev': fix.get('revision')
+            })
+            for subscription in subscriptions:
+                if subscription.matches(fix['id'], fix['latitude'], fix['longitude'], previous.get(fix['id'])):
+                    delivered += self._deliver(subscription, frame)
+
+        with self._lock:
+            self.stats['published'] += len(fixes)
+            self.stats['delivered'] += delivered
+
+    def publish_device(self, device_id, revision=None, reason='updated', latitude=None, longitude=None):
+        """
+        Publica un cambio de un dispositivo que no es un fix (alquiler, alta, edición, baja)
+
+        El cliente responde sincronizando con /api/devices/changes.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+        if not subscriptions:
+            return
+
+        frame = self._frame('device', {'id': device_id, 'rev': revision, 'reason': reason})
+        delivered = 0
+        for subscription in subscriptions:
+            if subscription.matches(device_id, latitude, longitude):
+                delivered += self._deliver(subscription, frame)
+
+        with self._lock:
+            self.stats['published'] += 1
+            self.stats['delivered'] += delivered
+
+    def publish_geofence_events(self, events):
+        """
+        Publica entradas y salidas de geocercas ya confirmadas (llegan a todas las suscripciones)
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+        if not subscriptions or not events:
+            return
+
+        delivered = 0
+        for event in events:
+            frame = self._frame('geofence', {
+                'id': event['device_id'],
+                'geofence_id': event['geofence_id'],
+                'geofence': event['geofence'],
+                'site': event['site'],
+                'event': event['event'],
+                't': event['timestamp'].isoformat()
+            })
+            for subscription in subscriptions:
+                delivered += self._deliver(subscription, frame)
+
+        with self._lock:
+            self.stats['published'] += len(events)
+            self.stats['delivered'] += delivered
+
+    def stream(self, subscription):
+        """
+        Generador del cuerpo de la respuesta text/event-stream
+
+        Envía un heartbeat cada `heartbeat_seconds` sin eventos; así los
+        proxies no cierran la conexión y el servidor detecta clientes caídos.
+        """
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                if subscription.needs_resync:
+                    # Descartar lo acumulado: el cliente va a pedir el delta completo
+                    while True:
+                        try:
+                            subscription.queue.get_nowait()
+                        except queue.Empty:
+                            break
+                    subscription.needs_resync = False
+                    yield self._frame('resync', {})
+                    continue
+
+                try:
+                    yield subscription.queue.get(timeout=self.heartbeat_seconds)
+                except queue.Empty:
+                    with self._lock:
+                        self.stats['heartbeats'] += 1
+                    yield ": ping\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def get_stats(self):
+        """
+        Obtiene estadísticas del canal en vivo
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['subscribers'] = len(self._subscriptions)
+            stats['pending'] = sum(s.queue.qsize() for s in self._subscriptions.values())
+        stats['heartbeat_seconds'] = self.heartbeat_seconds
+        stats['enabled'] = self.enabled
+        stats['max_subscribers'] = self.max_subscribers
+        return stats
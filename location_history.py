@@ -0,0 +1,280 @@
+"""
+Historial de ubicaciones GPS (solo inserción)
+Cada fix recibido por SMS se agrega a una tabla particionada por mes
+(location_history_YYYYMM) con índice compuesto (device_id, timestamp),
+de modo que las consultas por vehículo y rango de fechas sigan siendo rápidas
+aunque la flota acumule decenas de millones de puntos.
+La tabla gps_devices sigue funcionando como caché de "última posición".
+"""
+import threading
+from array import array
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import Table, Column, Integer, BigInteger, Float, DateTime, String, MetaData, Index, inspect, select, func, cast  # pyright: ignore[reportMissingImports]
+
+PARTITION_PREFIX = 'location_history_'
+EPOCH = datetime(1970, 1, 1)
+ONE_MS = timedelta(milliseconds=1)
+# Columnas de iter_columns: nombre -> typecode de array (int64 / float64)
+COLUMN_TYPES = (('device_id', 'q'), ('timestamp_ms', 'q'), ('latitude', 'd'), ('longitude', 'd'))
+
+
+class LocationHistory:
+    """
+    Almacén append-only de fixes GPS particionado por mes
+    """
+
+    def __init__(self, engine):
+        """
+        Args:
+            engine: Engine de SQLAlchemy donde viven las particiones
+        """
+        self.engine = engine
+        self.metadata = MetaData()
+        self._tables = {}
+        self._created = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def partition_name(timestamp):
+        """
+        Nombre de la partición mensual que corresponde a un timestamp
+        """
+        return f'{PARTITION_PREFIX}{timestamp:%Y%m}'
+
+    @staticmethod
+    def _naive_utc(value):
+        """
+        Convierte un datetime con zona horaria (ej: '...Z' o '+00:00' en la URL)
+        a UTC sin zona, como se guardan los timestamps
+        """
+        if value is not None and value.tzinfo is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def _table(self, name):
+        """
+        Obtiene (o define) la tabla de una partición sin crearla en la base de datos
+        """
+        table = self._tables.get(name)
+        if table is None:
+            table = Table(
+                name, self.metadata,
+                Column('id', Integer, primary_key=True),
+                Column('device_id', Integer, nullable=False),
+                Column('timestamp', DateTime, nullable=False),
+                Column('latitude', Float, nullable=False),
+                Column('longitude', Float, nullable=False),
+                Column('source', String(20), default='sms'),
+                Index(f'ix_{name}_device_ts', 'device_id', 'timestamp')
+            )
+            self._tables[name] = table
+        return table
+
+    def ensure_partition(self, timestamp):
+        """
+        Crea la partición del mes si no existe y retorna su tabla
+
+        Debe llamarse antes de abrir la transacción de escritura: en SQLite el
+        CREATE TABLE usa otra conexión y no debe competir con el lock de escritura.
+        """
+        name = self.partition_name(timestamp)
+        table = self._table(name)
+        if name not in self._created:
+            with self._lock:
+                if name not in self._created:
+                    table.create(self.engine, checkfirst=True)
+                    self._created.add(name)
+        return table
+
+    def existing_partitions(self):
+        """
+        Lista ordenada de las particiones que existen en la base de datos
+        """
+        names = [n for n in inspect(self.engine).get_table_names() if n.startswith(PARTITION_PREFIX)]
+        return sorted(names)
+
+    def _partitions_for_range(self, start, end):
+        """
+        Particiones existentes que pueden contener puntos entre start y end
+        """
+        existing = set(self.existing_partitions())
+        names = []
+        month = datetime(start.year, start.month, 1)
+        while month <= end:
+            name = self.partition_name(month)
+            if name in existing:
+                names.append(name)
+            # Avanzar al primer día del mes siguiente
+            month = (month + timedelta(days=32)).replace(day=1)
+        return names
+
+    def append(self, session, device_id, latitude, longitude, timestamp=None, source='sms'):
+        """
+        Agrega un fix al historial dentro de la transacción de la sesión dada
+
+        Args:
+            session: Sesión (o conexión) de SQLAlchemy; el commit lo hace quien llama
+            device_id: ID (clave primaria) del GPSDevice
+            latitude, longitude: Coordenadas del fix
+            timestamp: Momento del fix (default: ahora, UTC)
+            source: Origen del fix ('sms', 'manual', ...)
+        """
+        timestamp = timestamp or datetime.utcnow()
+        table = self.ensure_partition(timestamp)
+        session.execute(table.insert().values(
+            device_id=device_id,
+            timestamp=timestamp,
+            latitude=latitude,
+            longitude=longitude,
+            source=source
+        ))
+        return timestamp
+
+    def append_many(self, session, rows):
+        """
+        Agrega varios fixes en un solo executemany por partición
+
+        Args:
+            session: Sesión (o conexión) de SQLAlchemy; el commit lo hace quien llama
+            rows: Lista de dicts con device_id, latitude, longitude, timestamp y opcionalmente source
+        """
+        by_partition = {}
+        for row in rows:
+            row.setdefault('source', 'sms')
+            by_partition.setdefault(self.partition_name(row['timestamp']), []).append(row)
+
+        for partition_rows in by_partition.values():
+            table = self.ensure_partition(partition_rows[0]['timestamp'])
+            session.execute(table.insert(), partition_rows)
+
+        return len(rows)
+
+    def query(self, device_id=None, start=None, end=None, limit=None):
+        """
+        Consulta el historial en orden cronológico
+
+        Args:
+            device_id: ID del GPSDevice (None = toda la flota)
+            start, end: Rango de fechas UTC, con o sin zona horaria (default: últimas 24 horas)
+            limit: Máximo de puntos a retornar
+
+        Returns:
+            list: Lista de dicts con device_id, timestamp, latitude, longitude, source
+        """
+        end = self._naive_utc(end) or datetime.utcnow()
+        start = self._naive_utc(start) or (end - timedelta(hours=24))
+        points = []
+
+        with self.engine.connect() as conn:
+            for name in self._partitions_for_range(start, end):
+                table = self._table(name)
+                stmt = select(table).where(
+                    table.c.timestamp >= start,
+                    table.c.timestamp <= end
+                )
+                if device_id is not None:
+                    stmt = stmt.where(table.c.device_id == device_id)
+                stmt = stmt.order_by(table.c.timestamp)
+                if limit:
+                    stmt = stmt.limit(limit - len(points))
+
+                for row in conn.execute(stmt):
+                    points.append({
+                        'device_id': row.device_id,
+                        'timestamp': row.timestamp.isoformat(),
+                        'latitude': row.latitude,
+                        'longitude': row.longitude,
+                        'source': row.source
+                    })
+
+                if limit and len(points) >= limit:
+                    break
+
+        return points
+
+    def _timestamp_ms(self, table):
+        """
+        Expresión SQL con el timestamp en milisegundos desde 1970 (None si el
+        motor no tiene una; entonces se convierte en Python, bastante más lento)
+        """
+        column = table.c.timestamp
+        dialect = self.engine.dialect.name
+        if dialect == 'sqlite':
+            # 2440587.5 = día juliano de 1970-01-01
+            return cast(func.round((func.julianday(column) - 2440587.5) * 86400000.0), BigInteger)
+        if dialect == 'postgresql':
+            return cast(func.round(func.extract('epoch', column) * 1000), BigInteger)
+        return None
+
+    def iter_columns(self, device_id=None, start=None, end=None, batch_size=50000, with_ids=False):
+        """
+        Recorre el historial en lotes columnares directamente desde el cursor
+
+        No crea un dict ni un objeto por punto: cada lote son cuatro arrays
+        compactos (int64/float64). Los puntos salen ordenados por vehículo y
+        timestamp dentro de cada partición mensual.
+
+        Args:
+            device_id: ID del GPSDevice (None = toda la flota)
+            start, end: Rango de fechas UTC, con o sin zona horaria (default: últimas 24 horas)
+            batch_size: Máximo de puntos por lote
+            with_ids: Incluir también la columna id (para delete_points)
+
+        Yields:
+            dict: device_id, timestamp_ms (array 'q'), latitude, longitude (array 'd')
+                  y con with_ids también id (array 'q')
+        """
+        end = self._naive_utc(end) or datetime.utcnow()
+        start = self._naive_utc(start) or (end - timedelta(hours=24))
+
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(stream_results=True, yield_per=batch_size)
+            for name in self._partitions_for_range(start, end):
+                table = self._table(name)
+                timestamp_ms = self._timestamp_ms(table)
+                stmt = select(
+                    table.c.device_id,
+                    table.c.timestamp if timestamp_ms is None else timestamp_ms,
+                    table.c.latitude,
+                    table.c.longitude,
+                    *([table.c.id] if with_ids else [])
+                ).where(
+                    table.c.timestamp >= start,
+                    table.c.timestamp <= end
+                )
+                if device_id is not None:
+                    stmt = stmt.where(table.c.device_id == device_id)
+                stmt = stmt.order_by(table.c.device_id, table.c.timestamp)
+
+                for rows in conn.execute(stmt).partitions(batch_size):
+                    columns = list(zip(*rows))
+                    timestamps = columns[1]
+                    if timestamp_ms is None:
+                        timestamps = [(t - EPOCH) // ONE_MS for t in timestamps]
+                    batch = {
+                        'device_id': array('q', columns[0]),
+                        'timestamp_ms': array('q', timestamps),
+                        'latitude': array('d', columns[2]),
+                        'longitude': array('d', columns[3])
+                    }
+                    if with_ids:
+                        batch['id'] = array('q', columns[4])
+                    yield batch
+
+    def delete_points(self, timestamp, ids, chunk_size=500):
+        """
+        Borra puntos por id de la partición del mes de `timestamp`
+
+        Returns:
+            int: Puntos borrados
+        """
+        name = self.partition_name(timestamp)
+        if name not in set(self.existing_partitions()):
+            return 0
+        table = self._table(name)
+        ids = list(ids)
+        deleted = 0
+        with self.engine.begin() as conn:
+            for i in range(0, len(ids), chunk_size):
+                deleted += conn.execute(table.delete().where(table.c.id.in_(ids[i:i + chunk_size]))).rowcount
+        return deleted
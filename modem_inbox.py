@@ -0,0 +1,233 @@
+"""
+Recepción de SMS directamente desde el módem GSM
+Con AT+CNMI=2,1 el módem avisa cada SMS nuevo con un URC +CMTI. En lugar de
+leerlos uno por uno (AT+CMGR por índice), el buzón espera unos milisegundos a
+que se acumulen los avisos de una ráfaga y lee todos los mensajes nuevos con
+un solo AT+CMGL="REC UNREAD". Cada SMS se borra por índice (AT+CMGD=<idx>)
+solo después de que on_sms lo procesó sin error: un SMS cuyo procesamiento
+falla queda leído en la SIM en vez de perderse con un borrado masivo.
+
+Si un borrado falla, el índice queda en la lista de entregados (con remitente
+y texto) y se reintenta en la siguiente lectura; mientras tanto, si el módem
+lo vuelve a listar con el mismo contenido no se entrega dos veces.
+
+Cada texto se entrega a `on_sms(sms_text, phone_number)`; en app.py ese
+callback lo parsea con SMSGPSHandler.parse_sms y lo encola en la cola de
+ingesta, igual que un webhook pero sin proveedor ni URL pública.
+"""
+import re
+import threading
+import time
+from datetime import datetime
+from gsm_modem import ATError
+
+# +CMGL: 1,"REC UNREAD","+573001234567",,"24/05/01,10:22:00-20"
+CMGL_HEADER = re.compile(r'^\+CMGL:\s*(\d+)\s*,\s*"([^"]*)"\s*,\s*"([^"]*)"')
+# +CMT: "+573001234567",,"24/05/01,10:22:00-20"
+CMT_HEADER = re.compile(r'^\+CMT:\s*"([^"]*)"')
+
+
+def parse_cmgl(lines):
+    """
+    Convierte la respuesta de AT+CMGL (modo texto) en mensajes
+
+    Returns:
+        list: dicts con index, status, phone_number y text
+    """
+    messages = []
+    current = None
+    for line in lines:
+        match = CMGL_HEADER.match(line)
+        if match:
+            current = {
+                'index': int(match.group(1)),
+                'status': match.group(2),
+                'phone_number': match.group(3),
+                'text': ''
+            }
+            messages.append(current)
+        elif current is not None:
+            # Un SMS con saltos de línea llega en varias líneas
+            current['text'] = f"{current['text']}\n{line}" if current['text'] else line
+    return messages
+
+
+class ModemInbox:
+    """
+    Lee, entrega y borra por lotes los SMS que llegan al módem
+    """
+
+    def __init__(self, modem, on_sms, batch_delay=0.2, poll_interval=60):
+        """
+        Args:
+            modem: ATModem ya abierto
+            on_sms: Función on_sms(sms_text, phone_number) que procesa cada SMS
+            batch_delay: Segundos que se esperan tras un aviso para juntar la ráfaga
+            poll_interval: Cada cuánto se revisa la SIM aunque no lleguen avisos
+        """
+        self.modem = modem
+        self.on_sms = on_sms
+        self.batch_delay = batch_delay
+        self.poll_interval = poll_interval
+        self.is_running = False
+        self.thread = None
+        self._wake = threading.Event()
+        self._direct = []
+        # Índice en la SIM -> (remitente, texto) de los SMS entregados y aún sin borrar
+        self._delivered = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'indications': 0,
+            'reads': 0,
+            'received': 0,
+            'deleted': 0,
+            'delete_errors': 0,
+            'duplicates': 0,
+            'handler_errors': 0,
+            'read_errors': 0,
+            'max_batch': 0,
+            'last_received_time': None
+        }
+
+    def start(self):
+        """
+        Activa los avisos de SMS nuevos y vacía lo que ya esté guardado en la SIM
+        """
+        if self.is_running:
+            return
+        self.modem.add_urc_handler(self._on_urc)
+        # mode=2 (avisar siempre), mt=1 (guardar y avisar con +CMTI)
+        self.modem.command('AT+CNMI=2,1,0,0,0')
+        self.is_running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        self._wake.set()
+
+    def stop(self):
+        """
+        Detiene el hilo del buzón
+        """
+        self.is_running = False
+        self._wake.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+
+    def _on_urc(self, line, body):
+        """
+        Manejador de URC (se ejecuta en el hilo lector del módem: no bloquear)
+        """
+        if line.startswith('+CMTI:'):
+            with self._lock:
+                self.stats['indications'] += 1
+            self._wake.set()
+        elif line.startswith('+CMT:') and body is not None:
+            # Entrega directa (CNMI con mt=2): el SMS no queda en la SIM
+            match = CMT_HEADER.match(line)
+            with self._lock:
+                self.stats['indications'] += 1
+                self._direct.append((body, match.group(1) if match else ''))
+            self._wake.set()
+
+    def _loop(self):
+        while self.is_running:
+            self._wake.wait(self.poll_interval)
+            if not self.is_running:
+                break
+            self._wake.clear()
+            # Dejar que lleguen el resto de avisos de la ráfaga
+            time.sleep(self.batch_delay)
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception as e:
+                print(f"⚠ Error leyendo SMS del módem: {e}")
+
+    def _deliver(self, text, phone_number):
+        """
+        Returns:
+            bool: True si on_sms procesó el SMS sin error
+        """
+        try:
+            self.on_sms(text, phone_number)
+            return True
+        except Exception as e:
+            print(f"⚠ Error procesando SMS de {phone_number}: {e}")
+            with self._lock:
+                self.stats['handler_errors'] += 1
+            return False
+
+    def _delete_delivered(self):
+        """
+        Borra de la SIM los SMS ya entregados (incluidos borrados fallidos antes)
+
+        Returns:
+            int: Cantidad de SMS borrados
+        """
+        deleted = 0
+        for index in sorted(self._delivered):
+            try:
+                self.modem.command(f'AT+CMGD={index}', timeout=10)
+            except ATError as e:
+                with self._lock:
+                    self.stats['delete_errors'] += 1
+                print(f"⚠ AT+CMGD={index} falló: {e.result}")
+                continue
+            del self._delivered[index]
+            deleted += 1
+        return deleted
+
+    def drain(self):
+        """
+        Lee los SMS nuevos con un AT+CMGL, los entrega y borra los procesados
+
+        Returns:
+            int: Cantidad de SMS procesados
+        """
+        with self._lock:
+            direct, self._direct = self._direct, []
+        for text, phone_number in direct:
+            self._deliver(text, phone_number)
+
+        try:
+            lines = self.modem.command('AT+CMGL="REC UNREAD"', timeout=30)
+        except ATError as e:
+            with self._lock:
+                self.stats['read_errors'] += 1
+            print(f"⚠ AT+CMGL falló: {e.result}")
+            return len(direct)
+
+        messages = parse_cmgl(lines)
+        delivered = 0
+        duplicates = 0
+        for message in messages:
+            signature = (message['phone_number'], message['text'])
+            if self._delivered.get(message['index']) == signature:
+                # Ya entregado; solo faltaba borrarlo
+                duplicates += 1
+                continue
+            if self._deliver(message['text'], message['phone_number']):
+                self._delivered[message['index']] = signature
+                delivered += 1
+
+        deleted = self._delete_delivered()
+
+        received = delivered + len(direct)
+        with self._lock:
+            self.stats['reads'] += 1
+            self.stats['received'] += received
+            self.stats['deleted'] += deleted
+            self.stats['duplicates'] += duplicates
+            self.stats['max_batch'] = max(self.stats['max_batch'], len(messages))
+            if received:
+                self.stats['last_received_time'] = datetime.utcnow()
+        return received
+
+    def get_stats(self):
+        """
+        Obtiene estadísticas del buzón
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        stats['is_running'] = self.is_running
+        stats['last_received_time'] = stats['last_received_time'].isoformat() if stats['last_received_time'] else None
+        return stats
@@ -0,0 +1,288 @@
+"""
+Pool de módems GSM para repartir los envíos de SMS
+Cada puerto detectado (o listado en GSM_MODEM_PORTS) se abre con su propio
+driver AT y su propio limitador de envío. Cada SMS va al módem sano con menos
+envíos en curso; en empate, al que lleva más tiempo sin usarse (round-robin).
+Así la capacidad de envío crece con la cantidad de módems conectados.
+
+Un módem que falla EJECT_AFTER envíos seguidos (o que no abre) sale del pool
+durante un tiempo que se duplica en cada expulsión; cuando vence, el siguiente
+envío o chequeo de salud intenta reabrirlo.
+"""
+import collections
+import threading
+import time
+from gsm_modem import ATModem, ATError, ATTimeout
+from modem_inbox import ModemInbox
+from rate_limit import get_limiter
+
+EJECT_AFTER = 3
+EJECT_BASE_SECONDS = 30
+EJECT_MAX_SECONDS = 600
+
+
+class PooledModem:
+    """
+    Un módem del pool con su estado de salud y sus contadores
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.modem = None
+        self.inbox = None
+        self.limiter = get_limiter(f'gsm_modem:{port}')
+        self.in_flight = 0
+        self.last_used = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = None
+        self.ejections = 0
+        self.last_error = None
+        self.sent = 0
+        self.failed = 0
+        self.total_send_ms = 0.0
+        self.recent = collections.deque()
+
+    @property
+    def is_open(self):
+        return self.modem is not None and self.modem.is_running
+
+    def get_stats(self, now):
+        # Envíos confirmados en el último minuto
+        while self.recent and now - self.recent[0] > 60:
+            self.recent.popleft()
+        return {
+            'port': self.port,
+            'open': self.is_open,
+            'ejected': self.ejected_until is not None,
+            'ejected_for_seconds': round(self.ejected_until - now, 1) if self.ejected_until else None,
+            'ejections': self.ejections,
+            'in_flight': self.in_flight,
+            'sent': self.sent,
+            'failed': self.failed,
+            'consecutive_failures': self.consecutive_failures,
+            'sms_last_minute': len(self.recent),
+            'avg_send_ms': round(self.total_send_ms / self.sent, 1) if self.sent else None,
+            'last_error': self.last_error,
+            'inbox': self.inbox.get_stats() if self.inbox else None
+        }
+
+
+class ModemPool:
+    """
+    Conjunto de módems GSM con balanceo de carga y expulsión de los que fallan
+    """
+
+    def __init__(self, ports, baudrate=9600):
+        """
+        Args:
+            ports: Lista de puertos serie
+            baudrate: Velocidad de los puertos
+        """
+        self.baudrate = baudrate
+        self.members = [PooledModem(port) for port in ports]
+        self.inbound_handler = None
+        self._lock = threading.Lock()
+
+    def _open_member(self, member):
+        """
+        Abre (o reabre) un módem; si falla queda expulsado
+        """
+        if member.is_open:
+            return True
+        try:
+            member.modem = ATModem(member.port, baudrate=self.baudrate).open()
+        except Exception as e:
+            member.modem = None
+            self._record_failure(member, f'no abre: {e}', force_eject=True)
+            return False
+
+        with self._lock:
+            member.ejected_until = None
+            member.consecutive_failures = 0
+        if self.inbound_handler:
+            self._start_inbox(member)
+        return True
+
+    def _start_inbox(self, member):
+        try:
+            member.inbox = ModemInbox(member.modem, self.inbound_handler)
+            member.inbox.start()
+            print(f"✓ Recepción de SMS activada en el módem {member.port}")
+        except Exception as e:
+            # El módem sigue sirviendo para enviar aunque no acepte AT+CNMI
+            print(f"⚠ No se pudo activar la recepción de SMS en {member.port}: {e}")
+            member.inbox = None
+
+    def _close_member(self, member):
+        if member.inbox:
+            member.inbox.stop()
+            member.inbox = None
+        if member.modem:
+            member.modem.close()
+            member.modem = None
+
+    def open(self):
+        """
+        Abre los módems que no están expulsados
+
+        Los que siguen en su espera de expulsión no se prueban: abrir un puerto
+        muerto tarda varios segundos y lo reintentan send_sms o check_health
+        cuando la espera vence.
+
+        Returns:
+            int: Cantidad de módems abiertos
+        """
+        now = time.monotonic()
+        return sum(
+            1 for member in self.members
+            if (member.ejected_until is None or member.ejected_until <= now) and self._open_member(member)
+        )
+
+    def close(self):
+        for member in self.members:
+            self._close_member(member)
+
+    def set_inbound_handler(self, handler):
+        """
+        Activa la recepción de SMS en todos los módems abiertos (y en los que se abran después)
+        """
+        self.inbound_handler = handler
+        for member in self.members:
+            if handler and member.is_open and not member.inbox:
+                self._start_inbox(member)
+
+    def _record_failure(self, member, error, force_eject=False):
+        with self._lock:
+            member.failed += 1
+            member.consecutive_failures += 1
+            member.last_error = error
+            if force_eject or member.consecutive_failures >= EJECT_AFTER:
+                backoff = min(EJECT_BASE_SECONDS * (2 ** member.ejections), EJECT_MAX_SECONDS)
+                member.ejected_until = time.monotonic() + backoff
+                member.ejections += 1
+                eject = True
+            else:
+                eject = False
+        if eject:
+            print(f"⚠ Módem {member.port} fuera del pool por {backoff}s: {error}")
+            self._close_member(member)
+
+    def _acquire(self, exclude=()):
+        """
+        Elige el módem menos cargado y reserva un envío en curso
+
+        Los módems expulsados cuya espera venció se devuelven para reintentar
+        abrirlos (el llamador los reabre).
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                m for m in self.members
+                if m not in exclude and (m.ejected_until is None or m.ejected_until <= now)
+            ]
+            if not candidates:
+                return None
+            member = min(candidates, key=lambda m: (m.in_flight, m.last_used))
+            member.in_flight += 1
+            member.last_used = now
+            return member
+
+    def _release(self, member):
+        with self._lock:
+            member.in_flight -= 1
+
+    def available_count(self):
+        """
+        Cantidad de módems abiertos y no expulsados
+        """
+        with self._lock:
+            return sum(1 for m in self.members if m.ejected_until is None and m.is_open)
+
+    def send_sms(self, phone_number, text):
+        """
+        Envía un SMS por el módem menos cargado
+
+        Si el módem responde con un código de error (el SMS no salió) se
+        reintenta una vez en otro módem; tras un timeout no, porque el SMS
+        podría haberse enviado.
+
+        Returns:
+            dict: port y message_reference
+
+        Raises:
+            ATError: si ningún módem pudo enviar
+        """
+        tried = []
+        last_error = None
+        while len(tried) < 2:
+            member = self._acquire(exclude=tried)
+            if member is None:
+                break
+            tried.append(member)
+            try:
+                if not member.is_open and not self._open_member(member):
+                    last_error = ATError(f'AT+CMGS="{phone_number}"', member.last_error)
+                    continue
+
+                started = time.perf_counter()
+                with member.limiter:
+                    reference = member.modem.send_sms(phone_number, text)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                with self._lock:
+                    member.sent += 1
+                    member.consecutive_failures = 0
+                    member.total_send_ms += elapsed_ms
+                    member.recent.append(time.monotonic())
+                return {'port': member.port, 'message_reference': reference}
+            except ATTimeout as e:
+                self._record_failure(member, str(e))
+                raise
+            except ATError as e:
+                self._record_failure(member, str(e))
+                last_error = e
+            finally:
+                self._release(member)
+
+        raise last_error or ATError(f'AT+CMGS="{phone_number}"', 'no hay módems disponibles')
+
+    def check_health(self):
+        """
+        Chequea cada módem (AT) y reintenta abrir los expulsados cuya espera venció
+
+        Returns:
+            dict: ready (al menos un módem disponible), detail y estado por puerto
+        """
+        now = time.monotonic()
+        for member in self.members:
+            if member.ejected_until is not None and member.ejected_until > now:
+                continue
+            if not member.is_open:
+                self._open_member(member)
+                continue
+            try:
+                member.modem.command('AT', timeout=3)
+            except ATError as e:
+                self._record_failure(member, f'sin respuesta: {e.result}', force_eject=True)
+
+        available = self.available_count()
+        return {
+            'ready': available > 0,
+            'detail': f'{available}/{len(self.members)} módems disponibles ({", ".join(m.port for m in self.members)})'
+        }
+
+    def get_stats(self):
+        """
+        Estado y contadores de cada módem
+        """
+        now = time.monotonic()
+        with self._lock:
+            members = [member.get_stats(now) for member in self.members]
+        for member, stats in zip(self.members, members):
+            stats['driver'] = member.modem.get_stats() if member.modem else None
+        return {
+            'modems': len(self.members),
+            'available': sum(1 for m in members if m['open'] and not m['ejected']),
+            'sent': sum(m['sent'] for m in members),
+            'failed': sum(m['failed'] for m in members),
+            'members': members
+        }
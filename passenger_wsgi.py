@@ -16,6 +16,11 @@ except ImportError:
     # Si dotenv no está disponible, intentar cargar variables manualmente
     pass
 
+# Passenger atiende una petición por proceso: cada conexión SSE abierta
+# bloquearía un proceso entero, así que el dashboard usa el sondeo
+# (se puede activar con SSE_ENABLED=true en .env)
+os.environ.setdefault('SSE_ENABLED', 'false')
+
 # Importar la aplicación Flask
 from app import app as application
 
@@ -0,0 +1,46 @@
+"""
+Normalización de números de teléfono (SIM de las placas GPS) a formato E.164
+Se usa tanto para enviar SMS como para identificar al remitente de un SMS
+recibido, de modo que "+573001234567", "573001234567", "03001234567" y
+"300 123 4567" sean el mismo número.
+"""
+import os
+
+# Código de país por defecto (Colombia)
+DEFAULT_COUNTRY_CODE = os.getenv('DEFAULT_COUNTRY_CODE', '57')
+
+
+def normalize_phone(phone, country_code=None):
+    """
+    Convierte un número a formato E.164 (+<código de país><número>)
+
+    Args:
+        phone: Número en cualquier formato (con espacios, guiones, paréntesis, 'whatsapp:', etc.)
+        country_code: Código de país a usar si el número no lo trae (default: DEFAULT_COUNTRY_CODE)
+
+    Returns:
+        str: Número en formato E.164 o None si no contiene dígitos
+    """
+    if phone is None:
+        return None
+
+    phone = str(phone).strip().replace('whatsapp:', '')
+    digits = ''.join(c for c in phone if c.isdigit())
+    if not digits:
+        return None
+
+    # Ya trae código de país
+    if phone.startswith('+'):
+        return f'+{digits}'
+    if digits.startswith('00'):
+        return f'+{digits[2:]}'
+
+    country_code = country_code or DEFAULT_COUNTRY_CODE
+
+    # Si empieza con 0 (prefijo nacional), removerlo
+    if digits.startswith('0'):
+        digits = digits[1:]
+
+    if digits.startswith(country_code):
+        return f'+{digits}'
+    return f'+{country_code}{digits}'
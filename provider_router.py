@@ -0,0 +1,308 @@
+"""
+Enrutamiento de SMS salientes entre proveedores
+Cada proveedor (módem GSM, SMSMobileAPI, gateway Android, Vonage, Sinch...) tiene un
+estado de salud compartido por todo el proceso:
+
+- Circuit breaker: tras FAILURE_THRESHOLD fallos seguidos queda abierto y no
+  recibe envíos durante un tiempo (que se duplica si sigue fallando); luego
+  pasa a semiabierto y deja pasar un único envío de prueba que lo cierra o lo
+  vuelve a abrir.
+- Latencia y tasa de error como medias móviles exponenciales (EWMA).
+- Cuota diaria: SMS_DAILY_QUOTA_<PROVEEDOR> o, sin configurar, hasta que el
+  proveedor responda que se quedó sin cupo (la función de envío lo indica
+  con quota_exceeded=True: HTTP 429 o el código de límite del proveedor); se
+  reinicia a medianoche UTC. Cualquier otro error (red, timeout) cuenta para
+  el breaker.
+
+ProviderRouter prueba para cada mensaje los proveedores sanos del más barato al
+más caro (en empate, el de menor latencia). Un proveedor caído ya no suma su
+timeout a cada envío: se salta mientras su breaker esté abierto.
+
+Variables de entorno:
+    SMS_COST_<PROVEEDOR>=<costo por SMS>
+    SMS_DAILY_QUOTA_<PROVEEDOR>=<SMS por día>   (0 = sin límite)
+    SMS_BREAKER_FAILURES=<fallos seguidos>      (por defecto 5)
+    SMS_BREAKER_RESET_SECONDS=<segundos>        (por defecto 30)
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# proveedor -> costo aproximado por SMS (USD); los métodos propios solo gastan el plan de la SIM
+PROVIDER_COSTS = {
+    'gsm_modem': 0.0,
+    'smsmobileapi': 0.0,
+    'android_gateway': 0.0,
+    'messagebird': 0.0075,
+    'sinch': 0.0078,
+    'vonage': 0.0080,
+    'twilio': 0.0083,
+    # ADB solo abre la app de SMS y alguien tiene que tocar enviar: último recurso
+    'android_adb': 0.05,
+}
+DEFAULT_COST = 0.01
+
+FAILURE_THRESHOLD = int(os.getenv('SMS_BREAKER_FAILURES', '5'))
+RESET_SECONDS = float(os.getenv('SMS_BREAKER_RESET_SECONDS', '30'))
+MAX_RESET_SECONDS = 600
+EWMA_ALPHA = 0.2
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def _next_utc_midnight(now=None):
+    now = now or datetime.now(timezone.utc)
+    return (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class ProviderHealth:
+    """
+    Circuit breaker, EWMA de latencia/errores y cuota diaria de un proveedor
+    """
+
+    def __init__(self, name, cost, daily_quota):
+        self.name = name
+        self.cost = cost
+        self.daily_quota = daily_quota or None
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.reset_seconds = RESET_SECONDS
+        self.probe_in_flight = False
+        self.latency_ms = None
+        self.error_rate = 0.0
+        self.sent_today = 0
+        self.quota_exhausted = False
+        self.quota_resets_at = _next_utc_midnight()
+        self.last_error = None
+        self._lock = threading.Lock()
+        self.stats = {
+            'sent': 0,
+            'failed': 0,
+            'rejected': 0,
+            'opened': 0
+        }
+
+    def _roll_day_locked(self):
+        if datetime.now(timezone.utc) >= self.quota_resets_at:
+            self.sent_today = 0
+            self.quota_exhausted = False
+            self.quota_resets_at = _next_utc_midnight()
+
+    def has_quota(self):
+        with self._lock:
+            self._roll_day_locked()
+            return not self.quota_exhausted and (self.daily_quota is None or self.sent_today < self.daily_quota)
+
+    def allow(self):
+        """
+        Reserva un envío si el breaker lo permite
+
+        Returns:
+            bool: False si el breaker está abierto (o ya hay una prueba en curso)
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() < self.open_until:
+                    self.stats['rejected'] += 1
+                    return False
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self.probe_in_flight:
+                    self.stats['rejected'] += 1
+                    return False
+                self.probe_in_flight = True
+            return True
+
+    def _observe_locked(self, latency_ms, failed):
+        if latency_ms is not None:
+            self.latency_ms = latency_ms if self.latency_ms is None else (1 - EWMA_ALPHA) * self.latency_ms + EWMA_ALPHA * latency_ms
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate + EWMA_ALPHA * (1.0 if failed else 0.0)
+
+    def record_success(self, latency_ms=None):
+        with self._lock:
+            self._roll_day_locked()
+            self._observe_locked(latency_ms, failed=False)
+            self.stats['sent'] += 1
+            self.sent_today += 1
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+            if self.state != CLOSED:
+                print(f"✓ Proveedor {self.name} recuperado")
+            self.state = CLOSED
+            self.reset_seconds = RESET_SECONDS
+
+    def record_failure(self, error, latency_ms=None, quota=False):
+        """
+        Registra un envío fallido; un error de cupo agota el día sin abrir el breaker
+
+        Args:
+            error: Texto del error
+            latency_ms: Duración del intento
+            quota: True solo si el proveedor indicó que se agotó el cupo
+        """
+        with self._lock:
+            self._roll_day_locked()
+            self.stats['failed'] += 1
+            self.last_error = str(error)[:200]
+            self.probe_in_flight = False
+            if quota:
+                # El proveedor responde bien: solo se quedó sin cupo hasta mañana
+                if not self.quota_exhausted:
+                    print(f"⚠ Cupo diario de {self.name} agotado hasta {self.quota_resets_at.isoformat()}")
+                self.quota_exhausted = True
+                return
+            self._observe_locked(latency_ms, failed=True)
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN:
+                # La prueba falló: volver a abrir con espera doble
+                self.reset_seconds = min(self.reset_seconds * 2, MAX_RESET_SECONDS)
+                self._open_locked()
+            elif self.state == CLOSED and self.consecutive_failures >= FAILURE_THRESHOLD:
+                self._open_locked()
+
+    def _open_locked(self):
+        self.state = OPEN
+        self.open_until = time.monotonic() + self.reset_seconds
+        self.stats['opened'] += 1
+        print(f"⚠ Proveedor {self.name} en pausa por {self.reset_seconds:.0f}s: {self.last_error}")
+
+    def get_stats(self):
+        with self._lock:
+            self._roll_day_locked()
+            stats = dict(self.stats)
+            stats.update({
+                'state': self.state,
+                'cost': self.cost,
+                'open_for_seconds': round(self.open_until - time.monotonic(), 1) if self.state == OPEN else None,
+                'consecutive_failures': self.consecutive_failures,
+                'latency_ewma_ms': round(self.latency_ms, 1) if self.latency_ms is not None else None,
+                'error_rate_ewma': round(self.error_rate, 3),
+                'sent_today': self.sent_today,
+                'daily_quota': self.daily_quota,
+                'quota_exhausted': self.quota_exhausted,
+                'quota_resets_at': self.quota_resets_at.isoformat(),
+                'last_error': self.last_error
+            })
+        return stats
+
+
+_health = {}
+_registry_lock = threading.Lock()
+
+
+def get_health(provider):
+    """
+    Obtiene (o crea) el estado de salud compartido de un proveedor
+    """
+    health = _health.get(provider)
+    if health is None:
+        with _registry_lock:
+            health = _health.get(provider)
+            if health is None:
+                env_name = provider.upper()
+                cost = float(os.getenv(f'SMS_COST_{env_name}', PROVIDER_COSTS.get(provider, DEFAULT_COST)))
+                quota = int(os.getenv(f'SMS_DAILY_QUOTA_{env_name}', '0'))
+                health = ProviderHealth(provider, cost, quota)
+                _health[provider] = health
+    return health
+
+
+def get_all_stats():
+    """
+    Estado de todos los proveedores usados hasta ahora
+    """
+    with _registry_lock:
+        providers = list(_health.values())
+    return {health.name: health.get_stats() for health in providers}
+
+
+class ProviderRouter:
+    """
+    Elige para cada mensaje el proveedor sano más barato y pasa al siguiente si falla
+
+    Uso:
+        router = ProviderRouter()
+        router.register('vonage', send_vonage)   # send(to_number, message) -> dict
+        result = router.send('+573001234567', 'URL#')
+    """
+
+    def __init__(self):
+        self.providers = {}
+
+    def register(self, name, send, is_ready=None):
+        """
+        Args:
+            name: Nombre del proveedor (clave de get_health y get_limiter)
+            send: Función send(to_number, message) que devuelve un dict con
+                  success y message_sid o error (y quota_exceeded=True si el
+                  proveedor rechazó el envío por cupo)
+            is_ready: Función opcional; si devuelve False el proveedor se salta
+                      sin contarlo como fallo (ej: módem aún no detectado)
+        """
+        self.providers[name] = (send, is_ready)
+
+    def candidates(self):
+        """
+        Proveedores con cupo, del más barato al más caro (en empate, el más rápido)
+        """
+        ready = []
+        for name, (_, is_ready) in self.providers.items():
+            health = get_health(name)
+            if not health.has_quota():
+                continue
+            if is_ready is not None and not is_ready():
+                continue
+            latency = health.latency_ms if health.latency_ms is not None else 0.0
+            ready.append((health.cost, latency, name))
+        return [name for _, _, name in sorted(ready)]
+
+    def send(self, to_number, message):
+        """
+        Envía un mensaje por el primer proveedor sano que lo acepte
+
+        Returns:
+            dict: Resultado del proveedor usado (con 'method') más 'attempts';
+                  si ninguno pudo, success=False y quota_exhausted=True cuando
+                  todos los proveedores agotaron su cupo diario
+        """
+        attempts = []
+        last_error = None
+        for name in self.candidates():
+            health = get_health(name)
+            if not health.allow():
+                attempts.append({'method': name, 'skipped': health.state})
+                continue
+
+            send, _ = self.providers[name]
+            started = time.perf_counter()
+            try:
+                result = send(to_number, message)
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            if result.get('success'):
+                health.record_success(elapsed_ms)
+                attempts.append({'method': name, 'success': True, 'ms': round(elapsed_ms, 1)})
+                result.setdefault('method', name)
+                result['attempts'] = attempts
+                return result
+
+            last_error = result.get('error', 'Error desconocido')
+            health.record_failure(last_error, elapsed_ms, quota=bool(result.get('quota_exceeded')))
+            attempts.append({'method': name, 'success': False, 'error': last_error, 'ms': round(elapsed_ms, 1)})
+            print(f"  ⚠ Error con {name}: {last_error}")
+
+        quota_exhausted = bool(self.providers) and all(
+            not get_health(name).has_quota() for name in self.providers
+        )
+        return {
+            'success': False,
+            'error': last_error or 'No hay método de envío de SMS disponible',
+            'quota_exhausted': quota_exhausted,
+            'attempts': attempts
+        }
@@ -0,0 +1,161 @@
+"""
+Limitadores de envío por proveedor de SMS
+Cada proveedor (módem GSM, SMSMobileAPI, MessageBird, Sinch, Vonage, Twilio...)
+tiene su propio token bucket (mensajes por segundo + ráfaga) y un tope de
+envíos simultáneos, de modo que el barrido de la flota pueda repartirse entre
+varios hilos sin saturar a ningún proveedor.
+
+Los valores por defecto se pueden sobrescribir con variables de entorno:
+    SMS_RATE_<PROVEEDOR>=<mensajes por segundo>
+    SMS_BURST_<PROVEEDOR>=<tamaño de ráfaga>
+    SMS_CONCURRENCY_<PROVEEDOR>=<envíos simultáneos>
+(ej: SMS_RATE_TWILIO=1, SMS_CONCURRENCY_GSM_MODEM=1)
+
+Un proveedor con varias instancias usa '<proveedor>:<instancia>' (ej:
+'gsm_modem:/dev/ttyUSB0'): cada instancia tiene su propio limitador con los
+valores del proveedor.
+"""
+import os
+import threading
+import time
+
+# proveedor -> (mensajes por segundo, ráfaga, envíos simultáneos)
+PROVIDER_DEFAULTS = {
+    # Cada módem es un solo puerto serie: un envío a la vez. AT+CMGS ya tarda
+    # 0.5-3 s en la red, así que el ritmo solo frena un bucle desbocado
+    'gsm_modem': (2, 4, 1),
+    'android_gateway': (1, 1, 1),
+    'android_adb': (0.5, 1, 1),
+    'smsmobileapi': (1, 2, 2),
+    'messagebird': (10, 10, 8),
+    'sinch': (10, 10, 8),
+    'vonage': (20, 20, 8),
+    'twilio': (5, 5, 4),
+}
+DEFAULT_LIMITS = (1, 1, 1)
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe: `rate` tokens por segundo, hasta `capacity` acumulados
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, timeout=None):
+        """
+        Espera hasta obtener un token
+
+        Returns:
+            bool: False si se agotó el timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+class ProviderLimiter:
+    """
+    Token bucket + semáforo de concurrencia de un proveedor
+
+    Uso:
+        with get_limiter('twilio'):
+            client.messages.create(...)
+    """
+
+    def __init__(self, name, rate, burst, concurrency):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self.stats = {
+            'acquired': 0,
+            'in_flight': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0
+        }
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.semaphore.acquire()
+        self.bucket.acquire()
+        waited_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.stats['acquired'] += 1
+            self.stats['in_flight'] += 1
+            self.stats['total_wait_ms'] += waited_ms
+            self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], waited_ms)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._lock:
+            self.stats['in_flight'] -= 1
+        self.semaphore.release()
+        return False
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['rate_per_second'] = self.bucket.rate
+        stats['burst'] = int(self.bucket.capacity)
+        stats['concurrency'] = self.concurrency
+        stats['avg_wait_ms'] = round(stats['total_wait_ms'] / stats['acquired'], 3) if stats['acquired'] else None
+        stats['total_wait_ms'] = round(stats['total_wait_ms'], 3)
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 3)
+        return stats
+
+
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def get_limiter(provider):
+    """
+    Obtiene (o crea) el limitador compartido de un proveedor (o de una instancia)
+    """
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        with _registry_lock:
+            limiter = _limiters.get(provider)
+            if limiter is None:
+                base = provider.split(':', 1)[0]
+                rate, burst, concurrency = PROVIDER_DEFAULTS.get(base, DEFAULT_LIMITS)
+                env_name = base.upper()
+                rate = float(os.getenv(f'SMS_RATE_{env_name}', rate))
+                burst = int(os.getenv(f'SMS_BURST_{env_name}', burst))
+                concurrency = int(os.getenv(f'SMS_CONCURRENCY_{env_name}', concurrency))
+                limiter = ProviderLimiter(provider, rate, burst, concurrency)
+                _limiters[provider] = limiter
+    return limiter
+
+
+def get_all_stats():
+    """
+    Estadísticas de todos los limitadores usados hasta ahora
+    """
+    with _registry_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.get_stats() for limiter in limiters}
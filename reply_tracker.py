@@ -0,0 +1,239 @@
+"""
+Seguimiento de las solicitudes de ubicación (URL#) hasta su respuesta
+Cada SMS enviado a un vehículo abre una solicitud en curso (device_id ->
+enviado, proveedor, message_sid). Cuando llega su fix (process_sms o la cola
+de ingesta) la solicitud se cierra y su latencia entra en los histogramas del
+vehículo y del proveedor. Si no llega respuesta en REPLY_TIMEOUT_SECONDS la
+solicitud cuenta como sin respuesta.
+
+El planificador de AutoUpdateService lo usa para:
+- no volver a enviar mientras la solicitud anterior siga esperando
+  (REPLY_SKIP_SECONDS);
+- espaciar los sondeos de los vehículos que dejaron de responder: tras
+  NO_REPLY_BACKOFF_AFTER solicitudes seguidas sin respuesta el intervalo se
+  duplica en cada una (hasta x32) y vuelve a la normalidad con la primera
+  respuesta.
+
+Variables de entorno:
+    REPLY_TIMEOUT_SECONDS=<segundos>    (por defecto 300)
+    REPLY_SKIP_SECONDS=<segundos>       (por defecto 90)
+    NO_REPLY_BACKOFF_AFTER=<solicitudes> (por defecto 3)
+"""
+import os
+import threading
+import time
+
+# Límites superiores (segundos) de los cubos del histograma de latencia
+LATENCY_BUCKETS = (5, 10, 20, 30, 60, 120, 300)
+MAX_BACKOFF_FACTOR = 32
+
+
+class LatencyHistogram:
+    """
+    Histograma de latencias de respuesta + solicitudes sin respuesta
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.replies = 0
+        self.total_seconds = 0.0
+        self.no_reply = 0
+
+    def add(self, seconds):
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        self.counts[index] += 1
+        self.replies += 1
+        self.total_seconds += seconds
+
+    def percentile(self, fraction):
+        """
+        Límite superior del cubo que contiene el percentil (None si no hay datos)
+        """
+        if not self.replies:
+            return None
+        target = fraction * self.replies
+        running = 0
+        for index, count in enumerate(self.counts):
+            running += count
+            if running >= target:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else None
+        return None
+
+    def to_dict(self):
+        requests = self.replies + self.no_reply
+        buckets = {f'le_{bound}s': count for bound, count in zip(LATENCY_BUCKETS, self.counts)}
+        buckets[f'gt_{LATENCY_BUCKETS[-1]}s'] = self.counts[-1]
+        return {
+            'replies': self.replies,
+            'no_reply': self.no_reply,
+            'no_reply_rate': round(self.no_reply / requests, 3) if requests else None,
+            'avg_seconds': round(self.total_seconds / self.replies, 1) if self.replies else None,
+            'p50_seconds': self.percentile(0.5),
+            'p90_seconds': self.percentile(0.9),
+            'buckets': buckets
+        }
+
+
+class ReplyTracker:
+    """
+    Tabla de solicitudes de ubicación en curso con histogramas por vehículo y proveedor
+    """
+
+    def __init__(self, timeout_seconds=300, skip_seconds=90, backoff_after=3):
+        """
+        Args:
+            timeout_seconds: Tiempo tras el cual una solicitud cuenta como sin respuesta
+            skip_seconds: Tiempo durante el cual no se reenvía a un vehículo que no ha respondido
+            backoff_after: Solicitudes seguidas sin respuesta antes de espaciar los sondeos
+        """
+        self.timeout_seconds = timeout_seconds
+        self.skip_seconds = skip_seconds
+        self.backoff_after = backoff_after
+        # device_id -> {'sent_at', 'provider', 'message_sid', 'attempts'}
+        self._inflight = {}
+        self._devices = {}
+        self._providers = {}
+        self._consecutive_no_reply = {}
+        self._last_expire = 0.0
+        self._lock = threading.Lock()
+        self.stats = {
+            'sent': 0,
+            'replied': 0,
+            'expired': 0,
+            'unsolicited': 0
+        }
+
+    def _histogram_locked(self, table, key):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = LatencyHistogram()
+        return histogram
+
+    def _expire_locked(self, now):
+        # Recorrer la tabla como mucho una vez por segundo (el barrido consulta vehículo por vehículo)
+        if now - self._last_expire < 1:
+            return
+        self._last_expire = now
+        expired = [
+            device_id for device_id, entry in self._inflight.items()
+            if now - entry['sent_at'] >= self.timeout_seconds
+        ]
+        for device_id in expired:
+            entry = self._inflight.pop(device_id)
+            self._histogram_locked(self._devices, device_id).no_reply += 1
+            self._histogram_locked(self._providers, entry['provider']).no_reply += 1
+            self._consecutive_no_reply[device_id] = self._consecutive_no_reply.get(device_id, 0) + 1
+            self.stats['expired'] += 1
+
+    def record_sent(self, device_id, provider, message_sid=None):
+        """
+        Abre (o renueva) la solicitud en curso de un vehículo
+
+        Si ya había una esperando se conserva su hora de envío: la respuesta
+        que llegue corresponde a la primera.
+        """
+        now = time.time()
+        with self._lock:
+            self._expire_locked(now)
+            self.stats['sent'] += 1
+            entry = self._inflight.get(device_id)
+            if entry is None:
+                self._inflight[device_id] = {
+                    'sent_at': now,
+                    'provider': provider,
+                    'message_sid': message_sid,
+                    'attempts': 1
+                }
+            else:
+                entry['attempts'] += 1
+
+    def record_reply(self, device_id):
+        """
+        Cierra la solicitud en curso de un vehículo al recibir su fix
+
+        Returns:
+            float: Latencia en segundos, o None si no había solicitud en curso
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._inflight.pop(device_id, None)
+            # Cualquier fix demuestra que el vehículo responde
+            self._consecutive_no_reply.pop(device_id, None)
+            if entry is None:
+                self.stats['unsolicited'] += 1
+                return None
+            latency = now - entry['sent_at']
+            self._histogram_locked(self._devices, device_id).add(latency)
+            self._histogram_locked(self._providers, entry['provider']).add(latency)
+            self.stats['replied'] += 1
+            return latency
+
+    def record_replies(self, device_ids):
+        for device_id in device_ids:
+            self.record_reply(device_id)
+
+    def awaiting_reply(self, device_id):
+        """
+        True si el vehículo tiene una solicitud reciente sin responder (no reenviar aún)
+        """
+        now = time.time()
+        with self._lock:
+            self._expire_locked(now)
+            entry = self._inflight.get(device_id)
+            return entry is not None and now - entry['sent_at'] < self.skip_seconds
+
+    def backoff_factor(self, device_id):
+        """
+        Multiplicador del intervalo de sondeo de un vehículo que no responde (1 si responde)
+        """
+        with self._lock:
+            misses = self._consecutive_no_reply.get(device_id, 0)
+        if misses < self.backoff_after:
+            return 1
+        return min(2 ** (misses - self.backoff_after + 1), MAX_BACKOFF_FACTOR)
+
+    def forget(self, device_id):
+        """
+        Descarta el estado de un vehículo eliminado
+        """
+        with self._lock:
+            self._inflight.pop(device_id, None)
+            self._devices.pop(device_id, None)
+            self._consecutive_no_reply.pop(device_id, None)
+
+    def get_device_stats(self, device_id):
+        now = time.time()
+        with self._lock:
+            self._expire_locked(now)
+            histogram = self._devices.get(device_id)
+            entry = self._inflight.get(device_id)
+            stats = histogram.to_dict() if histogram else LatencyHistogram().to_dict()
+            stats['consecutive_no_reply'] = self._consecutive_no_reply.get(device_id, 0)
+            stats['awaiting_since_seconds'] = round(now - entry['sent_at'], 1) if entry else None
+            stats['awaiting_provider'] = entry['provider'] if entry else None
+        stats['backoff_factor'] = self.backoff_factor(device_id)
+        return stats
+
+    def get_stats(self):
+        """
+        Resumen: histogramas por proveedor y vehículos que dejaron de responder
+        """
+        with self._lock:
+            self._expire_locked(time.time())
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self._inflight)
+            stats['providers'] = {name: h.to_dict() for name, h in self._providers.items()}
+            stats['not_replying'] = sorted(
+                device_id for device_id, misses in self._consecutive_no_reply.items()
+                if misses >= self.backoff_after
+            )
+        stats['timeout_seconds'] = self.timeout_seconds
+        stats['skip_seconds'] = self.skip_seconds
+        return stats
+
+
+reply_tracker = ReplyTracker(
+    timeout_seconds=int(os.getenv('REPLY_TIMEOUT_SECONDS', '300')),
+    skip_seconds=int(os.getenv('REPLY_SKIP_SECONDS', '90')),
+    backoff_after=int(os.getenv('NO_REPLY_BACKOFF_AFTER', '3'))
+)
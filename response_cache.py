@@ -0,0 +1,128 @@
+"""
+Caché en memoria de la respuesta completa de GET /api/devices
+Armar la lista de la flota (consulta de toda la tabla + to_dict + JSON) en
+cada sondeo era el mayor costo por petición, y la lista solo cambia cuando
+llega un fix o alguien edita un vehículo. Se guarda el cuerpo JSON ya
+serializado con su ETag; mientras no cambie nada, las peticiones se
+responden desde memoria sin tocar la base de datos (o con 304 si el cliente
+ya tiene esa versión).
+
+Invalidación:
+- install_invalidation_hook: cualquier commit del ORM que cree, modifique o
+  borre un GPSDevice (add_device, update_device, delete_device, alquileres,
+  process_sms) invalida la caché;
+- los UPDATE masivos (cola de ingesta) llaman a invalidate() por su cuenta;
+- ttl_seconds acota cuánto puede durar una entrada si otro proceso (otro
+  worker de Passenger) modificó la tabla.
+
+Variables de entorno:
+    DEVICES_CACHE_TTL_SECONDS=<segundos>  (por defecto 30, 0 desactiva la caché)
+"""
+import hashlib
+import os
+import threading
+import time
+from sqlalchemy import event  # pyright: ignore[reportMissingImports]
+
+DEVICES_CACHE_TTL_SECONDS = float(os.getenv('DEVICES_CACHE_TTL_SECONDS', '30'))
+
+
+class ResponseCache:
+    """
+    Un cuerpo de respuesta pre-serializado, su ETag y un contador de versión
+    """
+
+    def __init__(self, ttl_seconds=DEVICES_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self._entry = None  # (body, etag, built_at)
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'not_modified': 0,
+            'invalidations': 0,
+            'last_build_ms': None
+        }
+
+    def invalidate(self):
+        """
+        Descarta la respuesta guardada (la próxima petición la reconstruye)
+        """
+        with self._lock:
+            self.version += 1
+            self._entry = None
+            self.stats['invalidations'] += 1
+
+    def get(self, build):
+        """
+        Retorna la respuesta guardada o la construye
+
+        Args:
+            build: Función sin argumentos que retorna el cuerpo (bytes)
+
+        Returns:
+            tuple: (body, etag)
+        """
+        with self._lock:
+            entry = self._entry
+            version = self.version
+            if entry is not None and time.monotonic() - entry[2] < self.ttl_seconds:
+                self.stats['hits'] += 1
+                return entry[0], entry[1]
+            self.stats['misses'] += 1
+
+        started = time.perf_counter()
+        body = build()
+        etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        with self._lock:
+            self.stats['last_build_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            # Si hubo una escritura mientras se construía, esta respuesta ya no es la vigente
+            if self.version == version and self.ttl_seconds > 0:
+                self._entry = (body, etag, time.monotonic())
+        return body, etag
+
+    def record_not_modified(self):
+        with self._lock:
+            self.stats['not_modified'] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['version'] = self.version
+            stats['cached'] = self._entry is not None
+        requests = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / requests, 4) if requests else None
+        stats['ttl_seconds'] = self.ttl_seconds
+        return stats
+
+
+def install_invalidation_hook(session_factory, gps_device_model, cache):
+    """
+    Invalida la caché después de cada commit que cambió algún GPSDevice
+    """
+    def _touches_devices(session):
+        return any(
+            isinstance(obj, gps_device_model)
+            for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+        )
+
+    @event.listens_for(session_factory, 'after_flush')
+    def _mark_changed(session, flush_context):
+        if _touches_devices(session):
+            session.info['devices_changed'] = True
+
+    @event.listens_for(session_factory, 'after_commit')
+    def _invalidate(session):
+        if session.info.pop('devices_changed', False):
+            cache.invalidate()
+
+    @event.listens_for(session_factory, 'after_rollback')
+    def _discard(session):
+        session.info.pop('devices_changed', None)
+
+    return _invalidate
+
+
+# Instancia global de /api/devices
+devices_cache = ResponseCache()
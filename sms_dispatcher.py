@@ -0,0 +1,469 @@
+"""
+Despachador único de SMS salientes
+La solicitud manual de ubicación (app.py) y el barrido automático
+(auto_update_service.py) encolan trabajos aquí en lugar de hablar cada uno con
+los proveedores:
+
+- Una sola cola con prioridad: lo manual se atiende antes que lo pendiente del
+  barrido.
+- Un SMS igual a la misma SIM que ya está en cola o enviándose no se repite:
+  el segundo pedido espera el resultado del primero (y si era manual, sube la
+  prioridad del que estaba en cola).
+- Los proveedores (módem GSM, cada canal Android, Vonage, Sinch, Twilio) se
+  registran una sola vez sobre el ProviderRouter y usan los clientes
+  compartidos de http_pool.
+- Todos los envíos devuelven el mismo formato de resultado (ver _result).
+
+Variables de entorno:
+    SMS_DISPATCH_WORKERS=<hilos>   (por defecto AUTO_UPDATE_WORKERS o 16)
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from phone_utils import normalize_phone
+from rate_limit import get_limiter
+from http_pool import get_session, get_timeout, get_vonage_client, get_twilio_client
+from provider_router import ProviderRouter
+from reply_tracker import reply_tracker
+
+# Importar Twilio
+try:
+    from twilio.rest import Client  # noqa: F401  # pyright: ignore[reportMissingImports]
+    TWILIO_AVAILABLE = True
+except ImportError:
+    TWILIO_AVAILABLE = False
+    print("Advertencia: Twilio no está disponible. Instala con: pip install twilio")
+
+# Importar Vonage
+try:
+    import vonage  # pyright: ignore[reportMissingImports]
+    VONAGE_AVAILABLE = True
+except ImportError:
+    VONAGE_AVAILABLE = False
+    print("Advertencia: Vonage no está disponible. Instala con: pip install vonage")
+
+# Importar SMS gratis (módem GSM o Android)
+try:
+    from sms_sender_free import get_sms_sender, ANDROID_CHANNELS
+    FREE_SMS_AVAILABLE = True
+except ImportError:
+    FREE_SMS_AVAILABLE = False
+    ANDROID_CHANNELS = ()
+
+PRIORITY_MANUAL = 0
+PRIORITY_SWEEP = 10
+
+QUEUED = 'queued'
+SENDING = 'sending'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+
+# Proveedores: send(to_number, message) -> dict con success y message_sid o error;
+# quota_exceeded=True solo cuando el proveedor rechaza por cupo (HTTP 429 o su código de límite)
+
+# Vonage: status 9 = "Partner quota violation" (sin saldo / cupo de la cuenta)
+VONAGE_QUOTA_STATUSES = {'9'}
+# Twilio: 20429 = Too Many Requests, 63038 = límite diario de mensajes de la cuenta
+TWILIO_QUOTA_CODES = {20429, 63038}
+
+def free_sms_method():
+    """
+    Método gratis detectado y listo ('gsm_modem', 'android_phone') o None
+    """
+    if not FREE_SMS_AVAILABLE:
+        return None
+    # Sender compartido: la detección y la apertura del módem ya se hicieron
+    free_sender = get_sms_sender(os.getenv('SMS_METHOD', 'auto'))
+    return free_sender.method if free_sender and free_sender.is_available() else None
+
+
+def android_channel_ready(channel):
+    """
+    Indica si un canal Android (SMSMobileAPI, MessageBird, gateway, ADB) está configurado
+    """
+    if not FREE_SMS_AVAILABLE:
+        return False
+    free_sender = get_sms_sender(os.getenv('SMS_METHOD', 'auto'))
+    return bool(free_sender) and channel in free_sender.android_channels()
+
+
+def _send_free(to_number, message, channel=None):
+    free_sender = get_sms_sender(os.getenv('SMS_METHOD', 'auto'))
+    if not free_sender:
+        return {'success': False, 'error': 'Sender gratis no disponible (ver /api/metrics -> sms_senders)'}
+    if channel:
+        result = free_sender.send_via(channel, to_number, message)
+    else:
+        result = free_sender.send_sms(to_number, message)
+    if result.get('success'):
+        result['message_sid'] = f"free_{result.get('method', free_sender.method)}_{int(time.time())}"
+    return result
+
+
+def vonage_configured():
+    return VONAGE_AVAILABLE and bool(os.getenv('VONAGE_API_KEY') and os.getenv('VONAGE_API_SECRET'))
+
+
+def _send_vonage(to_number, message):
+    vonage_phone = os.getenv('VONAGE_PHONE_NUMBER', 'API de Vonage')  # Usar texto por defecto si no hay número
+    vonage_client = get_vonage_client(os.getenv('VONAGE_API_KEY'), os.getenv('VONAGE_API_SECRET'))
+    with get_limiter('vonage'):
+        response_data = vonage.Sms(vonage_client).send_message({
+            'from': vonage_phone,
+            'to': to_number,
+            'text': message
+        })
+
+    status = response_data["messages"][0]["status"]
+    if status == "0":
+        return {'success': True, 'message_sid': response_data['messages'][0]['message-id']}
+    return {
+        'success': False,
+        'error': response_data["messages"][0]["error-text"],
+        'quota_exceeded': status in VONAGE_QUOTA_STATUSES
+    }
+
+
+def sinch_configured():
+    return bool(os.getenv('SINCH_SERVICE_PLAN_ID') and os.getenv('SINCH_API_TOKEN') and os.getenv('SINCH_FROM_NUMBER'))
+
+
+def _send_sinch(to_number, message):
+    sinch_service_plan_id = os.getenv('SINCH_SERVICE_PLAN_ID')
+    sinch_api_url = os.getenv('SINCH_API_URL', 'https://us.sms.api.sinch.com/xms/v1')
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f"Bearer {os.getenv('SINCH_API_TOKEN')}"
+    }
+    body = {
+        'from': os.getenv('SINCH_FROM_NUMBER'),
+        'to': [to_number],
+        'body': message
+    }
+
+    # La URL de Sinch ya incluye el service plan ID
+    full_sinch_url = f"{sinch_api_url.rstrip('/')}/{sinch_service_plan_id}/batches"
+    with get_limiter('sinch'):
+        response = get_session('sinch').post(full_sinch_url, json=body, headers=headers, timeout=get_timeout('sinch'))
+
+    if response.status_code == 201:  # 201 Created for successful batch
+        response_data = response.json()
+        return {
+            'success': True,
+            'message_sid': response_data.get('id') or response_data.get('batch_id'),
+            'status': 'accepted',
+            'warning': 'En modo trial, Sinch solo envía a números verificados. Verifica el número en el dashboard de Sinch.'
+        }
+    return {
+        'success': False,
+        'error': f"HTTP {response.status_code}: {response.text}",
+        'quota_exceeded': response.status_code == 429
+    }
+
+
+def twilio_configured():
+    return TWILIO_AVAILABLE and bool(os.getenv('TWILIO_ACCOUNT_SID') and os.getenv('TWILIO_AUTH_TOKEN'))
+
+
+def _send_twilio(to_number, message):
+    client = get_twilio_client(os.getenv('TWILIO_ACCOUNT_SID'), os.getenv('TWILIO_AUTH_TOKEN'))
+    try:
+        with get_limiter('twilio'):
+            message_obj = client.messages.create(
+                body=message,
+                from_=os.getenv('TWILIO_PHONE_NUMBER'),
+                to=to_number
+            )
+        return {'success': True, 'message_sid': message_obj.sid}
+    except Exception as e:
+        error_msg = str(e)
+        # TwilioRestException trae el status HTTP y el código de error de Twilio
+        quota_exceeded = getattr(e, 'status', None) == 429 or getattr(e, 'code', None) in TWILIO_QUOTA_CODES
+        # Detectar errores comunes de Twilio
+        if "not a valid phone number" in error_msg.lower():
+            error_msg = f"Número de teléfono inválido: {to_number}. Verifica el formato."
+        elif "unverified" in error_msg.lower() or "verified" in error_msg.lower():
+            error_msg = f"El número {to_number} no está verificado en Twilio. Verifícalo en la consola de Twilio."
+        elif "insufficient" in error_msg.lower() or "balance" in error_msg.lower():
+            error_msg = "Crédito insuficiente en tu cuenta de Twilio. Recarga tu cuenta."
+        elif quota_exceeded:
+            error_msg = "Límite diario de SMS alcanzado (429). El límite se reinicia en 24 horas. Detén el servicio automático o aumenta el intervalo."
+        return {'success': False, 'error': error_msg, 'quota_exceeded': quota_exceeded}
+
+
+def build_router():
+    """
+    Router con todos los proveedores; los no configurados se saltan en cada envío
+    """
+    router = ProviderRouter()
+    router.register('gsm_modem', _send_free, is_ready=lambda: free_sms_method() == 'gsm_modem')
+    # Cada canal Android con su costo, breaker y cupo (ver PROVIDER_COSTS)
+    for channel in ANDROID_CHANNELS:
+        router.register(
+            channel,
+            lambda to_number, message, channel=channel: _send_free(to_number, message, channel),
+            is_ready=lambda channel=channel: android_channel_ready(channel)
+        )
+    router.register('vonage', _send_vonage, is_ready=vonage_configured)
+    router.register('sinch', _send_sinch, is_ready=sinch_configured)
+    router.register('twilio', _send_twilio, is_ready=twilio_configured)
+    return router
+
+
+def configured_methods():
+    """
+    Proveedores configurados en este momento (sin mirar breaker ni cupo)
+    """
+    methods = ['gsm_modem'] if free_sms_method() == 'gsm_modem' else []
+    methods.extend(channel for channel in ANDROID_CHANNELS if android_channel_ready(channel))
+    for name, configured in (('vonage', vonage_configured), ('sinch', sinch_configured), ('twilio', twilio_configured)):
+        if configured():
+            methods.append(name)
+    return methods
+
+
+def _result(job, success, **fields):
+    """
+    Resultado de un envío, con las mismas claves para todos los proveedores y llamadores
+    """
+    result = {
+        'success': success,
+        'to': job.to_number,
+        'device_name': job.device_name,
+        'method': None,
+        'message_sid': None,
+        'error': None,
+        'attempts': [],
+        'priority': job.priority,
+        'queued_ms': job.queued_ms,
+        'send_ms': None,
+        'quota_exhausted': False
+    }
+    result.update(fields)
+    return result
+
+
+class DispatchJob:
+    """
+    SMS encolado en el despachador
+    """
+
+    def __init__(self, to_number, message, priority, device_name=None, device_id=None):
+        self.to_number = to_number
+        self.message = message
+        self.priority = priority
+        self.device_name = device_name
+        self.device_id = device_id
+        self.state = QUEUED
+        self.result = None
+        self.submitted = time.monotonic()
+        self.queued_ms = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+        Espera el resultado del envío
+
+        Returns:
+            dict: Resultado (ver _result), o None si se agotó el timeout
+        """
+        if not self.done.wait(timeout):
+            return None
+        return self.result
+
+
+class MessageDispatcher:
+    """
+    Cola única con prioridad y deduplicación para todos los SMS salientes
+
+    Uso:
+        job = get_dispatcher().submit('+573001234567', 'URL#', PRIORITY_MANUAL)
+        result = job.wait(60)
+    """
+
+    def __init__(self, router=None, workers=16):
+        """
+        Args:
+            router: ProviderRouter (por defecto build_router())
+            workers: Hilos que envían en paralelo; el ritmo real lo fija el
+                     limitador de cada proveedor (rate_limit.py)
+        """
+        self.router = router or build_router()
+        self.workers = workers
+        self._heap = []
+        self._seq = itertools.count()
+        self._inflight = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self.is_running = False
+        self.stats = {
+            'submitted': 0,
+            'deduplicated': 0,
+            'promoted': 0,
+            'cancelled': 0,
+            'sent': 0,
+            'failed': 0,
+            'max_queue_ms': 0.0
+        }
+
+    def start(self):
+        with self._cond:
+            if self.is_running:
+                return
+            self.is_running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'sms-dispatch-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._cond:
+            self.is_running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+
+    def submit(self, to_number, message='URL#', priority=PRIORITY_SWEEP, device_name=None, device_id=None):
+        """
+        Encola un SMS (o se une al mismo SMS a la misma SIM que ya está pendiente)
+
+        Con device_id, el envío abre una solicitud en reply_tracker que se
+        cierra cuando llega la respuesta del vehículo.
+
+        Returns:
+            DispatchJob: usar job.wait(timeout) para obtener el resultado
+        """
+        normalized = normalize_phone(to_number)
+        if not normalized:
+            # Un número inválido no debe llegar a los proveedores (contaría como fallo del breaker)
+            job = DispatchJob(to_number, message, priority, device_name, device_id)
+            job.state = DONE
+            job.result = _result(job, False, error=f'Número de SIM inválido: {to_number}')
+            job.done.set()
+            return job
+
+        to_number = normalized
+        key = (to_number, message)
+        with self._cond:
+            self.stats['submitted'] += 1
+            job = self._inflight.get(key)
+            if job is not None:
+                self.stats['deduplicated'] += 1
+                if priority < job.priority and job.state == QUEUED:
+                    # Lo manual adelanta al pedido del barrido; la entrada vieja se ignora al salir
+                    job.priority = priority
+                    heapq.heappush(self._heap, (priority, next(self._seq), job))
+                    self.stats['promoted'] += 1
+                    self._cond.notify()
+                return job
+
+            job = DispatchJob(to_number, message, priority, device_name, device_id)
+            self._inflight[key] = job
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            self._cond.notify()
+        if not self.is_running:
+            self.start()
+        return job
+
+    def send(self, to_number, message='URL#', priority=PRIORITY_MANUAL, device_name=None, device_id=None, timeout=120):
+        """
+        Encola un SMS y espera su resultado
+
+        Returns:
+            dict: Resultado (ver _result); success=False si no terminó a tiempo
+        """
+        job = self.submit(to_number, message, priority, device_name, device_id)
+        result = job.wait(timeout)
+        if result is None:
+            return _result(job, False, error=f'El envío sigue en cola tras {timeout}s', timed_out=True)
+        return result
+
+    def cancel(self, job):
+        """
+        Cancela un trabajo que todavía no empezó a enviarse
+
+        Returns:
+            bool: True si se canceló
+        """
+        with self._cond:
+            if job.state != QUEUED:
+                return False
+            job.state = CANCELLED
+            self._inflight.pop((job.to_number, job.message), None)
+            self.stats['cancelled'] += 1
+        job.result = _result(job, False, error='Cancelado', cancelled=True)
+        job.done.set()
+        return True
+
+    def _next_job(self):
+        with self._cond:
+            while self.is_running:
+                while self._heap:
+                    priority, _, job = heapq.heappop(self._heap)
+                    # Ignorar entradas obsoletas (cancelado o adelantado con otra prioridad)
+                    if job.state == QUEUED and job.priority == priority:
+                        job.state = SENDING
+                        job.queued_ms = round((time.monotonic() - job.submitted) * 1000, 1)
+                        self.stats['max_queue_ms'] = max(self.stats['max_queue_ms'], job.queued_ms)
+                        return job
+                self._cond.wait()
+            return None
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+
+            started = time.perf_counter()
+            try:
+                routed = self.router.send(job.to_number, job.message)
+            except Exception as e:
+                routed = {'success': False, 'error': str(e), 'attempts': []}
+            send_ms = round((time.perf_counter() - started) * 1000, 1)
+
+            if routed['success'] and job.device_id is not None:
+                reply_tracker.record_sent(job.device_id, routed.get('method'), routed.get('message_sid'))
+
+            fields = {k: v for k, v in routed.items() if k not in ('success', 'to')}
+            job.result = _result(job, routed['success'], send_ms=send_ms, **fields)
+            with self._cond:
+                job.state = DONE
+                self._inflight.pop((job.to_number, job.message), None)
+                self.stats['sent' if routed['success'] else 'failed'] += 1
+            job.done.set()
+
+    def get_stats(self):
+        with self._cond:
+            stats = dict(self.stats)
+            stats['queued'] = sum(1 for job in self._inflight.values() if job.state == QUEUED)
+            stats['sending'] = sum(1 for job in self._inflight.values() if job.state == SENDING)
+        stats['workers'] = self.workers
+        stats['is_running'] = self.is_running
+        stats['configured_methods'] = configured_methods()
+        return stats
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher(workers=None):
+    """
+    Despachador compartido del proceso (app.py y AutoUpdateService)
+
+    Args:
+        workers: Hilos de envío si el despachador aún no existe
+                 (por defecto SMS_DISPATCH_WORKERS, AUTO_UPDATE_WORKERS o 16)
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                workers = workers or int(os.getenv('SMS_DISPATCH_WORKERS', os.getenv('AUTO_UPDATE_WORKERS', '16')))
+                _dispatcher = MessageDispatcher(workers=workers)
+    return _dispatcher
@@ -2,33 +2,45 @@
 Módulo para recibir y procesar SMS de placas GPS
 La placa GPS envía SMS con la ubicación, este módulo los procesa
 """
+import collections
 import re
+import threading
 from datetime import datetime
+from reply_tracker import reply_tracker
+from trajectory_compression import deadband
 
 # Importación diferida para evitar importaciones circulares
 GPSDevice = None
 Session = None
+history = None
+device_index = None
+broker = None
+geofences = None
 
 def _get_models():
     """Obtiene los modelos de forma diferida"""
-    global GPSDevice, Session
+    global GPSDevice, Session, history, device_index, broker, geofences
     
     if GPSDevice is None or Session is None:
         try:
             # Intentar importar desde app.py (cuando se usa desde Flask)
-            from app import GPSDevice as AppGPSDevice, Session as AppSession
+            from app import GPSDevice as AppGPSDevice, Session as AppSession, location_history, sim_device_index, live_broker, geofence_engine
             GPSDevice = AppGPSDevice
             Session = AppSession
+            history = location_history
+            device_index = sim_device_index
+            broker = live_broker
+            geofences = geofence_engine
         except ImportError:
             # Si no se puede, crear la sesión directamente
-            from sqlalchemy import create_engine
+            from db_engine import create_db_engine
             from sqlalchemy.orm import sessionmaker
             import os
             from dotenv import load_dotenv
             
             load_dotenv()
             DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///gps_devices.db')
-            engine = create_engine(DATABASE_URL, echo=False)
+            engine = create_db_engine(DATABASE_URL)
             Session = sessionmaker(bind=engine)
             
             # Importar el modelo desde app
@@ -38,20 +50,106 @@ def _get_models():
             app_module = importlib.util.module_from_spec(spec)
             spec.loader.exec_module(app_module)
             GPSDevice = app_module.GPSDevice
+            history = app_module.location_history
+            device_index = app_module.sim_device_index
+            broker = app_module.live_broker
+            geofences = app_module.geofence_engine
     
     return GPSDevice, Session
 
+def _get_history():
+    """Obtiene el historial de ubicaciones de forma diferida"""
+    _get_models()
+    return history
+
+# Formatos que pueden enviar las placas GPS, en orden de prioridad
+SMS_FORMATS = [
+    # Formato: URL de Google Maps (N7.097760,W73.122780)
+    ('maps_url', r'maps\.google\.com/maps\?q=([NS])(\d+\.?\d*),([EW])(\d+\.?\d*)'),
+    # Formato: URL de Google Maps (q=N7.097760,W73.122780)
+    ('maps_query', r'q=([NS])(\d+\.?\d*),([EW])(\d+\.?\d*)'),
+    # Formato: LAT:7.1254,LON:-73.1198
+    ('lat_lon', r'LAT[:\s]*([+-]?\d+\.?\d*)[,\s]+LON[:\s]*([+-]?\d+\.?\d*)'),
+    # Formato: 7.1254,-73.1198
+    ('pair', r'([+-]?\d+\.?\d*)[,\s]+([+-]?\d+\.?\d*)'),
+    # Formato: lat=7.1254&lon=-73.1198
+    ('lat_lon_param', r'lat[=:]\s*([+-]?\d+\.?\d*)[,\s&]+lon[=:]\s*([+-]?\d+\.?\d*)'),
+    # Formato: GPS:7.1254,-73.1198
+    ('gps', r'GPS[:\s]*([+-]?\d+\.?\d*)[,\s]+([+-]?\d+\.?\d*)'),
+]
+
+# Patrones compilados una sola vez al importar el módulo. No se combinan en un
+# solo patrón: una alternancia simple elige el match más a la izquierda (casi
+# siempre el par de números) en vez del formato de mayor prioridad, y la
+# variante correcta (un lookahead por formato, ver benchmarks/bench_sms_parser.py)
+# es más lenta que estos search en orden porque recorre el texto carácter a
+# carácter sin los atajos de prefijo de re.search.
+_COMPILED_FORMATS = [re.compile(pattern, re.IGNORECASE) for _, pattern in SMS_FORMATS]
+_PAIR_FORMAT = 3
+
+# Último formato usado por cada remitente (número de SIM -> índice del formato),
+# LRU acotado; se comparte entre los hilos de Flask y el del módem
+MAX_LEARNED_SENDERS = 10000
+_sender_formats = collections.OrderedDict()
+_sender_formats_lock = threading.Lock()
+
 class SMSGPSHandler:
     """
     Procesa SMS recibidos de placas GPS
     Formato típico de SMS GPS: "LAT:7.1254,LON:-73.1198" o similar
     """
     
+    @staticmethod
+    def _coordinates_from_match(match, format_index):
+        """
+        Convierte los grupos de un match en (lat, lon) o None si no son válidas
+        """
+        try:
+            # Los dos primeros formatos son URLs de Google Maps (N/E/W/S)
+            if format_index < 2:
+                direction_lat, lat_value, direction_lon, lon_value = match.groups()
+                
+                # Convertir según dirección
+                lat = float(lat_value) if direction_lat in 'Nn' else -float(lat_value)
+                lon = float(lon_value) if direction_lon in 'Ee' else -float(lon_value)
+            else:  # Formatos normales (LAT/LON o números)
+                lat_value, lon_value = match.groups()
+                lat = float(lat_value)
+                lon = float(lon_value)
+        except (ValueError, TypeError):
+            return None
+        
+        # Validar que sean coordenadas válidas
+        if -90 <= lat <= 90 and -180 <= lon <= 180:
+            return lat, lon
+        return None
+    
+    @staticmethod
+    def _learned_format(phone_number):
+        with _sender_formats_lock:
+            format_index = _sender_formats.get(phone_number)
+            if format_index is not None:
+                _sender_formats.move_to_end(phone_number)
+            return format_index
+    
+    @staticmethod
+    def _learn_format(phone_number, format_index):
+        with _sender_formats_lock:
+            _sender_formats[phone_number] = format_index
+            _sender_formats.move_to_end(phone_number)
+            if len(_sender_formats) > MAX_LEARNED_SENDERS:
+                _sender_formats.popitem(last=False)
+    
     @staticmethod
     def parse_sms(sms_text, phone_number):
         """
         Parsea un SMS recibido de una placa GPS
         
+        Primero prueba el formato que usó ese remitente la última vez (un solo
+        search); si no aplica, prueba los patrones precompilados en orden de
+        prioridad. El par de números sin prefijo no se usa como atajo porque
+        coincide con casi cualquier texto que tenga dos números.
+        
         Args:
             sms_text: Texto del SMS (ej: "LAT:7.1254,LON:-73.1198" o "7.1254,-73.1198")
             phone_number: Número de teléfono que envió el SMS (número de la SIM)
@@ -59,52 +157,33 @@ class SMSGPSHandler:
         Returns:
             dict: Datos parseados o None si no se puede parsear
         """
-        # Diferentes formatos que pueden enviar las placas GPS
-        patterns = [
-            # Formato: URL de Google Maps (N7.097760,W73.122780)
-            r'maps\.google\.com/maps\?q=([NS])(\d+\.?\d*),([EW])(\d+\.?\d*)',
-            # Formato: URL de Google Maps (q=N7.097760,W73.122780)
-            r'q=([NS])(\d+\.?\d*),([EW])(\d+\.?\d*)',
-            # Formato: LAT:7.1254,LON:-73.1198
-            r'LAT[:\s]*([+-]?\d+\.?\d*)[,\s]+LON[:\s]*([+-]?\d+\.?\d*)',
-            # Formato: 7.1254,-73.1198
-            r'([+-]?\d+\.?\d*)[,\s]+([+-]?\d+\.?\d*)',
-            # Formato: lat=7.1254&lon=-73.1198
-            r'lat[=:]\s*([+-]?\d+\.?\d*)[,\s&]+lon[=:]\s*([+-]?\d+\.?\d*)',
-            # Formato: GPS:7.1254,-73.1198
-            r'GPS[:\s]*([+-]?\d+\.?\d*)[,\s]+([+-]?\d+\.?\d*)',
-        ]
+        coords = None
+        format_index = SMSGPSHandler._learned_format(phone_number)
         
-        for i, pattern in enumerate(patterns):
-            match = re.search(pattern, sms_text, re.IGNORECASE)
+        if format_index is not None and format_index != _PAIR_FORMAT:
+            match = _COMPILED_FORMATS[format_index].search(sms_text)
             if match:
-                try:
-                    # Los primeros dos patrones son para URLs de Google Maps (N/E/W/S)
-                    if i < 2:  # Formatos de Google Maps
-                        direction_lat = match.group(1).upper()  # N o S
-                        lat_value = float(match.group(2))
-                        direction_lon = match.group(3).upper()  # E o W
-                        lon_value = float(match.group(4))
-                        
-                        # Convertir según dirección
-                        lat = lat_value if direction_lat == 'N' else -lat_value
-                        lon = lon_value if direction_lon == 'E' else -lon_value
-                    else:  # Formatos normales (LAT/LON o números)
-                        lat = float(match.group(1))
-                        lon = float(match.group(2))
-                    
-                    # Validar que sean coordenadas válidas
-                    if -90 <= lat <= 90 and -180 <= lon <= 180:
-                        return {
-                            'latitude': lat,
-                            'longitude': lon,
-                            'phone_number': phone_number,
-                            'raw_sms': sms_text
-                        }
-                except (ValueError, IndexError):
-                    continue
+                coords = SMSGPSHandler._coordinates_from_match(match, format_index)
         
-        return None
+        if coords is None:
+            for format_index, pattern in enumerate(_COMPILED_FORMATS):
+                match = pattern.search(sms_text)
+                if match:
+                    coords = SMSGPSHandler._coordinates_from_match(match, format_index)
+                    if coords:
+                        break
+            
+            if coords is None:
+                return None
+            SMSGPSHandler._learn_format(phone_number, format_index)
+        
+        return {
+            'latitude': coords[0],
+            'longitude': coords[1],
+            'phone_number': phone_number,
+            'raw_sms': sms_text,
+            'format': SMS_FORMATS[format_index][0]
+        }
     
     @staticmethod
     def process_sms(sms_text, phone_number):
@@ -138,13 +217,10 @@ class SMSGPSHandler:
                     'received_sms': sms_text
                 }
             
-            # Buscar vehículo por número de SIM (phone_number)
-            # El phone_number debe coincidir con placa_gps
-            device = session.query(GPSDevice).filter_by(placa_gps=phone_number).first()
-            
-            if not device:
-                # Intentar buscar por device_id
-                device = session.query(GPSDevice).filter_by(device_id=phone_number).first()
+            # Buscar vehículo por número de SIM (phone_number) en el índice en memoria
+            # (SIM normalizada a E.164 o, como respaldo, device_id)
+            entry = device_index.resolve(phone_number) if device_index is not None else None
+            device = session.get(GPSDevice, entry[0]) if entry else None
             
             if not device:
                 return {
@@ -153,16 +229,68 @@ class SMSGPSHandler:
                     'parsed_data': parsed
                 }
             
-            # Actualizar ubicación
-            device.latitude = parsed['latitude']
-            device.longitude = parsed['longitude']
-            device.last_update = datetime.utcnow()
+            # Banda muerta: un fix junto a la última posición guardada solo renueva last_update
+            # (el estado del filtro y de las geocercas se aplica solo si el commit sale bien)
+            fix_time = datetime.utcnow()
+            deadband_pending = deadband.new_pending()
+            store, close_stop = deadband.check(
+                device.id, device.latitude, device.longitude, parsed['latitude'], parsed['longitude'],
+                pending=deadband_pending
+            )
+            location_history = _get_history()
+            close_stop = close_stop and location_history is not None and device.last_update is not None
+            if location_history is not None:
+                # Particiones antes de la primera escritura (la parada puede ser del mes anterior)
+                location_history.ensure_partition(fix_time)
+                if close_stop:
+                    location_history.ensure_partition(device.last_update)
+            if close_stop:
+                # Cerrar la parada: posición estacionada con la hora del último fix descartado
+                location_history.append(session, device.id, device.latitude, device.longitude, device.last_update)
+            
+            # Actualizar ubicación (gps_devices es la caché de la última posición)
+            previous = (device.latitude, device.longitude)
+            if store:
+                device.latitude = parsed['latitude']
+                device.longitude = parsed['longitude']
+            device.last_update = fix_time
+            
+            # Agregar el fix al historial en la misma transacción
+            if store and location_history is not None:
+                location_history.append(session, device.id, parsed['latitude'], parsed['longitude'], fix_time)
+            
+            # Entradas y salidas de geocercas (se registran con el fix)
+            geofence_events = []
+            geofence_pending = {}
+            if store and geofences is not None:
+                geofence_events = geofences.evaluate(
+                    device.id, parsed['latitude'], parsed['longitude'], fix_time, pending=geofence_pending
+                )
+                geofences.append_events(session, geofence_events)
             
             session.commit()
+            deadband.commit(deadband_pending)
+            if geofences is not None:
+                geofences.commit_state(geofence_pending)
+            
+            # Cerrar la solicitud URL# pendiente del vehículo (latencia de respuesta)
+            reply_tracker.record_reply(device.id)
+            
+            # Avisar a los dashboards conectados por SSE
+            if broker is not None:
+                broker.publish_fixes([{
+                    'id': device.id,
+                    'latitude': device.latitude,
+                    'longitude': device.longitude,
+                    'last_update': fix_time,
+                    'revision': device.revision
+                }], previous={device.id: previous})
+                broker.publish_geofence_events(geofence_events)
             
             return {
                 'status': 'success',
                 'message': f'Ubicación actualizada para {device.name}',
+                'stored': store,
                 'device': {
                     'id': device.id,
                     'name': device.name,
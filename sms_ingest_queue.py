@@ -0,0 +1,437 @@
+"""
+Cola de ingesta de SMS GPS con escritura agrupada (group commit)
+El webhook /api/sms/receive solo parsea y encola; un hilo escritor vacía la
+cola en micro-lotes (limitados por tamaño y por tiempo) y aplica todas las
+actualizaciones en una sola transacción con UPDATE masivos.
+Así, ante ráfagas de callbacks de los proveedores, SQLite recibe una
+escritura por lote en vez de una por SMS.
+
+Los fixes ya se respondieron con 202, así que un lote que falla (base
+bloqueada, error de partición...) no se descarta: se reintenta con espera
+creciente y, si sigue fallando, se aplica fix por fix para aislar el que
+falla. Los que no se pueden aplicar quedan registrados en failed_fixes y
+su clave de deduplicación se libera, para que un reintento del proveedor
+no se descarte como duplicado.
+"""
+import collections
+import queue
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import or_, select, update  # pyright: ignore[reportMissingImports]
+from device_sync import next_revision
+from spatial_index import quadkey
+from reply_tracker import reply_tracker
+
+# Esperas entre reintentos de un lote fallido (segundos)
+RETRY_DELAYS = (0.1, 0.5, 2.0)
+# Fixes que no se pudieron aplicar, guardados para diagnóstico
+MAX_FAILED_FIXES = 1000
+
+
+class SMSIngestQueue:
+    """
+    Cola en proceso + hilo escritor que aplica fixes GPS por lotes
+    """
+
+    def __init__(self, session_factory, gps_device_model, history=None, device_index=None, broker=None,
+                 geofences=None, deadband=None, devices_cache=None, dedup=None, max_batch_size=200,
+                 max_batch_wait=0.05, max_queue_size=10000):
+        """
+        Args:
+            session_factory: Función que retorna una sesión de base de datos
+            gps_device_model: Modelo GPSDevice
+            history: LocationHistory donde se agregan los fixes (opcional)
+            device_index: SIMDeviceIndex para resolver remitentes sin consultar la BD (opcional)
+            broker: LiveUpdateBroker al que se publican los fixes confirmados (opcional)
+            geofences: GeofenceEngine con el que se evalúa cada fix (opcional)
+            deadband: DeadBandFilter que descarta fixes junto a la última posición (opcional)
+            devices_cache: ResponseCache de /api/devices a invalidar tras cada lote (opcional)
+            dedup: WebhookDeduplicator cuya clave (parsed['dedup_key']) se libera si el fix no se guarda (opcional)
+            max_batch_size: Máximo de fixes por transacción
+            max_batch_wait: Segundos máximos que se espera para completar un lote
+            max_queue_size: Capacidad de la cola (si se llena, enqueue retorna False)
+        """
+        self.session_factory = session_factory
+        self.gps_device_model = gps_device_model
+        self.history = history
+        self.device_index = device_index
+        self.broker = broker
+        self.geofences = geofences
+        self.deadband = deadband
+        self.devices_cache = devices_cache
+        self.dedup = dedup
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.is_running = False
+        self.thread = None
+        self._lock = threading.Lock()
+        self.failed_fixes = collections.deque(maxlen=MAX_FAILED_FIXES)
+        self.metrics = {
+            'enqueued': 0,
+            'dequeued': 0,
+            'rejected': 0,
+            'applied': 0,
+            'suppressed': 0,
+            'not_found': 0,
+            'errors': 0,
+            'retries': 0,
+            'side_effect_errors': 0,
+            'batches': 0,
+            'last_batch_size': 0,
+            'max_batch_size_seen': 0,
+            'last_commit_ms': None,
+            'avg_commit_ms': None,
+            'max_commit_ms': None,
+            'last_commit_time': None
+        }
+
+    def start(self):
+        """
+        Inicia el hilo escritor
+        """
+        if self.is_running:
+            return
+        self.is_running = True
+        self.thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """
+        Detiene el hilo escritor después de vaciar lo que quede en la cola
+        """
+        self.is_running = False
+        if self.thread:
+            self.thread.join(timeout=timeout)
+
+    def enqueue(self, parsed):
+        """
+        Encola un SMS ya parseado por SMSGPSHandler.parse_sms
+
+        Returns:
+            bool: False si la cola está llena o el escritor no corre
+        """
+        if not self.is_running:
+            return False
+        parsed.setdefault('received_at', datetime.utcnow())
+        try:
+            self.queue.put_nowait(parsed)
+        except queue.Full:
+            with self._lock:
+                self.metrics['rejected'] += 1
+            return False
+        with self._lock:
+            self.metrics['enqueued'] += 1
+        return True
+
+    def _collect_batch(self):
+        """
+        Espera el primer fix y junta más hasta llenar el lote o agotar el tiempo
+        """
+        try:
+            first = self.queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_batch_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _writer_loop(self):
+        """
+        Loop del hilo escritor
+        """
+        while self.is_running or not self.queue.empty():
+            batch = self._collect_batch()
+            if not batch:
+                continue
+            with self._lock:
+                m = self.metrics
+                m['batches'] += 1
+                m['dequeued'] += len(batch)
+                m['last_batch_size'] = len(batch)
+                m['max_batch_size_seen'] = max(m['max_batch_size_seen'], len(batch))
+            try:
+                self._apply_with_retry(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _apply_with_retry(self, batch):
+        """
+        Aplica un lote reintentando con espera; si no hay caso, fix por fix
+
+        Returns:
+            list: Fixes que no se pudieron aplicar (quedan en failed_fixes)
+        """
+        for attempt, delay in enumerate((0,) + RETRY_DELAYS):
+            if delay:
+                time.sleep(delay)
+                with self._lock:
+                    self.metrics['retries'] += 1
+            try:
+                committed = self._apply_batch(batch)
+            except Exception as e:
+                error = e
+                print(f"  ⚠ Error aplicando lote de SMS ({len(batch)} fixes, intento {attempt + 1}): {e}")
+                continue
+            # Fuera del reintento: el lote ya está guardado y no se vuelve a aplicar
+            self._after_commit(committed)
+            return []
+
+        if len(batch) > 1:
+            # Aislar el fix que hace fallar al lote: el resto se aplica por separado
+            failed = []
+            for parsed in batch:
+                try:
+                    committed = self._apply_batch([parsed])
+                except Exception as e:
+                    self._record_failed(parsed, e)
+                    failed.append(parsed)
+                    continue
+                self._after_commit(committed)
+            return failed
+
+        self._record_failed(batch[0], error)
+        return batch
+
+    def _record_failed(self, parsed, error):
+        print(f"✗ Fix de {parsed['phone_number']} ({parsed['latitude']}, {parsed['longitude']}) "
+              f"recibido {parsed['received_at'].isoformat()} no se pudo guardar: {error}")
+        if self.dedup is not None and parsed.get('dedup_key'):
+            self.dedup.forget(parsed['dedup_key'])
+        with self._lock:
+            self.metrics['errors'] += 1
+            self.failed_fixes.append({
+                'phone_number': parsed['phone_number'],
+                'latitude': parsed['latitude'],
+                'longitude': parsed['longitude'],
+                'received_at': parsed['received_at'].isoformat(),
+                'error': str(error)[:200]
+            })
+
+    def _resolve_devices(self, session, phone_numbers):
+        """
+        Resuelve números de SIM a dispositivos con una sola consulta
+
+        Returns:
+            dict: phone_number -> (id, name)
+        """
+        if self.device_index is not None:
+            return {phone: self.device_index.resolve(phone) for phone in phone_numbers}
+        
+        model = self.gps_device_model
+        rows = session.execute(
+            select(model.id, model.name, model.placa_gps, model.device_id).where(
+                or_(model.placa_gps.in_(phone_numbers), model.device_id.in_(phone_numbers))
+            )
+        ).all()
+
+        by_placa = {row.placa_gps: (row.id, row.name) for row in rows if row.placa_gps}
+        by_device_id = {row.device_id: (row.id, row.name) for row in rows}
+        # placa_gps tiene prioridad sobre device_id (igual que process_sms)
+        return {
+            phone: by_placa.get(phone) or by_device_id.get(phone)
+            for phone in phone_numbers
+        }
+
+    def _last_positions(self, session, device_pks):
+        """
+        Última posición guardada de cada vehículo del lote (para la banda muerta
+        y para avisar por SSE a quien lo veía en su región)
+
+        Returns:
+            dict: id -> [latitude, longitude, last_update]
+        """
+        model = self.gps_device_model
+        rows = session.execute(
+            select(model.id, model.latitude, model.longitude, model.last_update).where(model.id.in_(device_pks))
+        ).all()
+        return {row.id: [row.latitude, row.longitude, row.last_update] for row in rows}
+
+    def _apply_batch(self, batch):
+        """
+        Aplica un lote de fixes en una sola transacción
+
+        Solo escribe en la base; lo que depende del commit (estado en memoria,
+        caché, reply_tracker, eventos en vivo) lo hace _after_commit, para que
+        un error ahí no haga reintentar un lote ya guardado.
+
+        Returns:
+            dict: Lo confirmado en la transacción, para _after_commit
+        """
+        model = self.gps_device_model
+
+        session = self.session_factory()
+        started = time.perf_counter()
+        try:
+            devices = self._resolve_devices(session, list({p['phone_number'] for p in batch}))
+            positions = {}
+            if self.deadband is not None or self.broker is not None:
+                positions = self._last_positions(session, list({d[0] for d in devices.values() if d}))
+            previous = {device_pk: (position[0], position[1]) for device_pk, position in positions.items()}
+
+            latest = {}
+            history_rows = []
+            geofence_events = []
+            not_found = 0
+            suppressed = 0
+            # Estado de la banda muerta y de las geocercas: se aplica solo tras el commit
+            deadband_pending = self.deadband.new_pending() if self.deadband is not None else None
+            geofence_pending = {}
+            for parsed in batch:
+                device = devices.get(parsed['phone_number'])
+                if not device:
+                    not_found += 1
+                    print(f"  ⚠ Vehículo con SIM {parsed['phone_number']} no encontrado")
+                    continue
+                device_pk = device[0]
+                position = positions.get(device_pk) if self.deadband is not None else None
+                if position is not None:
+                    store, close_stop = self.deadband.check(
+                        device_pk, position[0], position[1], parsed['latitude'], parsed['longitude'],
+                        pending=deadband_pending
+                    )
+                    if close_stop and position[2] is not None:
+                        # Cerrar la parada con la hora del último fix descartado
+                        history_rows.append({
+                            'device_id': device_pk,
+                            'latitude': position[0],
+                            'longitude': position[1],
+                            'timestamp': position[2]
+                        })
+                    position[2] = parsed['received_at']
+                    if not store:
+                        # Dentro de la banda muerta: solo se renueva last_update
+                        suppressed += 1
+                        latest[device_pk] = {
+                            'id': device_pk,
+                            'latitude': position[0],
+                            'longitude': position[1],
+                            'quadkey': quadkey(position[0], position[1]),
+                            'last_update': parsed['received_at']
+                        }
+                        continue
+                    position[0], position[1] = parsed['latitude'], parsed['longitude']
+                # Si llegan varios fixes del mismo vehículo, gps_devices guarda el último
+                latest[device_pk] = {
+                    'id': device_pk,
+                    'latitude': parsed['latitude'],
+                    'longitude': parsed['longitude'],
+                    'quadkey': quadkey(parsed['latitude'], parsed['longitude']),
+                    'last_update': parsed['received_at']
+                }
+                history_rows.append({
+                    'device_id': device_pk,
+                    'latitude': parsed['latitude'],
+                    'longitude': parsed['longitude'],
+                    'timestamp': parsed['received_at']
+                })
+                # Cada fix del lote en orden, para no perder un cruce intermedio
+                if self.geofences is not None:
+                    geofence_events.extend(self.geofences.evaluate(
+                        device_pk, parsed['latitude'], parsed['longitude'], parsed['received_at'],
+                        pending=geofence_pending
+                    ))
+
+            # Crear particiones antes de la primera escritura: en SQLite el CREATE TABLE usa
+            # otra conexión. Incluye las paradas cerradas, que pueden ser de un mes anterior
+            if self.history is not None:
+                months = {self.history.partition_name(row['timestamp']): row['timestamp'] for row in history_rows}
+                for timestamp in months.values():
+                    self.history.ensure_partition(timestamp)
+
+            if latest:
+                # Todo el lote comparte una revisión (el UPDATE masivo no pasa por before_flush)
+                revision = next_revision(session)
+                for values in latest.values():
+                    values['revision'] = revision
+                session.execute(update(model), list(latest.values()))
+            if history_rows and self.history is not None:
+                self.history.append_many(session, history_rows)
+            if geofence_events:
+                self.geofences.append_events(session, geofence_events)
+
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        return {
+            'latest': latest,
+            'previous': previous,
+            'geofence_events': geofence_events,
+            'deadband_pending': deadband_pending,
+            'geofence_pending': geofence_pending,
+            'applied': len(history_rows),
+            'suppressed': suppressed,
+            'not_found': not_found,
+            'commit_ms': (time.perf_counter() - started) * 1000
+        }
+
+    def _after_commit(self, committed):
+        """
+        Aplica lo que depende de un lote ya confirmado
+
+        Un error aquí se registra y no se propaga: el lote no se vuelve a
+        aplicar (duplicaría historial y eventos) ni se libera su clave de
+        deduplicación.
+        """
+        latest = committed['latest']
+        geofence_events = committed['geofence_events']
+        commit_ms = committed['commit_ms']
+        with self._lock:
+            m = self.metrics
+            m['applied'] += committed['applied']
+            m['suppressed'] += committed['suppressed']
+            m['not_found'] += committed['not_found']
+            m['last_commit_ms'] = round(commit_ms, 3)
+            m['avg_commit_ms'] = round(commit_ms if m['avg_commit_ms'] is None else 0.9 * m['avg_commit_ms'] + 0.1 * commit_ms, 3)
+            m['max_commit_ms'] = round(max(m['max_commit_ms'] or 0, commit_ms), 3)
+            m['last_commit_time'] = datetime.utcnow()
+
+        try:
+            if committed['deadband_pending'] is not None:
+                self.deadband.commit(committed['deadband_pending'])
+            if self.geofences is not None:
+                self.geofences.commit_state(committed['geofence_pending'])
+
+            # El UPDATE masivo no pasa por los eventos de la sesión
+            if self.devices_cache is not None and latest:
+                self.devices_cache.invalidate()
+            # Cerrar las solicitudes URL# pendientes de los vehículos que respondieron
+            reply_tracker.record_replies(latest.keys())
+            if self.broker is not None and latest:
+                self.broker.publish_fixes(list(latest.values()), previous=committed['previous'])
+            if self.broker is not None and geofence_events:
+                self.broker.publish_geofence_events(geofence_events)
+        except Exception as e:
+            with self._lock:
+                self.metrics['side_effect_errors'] += 1
+            print(f"  ⚠ Lote de SMS guardado, pero falló una actualización posterior al commit: {e}")
+
+    def get_metrics(self):
+        """
+        Obtiene las métricas de la cola de ingesta
+        """
+        with self._lock:
+            metrics = dict(self.metrics)
+            metrics['failed_fixes'] = list(self.failed_fixes)[-20:]
+        metrics['queue_depth'] = self.queue.qsize()
+        metrics['is_running'] = self.is_running
+        metrics['max_batch_size'] = self.max_batch_size
+        metrics['max_batch_wait_ms'] = int(self.max_batch_wait * 1000)
+        metrics['avg_batch_size'] = round(metrics['dequeued'] / metrics['batches'], 2) if metrics['batches'] else None
+        metrics['last_commit_time'] = metrics['last_commit_time'].isoformat() if metrics['last_commit_time'] else None
+        return metrics
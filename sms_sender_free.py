@@ -8,8 +8,10 @@ Módulo para enviar SMS usando:
    - Otras apps SMS Gateway similares
 3. SMSMobileAPI (API en la nube - solo saldo local)
 4. MessageBird (servicio de pago - confiable, sin prefijo)
-5. Sinch SMS (servicio de pago - confiable)
-6. Twilio (como respaldo)
+
+Cada canal Android (SMSMobileAPI, MessageBird, gateway, ADB) se envía por
+separado con send_via: sms_dispatcher los registra como proveedores propios
+del ProviderRouter. Sinch, Vonage y Twilio se envían desde sms_dispatcher.
 """
 import os
 import serial
@@ -17,8 +19,19 @@ import serial.tools.list_ports
 import subprocess
 import json
 import time
+import threading
 import requests
+from datetime import datetime
 from typing import Optional, Dict
+from rate_limit import get_limiter
+from http_pool import get_session, get_timeout
+from gsm_modem import ATError
+from modem_pool import ModemPool
+
+# Canales del lado Android, en orden de preferencia (cada uno es un proveedor del router)
+ANDROID_CHANNELS = ('smsmobileapi', 'messagebird', 'android_gateway', 'android_adb')
+# MessageBird: 25 = "Not enough balance" (sin saldo en la cuenta)
+MESSAGEBIRD_QUOTA_CODES = {25}
 
 class FreeSMSSender:
     """
@@ -32,17 +45,19 @@ class FreeSMSSender:
         """
         self.method = method
         self.gsm_port = None
-        self.gsm_serial = None
+        # Todos los módems detectados (o GSM_MODEM_PORTS separados por coma)
+        self.gsm_ports = [p.strip() for p in os.getenv('GSM_MODEM_PORTS', '').split(',') if p.strip()]
+        self.modem_pool = None
+        # Recepción de SMS por el módem (AT+CNMI): callback on_sms(texto, número)
+        self.inbound_handler = None
+        # Serializa la apertura del puerto serie (envíos y chequeos de salud)
+        self._modem_lock = threading.Lock()
         self.android_available = False
+        self.adb_available = False
         self.android_gateway_url = os.getenv('ANDROID_SMS_GATEWAY_URL', '')
         self.android_gateway_token = os.getenv('ANDROID_SMS_GATEWAY_TOKEN', '')
         # API Key para SMSMobileAPI (api.smsmobileapi.com)
         self.smsmobileapi_key = os.getenv('SMSMOBILEAPI_KEY', '')
-        # Credenciales para Sinch SMS
-        self.sinch_service_plan_id = os.getenv('SINCH_SERVICE_PLAN_ID', '')
-        self.sinch_api_token = os.getenv('SINCH_API_TOKEN', '')
-        self.sinch_api_url = os.getenv('SINCH_API_URL', 'https://us.sms.api.sinch.com/xms/v1')
-        self.sinch_from_number = os.getenv('SINCH_FROM_NUMBER', '447418631073')
         # Credenciales para MessageBird
         self.messagebird_api_key = os.getenv('MESSAGEBIRD_API_KEY', '').strip()
         self.messagebird_originator = os.getenv('MESSAGEBIRD_ORIGINATOR', 'MessageBird')
@@ -66,8 +81,6 @@ class FreeSMSSender:
                     print("✓ SMSMobileAPI detectado (método preferido - sin prefijo)")
                 elif self.messagebird_api_key:
                     print("✓ MessageBird detectado (método preferido - sin prefijo)")
-                elif self.sinch_service_plan_id:
-                    print("✓ Sinch SMS detectado (método preferido - sin prefijo)")
             # Prioridad 2: Módem GSM
             elif self._detect_gsm_modem():
                 self.method = 'gsm_modem'
@@ -82,15 +95,22 @@ class FreeSMSSender:
     
     def _detect_gsm_modem(self) -> bool:
         """
-        Detecta si hay un módem GSM conectado
+        Detecta los módems GSM conectados (todos, para repartir los envíos)
         """
+        if self.gsm_ports:
+            self.gsm_port = self.gsm_ports[0]
+            return True
         try:
             ports = serial.tools.list_ports.comports()
             for port in ports:
                 # Buscar módems GSM comunes (Huawei, ZTE, etc.)
                 if any(brand in port.description.lower() for brand in ['huawei', 'zte', 'gsm', 'modem', '3g', '4g']):
-                    self.gsm_port = port.device
-                    return True
+                    self.gsm_ports.append(port.device)
+            if self.gsm_ports:
+                self.gsm_port = self.gsm_ports[0]
+                if len(self.gsm_ports) > 1:
+                    print(f"✓ {len(self.gsm_ports)} puertos de módem GSM: {', '.join(self.gsm_ports)}")
+                return True
             return False
         except Exception as e:
             print(f"Error detectando módem GSM: {e}")
@@ -114,12 +134,6 @@ class FreeSMSSender:
             self.android_available = True
             return True
         
-        # Verificar Sinch SMS
-        if self.sinch_service_plan_id and self.sinch_api_token:
-            print(f"✓ Sinch SMS detectado con Service Plan ID: {self.sinch_service_plan_id[:20]}...")
-            self.android_available = True
-            return True
-        
         # Verificar gateway local (SMS Gateway app de Mattia A. u otras apps similares)
         if self.android_gateway_url:
             print(f"✓ Android SMS Gateway URL configurada: {self.android_gateway_url}")
@@ -143,6 +157,7 @@ class FreeSMSSender:
                                   timeout=5)
             if result.returncode == 0 and 'device' in result.stdout:
                 self.android_available = True
+                self.adb_available = True
                 return True
             return False
         except (subprocess.TimeoutExpired, FileNotFoundError):
@@ -153,82 +168,69 @@ class FreeSMSSender:
     
     def _init_gsm_modem(self) -> bool:
         """
-        Inicializa el módem GSM
+        Inicializa el pool de módems GSM (abre los puertos y los configura en modo texto)
         """
-        if not self.gsm_port:
+        if not self.gsm_ports and self.gsm_port:
+            self.gsm_ports = [self.gsm_port]
+        if not self.gsm_ports:
             return False
         
-        try:
-            self.gsm_serial = serial.Serial(
-                port=self.gsm_port,
-                baudrate=9600,
-                timeout=5,
-                bytesize=serial.EIGHTBITS,
-                parity=serial.PARITY_NONE,
-                stopbits=serial.STOPBITS_ONE
-            )
-            
-            # Esperar a que el módem esté listo
-            time.sleep(2)
-            
-            # Verificar que el módem responda
-            self.gsm_serial.write(b'AT\r\n')
-            time.sleep(0.5)
-            response = self.gsm_serial.read(100).decode('utf-8', errors='ignore')
-            
-            if 'OK' in response:
-                # Configurar modo texto
-                self.gsm_serial.write(b'AT+CMGF=1\r\n')
-                time.sleep(0.5)
-                self.gsm_serial.read(100)
-                return True
-            
-            return False
-        except Exception as e:
-            print(f"Error inicializando módem GSM: {e}")
-            return False
+        if self.modem_pool is None:
+            self.modem_pool = ModemPool(self.gsm_ports, baudrate=9600)
+            if self.inbound_handler:
+                self.modem_pool.set_inbound_handler(self.inbound_handler)
+        opened = self.modem_pool.open()
+        if opened == 0:
+            print("Error inicializando módem GSM: ningún puerto respondió")
+        return opened > 0
+    
+    def set_inbound_handler(self, handler):
+        """
+        Define el callback para los SMS que lleguen a los módems
+
+        Args:
+            handler: Función handler(sms_text, phone_number)
+        """
+        self.inbound_handler = handler
+        if self.modem_pool:
+            self.modem_pool.set_inbound_handler(handler)
     
     def _send_sms_gsm_modem(self, phone_number: str, message: str) -> Dict:
         """
-        Envía SMS usando módem GSM
+        Envía SMS usando el módem GSM menos cargado del pool
         """
-        if not self.gsm_serial:
-            if not self._init_gsm_modem():
-                return {
-                    'success': False,
-                    'error': 'No se pudo inicializar el módem GSM'
-                }
+        with self._modem_lock:
+            # Solo se abre el pool la primera vez; después, los módems expulsados
+            # se reabren desde pool.send_sms cuando vence su espera (sin bloquear
+            # aquí a los demás envíos) y, si no queda ninguno, falla de inmediato
+            if self.modem_pool is None:
+                if not self._init_gsm_modem() and self.modem_pool is None:
+                    return {
+                        'success': False,
+                        'error': 'No se pudo inicializar el módem GSM'
+                    }
+            pool = self.modem_pool
         
         try:
             # Formatear número (remover + y espacios)
             phone = phone_number.replace('+', '').replace(' ', '').replace('-', '')
             
-            # Enviar comando AT para enviar SMS
-            cmd = f'AT+CMGS="{phone}"\r\n'
-            self.gsm_serial.write(cmd.encode())
-            time.sleep(0.5)
-            
-            # Enviar mensaje
-            self.gsm_serial.write(message.encode())
-            self.gsm_serial.write(b'\x1A')  # Ctrl+Z para enviar
-            time.sleep(2)
-            
-            # Leer respuesta
-            response = self.gsm_serial.read(500).decode('utf-8', errors='ignore')
-            
-            if 'OK' in response or '+CMGS' in response:
-                return {
-                    'success': True,
-                    'method': 'gsm_modem',
-                    'to': phone_number,
-                    'message': 'SMS enviado exitosamente'
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': f'Error del módem: {response}',
-                    'method': 'gsm_modem'
-                }
+            # AT+CMGS -> prompt '>' -> texto + Ctrl+Z -> +CMGS: <ref> / OK
+            result = pool.send_sms(phone, message)
+            return {
+                'success': True,
+                'method': 'gsm_modem',
+                'to': phone_number,
+                'message': 'SMS enviado exitosamente',
+                'modem_port': result['port'],
+                'message_reference': result['message_reference']
+            }
+        except ATError as e:
+            return {
+                'success': False,
+                'error': f'Error del módem: {e.result}',
+                'method': 'gsm_modem'
+            }
         except Exception as e:
             return {
                 'success': False,
@@ -236,400 +238,247 @@ class FreeSMSSender:
                 'method': 'gsm_modem'
             }
     
-    def _send_sms_android_phone(self, phone_number: str, message: str) -> Dict:
+    def android_channels(self) -> list:
         """
-        Envía SMS usando teléfono Android o servicios de SMS
-        Método 1 (preferido): SMSMobileAPI - API en la nube (completamente automático, solo saldo local)
-        Método 2: MessageBird - Servicio de pago (confiable, sin prefijo)
-        Método 3: Sinch SMS - Servicio de pago (confiable, sin prefijo)
-        Método 4: SMS Gateway API local - completamente automático
-        Método 5 (respaldo): ADB - abre app de SMS (semi-automático)
+        Canales del lado Android configurados, en el orden de preferencia
+
+        Cada uno se registra como un proveedor propio en el ProviderRouter
+        (sms_dispatcher), con su costo, su breaker y su cupo.
         """
-        # Formatear número (remover + y espacios)
-        phone = phone_number.replace('+', '').replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-        
-        # MÉTODO 1: SMSMobileAPI (API en la nube - completamente automático)
+        channels = []  # mismo orden que ANDROID_CHANNELS
         if self.smsmobileapi_key:
-            try:
-                # URL de la API de SMSMobileAPI
-                url = "https://api.smsmobileapi.com/sendsms/"
-                
-                # Formatear número: remover + y espacios, solo números
-                phone_clean = phone.replace('+', '').replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-                
-                # Parámetros GET
-                params = {
-                    'recipients': phone_clean,
-                    'message': message,
-                    'apikey': self.smsmobileapi_key
-                }
-                
-                # Enviar solicitud
-                response = requests.get(url, params=params, timeout=15)
-                
-                if response.status_code == 200:
-                    result_data = response.json()
-                    # Verificar respuesta
-                    if result_data.get('result', {}).get('error') == 0:
-                        return {
-                            'success': True,
-                            'method': 'smsmobileapi',
-                            'to': phone_number,
-                            'message': 'SMS enviado exitosamente vía SMSMobileAPI',
-                            'gateway_response': result_data
-                        }
-                    else:
-                        # Error en SMSMobileAPI, continuar con otros métodos
-                        error_code = result_data.get('result', {}).get('error', 'Error desconocido')
-                        error_text = result_data.get('result', {}).get('error-text', '')
-                        print(f"⚠ SMSMobileAPI falló (código {error_code}): {error_text}, intentando MessageBird/Sinch...")
-                        import sys
-                        sys.stdout.flush()  # Forzar que se muestre el mensaje
-                else:
-                    print(f"⚠ SMSMobileAPI falló (HTTP {response.status_code}): {response.text}, intentando MessageBird/Sinch...")
-                    import sys
-                    sys.stdout.flush()  # Forzar que se muestre el mensaje
-            except Exception as e:
-                print(f"⚠ Error con SMSMobileAPI: {e}, intentando otros métodos...")
-                import traceback
-                print(traceback.format_exc())
-        
-        # MÉTODO 2: MessageBird (servicio de pago - confiable, sin prefijo)
+            channels.append('smsmobileapi')
         if self.messagebird_api_key:
-            # Log para diagnóstico (se verá en app.py)
-            api_key_preview = self.messagebird_api_key[:20] if len(self.messagebird_api_key) > 20 else self.messagebird_api_key
-            print(f"🔄 Intentando MessageBird:")
-            print(f"   - API Key (primeros 20): {api_key_preview}...")
-            print(f"   - API Key (longitud): {len(self.messagebird_api_key)} caracteres")
-            print(f"   - API Key (últimos 10): ...{self.messagebird_api_key[-10:]}")
-            print(f"   - API Key (valor completo): '{self.messagebird_api_key}'")
-            import sys
-            sys.stdout.flush()
-            try:
-                # Limpiar API Key (eliminar espacios al inicio/final)
-                api_key_clean = self.messagebird_api_key.strip()
-                print(f"   - API Key después de strip: '{api_key_clean}' (longitud: {len(api_key_clean)})")
-                sys.stdout.flush()
-                
-                # URL de la API de MessageBird
-                url = "https://rest.messagebird.com/messages"
-                
-                # Formatear número: MessageBird requiere formato internacional con +
-                phone_clean = phone_number if phone_number.startswith('+') else f'+{phone_number}'
-                
-                # Headers
-                headers = {
-                    'Authorization': f'AccessKey {api_key_clean}',
-                    'Content-Type': 'application/json'
-                }
-                
-                # Body
-                data = {
-                    'originator': self.messagebird_originator,
-                    'recipients': [phone_clean],
-                    'body': message
-                }
-                
-                print(f"🔄 Enviando SMS vía MessageBird:")
-                print(f"   - URL: {url}")
-                print(f"   - Destino: {phone_clean}")
-                print(f"   - Originator: {self.messagebird_originator}")
-                print(f"   - API Key (primeros 20 chars): {api_key_clean[:20]}...")
-                print(f"   - API Key (longitud): {len(api_key_clean)} caracteres")
-                sys.stdout.flush()
-                
-                # Enviar solicitud
-                response = requests.post(url, json=data, headers=headers, timeout=15)
-                
-                print(f"🔄 Respuesta de MessageBird: Status={response.status_code}, Body={response.text[:200]}")
-                sys.stdout.flush()
-                
-                if response.status_code == 201:  # 201 Created for MessageBird
-                    result_data = response.json()
-                    print(f"✅ MessageBird exitoso!")
-                    sys.stdout.flush()
-                    return {
-                        'success': True,
-                        'method': 'messagebird',
-                        'to': phone_number,
-                        'message': 'SMS enviado exitosamente vía MessageBird',
-                        'gateway_response': result_data
-                    }
-                else:
-                    # Error en MessageBird, continuar con otros métodos
-                    error_text = response.text
-                    try:
-                        error_data = response.json()
-                        error_msg = error_data.get('errors', [{}])[0].get('description', error_text)
-                        error_code = error_data.get('errors', [{}])[0].get('code', 'unknown')
-                        print(f"⚠ MessageBird falló (HTTP {response.status_code}, código: {error_code}): {error_msg}")
-                    except:
-                        error_msg = error_text
-                        print(f"⚠ MessageBird falló (HTTP {response.status_code}): {error_msg}")
-                    print(f"⚠ Respuesta completa de MessageBird: {response.text}")
-                    print(f"⚠ Intentando Sinch...")
-                    sys.stdout.flush()
-            except Exception as e:
-                print(f"⚠ Error con MessageBird: {e}, intentando otros métodos...")
-                import traceback
-                print(traceback.format_exc())
-                sys.stdout.flush()
-        else:
-            print(f"⚠ MessageBird no configurado (MESSAGEBIRD_API_KEY vacía)")
-            import sys
-            sys.stdout.flush()
+            channels.append('messagebird')
+        if self.android_gateway_url:
+            channels.append('android_gateway')
+        if self.adb_available:
+            channels.append('android_adb')
+        return channels
+    
+    def send_via(self, channel: str, phone_number: str, message: str) -> Dict:
+        """
+        Envía un SMS por un canal Android concreto (sin pasar a los demás si falla)
         
-        # MÉTODO 3: Sinch SMS (servicio de pago - confiable)
-        if self.sinch_service_plan_id and self.sinch_api_token:
-            try:
-                # URL completa de Sinch API
-                url = f"{self.sinch_api_url}/{self.sinch_service_plan_id}/batches"
-                
-                # Formatear número: remover + y espacios, solo números
-                phone_clean = phone.replace('+', '').replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-                
-                # Headers
-                headers = {
-                    'Authorization': f'Bearer {self.sinch_api_token}',
-                    'Content-Type': 'application/json'
-                }
-                
-                # Body
-                data = {
-                    'from': self.sinch_from_number,
-                    'to': [phone_clean],
-                    'body': message
+        Args:
+            channel: 'smsmobileapi', 'messagebird', 'android_gateway' o 'android_adb'
+        
+        Returns:
+            dict: success y, si falla, error (y quota_exceeded=True si el canal rechazó por cupo)
+        """
+        senders = {
+            'smsmobileapi': self._send_smsmobileapi,
+            'messagebird': self._send_messagebird,
+            'android_gateway': self._send_android_gateway,
+            'android_adb': self._send_android_adb,
+        }
+        if channel not in senders:
+            return {'success': False, 'error': f'Canal {channel} no disponible', 'method': channel}
+        return senders[channel](phone_number, message)
+    
+    def _send_smsmobileapi(self, phone_number: str, message: str) -> Dict:
+        """
+        SMSMobileAPI - API en la nube que envía desde el teléfono (solo saldo local)
+        """
+        phone_clean = phone_number.replace('+', '').replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+        params = {
+            'recipients': phone_clean,
+            'message': message,
+            'apikey': self.smsmobileapi_key
+        }
+        
+        with get_limiter('smsmobileapi'):
+            response = get_session('smsmobileapi').get(
+                'https://api.smsmobileapi.com/sendsms/', params=params, timeout=get_timeout('smsmobileapi')
+            )
+        
+        if response.status_code == 200:
+            result_data = response.json()
+            if result_data.get('result', {}).get('error') == 0:
+                return {
+                    'success': True,
+                    'method': 'smsmobileapi',
+                    'to': phone_number,
+                    'message': 'SMS enviado exitosamente vía SMSMobileAPI',
+                    'gateway_response': result_data
                 }
-                
-                # Enviar solicitud
-                response = requests.post(url, json=data, headers=headers, timeout=15)
-                
-                if response.status_code == 200 or response.status_code == 201:
-                    result_data = response.json()
-                    return {
-                        'success': True,
-                        'method': 'sinch',
-                        'to': phone_number,
-                        'message': 'SMS enviado exitosamente vía Sinch',
-                        'gateway_response': result_data
-                    }
-                else:
-                    # Error en Sinch, continuar con otros métodos
-                    error_text = response.text
-                    print(f"⚠ Sinch falló (HTTP {response.status_code}): {error_text}, intentando otros métodos...")
-            except Exception as e:
-                print(f"⚠ Error con Sinch: {e}, intentando otros métodos...")
-                import traceback
-                print(traceback.format_exc())
+            error_code = result_data.get('result', {}).get('error', 'Error desconocido')
+            error_text = result_data.get('result', {}).get('error-text', '')
+            return {
+                'success': False,
+                'method': 'smsmobileapi',
+                'error': f'SMSMobileAPI código {error_code}: {error_text}'
+            }
+        return {
+            'success': False,
+            'method': 'smsmobileapi',
+            'error': f'HTTP {response.status_code}: {response.text[:200]}',
+            'quota_exceeded': response.status_code == 429
+        }
+    
+    def _send_messagebird(self, phone_number: str, message: str) -> Dict:
+        """
+        MessageBird - servicio de pago (confiable, sin prefijo)
+        """
+        # MessageBird requiere formato internacional con +
+        phone_clean = phone_number if phone_number.startswith('+') else f'+{phone_number}'
+        headers = {
+            'Authorization': f'AccessKey {self.messagebird_api_key}',
+            'Content-Type': 'application/json'
+        }
+        data = {
+            'originator': self.messagebird_originator,
+            'recipients': [phone_clean],
+            'body': message
+        }
         
-        # MÉTODO 3: SMS Gateway API local (completamente automático)
-        # Soporta Traccar SMS Gateway y otros gateways locales
-        # MÉTODO 4: Android SMS Gateway App (SMS Gateway de Mattia A. u otras apps similares)
-        if self.android_gateway_url:
+        with get_limiter('messagebird'):
+            response = get_session('messagebird').post(
+                'https://rest.messagebird.com/messages', json=data, headers=headers, timeout=get_timeout('messagebird')
+            )
+        
+        if response.status_code == 201:  # 201 Created for MessageBird
+            return {
+                'success': True,
+                'method': 'messagebird',
+                'to': phone_number,
+                'message': 'SMS enviado exitosamente vía MessageBird',
+                'gateway_response': response.json()
+            }
+        
+        error_msg = response.text[:200]
+        error_code = None
+        try:
+            error = response.json().get('errors', [{}])[0]
+            error_msg = error.get('description', error_msg)
+            error_code = error.get('code')
+        except ValueError:
+            pass
+        return {
+            'success': False,
+            'method': 'messagebird',
+            'error': f'HTTP {response.status_code} (código {error_code}): {error_msg}',
+            'quota_exceeded': response.status_code == 429 or error_code in MESSAGEBIRD_QUOTA_CODES
+        }
+    
+    def _post_android_gateway(self, url, data, headers):
+        with get_limiter('android_gateway'):
+            return get_session('android_gateway').post(url, json=data, headers=headers, timeout=get_timeout('android_gateway'))
+    
+    def _send_android_gateway(self, phone_number: str, message: str) -> Dict:
+        """
+        App SMS Gateway en el teléfono (Simple SMS Gateway, Traccar u otras similares)
+        """
+        phone_clean = phone_number.replace('+', '').replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+        base_url = self.android_gateway_url.rstrip('/')
+        headers = {'Content-Type': 'application/json'}
+        
+        if 'traccar' in base_url.lower():
+            # Formato Traccar SMS Gateway
+            if self.android_gateway_token:
+                headers['X-Traccar-Token'] = self.android_gateway_token
+            response = self._post_android_gateway(
+                f"{base_url}/api/sms/send", {'phone': phone_clean, 'message': message}, headers
+            )
+        else:
+            # Simple SMS Gateway: POST /send-sms con JSON {"phone": "...", "message": "..."}
+            simple_sms_url = base_url if '/send-sms' in base_url else f"{base_url}/send-sms"
             try:
-                print(f"🔄 Intentando Android SMS Gateway: {self.android_gateway_url}")
-                import sys
-                sys.stdout.flush()
-                
-                # Formatear número: remover + y espacios para la app
-                phone_clean = phone_number.replace('+', '').replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-                
-                # Intentar formato Traccar SMS Gateway primero
-                if 'traccar' in self.android_gateway_url.lower():
-                    # Formato Traccar SMS Gateway
-                    url = f"{self.android_gateway_url.rstrip('/')}/api/sms/send"
-                    headers = {
-                        'Content-Type': 'application/json'
-                    }
-                    if self.android_gateway_token:
-                        headers['X-Traccar-Token'] = self.android_gateway_token
-                    
-                    data = {
-                        'phone': phone_clean,
-                        'message': message
-                    }
-                    
-                    print(f"   - Formato: Traccar SMS Gateway")
-                    print(f"   - URL: {url}")
-                    print(f"   - Destino: {phone_clean}")
-                    sys.stdout.flush()
-                    
-                    response = requests.post(url, json=data, headers=headers, timeout=15)
-                else:
-                    # SIMPLE SMS GATEWAY - Formato específico y optimizado
-                    # Simple SMS Gateway usa: POST /send-sms con JSON {"phone": "...", "message": "..."}
-                    base_url = self.android_gateway_url.rstrip('/')
-                    
-                    # Construir URL específica de Simple SMS Gateway
-                    if '/send-sms' in base_url:
-                        simple_sms_url = base_url
-                    else:
-                        simple_sms_url = f"{base_url}/send-sms"
-                    
-                    # Formato específico de Simple SMS Gateway
-                    simple_sms_data = {
-                        'phone': phone_clean,
-                        'message': message
-                    }
-                    
-                    # Simple SMS Gateway NO requiere token
-                    print(f"   - Formato: Simple SMS Gateway (específico)")
-                    print(f"   - URL: {simple_sms_url}")
-                    print(f"   - Destino: {phone_clean}")
-                    print(f"   - Método: POST con JSON")
-                    sys.stdout.flush()
-                    
-                    # Intentar Simple SMS Gateway primero (formato específico)
-                    headers = {'Content-Type': 'application/json'}
-                    print(f"   - Probando Simple SMS Gateway: POST {simple_sms_url}")
-                    sys.stdout.flush()
-                    
-                    try:
-                        response = requests.post(simple_sms_url, json=simple_sms_data, headers=headers, timeout=15)
-                        
+                response = self._post_android_gateway(simple_sms_url, {'phone': phone_clean, 'message': message}, headers)
+            except requests.exceptions.RequestException as e:
+                # Otras apps SMS Gateway usan otras rutas y nombres de campo
+                response = None
+                last_error = str(e)
+                for url in (f"{base_url}/send", f"{base_url}/api/send", f"{base_url}/sms/send"):
+                    for field in ('phone', 'number', 'to'):
+                        try:
+                            response = self._post_android_gateway(url, {field: phone_clean, 'message': message}, headers)
+                        except requests.exceptions.RequestException as backup_error:
+                            last_error = str(backup_error)
+                            continue
                         if response.status_code == 200:
-                            print(f"   - ✅ Éxito con Simple SMS Gateway!")
-                            sys.stdout.flush()
-                            # Éxito, continuar con el procesamiento de respuesta
-                        elif response.status_code in [404, 405]:
-                            # Si falla, intentar otros formatos como respaldo
-                            print(f"   - ⚠ Simple SMS Gateway falló (HTTP {response.status_code}), intentando otros formatos...")
-                            sys.stdout.flush()
-                            raise Exception(f"Simple SMS Gateway falló con HTTP {response.status_code}")
-                        else:
-                            print(f"   - ⚠ Simple SMS Gateway falló (HTTP {response.status_code}): {response.text[:200]}")
-                            sys.stdout.flush()
-                            raise Exception(f"Simple SMS Gateway falló con HTTP {response.status_code}")
-                    except requests.exceptions.RequestException as e:
-                        # Si Simple SMS Gateway falla por error de conexión, intentar otros formatos como respaldo
-                        print(f"   - ⚠ Error de conexión con Simple SMS Gateway: {e}, intentando otros formatos...")
-                        sys.stdout.flush()
-                        
-                        # Formato genérico para otras apps SMS Gateway (respaldo)
-                        param_variations = [
-                            {'phone': phone_clean, 'message': message},
-                            {'number': phone_clean, 'message': message},
-                            {'to': phone_clean, 'message': message},
-                        ]
-                        
-                        url_variations = [
-                            f"{base_url}/send",
-                            f"{base_url}/api/send",
-                            f"{base_url}/sms/send",
-                        ]
-                        
-                        success = False
-                        last_error = str(e)
-                        
-                        for url in url_variations:
-                            if success:
-                                break
-                                
-                            for params in param_variations:
-                                if success:
-                                    break
-                                
-                                try:
-                                    headers = {'Content-Type': 'application/json'}
-                                    print(f"   - Probando respaldo: POST {url} con params={list(params.keys())}")
-                                    sys.stdout.flush()
-                                    
-                                    response = requests.post(url, json=params, headers=headers, timeout=15)
-                                    
-                                    if response.status_code == 200:
-                                        print(f"   - ✅ Éxito con formato respaldo: {url}")
-                                        success = True
-                                        break
-                                except Exception as backup_error:
-                                    last_error = str(backup_error)
-                                    continue
-                        
-                        if not success:
-                            raise Exception(f"No se pudo conectar con Simple SMS Gateway ni otros formatos. Último error: {last_error}")
-                    
-                    sys.stdout.flush()
-                
-                print(f"   - Respuesta HTTP: {response.status_code}")
-                print(f"   - Respuesta: {response.text[:200]}")
-                sys.stdout.flush()
-                
-                if response.status_code == 200:
-                    try:
-                        result_data = response.json() if response.text else {}
-                    except:
-                        result_data = {'response': response.text}
-                    
-                    print(f"✅ Android SMS Gateway exitoso!")
-                    sys.stdout.flush()
+                            break
+                    if response is not None and response.status_code == 200:
+                        break
+                if response is None:
                     return {
-                        'success': True,
-                        'method': 'android_phone_gateway',
-                        'to': phone_number,
-                        'message': 'SMS enviado exitosamente vía Android SMS Gateway',
-                        'gateway_response': result_data
+                        'success': False,
+                        'method': 'android_gateway',
+                        'error': f'No se pudo conectar con el gateway Android: {last_error}'
                     }
-                else:
-                    error_msg = f"HTTP {response.status_code}: {response.text[:200]}"
-                    print(f"⚠ Android SMS Gateway falló: {error_msg}")
-                    sys.stdout.flush()
-            except Exception as e:
-                print(f"⚠ Error con Android SMS Gateway: {e}, intentando método ADB...")
-                import traceback
-                print(traceback.format_exc())
-                sys.stdout.flush()
         
-        # MÉTODO 3: ADB (semi-automático - abre app de SMS)
+        if response.status_code == 200:
+            try:
+                result_data = response.json() if response.text else {}
+            except ValueError:
+                result_data = {'response': response.text}
+            return {
+                'success': True,
+                'method': 'android_gateway',
+                'to': phone_number,
+                'message': 'SMS enviado exitosamente vía Android SMS Gateway',
+                'gateway_response': result_data
+            }
+        return {
+            'success': False,
+            'method': 'android_gateway',
+            'error': f'HTTP {response.status_code}: {response.text[:200]}',
+            'quota_exceeded': response.status_code == 429
+        }
+    
+    def _send_android_adb(self, phone_number: str, message: str) -> Dict:
+        """
+        ADB (semi-automático): abre la app de SMS del teléfono con el mensaje listo
+        """
+        phone = phone_number.replace('+', '').replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+        # Escapar comillas en el mensaje para el shell
+        escaped_message = message.replace('"', '\\"').replace("'", "\\'")
+        intent_cmd = [
+            'adb', 'shell', 'am', 'start',
+            '-a', 'android.intent.action.SENDTO',
+            '-d', f'sms:{phone}',
+            '--es', 'sms_body', escaped_message
+        ]
+        
         try:
-            # Escapar comillas en el mensaje para el shell
-            escaped_message = message.replace('"', '\\"').replace("'", "\\'")
-            
-            # Comando para abrir SMS con número y mensaje
-            intent_cmd = [
-                'adb', 'shell', 'am', 'start',
-                '-a', 'android.intent.action.SENDTO',
-                '-d', f'sms:{phone}',
-                '--es', 'sms_body', escaped_message
-            ]
-            
-            result = subprocess.run(intent_cmd, capture_output=True, text=True, timeout=10)
-            
-            if result.returncode == 0:
-                return {
-                    'success': True,
-                    'method': 'android_phone_adb',
-                    'to': phone_number,
-                    'message': 'SMS listo para enviar en el teléfono (toca enviar manualmente)',
-                    'note': 'Para envío automático, configura ANDROID_SMS_GATEWAY_URL'
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': f'No se pudo abrir SMS. Error: {result.stderr}',
-                    'method': 'android_phone',
-                    'suggestion': 'Configura ANDROID_SMS_GATEWAY_URL para envío automático o verifica ADB: adb devices'
-                }
+            with get_limiter('android_adb'):
+                result = subprocess.run(intent_cmd, capture_output=True, text=True, timeout=10)
         except FileNotFoundError:
             return {
                 'success': False,
                 'error': 'ADB no está instalado. Descarga desde: https://developer.android.com/studio/releases/platform-tools',
-                'method': 'android_phone',
+                'method': 'android_adb',
                 'suggestion': 'O configura ANDROID_SMS_GATEWAY_URL para envío automático sin ADB'
             }
-        except Exception as e:
+        
+        if result.returncode == 0:
             return {
-                'success': False,
-                'error': str(e),
-                'method': 'android_phone'
+                'success': True,
+                'method': 'android_adb',
+                'to': phone_number,
+                'message': 'SMS listo para enviar en el teléfono (toca enviar manualmente)',
+                'note': 'Para envío automático, configura ANDROID_SMS_GATEWAY_URL'
             }
+        return {
+            'success': False,
+            'error': f'No se pudo abrir SMS. Error: {result.stderr}',
+            'method': 'android_adb',
+            'suggestion': 'Configura ANDROID_SMS_GATEWAY_URL para envío automático o verifica ADB: adb devices'
+        }
     
     def send_sms(self, phone_number: str, message: str) -> Dict:
         """
         Envía un SMS usando el método configurado
         """
         if self.method == 'gsm_modem':
+            # El pool elige el módem y aplica el limitador de cada uno
             return self._send_sms_gsm_modem(phone_number, message)
         elif self.method == 'android_phone':
-            return self._send_sms_android_phone(phone_number, message)
+            # Sin cascada: el ProviderRouter pasa de un canal a otro con su propio breaker
+            channels = self.android_channels()
+            if not channels:
+                return {'success': False, 'error': 'No hay canal Android configurado'}
+            return self.send_via(channels[0], phone_number, message)
         else:
             return {
                 'success': False,
@@ -641,11 +490,59 @@ class FreeSMSSender:
         Verifica si el método de envío está disponible
         """
         if self.method == 'gsm_modem':
-            return self.gsm_port is not None
+            return bool(self.gsm_ports or self.gsm_port)
         elif self.method == 'android_phone':
             return self.android_available
         else:
             return False
+    
+    def check_health(self) -> Dict:
+        """
+        Comprueba que el método configurado pueda enviar en este momento
+        (abre el puerto del módem si aún no está abierto)
+        """
+        if self.method == 'gsm_modem':
+            with self._modem_lock:
+                if self.modem_pool is None:
+                    self._init_gsm_modem()
+                pool = self.modem_pool
+            if pool is None:
+                return {'ready': False, 'detail': 'No hay puertos de módem GSM'}
+            # AT en cada módem; los expulsados cuya espera venció se reabren
+            return pool.check_health()
+        
+        if self.method == 'android_phone':
+            # Servicios en la nube: basta con que estén configurados
+            if self.smsmobileapi_key or self.messagebird_api_key:
+                return {'ready': True, 'detail': 'API de SMS configurada'}
+            if self.android_gateway_url:
+                try:
+                    # Cualquier respuesta HTTP indica que la app del teléfono está escuchando
+                    get_session('android_gateway').get(self.android_gateway_url, timeout=(2, 3))
+                    return {'ready': True, 'detail': f'Gateway Android responde en {self.android_gateway_url}'}
+                except requests.exceptions.RequestException as e:
+                    return {'ready': False, 'detail': f'Gateway Android no responde: {e}'}
+            if self._detect_android_phone():
+                return {'ready': True, 'detail': 'Teléfono Android conectado por ADB'}
+            return {'ready': False, 'detail': 'Teléfono Android no conectado (ADB)'}
+        
+        return {'ready': False, 'detail': f'Método {self.method} no disponible'}
+    
+    def close(self):
+        """
+        Cierra los puertos de los módems si están abiertos
+        """
+        if self.modem_pool:
+            self.modem_pool.close()
+            self.modem_pool = None
+    
+    def get_modem_stats(self) -> Optional[Dict]:
+        """
+        Estado, contadores, driver AT y buzón de cada módem del pool (None si no hay módem)
+        """
+        if not self.modem_pool:
+            return None
+        return self.modem_pool.get_stats()
 
 
 # Función de conveniencia para usar desde otros módulos
@@ -659,6 +556,172 @@ def create_sms_sender(method='auto') -> Optional[FreeSMSSender]:
     return None
 
 
+class SMSSenderRegistry:
+    """
+    Senders de SMS gratis compartidos por todo el proceso (app y AutoUpdateService)
+
+    La autodetección (puertos serie, adb, variables de entorno) se hace una vez
+    por método; el puerto del módem queda abierto entre envíos. Un hilo en
+    segundo plano re-chequea la salud de cada sender cada `probe_interval`
+    segundos y re-detecta los que no estaban disponibles (módem conectado
+    después de arrancar, gateway que volvió), de modo que una solicitud de
+    ubicación solo gasta tiempo en el envío.
+    """
+    
+    def __init__(self, probe_interval=300):
+        """
+        Args:
+            probe_interval: Segundos entre chequeos de salud
+        """
+        self.probe_interval = probe_interval
+        self._senders = {}
+        self._health = {}
+        self._lock = threading.Lock()
+        # Un lock por método: la detección corre fuera de self._lock y sin repetirse
+        self._detect_locks = {}
+        self._wake = threading.Event()
+        self.inbound_handler = None
+        self.is_running = False
+        self.thread = None
+    
+    def set_inbound_handler(self, handler):
+        """
+        Callback para los SMS recibidos por el módem (se aplica a los senders actuales y futuros)
+        """
+        self.inbound_handler = handler
+        with self._lock:
+            senders = [sender for sender in self._senders.values() if sender]
+        for sender in senders:
+            sender.set_inbound_handler(handler)
+    
+    def _detect(self, method):
+        """
+        Ejecuta la autodetección de un método y deja el módem abierto
+        """
+        started = time.perf_counter()
+        sender = create_sms_sender(method=method)
+        if sender and self.inbound_handler:
+            sender.inbound_handler = self.inbound_handler
+        health = sender.check_health() if sender else {'ready': False, 'detail': 'No se detectó ningún método de SMS gratis'}
+        health['method'] = sender.method if sender else None
+        health['last_probe'] = datetime.utcnow().isoformat()
+        health['probe_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return sender, health
+    
+    def get_sender(self, method='auto') -> Optional[FreeSMSSender]:
+        """
+        Sender compartido del método, o None si no está listo
+
+        La primera llamada por método hace la detección; las siguientes solo
+        consultan el último chequeo de salud. La detección (adb, puertos serie)
+        no bloquea a los demás métodos ni a get_status: solo las llamadas
+        simultáneas del mismo método esperan su resultado.
+        """
+        with self._lock:
+            detect_lock = None if method in self._senders else self._detect_locks.setdefault(method, threading.Lock())
+
+        if detect_lock is not None:
+            with detect_lock:
+                with self._lock:
+                    detected = method in self._senders
+                if not detected:
+                    sender, health = self._detect(method)
+                    with self._lock:
+                        self._senders[method], self._health[method] = sender, health
+
+        with self._lock:
+            sender = self._senders[method]
+            ready = self._health[method]['ready']
+        return sender if sender and ready else None
+    
+    def probe(self):
+        """
+        Re-chequea la salud de todos los métodos usados hasta ahora
+        """
+        with self._lock:
+            methods = list(self._senders.keys())
+        
+        for method in methods:
+            with self._lock:
+                sender = self._senders.get(method)
+            
+            if sender is None:
+                # Fuera del lock: la detección puede tardar (adb, puertos serie)
+                sender, health = self._detect(method)
+            else:
+                started = time.perf_counter()
+                health = sender.check_health()
+                health['method'] = sender.method
+                health['last_probe'] = datetime.utcnow().isoformat()
+                health['probe_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            
+            with self._lock:
+                self._senders[method] = sender
+                self._health[method] = health
+            
+            if not health['ready']:
+                print(f"⚠ Sender de SMS '{method}' no disponible: {health['detail']}")
+    
+    def start(self):
+        """
+        Inicia el hilo de chequeo de salud (hace la detección inicial en segundo plano)
+        """
+        if self.is_running:
+            return
+        self.is_running = True
+        self.thread = threading.Thread(target=self._probe_loop, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """
+        Detiene el hilo de chequeo de salud
+        """
+        self.is_running = False
+        self._wake.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+    
+    def _probe_loop(self):
+        """
+        Loop del hilo de chequeo de salud
+        """
+        self.get_sender(os.getenv('SMS_METHOD', 'auto'))
+        while self.is_running:
+            self._wake.wait(self.probe_interval)
+            if not self.is_running:
+                break
+            try:
+                self.probe()
+            except Exception as e:
+                print(f"Error en chequeo de salud de SMS: {e}")
+    
+    def get_status(self):
+        """
+        Estado de preparación de cada método de SMS gratis
+        """
+        with self._lock:
+            status = {method: dict(health) for method, health in self._health.items()}
+            for method, sender in self._senders.items():
+                if sender and method in status:
+                    status[method]['modem'] = sender.get_modem_stats()
+        return {
+            'probe_interval_seconds': self.probe_interval,
+            'is_running': self.is_running,
+            'senders': status
+        }
+
+
+# Registro compartido del proceso
+sender_registry = SMSSenderRegistry(probe_interval=int(os.getenv('SMS_HEALTH_PROBE_SECONDS', '300')))
+
+
+def get_sms_sender(method='auto') -> Optional[FreeSMSSender]:
+    """
+    Obtiene el sender compartido listo para enviar (o None)
+    """
+    return sender_registry.get_sender(method)
+
+
 
 
 
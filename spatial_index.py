@@ -0,0 +1,256 @@
+"""
+Índice espacial de la flota por quadkey (teselas Web Mercator)
+Cada GPSDevice guarda en la columna quadkey (con índice B-tree) la tesela de
+nivel QUADKEY_LEVEL que contiene su posición. Los quadkeys de las teselas hijas
+empiezan con el de su tesela madre, así que una tesela de cualquier nivel es un
+rango contiguo de la columna: quadkey >= '0231' AND quadkey < '0232'.
+
+Una consulta por rectángulo (bbox del mapa) se cubre con unas pocas teselas,
+las teselas contiguas se unen en un mismo rango y el índice devuelve solo los
+vehículos de esos rangos; luego se filtra exacto por latitud/longitud.
+
+En zooms bajos los vehículos se agrupan en SQL por el prefijo del quadkey
+(celdas de unos 32 píxeles en pantalla) y se devuelven como
+clusters con su cantidad y su centro.
+
+La columna la mantienen el hook before_flush (add_device, update_device,
+process_sms) y la cola de ingesta en su UPDATE masivo.
+
+Variables de entorno:
+    SPATIAL_CLUSTER_MAX_ZOOM=<zoom>   (por defecto 13; en zooms mayores no se agrupa)
+"""
+import math
+import os
+from sqlalchemy import and_, case, event, func, or_, select  # pyright: ignore[reportMissingImports]
+
+# Nivel 20: teselas de ~38 m en el ecuador
+QUADKEY_LEVEL = 20
+MAX_LATITUDE = 85.05112878
+# Máximo de teselas con que se cubre un bbox (antes de unir las contiguas)
+MAX_COVER_TILES = 32
+# Las celdas de cluster son 2**3 veces más finas que las teselas del zoom (256 px / 8)
+CLUSTER_EXTRA_LEVELS = 3
+CLUSTER_MAX_ZOOM = int(os.getenv('SPATIAL_CLUSTER_MAX_ZOOM', '13'))
+
+
+def _tile_xy(lat, lon, level):
+    """
+    Coordenadas (x, y) de la tesela que contiene el punto en un nivel
+    """
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    n = 1 << level
+    x = int((lon + 180.0) / 360.0 * n)
+    sin_lat = math.sin(math.radians(lat))
+    y = int((0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def _tile_quadkey(x, y, level):
+    digits = []
+    for i in range(level, 0, -1):
+        mask = 1 << (i - 1)
+        digit = 0
+        if x & mask:
+            digit += 1
+        if y & mask:
+            digit += 2
+        digits.append(str(digit))
+    return ''.join(digits)
+
+
+def quadkey(lat, lon, level=QUADKEY_LEVEL):
+    """
+    Quadkey de la tesela que contiene el punto (None sin coordenadas)
+    """
+    if lat is None or lon is None:
+        return None
+    x, y = _tile_xy(lat, lon, level)
+    return _tile_quadkey(x, y, level)
+
+
+def _successor(prefix):
+    """
+    Primer quadkey del mismo largo posterior a prefix (None si prefix es '333...')
+    """
+    value = int(prefix, 4) + 1
+    if value >= 4 ** len(prefix):
+        return None
+    digits = []
+    for _ in range(len(prefix)):
+        value, digit = divmod(value, 4)
+        digits.append(str(digit))
+    return ''.join(reversed(digits))
+
+
+def parse_bbox(text):
+    """
+    Lee un bbox 'minLon,minLat,maxLon,maxLat'
+
+    Returns:
+        tuple: (min_lon, min_lat, max_lon, max_lat)
+
+    Raises:
+        ValueError: si el formato o los valores no son válidos
+    """
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in text.split(','))
+    except (AttributeError, ValueError):
+        raise ValueError('bbox debe ser minLon,minLat,maxLon,maxLat')
+    if not (-90 <= min_lat <= max_lat <= 90):
+        raise ValueError('Latitudes del bbox fuera de rango o invertidas')
+    if not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise ValueError('Longitudes del bbox fuera de rango')
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def _split_antimeridian(bbox):
+    # Un bbox con min_lon > max_lon cruza el meridiano 180
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lon <= max_lon:
+        return [bbox]
+    return [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)]
+
+
+def cover_ranges(bbox, max_tiles=MAX_COVER_TILES):
+    """
+    Rangos de quadkey [desde, hasta) que cubren un bbox
+
+    Se elige el nivel más fino con el que el bbox se cubre con max_tiles
+    teselas como mucho y se unen las teselas consecutivas en el orden Z.
+
+    Returns:
+        list: Tuplas (desde, hasta); hasta=None significa sin límite superior
+    """
+    prefixes = []
+    for min_lon, min_lat, max_lon, max_lat in _split_antimeridian(bbox):
+        level = QUADKEY_LEVEL
+        while True:
+            x0, y0 = _tile_xy(max_lat, min_lon, level)
+            x1, y1 = _tile_xy(min_lat, max_lon, level)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) <= max_tiles or level == 0:
+                break
+            level -= 1
+        if level == 0:
+            return [('', None)]
+        prefixes.extend(
+            _tile_quadkey(x, y, level)
+            for x in range(x0, x1 + 1)
+            for y in range(y0, y1 + 1)
+        )
+
+    ranges = []
+    for prefix in sorted(set(prefixes)):
+        if ranges and ranges[-1][1] == prefix:
+            ranges[-1] = (ranges[-1][0], _successor(prefix))
+        else:
+            ranges.append((prefix, _successor(prefix)))
+    return ranges
+
+
+def bbox_filter(model, bbox):
+    """
+    Condición SQL: rangos de quadkey (usan el índice) + filtro exacto por coordenadas
+    """
+    column = model.quadkey
+    ranges = [
+        column >= low if high is None else and_(column >= low, column < high)
+        for low, high in cover_ranges(bbox)
+    ]
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lon <= max_lon:
+        lon_filter = model.longitude.between(min_lon, max_lon)
+    else:
+        lon_filter = or_(model.longitude >= min_lon, model.longitude <= max_lon)
+    return and_(or_(*ranges), model.latitude.between(min_lat, max_lat), lon_filter)
+
+
+def cluster_level(zoom):
+    """
+    Largo del prefijo de quadkey con que se agrupa en un zoom (None = no agrupar)
+    """
+    if zoom is None or zoom > CLUSTER_MAX_ZOOM:
+        return None
+    return max(1, min(zoom + CLUSTER_EXTRA_LEVELS, QUADKEY_LEVEL))
+
+
+def query_bbox(session, model, bbox, zoom=None, base_filter=None):
+    """
+    Vehículos dentro de un bbox; en zooms bajos, agrupados en clusters
+
+    Args:
+        session: Sesión de SQLAlchemy
+        model: Modelo GPSDevice (con columna quadkey)
+        bbox: (min_lon, min_lat, max_lon, max_lat)
+        zoom: Zoom del mapa, o None para devolver siempre vehículos sueltos
+        base_filter: Condición extra (ej: excluir eliminados)
+
+    Returns:
+        dict: devices (vehículos sueltos, to_dict), clusters y total
+    """
+    condition = bbox_filter(model, bbox)
+    if base_filter is not None:
+        condition = and_(base_filter, condition)
+
+    level = cluster_level(zoom)
+    if level is None:
+        devices = session.execute(select(model).where(condition)).scalars().all()
+        return {
+            'devices': [device.to_dict() for device in devices],
+            'clusters': [],
+            'total': len(devices)
+        }
+
+    cell = func.substr(model.quadkey, 1, level)
+    rows = session.execute(
+        select(
+            cell.label('cell'),
+            func.count().label('count'),
+            func.avg(model.latitude).label('latitude'),
+            func.avg(model.longitude).label('longitude'),
+            func.min(model.latitude).label('min_lat'),
+            func.min(model.longitude).label('min_lon'),
+            func.max(model.latitude).label('max_lat'),
+            func.max(model.longitude).label('max_lon'),
+            func.sum(case((model.is_rented == True, 1), else_=0)).label('rented'),  # noqa: E712
+            func.min(model.id).label('first_id')
+        ).where(condition).group_by(cell)
+    ).all()
+
+    # Las celdas con un solo vehículo se devuelven como vehículo
+    single_ids = [row.first_id for row in rows if row.count == 1]
+    devices = []
+    if single_ids:
+        devices = session.execute(select(model).where(model.id.in_(single_ids))).scalars().all()
+    clusters = [
+        {
+            'quadkey': row.cell,
+            'count': row.count,
+            'rented': int(row.rented or 0),
+            'latitude': row.latitude,
+            'longitude': row.longitude,
+            'bounds': [row.min_lon, row.min_lat, row.max_lon, row.max_lat]
+        }
+        for row in rows if row.count > 1
+    ]
+    return {
+        'devices': [device.to_dict() for device in devices],
+        'clusters': clusters,
+        'total': sum(row.count for row in rows)
+    }
+
+
+def install_quadkey_hook(session_factory, gps_device_model):
+    """
+    Mantiene la columna quadkey de cada GPSDevice creado o modificado en un flush
+
+    Los UPDATE masivos (cola de ingesta) deben calcular el quadkey por su cuenta.
+    """
+    @event.listens_for(session_factory, 'before_flush')
+    def _assign_quadkey(session, flush_context, instances):
+        for obj in list(session.new) + list(session.dirty):
+            if isinstance(obj, gps_device_model):
+                key = quadkey(obj.latitude, obj.longitude)
+                if obj.quadkey != key:
+                    obj.quadkey = key
+
+    return _assign_quadkey
@@ -1,9 +1,24 @@
 // Inicializar el mapa
 let map;
 let markers = {};
+// Capa de marcadores (L.layerGroup o L.markerClusterGroup) y umbral de clustering
+let markerLayer = null;
+let markerLayerClustered = false;
+const MARKER_CLUSTER_THRESHOLD = window.MARKER_CLUSTER_THRESHOLD || 150;
+const mapRenderStats = { renders: 0, last_ms: 0, avg_ms: 0, max_ms: 0, markers: 0, clustered: false };
 let selectedDeviceId = null;
 let realTimeUpdateInterval = null;
 let allDevices = [];
+// Cursor de sincronización incremental (/api/devices/changes)
+let devicesCursor = 0;
+let devicesEtag = null;
+// Canal de actualizaciones en vivo (/api/stream)
+let liveStream = null;
+let liveConnected = false;
+let liveRenderTimer = null;
+// El servidor no acepta el canal (desactivado o lleno): solo sondeo por un rato
+let liveUnavailable = false;
+let liveReconnectTimer = null;
 
 let currentRentalDeviceId = null;
 
@@ -16,11 +31,12 @@ document.addEventListener('DOMContentLoaded', function() {
         loadDevices();
     }, 500);
     registerServiceWorker();
+    connectLiveStream();
     
     // Event listeners
     document.getElementById('deviceForm').addEventListener('submit', handleAddDevice);
     document.getElementById('rentalForm').addEventListener('submit', handleStartRental);
-    document.getElementById('refreshBtn').addEventListener('click', loadDevices);
+    document.getElementById('refreshBtn').addEventListener('click', () => loadDevices(true));
     
     // Menú móvil
     const mobileMenuBtn = document.getElementById('mobileMenuBtn');
@@ -35,10 +51,13 @@ document.addEventListener('DOMContentLoaded', function() {
         mobileOverlay.addEventListener('click', closeMobileMenu);
     }
     
-    // Actualizar ubicaciones cada 5 segundos (solo si no hay dispositivo seleccionado)
+    // Actualizar ubicaciones cada 5 segundos (solo si no hay dispositivo seleccionado).
+    // Con el canal en vivo conectado basta un sondeo de respaldo cada 60 segundos.
+    let pollTicks = 0;
     setInterval(() => {
-        if (!selectedDeviceId) {
-            loadDevices();
+        pollTicks++;
+        if (!selectedDeviceId && (!liveConnected || pollTicks % 12 === 0)) {
+            loadDevices(false, true);
         }
     }, 5000);
     
@@ -107,18 +126,184 @@ function initializeMap() {
     map.whenReady(function() {
         console.log('Mapa inicializado correctamente');
     });
+    
+    // El canal en vivo solo trae los fixes de la región visible
+    map.on('moveend', reconnectLiveStream);
+}
+
+// Pide solo los dispositivos que cambiaron desde el último cursor y los
+// mezcla en allDevices. Retorna true si hubo cambios.
+async function syncDevices(forceFull = false) {
+    if (forceFull) {
+        devicesCursor = 0;
+        devicesEtag = null;
+    }
+    
+    const headers = {};
+    if (devicesEtag) {
+        headers['If-None-Match'] = devicesEtag;
+    }
+    
+    const response = await fetch(`/api/devices/changes?since=${devicesCursor}`, { headers: headers });
+    if (response.status === 304) {
+        return false;
+    }
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+    }
+    
+    const data = await response.json();
+    if (data.full) {
+        allDevices = data.devices;
+    } else {
+        const byId = new Map(allDevices.map(d => [d.id, d]));
+        data.devices.forEach(d => byId.set(d.id, d));
+        data.deleted.forEach(id => byId.delete(id));
+        allDevices = Array.from(byId.values()).sort((a, b) => a.id - b.id);
+    }
+    
+    devicesCursor = data.revision;
+    devicesEtag = response.headers.get('ETag');
+    return data.full || data.devices.length > 0 || data.deleted.length > 0;
+}
+
+// Región visible (con margen) y vehículo seguido, para filtrar el canal en el servidor
+function liveStreamUrl() {
+    const params = new URLSearchParams();
+    if (map) {
+        params.set('bbox', map.getBounds().pad(0.2).toBBoxString());
+    }
+    if (selectedDeviceId) {
+        params.set('devices', selectedDeviceId);
+    }
+    const query = params.toString();
+    return query ? `/api/stream?${query}` : '/api/stream';
+}
+
+// Conecta el canal SSE; el navegador reconecta solo si se cae
+function connectLiveStream() {
+    if (!window.EventSource || liveStream || liveUnavailable) {
+        return;
+    }
+    
+    const stream = new EventSource(liveStreamUrl());
+    liveStream = stream;
+    
+    stream.onopen = function() {
+        liveConnected = true;
+        // Recuperar lo que haya cambiado mientras no había conexión
+        loadDevices(false, true);
+    };
+    
+    stream.onerror = function() {
+        liveConnected = false;
+        // 204 (canal desactivado) o 503 (sin cupo): el navegador no reconecta.
+        // Se sigue con el sondeo y se vuelve a intentar en 5 minutos.
+        if (stream.readyState === EventSource.CLOSED && liveStream === stream) {
+            liveStream = null;
+            liveUnavailable = true;
+            setTimeout(() => {
+                liveUnavailable = false;
+                connectLiveStream();
+            }, 300000);
+        }
+    };
+    
+    stream.addEventListener('fix', function(e) {
+        applyLiveFix(JSON.parse(e.data));
+    });
+    
+    // Un vehículo entró o salió de una geocerca
+    stream.addEventListener('geofence', function(e) {
+        const event = JSON.parse(e.data);
+        const device = allDevices.find(d => d.id === event.id);
+        const name = device ? device.name : `Vehículo ${event.id}`;
+        if (event.event === 'exit') {
+            showNotification('Salida de zona', `${name} salió de ${event.geofence}`, 'warning');
+        } else {
+            showNotification('Entrada a zona', `${name} entró a ${event.geofence}`, 'info');
+        }
+    });
+    
+    // Alquiler, alta, edición o baja: pedir el delta al servidor
+    stream.addEventListener('device', function() {
+        loadDevices(false, true);
+    });
+    
+    // El servidor descartó eventos (cliente lento): sincronizar
+    stream.addEventListener('resync', function() {
+        loadDevices(false, true);
+    });
+}
+
+// La región visible cambió: reabrir el canal con el nuevo filtro (agrupando movimientos)
+function reconnectLiveStream() {
+    if (!liveStream) {
+        return;
+    }
+    clearTimeout(liveReconnectTimer);
+    liveReconnectTimer = setTimeout(() => {
+        if (liveStream) {
+            liveStream.close();
+            liveStream = null;
+            liveConnected = false;
+            connectLiveStream();
+        }
+    }, 1000);
+}
+
+// Aplica un fix recibido por el canal en vivo sin consultar al servidor
+function applyLiveFix(fix) {
+    const device = allDevices.find(d => d.id === fix.id);
+    if (!device) {
+        loadDevices(false, true);
+        return;
+    }
+    
+    device.latitude = fix.lat;
+    device.longitude = fix.lon;
+    device.last_update = fix.t;
+    
+    // Mover el marcador de inmediato
+    const marker = markers[fix.id];
+    if (marker) {
+        marker.setLatLng([fix.lat, fix.lon]);
+        if (marker.isPopupOpen()) {
+            marker.getPopup().update();
+        }
+        if (selectedDeviceId === fix.id) {
+            map.panTo([fix.lat, fix.lon]);
+        }
+    } else {
+        updateMap(allDevices);
+    }
+    
+    // Lista y estadísticas: agrupar ráfagas de fixes en un solo re-dibujado
+    if (!liveRenderTimer) {
+        liveRenderTimer = setTimeout(() => {
+            liveRenderTimer = null;
+            displayDevices(allDevices);
+            updateStats(allDevices);
+        }, 1000);
+    }
 }
 
-async function loadDevices() {
+// onlyIfChanged: no re-dibujar si el servidor no reportó cambios (sondeo periódico)
+async function loadDevices(forceFull = false, onlyIfChanged = false) {
     try {
-        const response = await fetch('/api/devices');
-        const devices = await response.json();
+        // Encuadrar el mapa solo en la carga inicial y en el refresco manual
+        const fitBounds = forceFull === true || devicesCursor === 0;
+        const changed = await syncDevices(forceFull === true);
+        if (!changed && onlyIfChanged) {
+            return;
+        }
         
+        const devices = allDevices;
         console.log('Dispositivos cargados:', devices.length);
         console.log('Vehículos alquilados:', devices.filter(d => d.is_rented).length);
         
         displayDevices(devices);
-        updateMap(devices);
+        updateMap(devices, fitBounds);
         updateStats(devices);
     } catch (error) {
         console.error('Error al cargar dispositivos:', error);
@@ -380,81 +565,178 @@ function getTimeRemaining(endDate) {
     return `${minutes}m`;
 }
 
-function updateMap(devices) {
+function buildPopupContent(device, isSelected) {
+    return `
+                    <strong>${device.name}</strong><br>
+                    ID: ${device.device_id}<br>
+                    ${device.placa_gps ? `📡 Placa GPS: <strong>${device.placa_gps}</strong><br>` : ''}
+                    ${device.color ? `🎨 Color: ${device.color}<br>` : ''}
+                    ${device.description ? `${device.description}<br>` : ''}
+                    <strong>📍 Ubicación Exacta:</strong><br>
+                    Lat: ${device.latitude.toFixed(6)}<br>
+                    Lon: ${device.longitude.toFixed(6)}<br>
+                    ${device.last_update ? `Actualizado: ${formatDate(device.last_update)}<br>` : ''}
+                    ${device.is_rented ? `<br><strong style="color: #f59e0b;">⏰ EN ALQUILER</strong>` : ''}
+                    ${isSelected ? '<br><strong style="color: #10b981;">🟢 Siguiendo en tiempo real</strong>' : ''}
+                `;
+}
+
+// Iconos compartidos por todos los marcadores (se crean una sola vez)
+let defaultMarkerIcon = null;
+let selectedMarkerIcon = null;
+
+function getMarkerIcon(isSelected) {
+    if (!defaultMarkerIcon) {
+        selectedMarkerIcon = L.divIcon({
+            className: 'selected-marker',
+            html: '<div style="background-color: #4CAF50; width: 20px; height: 20px; border-radius: 50%; border: 3px solid white; box-shadow: 0 0 10px rgba(76, 175, 80, 0.8);"></div>',
+            iconSize: [20, 20],
+            iconAnchor: [10, 10]
+        });
+        defaultMarkerIcon = L.icon({
+            iconUrl: 'https://raw.githubusercontent.com/pointhi/leaflet-color-markers/master/img/marker-icon-blue.png',
+            iconSize: [25, 41],
+            iconAnchor: [12, 41],
+            popupAnchor: [1, -34]
+        });
+    }
+    return isSelected ? selectedMarkerIcon : defaultMarkerIcon;
+}
+
+// Capa donde viven los marcadores: grupo simple o grupo con clustering
+// según el tamaño de la flota
+function ensureMarkerLayer(count) {
+    const wantCluster = count > MARKER_CLUSTER_THRESHOLD && typeof L.markerClusterGroup === 'function';
+    if (markerLayer && markerLayerClustered === wantCluster) {
+        return;
+    }
+    
+    const layer = wantCluster ? L.markerClusterGroup({ chunkedLoading: true }) : L.layerGroup();
+    const existing = Object.values(markers);
+    if (markerLayer) {
+        markerLayer.clearLayers();
+        map.removeLayer(markerLayer);
+    }
+    if (existing.length > 0) {
+        layer.addLayers ? layer.addLayers(existing) : existing.forEach(m => layer.addLayer(m));
+    }
+    layer.addTo(map);
+    markerLayer = layer;
+    markerLayerClustered = wantCluster;
+}
+
+// Abre el popup de un marcador (si está dentro de un cluster, primero lo expande)
+function openMarkerPopup(deviceId) {
+    const marker = markers[deviceId];
+    if (!marker) {
+        return;
+    }
+    if (markerLayerClustered) {
+        markerLayer.zoomToShowLayer(marker, () => marker.openPopup());
+    } else {
+        marker.openPopup();
+    }
+}
+
+// Reconciliador de marcadores por id: crea los que faltan, mueve los
+// existentes con setLatLng y elimina los que ya no están. El popup se genera
+// al abrirlo. fitBounds solo se aplica cuando se pide (carga inicial o
+// refresco manual).
+function updateMap(devices, fitBounds = false) {
     // Verificar que el mapa esté inicializado
     if (!map) {
         console.error('Mapa no inicializado, esperando...');
         setTimeout(() => {
             if (map) {
-                updateMap(devices);
+                updateMap(devices, fitBounds);
             }
         }, 500);
         return;
     }
     
-    // Limpiar marcadores existentes
-    Object.values(markers).forEach(marker => {
-        if (marker && map.hasLayer(marker)) {
-            map.removeLayer(marker);
+    performance.mark('updateMap-start');
+    
+    const located = devices.filter(d => d.latitude && d.longitude);
+    ensureMarkerLayer(located.length);
+    
+    const seen = new Set();
+    const added = [];
+    located.forEach(device => {
+        const id = device.id;
+        const isSelected = selectedDeviceId === id;
+        seen.add(id);
+        
+        let marker = markers[id];
+        if (!marker) {
+            marker = L.marker([device.latitude, device.longitude], { icon: getMarkerIcon(isSelected) });
+            // Popup diferido: el HTML se arma con los datos vigentes al abrirlo
+            marker.bindPopup(() => {
+                const current = allDevices.find(d => d.id === id) || device;
+                return buildPopupContent(current, selectedDeviceId === id);
+            });
+            marker.deviceSelected = isSelected;
+            markers[id] = marker;
+            added.push(marker);
+            return;
+        }
+        
+        const pos = marker.getLatLng();
+        if (pos.lat !== device.latitude || pos.lng !== device.longitude) {
+            marker.setLatLng([device.latitude, device.longitude]);
+        }
+        if (marker.deviceSelected !== isSelected) {
+            marker.setIcon(getMarkerIcon(isSelected));
+            marker.deviceSelected = isSelected;
+        }
+        if (marker.isPopupOpen()) {
+            marker.getPopup().update();
         }
     });
-    markers = {};
     
-    // Agregar marcadores para cada dispositivo con ubicación
-    devices.forEach(device => {
-        if (device.latitude && device.longitude) {
-            const isSelected = selectedDeviceId === device.id;
-            
-            // Icono diferente para dispositivo seleccionado
-            const icon = isSelected ? 
-                L.divIcon({
-                    className: 'selected-marker',
-                    html: '<div style="background-color: #4CAF50; width: 20px; height: 20px; border-radius: 50%; border: 3px solid white; box-shadow: 0 0 10px rgba(76, 175, 80, 0.8);"></div>',
-                    iconSize: [20, 20],
-                    iconAnchor: [10, 10]
-                }) : L.icon({
-                    iconUrl: 'https://raw.githubusercontent.com/pointhi/leaflet-color-markers/master/img/marker-icon-blue.png',
-                    iconSize: [25, 41],
-                    iconAnchor: [12, 41],
-                    popupAnchor: [1, -34]
-                });
-            
-            const marker = L.marker([device.latitude, device.longitude], { icon: icon })
-                .addTo(map)
-                .bindPopup(`
-                    <strong>${device.name}</strong><br>
-                    ID: ${device.device_id}<br>
-                    ${device.placa_gps ? `📡 Placa GPS: <strong>${device.placa_gps}</strong><br>` : ''}
-                    ${device.color ? `🎨 Color: ${device.color}<br>` : ''}
-                    ${device.description ? `${device.description}<br>` : ''}
-                    <strong>📍 Ubicación Exacta:</strong><br>
-                    Lat: ${device.latitude.toFixed(6)}<br>
-                    Lon: ${device.longitude.toFixed(6)}<br>
-                    ${device.last_update ? `Actualizado: ${formatDate(device.last_update)}<br>` : ''}
-                    ${device.is_rented ? `<br><strong style="color: #f59e0b;">⏰ EN ALQUILER</strong>` : ''}
-                    ${isSelected ? '<br><strong style="color: #10b981;">🟢 Siguiendo en tiempo real</strong>' : ''}
-                `);
-            
-            markers[device.id] = marker;
-            
-            // Si es el dispositivo seleccionado, centrar el mapa y abrir popup
-            if (isSelected) {
-                map.setView([device.latitude, device.longitude], 15);
-                marker.openPopup();
-            }
+    if (added.length > 0) {
+        markerLayer.addLayers ? markerLayer.addLayers(added) : added.forEach(m => markerLayer.addLayer(m));
+    }
+    
+    Object.keys(markers).forEach(key => {
+        const id = Number(key);
+        if (!seen.has(id)) {
+            markerLayer.removeLayer(markers[key]);
+            delete markers[key];
         }
     });
     
     // Solo ajustar vista automáticamente si no hay dispositivo seleccionado
-    if (!selectedDeviceId && devices.length > 0 && devices.some(d => d.latitude && d.longitude)) {
-        const bounds = devices
-            .filter(d => d.latitude && d.longitude)
-            .map(d => [d.latitude, d.longitude]);
-        
-        if (bounds.length > 0) {
-            map.fitBounds(bounds, { padding: [50, 50] });
-        }
+    if (fitBounds && !selectedDeviceId && located.length > 0) {
+        map.fitBounds(located.map(d => [d.latitude, d.longitude]), { padding: [50, 50] });
     }
+    
+    performance.mark('updateMap-end');
+    const measure = performance.measure('updateMap', 'updateMap-start', 'updateMap-end');
+    recordMapRender(measure ? measure.duration : 0, located.length, added.length);
+}
+
+// Tiempos de renderizado del mapa (Performance API)
+function recordMapRender(duration, markerCount, addedCount) {
+    const stats = mapRenderStats;
+    stats.renders++;
+    stats.last_ms = duration;
+    stats.max_ms = Math.max(stats.max_ms, duration);
+    stats.avg_ms = stats.renders === 1 ? duration : 0.9 * stats.avg_ms + 0.1 * duration;
+    stats.markers = markerCount;
+    stats.clustered = markerLayerClustered;
+    
+    performance.clearMarks('updateMap-start');
+    performance.clearMarks('updateMap-end');
+    performance.clearMeasures('updateMap');
+    
+    // Un render de más de un frame (16 ms) se reporta en consola
+    if (duration > 16) {
+        console.warn(`updateMap lento: ${duration.toFixed(1)} ms (${markerCount} marcadores, ${addedCount} nuevos)`);
+    }
+}
+
+function getMapRenderStats() {
+    return Object.assign({}, mapRenderStats);
 }
 
 async function handleAddDevice(e) {
@@ -635,16 +917,17 @@ function selectDevice(deviceId) {
         trackingStatus.style.display = 'flex';
         const statusText = trackingStatus.querySelector('.status-text');
         if (statusText) {
-            statusText.textContent = `Siguiendo "${device.name}" en tiempo real - Actualización cada 10 segundos`;
+            statusText.textContent = liveConnected ?
+                `Siguiendo "${device.name}" en tiempo real` :
+                `Siguiendo "${device.name}" en tiempo real - Actualización cada 10 segundos`;
         }
     }
     
-    // Si el dispositivo tiene ubicación, centrar el mapa
+    // Cambiar el icono del seleccionado y centrar el mapa si tiene ubicación
+    updateMap(allDevices);
     if (device.latitude && device.longitude) {
         map.setView([device.latitude, device.longitude], 15);
-        if (markers[deviceId]) {
-            markers[deviceId].openPopup();
-        }
+        openMarkerPopup(deviceId);
     }
     
     // Actualizar la lista para mostrar el estado seleccionado
@@ -658,30 +941,30 @@ function startRealTimeTracking(deviceId) {
     // Actualizar inmediatamente
     updateDeviceLocation(deviceId);
     
-    // Configurar intervalo de 10 segundos
+    // Configurar intervalo de 10 segundos (si el canal en vivo está conectado,
+    // los fixes llegan por SSE y el intervalo no consulta al servidor)
     realTimeUpdateInterval = setInterval(() => {
-        updateDeviceLocation(deviceId);
+        if (!liveConnected) {
+            updateDeviceLocation(deviceId);
+        }
     }, 10000); // 10 segundos
 }
 
 async function updateDeviceLocation(deviceId) {
     try {
-        const response = await fetch('/api/devices');
-        const devices = await response.json();
+        // Solo se re-dibuja si algo cambió desde la última sincronización
+        const changed = await syncDevices();
         
-        const device = devices.find(d => d.id === deviceId);
-        if (device) {
-            // Actualizar en allDevices
-            const index = allDevices.findIndex(d => d.id === deviceId);
-            if (index !== -1) {
-                allDevices[index] = device;
+        const device = allDevices.find(d => d.id === deviceId);
+        if (device && changed) {
+            // Actualizar el mapa y seguir al vehículo
+            updateMap(allDevices);
+            if (device.latitude && device.longitude) {
+                map.panTo([device.latitude, device.longitude]);
             }
             
-            // Actualizar el mapa
-            updateMap(devices);
-            
             // Actualizar la lista
-            displayDevices(devices);
+            displayDevices(allDevices);
         }
     } catch (error) {
         console.error('Error al actualizar ubicación:', error);
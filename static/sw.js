@@ -1,4 +1,4 @@
-const CACHE_NAME = 'gps-tracker-v1';
+const CACHE_NAME = 'gps-tracker-v2';
 const urlsToCache = [
   '/',
   '/static/style.css',
@@ -38,6 +38,12 @@ self.addEventListener('activate', (event) => {
 
 // Estrategia: Network First, luego Cache
 self.addEventListener('fetch', (event) => {
+  // La API no se cachea: las respuestas incrementales (?since=) y los ETag
+  // los maneja el navegador directamente
+  if (new URL(event.request.url).pathname.startsWith('/api/')) {
+    return;
+  }
+  
   event.respondWith(
     fetch(event.request)
       .then((response) => {
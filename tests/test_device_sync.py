@@ -0,0 +1,85 @@
+"""
+Pruebas de las revisiones de gps_devices usadas por /api/devices/changes
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Column, Integer, String, create_engine, select  # noqa: E402  # pyright: ignore[reportMissingImports]
+from sqlalchemy.orm import declarative_base, sessionmaker  # noqa: E402  # pyright: ignore[reportMissingImports]
+import device_sync  # noqa: E402
+
+Base = declarative_base()
+
+
+class Device(Base):
+    __tablename__ = 'gps_devices'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    status = Column(String(20), default='available')
+    revision = Column(Integer, default=0)
+
+
+class DeviceSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        device_sync.create_tables(self.engine)
+        # Se llama en cada arranque: no debe duplicar la fila del contador
+        device_sync.create_tables(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        device_sync.install_revision_hook(self.Session, Device)
+        with self.Session() as session:
+            session.add_all([Device(name='Carro A'), Device(name='Carro B'), Device(name='Carro C')])
+            session.commit()
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def changes_since(self, since):
+        with self.Session() as session:
+            return sorted(session.scalars(select(Device.name).where(Device.revision > since)))
+
+    def current(self):
+        with self.Session() as session:
+            return device_sync.current_revision(session)
+
+    def test_one_flush_shares_one_revision(self):
+        self.assertEqual(self.current(), 1)
+        self.assertEqual(self.changes_since(0), ['Carro A', 'Carro B', 'Carro C'])
+        self.assertEqual(self.changes_since(1), [])
+
+    def test_only_modified_devices_are_returned(self):
+        with self.Session() as session:
+            session.get(Device, 2).status = 'deleted'
+            session.commit()
+        with self.Session() as session:
+            session.get(Device, 3).name = 'Carro C2'
+            session.commit()
+
+        self.assertEqual(self.current(), 3)
+        self.assertEqual(self.changes_since(1), ['Carro B', 'Carro C2'])
+        self.assertEqual(self.changes_since(2), ['Carro C2'])
+
+    def test_unchanged_flush_does_not_bump_the_counter(self):
+        with self.Session() as session:
+            device = session.get(Device, 1)
+            device.name = device.name
+            session.commit()
+        self.assertEqual(self.current(), 1)
+
+    def test_rolled_back_revision_is_not_consumed(self):
+        with self.Session() as session:
+            session.get(Device, 1).name = 'Carro A2'
+            session.flush()
+            session.rollback()
+        self.assertEqual(self.current(), 1)
+        self.assertEqual(self.changes_since(1), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Pruebas de las geocercas: entradas y salidas por polígono y círculo
+"""
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Column, Float, Integer, String, create_engine  # noqa: E402  # pyright: ignore[reportMissingImports]
+from sqlalchemy.orm import declarative_base, sessionmaker  # noqa: E402  # pyright: ignore[reportMissingImports]
+from geofence import GeofenceEngine  # noqa: E402
+
+Base = declarative_base()
+
+
+class Device(Base):
+    __tablename__ = 'gps_devices'
+
+    id = Column(Integer, primary_key=True)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    status = Column(String(20), default='available')
+
+
+# Patio de la sede: cuadrado de ~1 km
+YARD = [[-73.13, 7.11], [-73.12, 7.11], [-73.12, 7.12], [-73.13, 7.12]]
+INSIDE = (7.115, -73.125)
+OUTSIDE = (7.13, -73.14)
+
+
+def events(result):
+    return [(e['geofence'], e['event']) for e in result]
+
+
+class GeofenceEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        with self.Session() as session:
+            session.add_all([
+                Device(id=1, latitude=OUTSIDE[0], longitude=OUTSIDE[1]),
+                Device(id=2, latitude=INSIDE[0], longitude=INSIDE[1]),
+            ])
+            session.commit()
+        self.geofences = GeofenceEngine(self.engine, self.Session, Device)
+        self.geofences.create({'name': 'Patio', 'kind': 'polygon', 'coordinates': YARD})
+        self.geofences.create({'name': 'Taller', 'kind': 'circle', 'latitude': 7.1, 'longitude': -73.1, 'radius_m': 200})
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_enter_and_exit_polygon(self):
+        self.assertEqual(events(self.geofences.evaluate(1, *INSIDE)), [('Patio', 'enter')])
+        self.assertEqual(self.geofences.evaluate(1, 7.116, -73.126), [])
+        self.assertEqual(events(self.geofences.evaluate(1, *OUTSIDE)), [('Patio', 'exit')])
+
+    def test_state_starts_from_the_stored_position(self):
+        # El vehículo 2 ya estaba en el patio: su primer fix adentro no es una entrada
+        self.assertEqual(self.geofences.evaluate(2, *INSIDE), [])
+        self.assertEqual(events(self.geofences.evaluate(2, 7.1005, -73.1005)), [('Patio', 'exit'), ('Taller', 'enter')])
+
+    def test_circle_uses_distance_not_bbox(self):
+        # Esquina del bbox del círculo, a más de 200 m del centro
+        self.assertEqual(self.geofences.evaluate(1, 7.1017, -73.1017), [])
+        self.assertEqual(events(self.geofences.evaluate(1, 7.1010, -73.1)), [('Taller', 'enter')])
+
+    def test_new_device_only_initializes_its_state(self):
+        self.assertEqual(self.geofences.evaluate(3, *INSIDE), [])
+        self.assertEqual(events(self.geofences.evaluate(3, *OUTSIDE)), [('Patio', 'exit')])
+
+    def test_pending_state_is_applied_after_commit(self):
+        pending = {}
+        timestamp = datetime(2026, 3, 10, 12)
+        entered = self.geofences.evaluate(1, *INSIDE, timestamp=timestamp, pending=pending)
+        self.assertEqual(entered[0]['timestamp'], timestamp)
+        # Un segundo fix del mismo lote parte del estado pendiente
+        self.assertEqual(events(self.geofences.evaluate(1, *OUTSIDE, pending=pending)), [('Patio', 'exit')])
+
+        # Sin commit_state (rollback) el vehículo sigue afuera
+        self.assertEqual(self.geofences.inside_of(1), [])
+        self.geofences.evaluate(1, *INSIDE, pending=pending)
+        self.geofences.commit_state(pending)
+        self.assertEqual(self.geofences.inside_of(1), [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+"""
+Pruebas del driver AT contra un módem simulado en un pty
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gsm_modem import ATModem, ATTimeout  # noqa: E402
+
+
+class FakeModem:
+    """
+    Módem simulado sobre el lado maestro de un pty
+
+    hold_sms: el resultado de AT+CMGS no llega hasta el siguiente comando
+    prompt_delay: segundos que tarda el prompt '>' de AT+CMGS
+    """
+
+    def __init__(self, hold_sms=False, prompt_delay=0):
+        self.master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        self.hold_sms = hold_sms
+        self.prompt_delay = prompt_delay
+        self.echo = True
+        self.sent = 0
+        self.late = ''
+        self.csq_urc = False
+        self.cmgl_response = ''
+        self._lock = threading.Lock()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def close(self):
+        os.close(self.master)
+        os.close(self._slave)
+
+    def write(self, text):
+        with self._lock:
+            os.write(self.master, text.encode())
+
+    def _loop(self):
+        buffer = b''
+        text_mode = False
+        while True:
+            try:
+                buffer += os.read(self.master, 1024)
+            except OSError:
+                return
+
+            while True:
+                if text_mode:
+                    # Modo texto: Ctrl+Z envía, ESC cancela
+                    index = min((i for i in (buffer.find(b'\x1a'), buffer.find(b'\x1b')) if i >= 0), default=-1)
+                    if index < 0:
+                        break
+                    cancelled = buffer[index:index + 1] == b'\x1b'
+                    buffer = buffer[index + 1:]
+                    text_mode = False
+                    if cancelled:
+                        continue
+                    self.sent += 1
+                    result = f'\r\n+CMGS: {self.sent}\r\n\r\nOK\r\n'
+                    if self.hold_sms:
+                        self.late = result
+                    else:
+                        self.write(result)
+                    continue
+
+                index = buffer.find(b'\r')
+                if index < 0:
+                    break
+                command = buffer[:index].decode(errors='ignore').replace('\x1b', '').strip()
+                buffer = buffer[index + 1:].lstrip(b'\n')
+                if not command:
+                    continue
+                if self.late:
+                    self.write(self.late)
+                    self.late = ''
+                if self.echo:
+                    self.write(command + '\r\n')
+
+                upper = command.upper()
+                if upper.startswith('AT+CMGS='):
+                    time.sleep(self.prompt_delay)
+                    text_mode = True
+                    self.write('\r\n> ')
+                elif upper == 'ATE0':
+                    self.echo = False
+                    self.write('\r\nOK\r\n')
+                elif upper == 'AT+CMGF?':
+                    self.write('\r\n+CMGF: 1\r\n\r\nOK\r\n')
+                elif upper == 'AT+CSQ':
+                    if self.csq_urc:
+                        self.write('\r\n+CMTI: "SM",3\r\n')
+                    self.write('\r\n+CSQ: 21,0\r\n\r\nOK\r\n')
+                elif upper.startswith('AT+CMGL'):
+                    self.write(self.cmgl_response + '\r\n\r\nOK\r\n')
+                elif upper.startswith('AT'):
+                    self.write('\r\nOK\r\n')
+                else:
+                    self.write('\r\nERROR\r\n')
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), 'requiere os.openpty')
+class ATModemTest(unittest.TestCase):
+
+    def open_modem(self, **kwargs):
+        self.fake = FakeModem(**kwargs)
+        self.modem = ATModem(self.fake.port).open(timeout=2)
+        self.addCleanup(self.fake.close)
+        self.addCleanup(self.modem.close)
+        return self.modem
+
+    def test_send_sms_returns_reference(self):
+        modem = self.open_modem()
+        self.assertEqual(modem.send_sms('+573001112233', 'URL#', timeout=2), 1)
+        self.assertEqual(modem.send_sms('+573001112233', 'URL#', timeout=2), 2)
+        self.assertEqual(modem.get_stats()['sms_sent'], 2)
+
+    def test_pipelined_commands_get_their_own_response(self):
+        modem = self.open_modem()
+        requests = [modem.submit('AT+CSQ'), modem.submit('AT'), modem.submit('AT+CSQ')]
+        self.assertEqual([r.wait(2) for r in requests], [['+CSQ: 21,0'], [], ['+CSQ: 21,0']])
+
+    def test_urc_during_command_goes_to_handlers(self):
+        modem = self.open_modem()
+        urcs = []
+        modem.add_urc_handler(lambda line, body: urcs.append(line))
+        self.fake.csq_urc = True
+        self.assertEqual(modem.command('AT+CSQ', timeout=2), ['+CSQ: 21,0'])
+        self.assertEqual(urcs, ['+CMTI: "SM",3'])
+
+    def test_cmgl_body_that_looks_like_a_final_code_is_data(self):
+        modem = self.open_modem()
+        self.fake.cmgl_response = (
+            '\r\n+CMGL: 1,"REC UNREAD","+573001112233",,"26/03/10,12:00:00-20"\r\nOK'
+            '\r\n+CMGL: 2,"REC UNREAD","+573001112233",,"26/03/10,12:00:05-20"\r\nERROR de GPS'
+        )
+        lines = modem.command('AT+CMGL="REC UNREAD"', timeout=2)
+        self.assertEqual(len(lines), 4)
+        self.assertEqual((lines[1], lines[3]), ('OK', 'ERROR de GPS'))
+
+    def test_late_result_of_abandoned_sms_is_not_taken_by_next_command(self):
+        modem = self.open_modem(hold_sms=True)
+        with self.assertRaises(ATTimeout):
+            modem.send_sms('+573001112233', 'URL#', timeout=0.3)
+
+        # El +CMGS/OK tardío llega antes de la respuesta del siguiente comando
+        self.assertEqual(modem.command('AT+CSQ', timeout=3), ['+CSQ: 21,0'])
+        stats = modem.get_stats()
+        self.assertEqual(stats['resyncs'], 1)
+        self.assertEqual(stats['resync_failures'], 0)
+        self.assertGreaterEqual(stats['late_lines'], 2)
+
+    def test_late_prompt_is_cancelled_without_sending(self):
+        modem = self.open_modem(prompt_delay=0.5)
+        with self.assertRaises(ATTimeout):
+            modem.send_sms('+573001112233', 'URL#', timeout=0.2)
+
+        self.assertEqual(modem.command('AT+CSQ', timeout=3), ['+CSQ: 21,0'])
+        self.assertEqual(self.fake.sent, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
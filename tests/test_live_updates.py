@@ -0,0 +1,50 @@
+"""
+Pruebas del canal SSE: filtro por región visible y por dispositivos
+"""
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from live_updates import LiveUpdateBroker  # noqa: E402
+
+# min_lon, min_lat, max_lon, max_lat
+BBOX = (-73.2, 7.0, -73.0, 7.2)
+
+
+def fix(device_id, lat, lon):
+    return {'id': device_id, 'latitude': lat, 'longitude': lon, 'last_update': datetime(2026, 3, 10, 12), 'revision': 1}
+
+
+class LiveUpdateBrokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.broker = LiveUpdateBroker()
+        self.subscription = self.broker.subscribe(bbox=BBOX)
+
+    def delivered(self):
+        return self.subscription.queue.qsize()
+
+    def test_fix_inside_bbox_is_delivered(self):
+        self.broker.publish_fixes([fix(1, 7.1, -73.1), fix(2, 8.0, -74.0)])
+        self.assertEqual(self.delivered(), 1)
+
+    def test_vehicle_leaving_bbox_gets_its_exit_fix(self):
+        self.broker.publish_fixes([fix(1, 8.0, -74.0)], previous={1: (7.1, -73.1)})
+        self.assertEqual(self.delivered(), 1)
+
+        # Ya fuera de la región: los siguientes fixes no le interesan al cliente
+        self.broker.publish_fixes([fix(1, 8.1, -74.1)], previous={1: (8.0, -74.0)})
+        self.assertEqual(self.delivered(), 1)
+
+    def test_followed_device_is_delivered_anywhere(self):
+        followed = self.broker.subscribe(device_ids=[5], bbox=BBOX)
+        self.broker.publish_fixes([fix(5, 8.0, -74.0)])
+        self.assertEqual(followed.queue.qsize(), 1)
+        self.assertEqual(self.delivered(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+Pruebas del buzón del módem: lectura de no leídos y borrado por índice tras la entrega
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gsm_modem import ATError  # noqa: E402
+from modem_inbox import ModemInbox  # noqa: E402
+
+
+class FakeModem:
+    """
+    Memoria de la SIM como dict índice -> [estado, remitente, texto]
+    """
+
+    def __init__(self):
+        self.storage = {}
+        self.commands = []
+        self.failing_deletes = set()
+
+    def store(self, index, phone_number, text):
+        self.storage[index] = ['REC UNREAD', phone_number, text]
+
+    def command(self, command, timeout=5):
+        self.commands.append(command)
+        if command.startswith('AT+CMGL='):
+            status = command.split('=', 1)[1].strip('"')
+            lines = []
+            for index, entry in sorted(self.storage.items()):
+                if status == 'ALL' or entry[0] == status:
+                    lines += [f'+CMGL: {index},"{entry[0]}","{entry[1]}",,"26/03/10,12:00:00-20"', entry[2]]
+                    entry[0] = 'REC READ'
+            return lines
+        if command.startswith('AT+CMGD='):
+            index = int(command.split('=', 1)[1])
+            if index in self.failing_deletes:
+                raise ATError(command, '+CMS ERROR: 500')
+            self.storage.pop(index, None)
+        return []
+
+
+class ModemInboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.modem = FakeModem()
+        self.received = []
+        self.inbox = ModemInbox(self.modem, lambda text, phone: self.received.append((phone, text)))
+
+    def test_reads_unread_and_deletes_each_delivered_index(self):
+        self.modem.store(1, '+573000000001', 'LAT:7.1,LON:-73.1')
+        self.modem.store(2, '+573000000002', 'OK')
+
+        self.assertEqual(self.inbox.drain(), 2)
+        self.assertEqual(self.received, [('+573000000001', 'LAT:7.1,LON:-73.1'), ('+573000000002', 'OK')])
+        self.assertEqual(self.modem.commands, ['AT+CMGL="REC UNREAD"', 'AT+CMGD=1', 'AT+CMGD=2'])
+        self.assertEqual(self.modem.storage, {})
+
+    def test_failed_handler_keeps_message_on_sim(self):
+        def on_sms(text, phone):
+            if text == 'malo':
+                raise ValueError('no se pudo parsear')
+            self.received.append((phone, text))
+
+        self.inbox.on_sms = on_sms
+        self.modem.store(1, '+573000000001', 'malo')
+        self.modem.store(2, '+573000000002', 'LAT:7.2,LON:-73.2')
+
+        self.assertEqual(self.inbox.drain(), 1)
+        self.assertEqual(list(self.modem.storage), [1])
+        self.assertEqual(self.inbox.get_stats()['handler_errors'], 1)
+
+    def test_failed_delete_is_retried_without_redelivery(self):
+        self.modem.store(1, '+573000000001', 'LAT:7.1,LON:-73.1')
+        self.modem.failing_deletes.add(1)
+        self.inbox.drain()
+        self.assertIn(1, self.modem.storage)
+
+        # El módem lo vuelve a listar (sigue en la SIM) y esta vez el borrado funciona
+        self.modem.storage[1][0] = 'REC UNREAD'
+        self.modem.failing_deletes.clear()
+        self.assertEqual(self.inbox.drain(), 0)
+
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(self.modem.storage, {})
+        stats = self.inbox.get_stats()
+        self.assertEqual((stats['delete_errors'], stats['duplicates'], stats['deleted']), (1, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
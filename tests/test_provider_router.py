@@ -0,0 +1,60 @@
+"""
+Pruebas del circuit breaker y la cuota diaria de provider_router
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+import provider_router  # noqa: E402
+from provider_router import ProviderRouter, get_health, OPEN  # noqa: E402
+
+
+class ProviderRouterTest(unittest.TestCase):
+
+    def _router(self, name, send):
+        # Cada prueba usa un proveedor nuevo (el estado de salud es global)
+        provider_router._health.pop(name, None)
+        router = ProviderRouter()
+        router.register(name, send)
+        return router
+
+    def test_connection_error_opens_breaker_without_spending_quota(self):
+        def send(to_number, message):
+            raise requests.ConnectionError(
+                "HTTPSConnectionPool(host='us.sms.api.sinch.com', port=443): Max retries exceeded with url"
+            )
+
+        router = self._router('test_network', send)
+        for _ in range(provider_router.FAILURE_THRESHOLD):
+            result = router.send('+573004291234', 'URL#')
+            self.assertFalse(result['success'])
+            self.assertFalse(result['quota_exhausted'])
+
+        health = get_health('test_network')
+        self.assertEqual(health.state, OPEN)
+        self.assertFalse(health.quota_exhausted)
+        self.assertTrue(health.has_quota())
+
+    def test_phone_number_with_429_is_not_a_quota_error(self):
+        router = self._router('test_invalid', lambda to, msg: {
+            'success': False, 'error': f'Número de teléfono inválido: {to}'
+        })
+        router.send('+573004291234', 'URL#')
+        self.assertFalse(get_health('test_invalid').quota_exhausted)
+
+    def test_provider_quota_response_exhausts_the_day(self):
+        router = self._router('test_quota', lambda to, msg: {
+            'success': False, 'error': 'HTTP 429: Too Many Requests', 'quota_exceeded': True
+        })
+        result = router.send('+573001234567', 'URL#')
+        health = get_health('test_quota')
+        self.assertTrue(health.quota_exhausted)
+        self.assertEqual(health.consecutive_failures, 0)
+        self.assertTrue(result['quota_exhausted'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Pruebas del registro de proveedores de sms_dispatcher (canales Android por separado)
+"""
+import contextlib
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+import provider_router  # noqa: E402
+import sms_dispatcher  # noqa: E402
+import sms_sender_free  # noqa: E402
+from provider_router import get_health, OPEN  # noqa: E402
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self._data = data
+        self.text = str(data)
+
+    def json(self):
+        return self._data
+
+
+class FakeSession:
+    """
+    SMSMobileAPI caído (error de conexión) y MessageBird respondiendo 201
+    """
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def get(self, url, **kwargs):
+        self.calls.append('smsmobileapi')
+        raise requests.ConnectionError('Max retries exceeded')
+
+    def post(self, url, **kwargs):
+        self.calls.append('messagebird')
+        return FakeResponse(201, {'id': 'mb-1'})
+
+
+class AndroidChannelsTest(unittest.TestCase):
+
+    def setUp(self):
+        for name in sms_sender_free.ANDROID_CHANNELS:
+            provider_router._health.pop(name, None)
+        env = {'SMSMOBILEAPI_KEY': 'key', 'MESSAGEBIRD_API_KEY': 'key', 'ANDROID_SMS_GATEWAY_URL': ''}
+        with mock.patch.dict(os.environ, env):
+            self.sender = sms_sender_free.FreeSMSSender(method='android_phone')
+        self.calls = []
+        patches = [
+            mock.patch.object(sms_dispatcher, 'get_sms_sender', lambda method='auto': self.sender),
+            mock.patch.object(sms_sender_free, 'get_session', lambda provider: FakeSession(self.calls)),
+            # Sin esperas del token bucket (se prueba el enrutamiento, no el ritmo)
+            mock.patch.object(sms_sender_free, 'get_limiter', lambda provider: contextlib.nullcontext()),
+            mock.patch.object(sms_dispatcher, 'vonage_configured', lambda: False),
+            mock.patch.object(sms_dispatcher, 'sinch_configured', lambda: False),
+            mock.patch.object(sms_dispatcher, 'twilio_configured', lambda: False),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_each_channel_is_its_own_provider(self):
+        router = sms_dispatcher.build_router()
+        self.assertEqual(router.candidates(), ['smsmobileapi', 'messagebird'])
+        self.assertGreater(get_health('messagebird').cost, get_health('smsmobileapi').cost)
+
+    def test_dead_channel_opens_its_breaker_and_is_skipped(self):
+        router = sms_dispatcher.build_router()
+        for _ in range(provider_router.FAILURE_THRESHOLD):
+            result = router.send('+573001112233', 'URL#')
+            self.assertTrue(result['success'])
+            self.assertEqual(result['method'], 'messagebird')
+
+        self.assertEqual(get_health('smsmobileapi').state, OPEN)
+        self.calls.clear()
+        result = router.send('+573001112233', 'URL#')
+        self.assertEqual(self.calls, ['messagebird'])
+        self.assertEqual(result['attempts'][0], {'method': 'smsmobileapi', 'skipped': OPEN})
+
+    def test_messagebird_balance_error_is_a_quota_error(self):
+        session = mock.Mock()
+        session.post.return_value = FakeResponse(422, {'errors': [{'code': 25, 'description': 'Not enough balance'}]})
+        with mock.patch.object(sms_sender_free, 'get_session', lambda provider: session):
+            result = self.sender.send_via('messagebird', '+573001112233', 'URL#')
+        self.assertFalse(result['success'])
+        self.assertTrue(result['quota_exceeded'])
+
+
+if __name__ == '__main__':
+    unittest.main()
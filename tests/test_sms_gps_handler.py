@@ -0,0 +1,64 @@
+"""
+Pruebas del parser de SMS GPS: formatos, prioridad y formato aprendido por remitente
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sms_gps_handler  # noqa: E402
+from sms_gps_handler import SMSGPSHandler  # noqa: E402
+
+
+def parse(text, phone='+573000000001'):
+    result = SMSGPSHandler.parse_sms(text, phone)
+    return (result['format'], result['latitude'], result['longitude']) if result else None
+
+
+class ParseSMSTest(unittest.TestCase):
+
+    def setUp(self):
+        with sms_gps_handler._sender_formats_lock:
+            sms_gps_handler._sender_formats.clear()
+
+    def test_formats(self):
+        cases = [
+            ('http://maps.google.com/maps?q=N7.097760,W73.122780', ('maps_url', 7.09776, -73.12278)),
+            ('https://www.google.com/maps?q=S7.1254,E73.1198 bat:85%', ('maps_query', -7.1254, 73.1198)),
+            ('LAT:7.1254,LON:-73.1198', ('lat_lon', 7.1254, -73.1198)),
+            ('lat: 7.1301 lon: -73.1255 spd: 12', ('lat_lon', 7.1301, -73.1255)),
+            ('7.1254 -73.1198', ('pair', 7.1254, -73.1198)),
+            ('GPS: 7.0931 -73.1079 ACC ON', ('pair', 7.0931, -73.1079)),
+            ('Mensaje sin coordenadas', None),
+        ]
+        for index, (text, expected) in enumerate(cases):
+            with self.subTest(text=text):
+                self.assertEqual(parse(text, f'+57300000{index:04d}'), expected)
+
+    def test_priority_wins_over_leftmost_match(self):
+        # El par "12 85" aparece antes, pero LAT/LON tiene más prioridad
+        self.assertEqual(parse('Vel 12 85% LAT:7.1,LON:-73.2'), ('lat_lon', 7.1, -73.2))
+
+    def test_out_of_range_falls_back_to_next_format(self):
+        self.assertEqual(parse('LAT:95,LON:10 7.1,-73.1'), ('pair', 10.0, 7.1))
+
+    def test_learned_format_is_reused_and_relearned(self):
+        phone = '+573000000099'
+        self.assertEqual(parse('LAT:7.1,LON:-73.1', phone)[0], 'lat_lon')
+        self.assertEqual(sms_gps_handler._sender_formats[phone], 2)
+        self.assertEqual(parse('LAT:7.2,LON:-73.2', phone), ('lat_lon', 7.2, -73.2))
+
+        # La placa cambió de formato: el aprendido no aplica y se vuelve a detectar
+        self.assertEqual(parse('q=N7.3,W73.3', phone), ('maps_query', 7.3, -73.3))
+        self.assertEqual(sms_gps_handler._sender_formats[phone], 1)
+
+    def test_learned_pair_is_not_a_shortcut(self):
+        phone = '+573000000098'
+        self.assertEqual(parse('7.1,-73.1', phone)[0], 'pair')
+        # Con el par aprendido, un LAT/LON con otros números antes sigue ganando
+        self.assertEqual(parse('12 85 LAT:7.2,LON:-73.2', phone), ('lat_lon', 7.2, -73.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+"""
+Pruebas de la cola de ingesta: lotes, reintentos y efectos posteriores al commit
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Column, Integer, String, Float, DateTime, create_engine, select  # noqa: E402  # pyright: ignore[reportMissingImports]
+from sqlalchemy.orm import declarative_base, sessionmaker  # noqa: E402  # pyright: ignore[reportMissingImports]
+import device_sync  # noqa: E402
+import sms_ingest_queue  # noqa: E402
+from location_history import LocationHistory  # noqa: E402
+from sms_ingest_queue import SMSIngestQueue  # noqa: E402
+from trajectory_compression import DeadBandFilter  # noqa: E402
+
+Base = declarative_base()
+
+
+class Device(Base):
+    __tablename__ = 'gps_devices'
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(String(50), unique=True, nullable=False)
+    name = Column(String(100), nullable=False)
+    placa_gps = Column(String(50), default='')
+    latitude = Column(Float)
+    longitude = Column(Float)
+    last_update = Column(DateTime)
+    revision = Column(Integer, default=0)
+    quadkey = Column(String(20))
+
+
+def fix(phone, lat, lon, received_at, key=None):
+    return {
+        'phone_number': phone,
+        'latitude': lat,
+        'longitude': lon,
+        'received_at': received_at,
+        'dedup_key': key
+    }
+
+
+class IngestQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.engine = create_engine(f'sqlite:///{os.path.join(self.tmp, "t.db")}')
+        Base.metadata.create_all(self.engine)
+        device_sync.create_tables(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        with self.Session() as session:
+            session.add_all([
+                Device(device_id='A', name='Carro A', placa_gps='+573000000001', latitude=7.0, longitude=-73.0),
+                Device(device_id='B', name='Carro B', placa_gps='+573000000002', latitude=7.0, longitude=-73.0),
+            ])
+            session.commit()
+
+        self.history = LocationHistory(self.engine)
+        self.broker = mock.Mock()
+        self.dedup = mock.Mock()
+        self.queue = SMSIngestQueue(
+            self.Session, Device, history=self.history, broker=self.broker, dedup=self.dedup
+        )
+        self.now = datetime(2026, 3, 10, 12, 0, 0)
+        patch = mock.patch.object(sms_ingest_queue, 'RETRY_DELAYS', (0.001, 0.001))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def history_count(self):
+        return len(self.history.query(start=self.now - timedelta(days=1), end=self.now + timedelta(days=1)))
+
+    def test_batch_is_applied_in_one_revision(self):
+        batch = [
+            fix('+573000000001', 7.1, -73.1, self.now),
+            fix('+573000000002', 7.2, -73.2, self.now),
+            fix('+573000000001', 7.3, -73.3, self.now + timedelta(seconds=5)),
+        ]
+        self.assertEqual(self.queue._apply_with_retry(batch), [])
+
+        with self.Session() as session:
+            devices = {d.device_id: d for d in session.scalars(select(Device))}
+        # gps_devices guarda el último fix de cada vehículo; el historial, todos
+        self.assertEqual((devices['A'].latitude, devices['A'].longitude), (7.3, -73.3))
+        self.assertEqual(devices['A'].revision, devices['B'].revision)
+        self.assertEqual(self.history_count(), 3)
+        self.assertEqual(self.queue.get_metrics()['applied'], 3)
+
+    def test_published_fixes_carry_the_previous_position(self):
+        self.queue._apply_with_retry([fix('+573000000001', 7.1, -73.1, self.now)])
+
+        fixes, = self.broker.publish_fixes.call_args.args
+        previous = self.broker.publish_fixes.call_args.kwargs['previous']
+        self.assertEqual((fixes[0]['latitude'], fixes[0]['longitude']), (7.1, -73.1))
+        self.assertEqual(previous[fixes[0]['id']], (7.0, -73.0))
+
+    def test_deadband_closes_the_stop_when_the_vehicle_moves(self):
+        self.queue.deadband = DeadBandFilter(meters=10)
+        t = [self.now + timedelta(minutes=m) for m in (0, 5, 10)]
+        for parsed in (
+            fix('+573000000001', 7.00002, -73.0, t[0]),
+            fix('+573000000001', 7.00003, -73.0, t[1]),
+            fix('+573000000001', 7.01, -73.0, t[2]),
+        ):
+            self.assertEqual(self.queue._apply_with_retry([parsed]), [])
+
+        points = [(p['latitude'], p['timestamp']) for p in self.history.query(start=self.now, end=t[2])]
+        # La parada se guarda con la posición estacionada y la hora del último fix descartado
+        self.assertEqual(points, [(7.0, t[1].isoformat()), (7.01, t[2].isoformat())])
+        self.assertEqual(self.queue.get_metrics()['suppressed'], 2)
+
+    def test_failed_attempt_is_retried(self):
+        apply_batch = self.queue._apply_batch
+        calls = []
+
+        def flaky(batch):
+            calls.append(len(batch))
+            if len(calls) == 1:
+                raise RuntimeError('database is locked')
+            return apply_batch(batch)
+
+        self.queue._apply_batch = flaky
+        self.assertEqual(self.queue._apply_with_retry([fix('+573000000001', 7.1, -73.1, self.now)]), [])
+        self.assertEqual(calls, [1, 1])
+        self.assertEqual(self.queue.get_metrics()['retries'], 1)
+        self.assertEqual(self.history_count(), 1)
+
+    def test_poison_fix_is_isolated_and_its_key_released(self):
+        apply_batch = self.queue._apply_batch
+
+        def poison(batch):
+            if any(p['phone_number'] == '+573000000002' for p in batch):
+                raise ValueError('fix inválido')
+            return apply_batch(batch)
+
+        self.queue._apply_batch = poison
+        batch = [
+            fix('+573000000001', 7.1, -73.1, self.now, key='k1'),
+            fix('+573000000002', 7.2, -73.2, self.now, key='k2'),
+        ]
+        failed = self.queue._apply_with_retry(batch)
+
+        self.assertEqual([p['dedup_key'] for p in failed], ['k2'])
+        self.dedup.forget.assert_called_once_with('k2')
+        self.assertEqual(self.history_count(), 1)
+        metrics = self.queue.get_metrics()
+        self.assertEqual(metrics['errors'], 1)
+        self.assertEqual(len(metrics['failed_fixes']), 1)
+
+    def test_side_effect_error_does_not_reapply_committed_batch(self):
+        self.broker.publish_fixes.side_effect = RuntimeError('broker caído')
+        batch = [fix('+573000000001', 7.1, -73.1, self.now, key='k1')]
+
+        self.assertEqual(self.queue._apply_with_retry(batch), [])
+        self.assertEqual(self.history_count(), 1)
+        metrics = self.queue.get_metrics()
+        self.assertEqual(metrics['retries'], 0)
+        self.assertEqual(metrics['errors'], 0)
+        self.assertEqual(metrics['side_effect_errors'], 1)
+        self.dedup.forget.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Pruebas del registro de senders de SMS gratis: detección fuera del lock compartido
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sms_sender_free import SMSSenderRegistry  # noqa: E402
+
+
+class SenderRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = SMSSenderRegistry()
+        self.release = threading.Event()
+        self.detections = []
+
+        def detect(method):
+            self.detections.append(method)
+            if method == 'gsm_modem':
+                # Detección lenta (puerto serie que no responde)
+                self.release.wait(5)
+                return None, {'ready': False, 'detail': 'sin módem'}
+            return mock.Mock(method=method), {'ready': True, 'detail': 'ok'}
+
+        self.registry._detect = detect
+
+    def test_slow_detection_does_not_block_other_methods(self):
+        slow = threading.Thread(target=self.registry.get_sender, args=('gsm_modem',))
+        slow.start()
+        time.sleep(0.05)
+
+        started = time.perf_counter()
+        self.assertEqual(self.registry.get_sender('android_phone').method, 'android_phone')
+        self.registry.get_status()
+        self.assertLess(time.perf_counter() - started, 1)
+
+        self.release.set()
+        slow.join(5)
+        self.assertIsNone(self.registry.get_sender('gsm_modem'))
+
+    def test_concurrent_first_calls_detect_once(self):
+        threads = [threading.Thread(target=self.registry.get_sender, args=('gsm_modem',)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(self.detections, ['gsm_modem'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Pruebas del índice espacial por quadkey: consultas por bbox y clusters
+"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Boolean, Column, Float, Integer, String, create_engine  # noqa: E402  # pyright: ignore[reportMissingImports]
+from sqlalchemy.orm import declarative_base, sessionmaker  # noqa: E402  # pyright: ignore[reportMissingImports]
+import spatial_index  # noqa: E402
+from spatial_index import install_quadkey_hook, parse_bbox, query_bbox, quadkey  # noqa: E402
+
+Base = declarative_base()
+
+
+class Device(Base):
+    __tablename__ = 'gps_devices'
+
+    id = Column(Integer, primary_key=True)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    quadkey = Column(String(20), index=True)
+    is_rented = Column(Boolean, default=False)
+
+    def to_dict(self):
+        return {'id': self.id, 'latitude': self.latitude, 'longitude': self.longitude}
+
+
+def inside(bbox, lat, lon):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    in_lon = min_lon <= lon <= max_lon if min_lon <= max_lon else (lon >= min_lon or lon <= max_lon)
+    return min_lat <= lat <= max_lat and in_lon
+
+
+class SpatialIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        install_quadkey_hook(self.Session, Device)
+
+        rng = random.Random(7)
+        # Flota alrededor de Bucaramanga más algunos vehículos junto al meridiano 180
+        self.points = [(rng.uniform(6.9, 7.3), rng.uniform(-73.3, -72.9)) for _ in range(300)]
+        self.points += [(rng.uniform(-17.5, -16.5), rng.choice((rng.uniform(179.5, 180), rng.uniform(-180, -179.5))))
+                        for _ in range(20)]
+        with self.Session() as session:
+            session.add_all(Device(latitude=lat, longitude=lon) for lat, lon in self.points)
+            session.commit()
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def expected_ids(self, bbox):
+        return {i + 1 for i, (lat, lon) in enumerate(self.points) if inside(bbox, lat, lon)}
+
+    def test_child_tiles_share_the_parent_prefix(self):
+        key = quadkey(7.1193, -73.1227)
+        self.assertEqual(len(key), spatial_index.QUADKEY_LEVEL)
+        self.assertTrue(key.startswith(quadkey(7.1193, -73.1227, level=12)))
+
+    def test_hook_keeps_the_quadkey_column(self):
+        with self.Session() as session:
+            device = session.get(Device, 1)
+            self.assertEqual(device.quadkey, quadkey(device.latitude, device.longitude))
+            device.latitude, device.longitude = 4.711, -74.072
+            session.commit()
+            self.assertEqual(device.quadkey, quadkey(4.711, -74.072))
+
+    def test_bbox_query_matches_a_full_scan(self):
+        bboxes = [
+            parse_bbox('-73.2,7.0,-73.05,7.15'),
+            parse_bbox('-73.13,7.11,-73.11,7.13'),
+            parse_bbox('179.7,-17.2,-179.7,-16.8'),
+        ]
+        with self.Session() as session:
+            for bbox in bboxes:
+                with self.subTest(bbox=bbox):
+                    self.assertTrue(self.expected_ids(bbox))
+                    result = query_bbox(session, Device, bbox)
+                    self.assertEqual({d['id'] for d in result['devices']}, self.expected_ids(bbox))
+                    self.assertEqual(result['total'], len(self.expected_ids(bbox)))
+
+    def test_low_zoom_groups_into_clusters(self):
+        bbox = parse_bbox('-73.3,6.9,-72.9,7.3')
+        with self.Session() as session:
+            result = query_bbox(session, Device, bbox, zoom=8)
+        self.assertEqual(result['total'], len(self.expected_ids(bbox)))
+        self.assertEqual(sum(c['count'] for c in result['clusters']) + len(result['devices']), result['total'])
+        self.assertTrue(result['clusters'])
+
+    def test_invalid_bbox_is_rejected(self):
+        for text in ('1,2,3', '-73,8,-72,7', 'a,b,c,d'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse_bbox(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
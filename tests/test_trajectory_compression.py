@@ -0,0 +1,73 @@
+"""
+Pruebas de la banda muerta (cierre de paradas) y de la simplificación SED
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trajectory_compression import DeadBandFilter, NUMPY_AVAILABLE  # noqa: E402
+
+if NUMPY_AVAILABLE:
+    import numpy as np  # noqa: E402
+    from trajectory_compression import sed_keep_mask  # noqa: E402
+
+PARKED = (7.1193, -73.1227)
+# ~3 m y ~200 m del punto estacionado
+JITTER = (7.11932, -73.12272)
+AWAY = (7.1211, -73.1227)
+
+
+class DeadBandFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.deadband = DeadBandFilter(meters=10)
+
+    def test_parked_fixes_are_suppressed_and_the_stop_is_closed_once(self):
+        self.assertEqual(self.deadband.check(1, None, None, *PARKED), (True, False))
+        self.assertEqual(self.deadband.check(1, *PARKED, *JITTER), (False, False))
+        self.assertEqual(self.deadband.check(1, *PARKED, *JITTER), (False, False))
+        # Sale de la banda: se guarda el fix y antes la posición estacionada
+        self.assertEqual(self.deadband.check(1, *PARKED, *AWAY), (True, True))
+        self.assertEqual(self.deadband.check(1, *AWAY, 7.1230, -73.1227), (True, False))
+
+        stats = self.deadband.get_stats()
+        self.assertEqual((stats['fixes'], stats['stored'], stats['suppressed'], stats['stop_points']), (5, 3, 2, 1))
+
+    def test_pending_state_waits_for_commit(self):
+        pending = self.deadband.new_pending()
+        self.deadband.check(1, *PARKED, *JITTER, pending=pending)
+        # Dentro del mismo lote el estado pendiente ya cuenta
+        self.assertEqual(self.deadband.check(1, *PARKED, *AWAY, pending=pending), (True, True))
+
+        # Lote revertido: el filtro no quedó con el vehículo estacionado
+        rolled_back = self.deadband.new_pending()
+        self.deadband.check(2, *PARKED, *JITTER, pending=rolled_back)
+        self.assertEqual(self.deadband.check(2, *PARKED, *AWAY), (True, False))
+        self.assertEqual(self.deadband.get_stats()['fixes'], 1)
+
+    def test_zero_meters_disables_the_filter(self):
+        deadband = DeadBandFilter(meters=0)
+        self.assertEqual(deadband.check(1, *PARKED, *PARKED), (True, False))
+
+
+@unittest.skipUnless(NUMPY_AVAILABLE, 'requiere NumPy')
+class SEDTest(unittest.TestCase):
+
+    def test_stop_on_a_straight_line_is_kept(self):
+        # Recta a velocidad constante con una parada de 5 minutos en el medio
+        times = np.array([0, 60, 120, 180, 480, 540, 600], dtype=np.int64) * 1000
+        lats = np.array([7.100, 7.101, 7.102, 7.103, 7.103, 7.104, 7.105])
+        lons = np.full(len(lats), -73.12)
+
+        keep = sed_keep_mask(times, lats, lons, tolerance_m=10)
+        self.assertTrue(keep[3] and keep[4])
+        self.assertFalse(keep[1])
+        # Sin la parada, los puntos intermedios sobran
+        steady = sed_keep_mask(times[:4], lats[:4], lons[:4], tolerance_m=10)
+        self.assertEqual(steady.tolist(), [True, False, False, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""
+Pruebas de la deduplicación de webhooks: ventana por ID del proveedor y por contenido
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine  # noqa: E402  # pyright: ignore[reportMissingImports]
+from webhook_dedup import WebhookDeduplicator, content_key, message_key  # noqa: E402
+
+
+class WebhookDedupTest(unittest.TestCase):
+
+    def test_provider_id_is_remembered(self):
+        dedup = WebhookDeduplicator(ttl_seconds=60)
+        key = message_key('twilio', 'SM123')
+        self.assertTrue(dedup.claim(key))
+        self.assertFalse(dedup.claim(key))
+        self.assertTrue(dedup.claim(message_key('twilio', 'SM124')))
+        self.assertEqual(dedup.get_stats()['duplicates'], 1)
+
+    def test_content_key_only_covers_the_retry_window(self):
+        dedup = WebhookDeduplicator(ttl_seconds=60, content_ttl_seconds=0.05)
+        key = content_key('3001112233', 'LAT:7.1254,LON:-73.1198')
+        self.assertEqual(key, content_key('+573001112233', 'LAT:7.1254,LON:-73.1198 '))
+
+        self.assertTrue(dedup.claim(key))
+        self.assertFalse(dedup.claim(key))
+        # Placa estacionada: la respuesta al siguiente URL# trae el mismo texto y debe pasar
+        time.sleep(0.06)
+        self.assertTrue(dedup.claim(key))
+
+    def test_forget_lets_the_retry_through(self):
+        dedup = WebhookDeduplicator()
+        key = message_key('vonage', 'abc')
+        dedup.claim(key)
+        dedup.forget(key)
+        self.assertTrue(dedup.claim(key))
+
+    def test_persistent_table_is_shared_between_processes(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        engine = create_engine(f'sqlite:///{os.path.join(tmp, "dedup.db")}')
+        self.addCleanup(engine.dispose)
+        first = WebhookDeduplicator(engine=engine, content_ttl_seconds=0.05)
+        second = WebhookDeduplicator(engine=engine, content_ttl_seconds=0.05)
+
+        self.assertTrue(first.claim(message_key('sinch', 'm1')))
+        self.assertFalse(second.claim(message_key('sinch', 'm1')))
+        self.assertEqual(second.get_stats()['duplicates_persistent'], 1)
+
+        key = content_key('+573001112233', 'URL#')
+        self.assertTrue(first.claim(key))
+        self.assertFalse(second.claim(key))
+        # La fila vencida se reclama aunque siga en la tabla
+        time.sleep(0.06)
+        self.assertTrue(second.claim(key))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,369 @@
+"""
+Reducción del historial de posiciones: banda muerta al recibir y compactación
+La flota pasa la mayor parte del tiempo estacionada y los rastreadores repiten
+la misma posición (con unos metros de ruido) en cada respuesta. Guardar cada
+una multiplicaba las escrituras y el tamaño del historial sin aportar nada.
+
+- Banda muerta (DeadBandFilter): un fix a menos de GPS_DEADBAND_METERS del
+  último punto guardado no se escribe en el historial ni mueve el vehículo;
+  solo se actualiza last_update. Cuando el vehículo sale de la banda se
+  guarda primero la posición estacionada con la hora del último fix
+  descartado, para que la duración de la parada no se pierda.
+- Compactación (HistoryCompactor): el historial con más de
+  HISTORY_COMPACT_AFTER_HOURS se simplifica por vehículo y por día con
+  Douglas-Peucker sobre la distancia sincronizada en el tiempo (SED): un
+  punto se descarta si está a menos de HISTORY_COMPACT_TOLERANCE_M de donde
+  estaría el vehículo en ese instante interpolando entre los puntos que se
+  conservan. A diferencia de la distancia a la recta, las paradas y los
+  cambios de velocidad se conservan. Requiere NumPy.
+
+Variables de entorno:
+    GPS_DEADBAND_METERS=<metros>          (por defecto 10, 0 desactiva)
+    HISTORY_COMPACT_TOLERANCE_M=<metros>  (por defecto 10)
+    HISTORY_COMPACT_AFTER_HOURS=<horas>   (por defecto 48)
+    HISTORY_COMPACT_HOUR=<0-23>           (por defecto 4, hora UTC)
+    HISTORY_COMPACT_JOB=true|false        (por defecto true)
+"""
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import Table, Column, String, DateTime, MetaData, select  # pyright: ignore[reportMissingImports]
+from geo_utils import haversine_m, EARTH_RADIUS_M
+from location_history import PARTITION_PREFIX
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+GPS_DEADBAND_METERS = float(os.getenv('GPS_DEADBAND_METERS', '10'))
+HISTORY_COMPACT_TOLERANCE_M = float(os.getenv('HISTORY_COMPACT_TOLERANCE_M', '10'))
+HISTORY_COMPACT_AFTER_HOURS = float(os.getenv('HISTORY_COMPACT_AFTER_HOURS', '48'))
+
+# Metros por grado de latitud
+_METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+metadata = MetaData()
+compaction_state = Table(
+    'history_compaction', metadata,
+    Column('name', String(50), primary_key=True),
+    Column('compacted_until', DateTime, nullable=False)
+)
+
+
+def _ratio(before, after):
+    return round(before / after, 2) if after else None
+
+
+class DeadBandFilter:
+    """
+    Decide qué fixes se guardan según la distancia al último punto guardado
+    """
+
+    def __init__(self, meters=GPS_DEADBAND_METERS):
+        self.meters = meters
+        # Vehículos cuyo último fix cayó dentro de la banda (parada sin cerrar)
+        self._parked = set()
+        self._lock = threading.Lock()
+        self.stats = {
+            'fixes': 0,
+            'stored': 0,
+            'suppressed': 0,
+            'stop_points': 0
+        }
+
+    @staticmethod
+    def new_pending():
+        """
+        Cambios de estado y contadores de una transacción, para commit()
+        """
+        return {'parked': {}, 'fixes': 0, 'stored': 0, 'suppressed': 0, 'stop_points': 0}
+
+    def check(self, device_id, last_lat, last_lon, lat, lon, pending=None):
+        """
+        Clasifica un fix contra la posición guardada del vehículo
+
+        Args:
+            device_id: ID del vehículo
+            last_lat, last_lon: Último punto guardado (None si no hay)
+            lat, lon: Fix recibido
+            pending: Dict de new_pending(); si se indica, el estado queda ahí y
+                     se aplica con commit(pending) después del commit de la BD
+                     (así un rollback no deja el filtro desalineado)
+
+        Returns:
+            tuple: (store, close_stop). store indica si el fix se guarda;
+                   close_stop, si antes hay que guardar la posición estacionada
+                   con la hora del último fix descartado
+        """
+        own = pending is None
+        if own:
+            pending = self.new_pending()
+        parked = pending['parked']
+        if device_id in parked:
+            was_parked = parked[device_id]
+        else:
+            with self._lock:
+                was_parked = device_id in self._parked
+
+        pending['fixes'] += 1
+        if (self.meters > 0 and last_lat is not None and last_lon is not None
+                and haversine_m(last_lat, last_lon, lat, lon) < self.meters):
+            parked[device_id] = True
+            pending['suppressed'] += 1
+            store, close_stop = False, False
+        else:
+            parked[device_id] = False
+            pending['stored'] += 1
+            pending['stop_points'] += int(was_parked)
+            store, close_stop = True, was_parked
+
+        if own:
+            self.commit(pending)
+        return store, close_stop
+
+    def commit(self, pending):
+        """
+        Aplica el estado y los contadores de una transacción ya confirmada
+        """
+        with self._lock:
+            for device_id, parked in pending['parked'].items():
+                if parked:
+                    self._parked.add(device_id)
+                else:
+                    self._parked.discard(device_id)
+            for key in self.stats:
+                self.stats[key] += pending[key]
+
+    def forget(self, device_id):
+        with self._lock:
+            self._parked.discard(device_id)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['meters'] = self.meters
+        written = stats['stored'] + stats['stop_points']
+        stats['write_ratio'] = _ratio(stats['fixes'], written)
+        return stats
+
+
+def sed_keep_mask(timestamps_ms, lats, lons, tolerance_m):
+    """
+    Douglas-Peucker con distancia sincronizada en el tiempo (SED)
+
+    Se parte del primer y último punto; en cada tramo se busca el punto más
+    alejado de su posición interpolada en el tiempo y, si supera la tolerancia,
+    se conserva y se divide el tramo en dos. Las distancias se calculan en una
+    proyección equirectangular local (metros), válida para una trayectoria
+    urbana.
+
+    Args:
+        timestamps_ms, lats, lons: Arreglos de NumPy de un vehículo, ordenados por tiempo
+        tolerance_m: Error máximo en metros
+
+    Returns:
+        np.ndarray: Máscara booleana de los puntos que se conservan
+    """
+    n = len(timestamps_ms)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    scale = _METERS_PER_DEGREE * math.cos(math.radians(float(lats.mean())))
+    xs = (lons - lons[0]) * scale
+    ys = (lats - lats[0]) * _METERS_PER_DEGREE
+    ts = (timestamps_ms - timestamps_ms[0]).astype(np.float64)
+    tolerance_sq = tolerance_m * tolerance_m
+
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        span = ts[last] - ts[first]
+        inner = slice(first + 1, last)
+        ratio = (ts[inner] - ts[first]) / span if span > 0 else np.zeros(last - first - 1)
+        dx = xs[inner] - (xs[first] + (xs[last] - xs[first]) * ratio)
+        dy = ys[inner] - (ys[first] + (ys[last] - ys[first]) * ratio)
+        distance_sq = dx * dx + dy * dy
+        farthest = int(distance_sq.argmax())
+        if distance_sq[farthest] > tolerance_sq:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def compress_batch(batch, tolerance_m):
+    """
+    Aplica sed_keep_mask a cada vehículo de un lote de iter_columns
+
+    Returns:
+        np.ndarray: Máscara de los puntos que se conservan (en el orden del lote)
+    """
+    device_ids = np.frombuffer(batch['device_id'], dtype=np.int64)
+    timestamps = np.frombuffer(batch['timestamp_ms'], dtype=np.int64)
+    lats = np.frombuffer(batch['latitude'], dtype=np.float64)
+    lons = np.frombuffer(batch['longitude'], dtype=np.float64)
+    keep = np.ones(len(device_ids), dtype=bool)
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(device_ids)) + 1, [len(device_ids)]))
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        keep[lo:hi] = sed_keep_mask(timestamps[lo:hi], lats[lo:hi], lons[lo:hi], tolerance_m)
+    return keep
+
+
+class HistoryCompactor:
+    """
+    Compactación periódica del historial ya cerrado
+    """
+
+    STATE_NAME = 'location_history'
+
+    def __init__(self, engine, history, tolerance_m=HISTORY_COMPACT_TOLERANCE_M,
+                 after_hours=HISTORY_COMPACT_AFTER_HOURS):
+        """
+        Args:
+            engine: Engine de SQLAlchemy (donde se guarda hasta dónde se compactó)
+            history: LocationHistory a compactar
+            tolerance_m: Error máximo permitido en metros
+            after_hours: Antigüedad mínima de los puntos que se compactan
+        """
+        self.engine = engine
+        self.history = history
+        self.tolerance_m = tolerance_m
+        self.after_hours = after_hours
+        self.hour = None
+        self.is_running = False
+        self.thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self.stats = {
+            'runs': 0,
+            'points_read': 0,
+            'points_deleted': 0,
+            'last_run': None,
+            'last_run_ms': None
+        }
+        metadata.create_all(engine)
+
+    def compacted_until(self):
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(compaction_state.c.compacted_until).where(compaction_state.c.name == self.STATE_NAME)
+            ).scalar_one_or_none()
+
+    def _save_watermark(self, until):
+        with self.engine.begin() as conn:
+            updated = conn.execute(
+                compaction_state.update().where(compaction_state.c.name == self.STATE_NAME)
+                .values(compacted_until=until)
+            ).rowcount
+            if not updated:
+                conn.execute(compaction_state.insert().values(name=self.STATE_NAME, compacted_until=until))
+
+    def _first_day(self):
+        partitions = self.history.existing_partitions()
+        if not partitions:
+            return None
+        return datetime.strptime(partitions[0][len(PARTITION_PREFIX):], '%Y%m')
+
+    def compact(self, now=None):
+        """
+        Compacta día por día desde donde quedó la última vez hasta now - after_hours
+
+        Returns:
+            dict: days, points_read, points_deleted, ratio y elapsed_ms
+        """
+        started = time.perf_counter()
+        now = now or datetime.utcnow()
+        limit = now - timedelta(hours=self.after_hours)
+        limit = datetime(limit.year, limit.month, limit.day)
+        day = self.compacted_until() or self._first_day()
+
+        days = 0
+        read = 0
+        deleted = 0
+        while day is not None and day < limit:
+            day_end = day + timedelta(days=1)
+            doomed = []
+            for batch in self.history.iter_columns(
+                start=day, end=day_end - timedelta(microseconds=1), batch_size=10 ** 7, with_ids=True
+            ):
+                keep = compress_batch(batch, self.tolerance_m)
+                read += len(keep)
+                doomed.extend(np.frombuffer(batch['id'], dtype=np.int64)[~keep].tolist())
+            if doomed:
+                deleted += self.history.delete_points(day, doomed)
+            self._save_watermark(day_end)
+            days += 1
+            day = day_end
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.stats['runs'] += 1
+            self.stats['points_read'] += read
+            self.stats['points_deleted'] += deleted
+            self.stats['last_run'] = now.isoformat()
+            self.stats['last_run_ms'] = round(elapsed_ms, 1)
+        if read:
+            print(f"✓ Historial compactado: {days} días, {read} → {read - deleted} puntos en {elapsed_ms:.0f} ms")
+        return {
+            'days': days,
+            'points_read': read,
+            'points_deleted': deleted,
+            'ratio': _ratio(read, read - deleted),
+            'elapsed_ms': round(elapsed_ms, 1)
+        }
+
+    def start(self, hour=4):
+        """
+        Inicia la compactación diaria (a la hora UTC indicada)
+        """
+        if self.is_running:
+            return
+        self.hour = hour
+        self.is_running = True
+        self.thread = threading.Thread(target=self._nightly_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.is_running = False
+        self._wake.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def _seconds_until_next_run(self):
+        now = datetime.utcnow()
+        next_run = now.replace(hour=self.hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    def _nightly_loop(self):
+        while self.is_running:
+            self._wake.wait(self._seconds_until_next_run())
+            if not self.is_running:
+                break
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compactando historial: {e}")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['tolerance_m'] = self.tolerance_m
+        stats['ratio'] = _ratio(stats['points_read'], stats['points_read'] - stats['points_deleted'])
+        until = self.compacted_until()
+        stats['compacted_until'] = until.isoformat() if until else None
+        stats['nightly_hour_utc'] = self.hour if self.is_running else None
+        return stats
+
+
+# Instancia global (compartida por process_sms y la cola de ingesta)
+deadband = DeadBandFilter()
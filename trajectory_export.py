@@ -0,0 +1,135 @@
+"""
+Exportación columnar del historial y trayectos codificados
+El historial de un día de toda la flota son cientos de miles de puntos; armarlo
+como lista de dicts en JSON pesaba decenas de MB y tardaba segundos. Aquí los
+lotes de LocationHistory.iter_columns se escriben tal cual salen del cursor.
+
+Formatos de /api/history/export:
+
+- columns (por defecto, sin dependencias): secuencia de lotes binarios
+  little-endian. Cada lote es un uint32 con la cantidad de puntos N seguido de
+  las columnas completas: N int64 device_id, N int64 timestamp_ms (UTC),
+  N float64 latitude, N float64 longitude. Con NumPy cada columna se lee con
+  np.frombuffer(buf, '<i8' | '<f8', count=N, offset=...).
+- arrow (si pyarrow está instalado): stream IPC de Apache Arrow, legible con
+  pyarrow.ipc.open_stream, pandas o polars.
+
+/api/devices/<id>/track devuelve el trayecto de un vehículo como polilínea
+codificada (diferencias entre puntos, formato de Google) más los tiempos
+codificados igual (segundos desde el primer punto), para dibujarlo o
+reproducirlo en el mapa sin descargar cada fix.
+"""
+import struct
+import sys
+from location_history import COLUMN_TYPES
+from geo_utils import encode_polyline, encode_deltas
+
+try:
+    import pyarrow as pa  # pyright: ignore[reportMissingImports]
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+COLUMNS_MIMETYPE = 'application/octet-stream'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+COLUMNS_HEADER = ','.join(
+    f"{name}:{'int64' if typecode == 'q' else 'float64'}" for name, typecode in COLUMN_TYPES
+)
+
+
+def stream_columns(batches):
+    """
+    Serializa lotes columnares en el formato 'columns'
+
+    Yields:
+        bytes: Un bloque por lote
+    """
+    swap = sys.byteorder != 'little'
+    for batch in batches:
+        parts = [struct.pack('<I', len(batch['device_id']))]
+        for name, _ in COLUMN_TYPES:
+            column = batch[name]
+            if swap:
+                column = column.__copy__()
+                column.byteswap()
+            parts.append(column.tobytes())
+        yield b''.join(parts)
+
+
+class _ChunkSink:
+    """
+    Archivo en memoria del que se retiran los bytes escritos hasta el momento
+    """
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def stream_arrow(batches):
+    """
+    Serializa lotes columnares como stream IPC de Arrow
+
+    Yields:
+        bytes: Esquema y luego un record batch por lote
+    """
+    schema = pa.schema([
+        ('device_id', pa.int64()),
+        ('timestamp', pa.timestamp('ms', tz='UTC')),
+        ('latitude', pa.float64()),
+        ('longitude', pa.float64())
+    ])
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema)
+    for batch in batches:
+        writer.write_batch(pa.record_batch([
+            pa.array(batch['device_id'], type=pa.int64()),
+            pa.array(batch['timestamp_ms'], type=pa.int64()).cast(pa.timestamp('ms', tz='UTC')),
+            pa.array(batch['latitude'], type=pa.float64()),
+            pa.array(batch['longitude'], type=pa.float64())
+        ], schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def encode_track(batches, precision=5):
+    """
+    Trayecto de un vehículo como polilínea y tiempos codificados
+
+    Args:
+        batches: Lotes de iter_columns de un solo vehículo
+        precision: Decimales de las coordenadas (5 ≈ 1 m)
+
+    Returns:
+        dict: count, polyline, times (segundos desde start, codificados), start/end en ms
+    """
+    latitudes = []
+    longitudes = []
+    timestamps = []
+    for batch in batches:
+        latitudes.extend(batch['latitude'])
+        longitudes.extend(batch['longitude'])
+        timestamps.extend(batch['timestamp_ms'])
+
+    start_ms = timestamps[0] if timestamps else None
+    return {
+        'count': len(timestamps),
+        'precision': precision,
+        'polyline': encode_polyline(latitudes, longitudes, precision),
+        'times': encode_deltas([(t - start_ms) // 1000 for t in timestamps]),
+        'start_ms': start_ms,
+        'end_ms': timestamps[-1] if timestamps else None
+    }
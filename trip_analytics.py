@@ -0,0 +1,493 @@
+"""
+Analítica de uso por alquiler: distancia, velocidad, tiempo detenido y fuera de zona
+Cada alquiler (start_rental / end_rental) queda registrado en la tabla rentals.
+Su resumen se calcula sobre los fixes del historial con operaciones de NumPy
+sobre trayectorias completas, sin recorrer punto por punto en Python:
+
+- los fixes de todos los alquileres se juntan en un único arreglo, con el
+  número de alquiler de cada punto como grupo;
+- distancia haversine y velocidad de todos los tramos de una vez; un tramo
+  solo cuenta si sus dos puntos son del mismo alquiler;
+- tramos con velocidad imposible (saltos del GPS) se descartan;
+- un tramo es "detenido" por debajo de IDLE_SPEED_KMH; los tramos detenidos
+  seguidos forman un segmento, que cuenta si dura IDLE_MIN_SECONDS o más;
+- un tramo está fuera de zona si empieza fuera de todas las geocercas
+  (prueba punto en polígono vectorizada, con prefiltro por bbox);
+- los totales por alquiler salen de np.bincount y el máximo de np.maximum.at.
+
+El trabajo nocturno (RENTAL_ANALYTICS_HOUR, hora UTC) resume los alquileres
+terminados que aún no tienen resumen: carga el historial de toda la flota del
+día de una vez y resuelve cada alquiler con searchsorted.
+
+Variables de entorno:
+    RENTAL_ANALYTICS_HOUR=<0-23>        (por defecto 3)
+    RENTAL_ANALYTICS_JOB=true|false     (por defecto true)
+    IDLE_SPEED_KMH=<km/h>               (por defecto 1.0)
+    IDLE_MIN_SECONDS=<segundos>         (por defecto 120)
+    MAX_PLAUSIBLE_SPEED_KMH=<km/h>      (por defecto 60)
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import (  # pyright: ignore[reportMissingImports]
+    Table, Column, Integer, Float, DateTime, MetaData, Index, and_, or_, func, select, update
+)
+from geo_utils import EARTH_RADIUS_M
+from location_history import EPOCH
+
+IDLE_SPEED_KMH = float(os.getenv('IDLE_SPEED_KMH', '1.0'))
+IDLE_MIN_SECONDS = float(os.getenv('IDLE_MIN_SECONDS', '120'))
+# Vehículos eléctricos de juguete: más rápido que esto es un salto del GPS
+MAX_PLAUSIBLE_SPEED_KMH = float(os.getenv('MAX_PLAUSIBLE_SPEED_KMH', '60'))
+
+# Bits para combinar (device_id, timestamp_ms) en una sola clave ordenable
+_TIMESTAMP_BITS = 42
+
+metadata = MetaData()
+rentals = Table(
+    'rentals', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('device_id', Integer, nullable=False),
+    Column('started_at', DateTime, nullable=False),
+    Column('ends_at', DateTime),  # fin previsto (rental_end)
+    Column('ended_at', DateTime),  # fin real (end_rental)
+    Column('duration_hours', Integer),
+    # Resumen (se llena al terminar el alquiler, en el trabajo nocturno)
+    Column('fixes', Integer),
+    Column('distance_m', Float),
+    Column('max_speed_kmh', Float),
+    Column('avg_speed_kmh', Float),
+    Column('moving_seconds', Float),
+    Column('idle_seconds', Float),
+    Column('idle_segments', Integer),
+    Column('out_of_bounds_seconds', Float),
+    Column('analyzed_at', DateTime),
+    Index('ix_rentals_device_started', 'device_id', 'started_at')
+)
+
+SUMMARY_FIELDS = (
+    'fixes', 'distance_m', 'max_speed_kmh', 'avg_speed_kmh', 'moving_seconds',
+    'idle_seconds', 'idle_segments', 'out_of_bounds_seconds'
+)
+
+
+def _to_ms(value):
+    return (value - EPOCH) // timedelta(milliseconds=1)
+
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    """
+    Distancia haversine en metros entre arreglos de puntos (grados decimales)
+    """
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(lon2 - lon1)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def inside_any(fences, lats, lons):
+    """
+    Máscara de los puntos que están dentro de al menos una geocerca
+
+    Por geocerca: prefiltro por bbox y ray casting vectorizado sobre los
+    puntos que quedan (un paso por lado del polígono, no por punto).
+    """
+    inside = np.zeros(lats.shape, dtype=bool)
+    for fence in fences:
+        candidates = np.nonzero(
+            ~inside
+            & (lats >= fence.min_lat) & (lats <= fence.max_lat)
+            & (lons >= fence.min_lon) & (lons <= fence.max_lon)
+        )[0]
+        if not candidates.size:
+            continue
+        lat = lats[candidates]
+        lon = lons[candidates]
+        if fence.ring is None:
+            hit = haversine_np(lat, lon, fence.center_lat, fence.center_lon) <= fence.radius_m
+        else:
+            hit = np.zeros(candidates.shape, dtype=bool)
+            ring = fence.ring
+            lon_j, lat_j = ring[-1]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for lon_i, lat_i in ring:
+                    if lat_i != lat_j:
+                        crosses = (lat_i > lat) != (lat_j > lat)
+                        hit ^= crosses & (lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i)
+                    lon_j, lat_j = lon_i, lat_i
+        inside[candidates[hit]] = True
+    return inside
+
+
+def summarize_groups(groups, timestamps_ms, lats, lons, group_count, fences=None):
+    """
+    Resumen de uso de varias trayectorias a la vez
+
+    Args:
+        groups: Número de trayectoria (0..group_count-1) de cada punto; los
+                puntos de una trayectoria van seguidos y en orden de tiempo
+        timestamps_ms, lats, lons: Arreglos de los puntos
+        group_count: Cantidad de trayectorias
+        fences: Geocercas (Fence) que delimitan la zona permitida, o None
+
+    Returns:
+        dict: Arreglos de largo group_count con cada campo de SUMMARY_FIELDS
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    fixes = np.bincount(groups, minlength=group_count)
+    summary = {'fixes': fixes}
+    if groups.size < 2:
+        summary.update({field: np.zeros(group_count) for field in SUMMARY_FIELDS[1:]})
+        if not fences:
+            summary['out_of_bounds_seconds'] = None
+        return summary
+
+    same = groups[1:] == groups[:-1]
+    segment_group = groups[:-1]
+    dt = np.diff(timestamps_ms) / 1000.0
+    distance = haversine_np(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.where(dt > 0, distance / dt * 3.6, 0.0)
+
+    valid = same & (dt > 0) & (speed <= MAX_PLAUSIBLE_SPEED_KMH)
+    idle = valid & (speed < IDLE_SPEED_KMH)
+    moving = valid & ~idle
+
+    def total(weights, mask):
+        return np.bincount(segment_group[mask], weights=weights[mask], minlength=group_count)
+
+    summary['distance_m'] = total(distance, valid)
+    summary['moving_seconds'] = total(dt, moving)
+    summary['idle_seconds'] = total(dt, idle)
+    max_speed = np.zeros(group_count)
+    np.maximum.at(max_speed, segment_group[valid], speed[valid])
+    summary['max_speed_kmh'] = max_speed
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summary['avg_speed_kmh'] = np.where(
+            summary['moving_seconds'] > 0, summary['distance_m'] / summary['moving_seconds'] * 3.6, 0.0
+        )
+
+    # Segmentos detenidos: rachas de tramos detenidos seguidos del mismo alquiler
+    run_start = idle & ~np.concatenate(([False], idle[:-1]))
+    if run_start.any():
+        run_id = np.cumsum(run_start) - 1
+        run_seconds = np.bincount(run_id[idle], weights=dt[idle])
+        long_runs = run_start & (run_seconds[np.maximum(run_id, 0)] >= IDLE_MIN_SECONDS)
+        summary['idle_segments'] = np.bincount(segment_group[long_runs], minlength=group_count)
+    else:
+        summary['idle_segments'] = np.zeros(group_count, dtype=np.int64)
+
+    if fences:
+        outside = ~inside_any(fences, lats[:-1], lons[:-1])
+        summary['out_of_bounds_seconds'] = total(dt, valid & outside)
+    else:
+        summary['out_of_bounds_seconds'] = None
+    return summary
+
+
+def _load_fixes(history, device_id, start, end):
+    """
+    Fixes del historial como arreglos NumPy (un vehículo o toda la flota)
+    """
+    batches = list(history.iter_columns(device_id=device_id, start=start, end=end))
+    if not batches:
+        empty_i = np.zeros(0, dtype=np.int64)
+        return empty_i, empty_i, np.zeros(0), np.zeros(0)
+    device_ids = np.concatenate([np.frombuffer(b['device_id'], dtype=np.int64) for b in batches])
+    timestamps = np.concatenate([np.frombuffer(b['timestamp_ms'], dtype=np.int64) for b in batches])
+    lats = np.concatenate([np.frombuffer(b['latitude'], dtype=np.float64) for b in batches])
+    lons = np.concatenate([np.frombuffer(b['longitude'], dtype=np.float64) for b in batches])
+    # Con varias particiones mensuales el orden (vehículo, tiempo) se rehace
+    if len(batches) > 1:
+        order = np.lexsort((timestamps, device_ids))
+        device_ids, timestamps, lats, lons = device_ids[order], timestamps[order], lats[order], lons[order]
+    return device_ids, timestamps, lats, lons
+
+
+def summarize_rentals(rental_rows, device_ids, timestamps_ms, lats, lons, fences=None):
+    """
+    Resume varios alquileres sobre los fixes de la flota ordenados por (vehículo, tiempo)
+
+    Args:
+        rental_rows: Lista de (device_id, start_ms, end_ms)
+
+    Returns:
+        list: Un dict de resumen por alquiler, en el mismo orden
+    """
+    if not rental_rows:
+        return []
+    keys = (device_ids << _TIMESTAMP_BITS) | timestamps_ms
+    rental_devices = np.array([row[0] for row in rental_rows], dtype=np.int64)
+    starts = np.searchsorted(keys, (rental_devices << _TIMESTAMP_BITS) | np.array([row[1] for row in rental_rows], dtype=np.int64), 'left')
+    ends = np.searchsorted(keys, (rental_devices << _TIMESTAMP_BITS) | np.array([row[2] for row in rental_rows], dtype=np.int64), 'right')
+    lengths = np.maximum(ends - starts, 0)
+
+    # Índices de los puntos de cada alquiler, uno detrás de otro
+    groups = np.repeat(np.arange(len(rental_rows)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    index = np.repeat(starts, lengths) + offsets
+
+    summary = summarize_groups(
+        groups, timestamps_ms[index], lats[index], lons[index], len(rental_rows), fences
+    )
+    results = []
+    for i in range(len(rental_rows)):
+        result = {}
+        for field in SUMMARY_FIELDS:
+            values = summary[field]
+            if values is None:
+                result[field] = None
+            elif field in ('fixes', 'idle_segments'):
+                result[field] = int(values[i])
+            else:
+                result[field] = round(float(values[i]), 1)
+        results.append(result)
+    return results
+
+
+class TripAnalytics:
+    """
+    Registro de alquileres y sus resúmenes de uso
+    """
+
+    def __init__(self, engine, history, geofences=None):
+        """
+        Args:
+            engine: Engine de SQLAlchemy donde vive la tabla rentals
+            history: LocationHistory con los fixes
+            geofences: GeofenceEngine cuyas geocercas delimitan la zona permitida (opcional)
+        """
+        self.engine = engine
+        self.history = history
+        self.geofences = geofences
+        self.hour = None
+        self.is_running = False
+        self.thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self.stats = {
+            'runs': 0,
+            'analyzed': 0,
+            'last_run': None,
+            'last_run_ms': None,
+            'last_run_fixes': None
+        }
+        metadata.create_all(engine)
+
+    def _fences(self):
+        return self.geofences.fences() if self.geofences is not None else None
+
+    def start_rental(self, session, device_id, started_at, ends_at, duration_hours):
+        """
+        Registra un alquiler nuevo dentro de la transacción de la sesión (cierra el anterior si seguía abierto)
+        """
+        self.end_rental(session, device_id, started_at)
+        session.execute(rentals.insert().values(
+            device_id=device_id,
+            started_at=started_at,
+            ends_at=ends_at,
+            duration_hours=duration_hours
+        ))
+
+    def end_rental(self, session, device_id, ended_at):
+        """
+        Marca como terminado el alquiler abierto de un vehículo
+        """
+        session.execute(
+            update(rentals)
+            .where(rentals.c.device_id == device_id, rentals.c.ended_at.is_(None))
+            .values(ended_at=ended_at)
+        )
+
+    def sync_active(self, session_factory, gps_device_model):
+        """
+        Registra los alquileres en curso que empezaron antes de existir la tabla rentals
+        """
+        model = gps_device_model
+        session = session_factory()
+        try:
+            open_devices = set(session.execute(
+                select(rentals.c.device_id).where(rentals.c.ended_at.is_(None))
+            ).scalars())
+            rented = session.execute(
+                select(model.id, model.rental_start, model.rental_end, model.rental_duration_hours).where(
+                    model.is_rented == True, model.rental_start.isnot(None)  # noqa: E712
+                )
+            ).all()
+            missing = [row for row in rented if row.id not in open_devices]
+            for row in missing:
+                session.execute(rentals.insert().values(
+                    device_id=row.id,
+                    started_at=row.rental_start,
+                    ends_at=row.rental_end,
+                    duration_hours=row.rental_duration_hours
+                ))
+            session.commit()
+            return len(missing)
+        finally:
+            session.close()
+
+    @staticmethod
+    def _effective_end(row, now):
+        # Sin end_rental, el alquiler termina al vencer su tiempo (o sigue en curso)
+        if row.ended_at is not None:
+            return row.ended_at
+        if row.ends_at is not None and row.ends_at <= now:
+            return row.ends_at
+        return now
+
+    @staticmethod
+    def _rental_dict(row, now, summary):
+        return {
+            'id': row.id,
+            'device_id': row.device_id,
+            'started_at': row.started_at.isoformat(),
+            'ends_at': row.ends_at.isoformat() if row.ends_at else None,
+            'ended_at': row.ended_at.isoformat() if row.ended_at else None,
+            'active': row.ended_at is None and (row.ends_at is None or row.ends_at > now),
+            'duration_hours': row.duration_hours,
+            'analyzed_at': row.analyzed_at.isoformat() if row.analyzed_at else None,
+            **summary
+        }
+
+    def summary(self, rental_id):
+        """
+        Resumen de un alquiler: el guardado si ya terminó y se analizó, o calculado al momento
+
+        Returns:
+            dict: Datos del alquiler + resumen, o None si no existe
+        """
+        with self.engine.connect() as conn:
+            row = conn.execute(select(rentals).where(rentals.c.id == rental_id)).first()
+        if row is None:
+            return None
+        now = datetime.utcnow()
+        if row.analyzed_at is not None:
+            return self._rental_dict(row, now, {f: getattr(row, f) for f in SUMMARY_FIELDS})
+
+        end = self._effective_end(row, now)
+        device_ids, timestamps, lats, lons = _load_fixes(self.history, row.device_id, row.started_at, end)
+        summary = summarize_rentals(
+            [(row.device_id, _to_ms(row.started_at), _to_ms(end))],
+            device_ids, timestamps, lats, lons, self._fences()
+        )[0]
+        return self._rental_dict(row, now, summary)
+
+    def list_rentals(self, device_id=None, limit=50):
+        """
+        Alquileres más recientes primero (con su resumen si ya se analizaron)
+        """
+        query = select(rentals).order_by(rentals.c.started_at.desc()).limit(limit)
+        if device_id is not None:
+            query = query.where(rentals.c.device_id == device_id)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).all()
+        now = datetime.utcnow()
+        return [
+            self._rental_dict(row, now, {f: getattr(row, f) for f in SUMMARY_FIELDS})
+            for row in rows
+        ]
+
+    def analyze_pending(self, now=None):
+        """
+        Resume y guarda los alquileres terminados que aún no tienen resumen
+
+        Los alquileres se agrupan por día de inicio; por cada día se carga una
+        sola vez el historial de toda la flota.
+
+        Returns:
+            dict: rentals (analizados), days, fixes y elapsed_ms
+        """
+        started = time.perf_counter()
+        now = now or datetime.utcnow()
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(rentals).where(
+                    rentals.c.analyzed_at.is_(None),
+                    or_(
+                        rentals.c.ended_at.isnot(None),
+                        and_(rentals.c.ends_at.isnot(None), rentals.c.ends_at <= now)
+                    )
+                ).order_by(rentals.c.started_at)
+            ).all()
+
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(row.started_at.date(), []).append(row)
+
+        fences = self._fences()
+        analyzed = 0
+        total_fixes = 0
+        for day_rows in by_day.values():
+            ends = [self._effective_end(row, now) for row in day_rows]
+            device_ids, timestamps, lats, lons = _load_fixes(
+                self.history, None, min(row.started_at for row in day_rows), max(ends)
+            )
+            total_fixes += len(timestamps)
+            summaries = summarize_rentals(
+                [(row.device_id, _to_ms(row.started_at), _to_ms(end)) for row, end in zip(day_rows, ends)],
+                device_ids, timestamps, lats, lons, fences
+            )
+            with self.engine.begin() as conn:
+                for row, summary in zip(day_rows, summaries):
+                    conn.execute(update(rentals).where(rentals.c.id == row.id).values(analyzed_at=now, **summary))
+            analyzed += len(day_rows)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.stats['runs'] += 1
+            self.stats['analyzed'] += analyzed
+            self.stats['last_run'] = now.isoformat()
+            self.stats['last_run_ms'] = round(elapsed_ms, 1)
+            self.stats['last_run_fixes'] = total_fixes
+        if analyzed:
+            print(f"✓ Analítica de alquileres: {analyzed} alquileres, {total_fixes} fixes en {elapsed_ms:.0f} ms")
+        return {'rentals': analyzed, 'days': len(by_day), 'fixes': total_fixes, 'elapsed_ms': round(elapsed_ms, 1)}
+
+    def start(self, hour=3):
+        """
+        Inicia el trabajo nocturno (todos los días a la hora UTC indicada)
+        """
+        if self.is_running:
+            return
+        self.hour = hour
+        self.is_running = True
+        self.thread = threading.Thread(target=self._nightly_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.is_running = False
+        self._wake.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def _seconds_until_next_run(self):
+        now = datetime.utcnow()
+        next_run = now.replace(hour=self.hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    def _nightly_loop(self):
+        while self.is_running:
+            self._wake.wait(self._seconds_until_next_run())
+            if not self.is_running:
+                break
+            try:
+                self.analyze_pending()
+            except Exception as e:
+                print(f"Error en analítica de alquileres: {e}")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        with self.engine.connect() as conn:
+            stats['not_analyzed'] = conn.execute(
+                select(func.count()).select_from(rentals).where(rentals.c.analyzed_at.is_(None))
+            ).scalar_one()
+        stats['nightly_hour_utc'] = self.hour if self.is_running else None
+        return stats
@@ -0,0 +1,192 @@
+"""
+Supresión de webhooks de SMS duplicados
+Los proveedores reintentan la entrega del webhook cuando no reciben respuesta a
+tiempo (o por sus propias políticas). Cada reintento volvía a pasar por
+process_sms: otra búsqueda y otro commit, y un fix viejo podía pisar uno más
+reciente.
+
+La clave de cada SMS es el ID que asigna el proveedor (MessageSid de Twilio,
+messageId de Vonage, id de Sinch...). Sin ID se usa un hash de remitente y
+texto, pero solo durante unos segundos (content_ttl_seconds): lo que tarda un
+proveedor en reintentar un webhook. Una placa estacionada responde cada URL#
+con el mismo texto, y esa respuesta nueva tiene que llegar a process_sms para
+renovar last_update y cerrar la solicitud en reply_tracker.
+
+Las claves vistas se guardan en memoria (LRU acotado con TTL). Con
+SMS_DEDUP_PERSISTENT=true además se registran en la tabla sms_webhook_receipts,
+para que varios procesos (workers de gunicorn) compartan la deduplicación.
+
+Variables de entorno:
+    SMS_DEDUP_TTL_SECONDS=<segundos>   (por defecto 86400)
+    SMS_DEDUP_CONTENT_SECONDS=<segundos>  (por defecto 20, SMS sin ID del proveedor)
+    SMS_DEDUP_MAX_ENTRIES=<claves>     (por defecto 100000)
+    SMS_DEDUP_PERSISTENT=true|false    (por defecto false)
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import Table, Column, String, DateTime, MetaData, delete, update  # pyright: ignore[reportMissingImports]
+from sqlalchemy.exc import IntegrityError  # pyright: ignore[reportMissingImports]
+from phone_utils import normalize_phone
+
+# Cada cuántas claves nuevas se borran de la tabla las vencidas
+PRUNE_EVERY = 1000
+
+metadata = MetaData()
+webhook_receipts = Table(
+    'sms_webhook_receipts', metadata,
+    Column('key', String(100), primary_key=True),
+    Column('received_at', DateTime, nullable=False, index=True)
+)
+
+
+def message_key(provider, message_id):
+    """
+    Clave de un SMS con ID del proveedor
+    """
+    return f'{provider}:{message_id}'[:100]
+
+
+def content_key(phone_number, sms_text):
+    """
+    Clave de un SMS sin ID: hash de remitente y texto (vale content_ttl_seconds)
+    """
+    sender = normalize_phone(phone_number) or phone_number
+    digest = hashlib.sha1(f'{sender}|{sms_text.strip()}'.encode('utf-8')).hexdigest()
+    return f'h:{digest}'
+
+
+class WebhookDeduplicator:
+    """
+    Registro de SMS entrantes ya recibidos (LRU con TTL + tabla opcional)
+    """
+
+    def __init__(self, ttl_seconds=86400, max_entries=100000, engine=None, content_ttl_seconds=20):
+        """
+        Args:
+            ttl_seconds: Tiempo que se recuerda cada SMS con ID del proveedor
+            max_entries: Máximo de claves en memoria (se descartan las más viejas)
+            engine: Engine de SQLAlchemy para la tabla compartida, o None (solo memoria)
+            content_ttl_seconds: Tiempo que se recuerda un SMS sin ID (ventana de reintento)
+        """
+        self.ttl_seconds = ttl_seconds
+        self.content_ttl_seconds = content_ttl_seconds
+        self.max_entries = max_entries
+        self.engine = engine
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserted = 0
+        self.stats = {
+            'checked': 0,
+            'duplicates': 0,
+            'duplicates_persistent': 0,
+            'evicted': 0,
+            'forgotten': 0,
+            'persistent_errors': 0
+        }
+        if engine is not None:
+            metadata.create_all(engine)
+
+    def _seen_locked(self, key, now):
+        expires = self._seen.get(key)
+        if expires is None:
+            return False
+        if expires <= now:
+            del self._seen[key]
+            return False
+        self._seen.move_to_end(key)
+        return True
+
+    def _ttl_for(self, key):
+        return self.content_ttl_seconds if key.startswith('h:') else self.ttl_seconds
+
+    def _remember_locked(self, key, now):
+        self._seen[key] = now + self._ttl_for(key)
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    def _claim_persistent(self, key):
+        """
+        Registra la clave en la tabla; False si otro proceso ya la registró y no venció
+        """
+        received_at = datetime.utcnow()
+        expired = received_at - timedelta(seconds=self._ttl_for(key))
+        try:
+            with self.engine.begin() as conn:
+                # Una fila vencida se reclama en el mismo UPDATE; si no hay, se inserta
+                # (si otro proceso la tiene vigente, la clave primaria lo rechaza)
+                renewed = conn.execute(
+                    update(webhook_receipts)
+                    .where(webhook_receipts.c.key == key, webhook_receipts.c.received_at < expired)
+                    .values(received_at=received_at)
+                ).rowcount
+                if not renewed:
+                    conn.execute(webhook_receipts.insert().values(key=key, received_at=received_at))
+                self._inserted += 1
+                if self._inserted % PRUNE_EVERY == 0:
+                    cutoff = received_at - timedelta(seconds=self.ttl_seconds)
+                    conn.execute(delete(webhook_receipts).where(webhook_receipts.c.received_at < cutoff))
+            return True
+        except IntegrityError:
+            return False
+        except Exception as e:
+            # Sin tabla se sigue con la deduplicación en memoria
+            with self._lock:
+                self.stats['persistent_errors'] += 1
+            print(f"⚠ Error registrando webhook en sms_webhook_receipts: {e}")
+            return True
+
+    def claim(self, key):
+        """
+        Marca un SMS como recibido
+
+        Args:
+            key: message_key(...) o content_key(...)
+
+        Returns:
+            bool: True si es la primera vez (hay que procesarlo), False si es duplicado
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.stats['checked'] += 1
+            if self._seen_locked(key, now):
+                self.stats['duplicates'] += 1
+                return False
+            # Se reserva antes de procesar para que un reintento concurrente no pase
+            self._remember_locked(key, now)
+
+        if self.engine is not None and not self._claim_persistent(key):
+            with self._lock:
+                self.stats['duplicates'] += 1
+                self.stats['duplicates_persistent'] += 1
+            return False
+        return True
+
+    def forget(self, key):
+        """
+        Olvida una clave (el procesamiento falló y el reintento del proveedor debe pasar)
+        """
+        with self._lock:
+            if self._seen.pop(key, None) is not None:
+                self.stats['forgotten'] += 1
+        if self.engine is not None:
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(delete(webhook_receipts).where(webhook_receipts.c.key == key))
+            except Exception as e:
+                print(f"⚠ Error borrando webhook de sms_webhook_receipts: {e}")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._seen)
+        stats['max_entries'] = self.max_entries
+        stats['ttl_seconds'] = self.ttl_seconds
+        stats['content_ttl_seconds'] = self.content_ttl_seconds
+        stats['persistent'] = self.engine is not None
+        stats['duplicate_rate'] = round(stats['duplicates'] / stats['checked'], 3) if stats['checked'] else None
+        return stats